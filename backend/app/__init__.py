@@ -5,10 +5,16 @@ from flask import Flask, current_app
 from flask_cors import CORS
 from .config import config
 
-from .routes import auth_bp, ai_bp, email_bp, views
+from .routes import auth_bp, ai_bp, email_bp, scheduler_bp, views
 from .utils.logger import init_logger, get_logger
 from .db.database import init_db
 from .service.service_manager import ServiceManager
+from .service.analysis_queue import init_analysis_queue
+from .service.ai.usage import init_usage_ledger
+from .service.scheduler_service import init_scheduler
+from .service.email_sync import reconcile_sync_jobs
+from .service.email_classifier import schedule_classifier_retrain
+from .service.ai.client_registry import schedule_client_sweep
 
 logger = get_logger(__name__)
 
@@ -33,10 +39,31 @@ def create_app(config_name='dev'):
     except:
         raise RuntimeError('数据库初始化失败')
 
+    # 启动 AI 用量记录、邮件分析任务队列和共享的定时任务调度器
+    init_usage_ledger(app)
+    init_analysis_queue(app)
+    init_scheduler(app)
+
+    # 持久化的定时任务已随调度器恢复，为缺少任务的已授权用户补建
+    with app.app_context():
+        try:
+            reconcile_sync_jobs()
+        except Exception as e:
+            logger.error(f"核对定时同步任务失败: {str(e)}")
+        try:
+            schedule_classifier_retrain(app.extensions['scheduler'], app.config.get('CLASSIFIER_RETRAIN_MINUTES', 60))
+        except Exception as e:
+            logger.error(f"创建预分类模型训练任务失败: {str(e)}")
+        try:
+            schedule_client_sweep(app.extensions['scheduler'], app.config.get('AI_CLIENT_SWEEP_SECONDS', 60))
+        except Exception as e:
+            logger.error(f"创建 AI 客户端清理任务失败: {str(e)}")
+
     # 注册蓝图
     app.register_blueprint(views)
     app.register_blueprint(ai_bp, url_prefix='/api/ai')
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(email_bp, url_prefix='/api/email')
+    app.register_blueprint(scheduler_bp, url_prefix='/api/scheduler')
 
     return app
@@ -31,6 +31,27 @@ class Config:
     PROXY_HOST = os.getenv('PROXY_HOST', '127.0.0.1')
     PROXY_PORT = os.getenv('PROXY_PORT', '7890')
 
+    # 邮件分析任务队列
+    ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', 2))  # 工作线程数
+    # 交互分析未提交 API 密钥时是否改用服务器的 DEEPSEEK_API_KEY，默认关闭
+    ANALYSIS_USE_SERVER_KEY = os.getenv('ANALYSIS_USE_SERVER_KEY', 'false').lower() == 'true'
+
+    # AI 用量记录
+    AI_USAGE_FLUSH_SECONDS = int(os.getenv('AI_USAGE_FLUSH_SECONDS', 10))  # 用量记录批量写库的间隔
+
+    # 定时任务调度器（每个应用一个）
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    SCHEDULER_POOL_SIZE = int(os.getenv('SCHEDULER_POOL_SIZE', 10))  # 执行任务的线程数
+    SCHEDULER_ASYNC_TIMEOUT = int(os.getenv('SCHEDULER_ASYNC_TIMEOUT', 1800))  # 协程任务单次执行的超时（秒）
+    SCHEDULER_ASYNC_CONCURRENCY = int(os.getenv('SCHEDULER_ASYNC_CONCURRENCY', 20))  # 同时执行的协程任务数
+    SCHEDULER_JOBSTORE = os.getenv('SCHEDULER_JOBSTORE', 'sqlalchemy')  # sqlalchemy（保存在应用数据库）或 memory
+    SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE', '')  # 执行任务的进程锁，默认 instance/scheduler.lock
+    SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.getenv('SCHEDULER_MISFIRE_GRACE_SECONDS', 3600))  # 错过执行后补执行的时限
+    SYNC_MAX_CONCURRENCY = int(os.getenv('SYNC_MAX_CONCURRENCY', 4))  # 所有用户的邮件同步同时执行数
+    SCHEDULER_MIN_INTERVAL_SECONDS = int(os.getenv('SCHEDULER_MIN_INTERVAL_SECONDS', 900))  # 用户创建的任务最短执行间隔
+    CLASSIFIER_RETRAIN_MINUTES = int(os.getenv('CLASSIFIER_RETRAIN_MINUTES', 60))  # 预分类模型定时重新训练的检查间隔
+    AI_CLIENT_SWEEP_SECONDS = int(os.getenv('AI_CLIENT_SWEEP_SECONDS', 60))  # 定时关闭空闲 AI 客户端的间隔
+
     @classmethod
     def init_app(cls, app):
         """初始化应用配置"""
@@ -63,6 +84,11 @@ class TestingConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     FLASK_ENV = 'test'
+    ANALYSIS_WORKERS = 0  # 测试中不启动后台线程
+    AI_USAGE_FLUSH_SECONDS = 0
+    SCHEDULER_ENABLED = False
+    CLASSIFIER_RETRAIN_MINUTES = 0  # 测试中不创建训练任务
+    AI_CLIENT_SWEEP_SECONDS = 0  # 测试中不创建清理任务
 
 
 class ProductionConfig(Config):
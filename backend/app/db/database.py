@@ -3,7 +3,9 @@
 数据库模块
 """
 from datetime import datetime
+from typing import List
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from flask_migrate import Migrate
 from ..utils.logger import get_logger
 
@@ -13,6 +15,16 @@ logger = get_logger(__name__)
 db = SQLAlchemy()
 migrate = Migrate()
 
+# 已有数据库的增量升级：db.create_all() 只创建缺少的表，不会给已有的表添加列
+# 模型新增列时在此登记 (表名, 列名)，启动时按模型中的列定义补齐缺少的列及其索引
+SCHEMA_UPGRADES = [
+    ('emails', 'simhash'),  # 近似重复检测指纹
+    ('emails', 'topic_id'),  # 所属主题
+    ('emails', 'labels'),  # Gmail 标签ID列表
+    ('emails', 'headers'),  # 用于预分类的部分邮件头
+    ('chat_histories', 'embedding'),  # 问答向量，用于召回早期对话
+]
+
 class BaseModel(db.Model):
     """基础模型类"""
     __abstract__ = True
@@ -47,18 +59,53 @@ def init_db(app):
             logger.info('数据库连接成功')
 
             # 导入所有模型以确保它们被注册
-            from ..models import User, Email, ChatHistory
+            from ..models import User, Email, ChatHistory, ChatSession, EmailTopic, EmailAnalysis, AnalysisJob, AIUsage, SyncState
             logger.info('模型导入成功')
 
             # 创建所有表
             db.create_all()
             logger.info('数据库表创建成功')
 
+            # 给已有的表补齐新增的列
+            upgrade_schema(db.engine)
+
         return True
     except Exception as e:
         logger.error(f'数据库初始化失败: {str(e)}')
         return False
 
+def upgrade_schema(engine) -> List[str]:
+    """给已有的表补齐 SCHEMA_UPGRADES 中登记的列
+    新增的列都允许为空，已有的行取 NULL，由之后的同步或重建任务填充；已存在的列不做修改
+    Args:
+        engine: 数据库引擎
+    Returns:
+        List[str]: 添加的列（表名.列名）
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    with engine.begin() as conn:
+        for table_name, column_name in SCHEMA_UPGRADES:
+            if table_name not in tables:
+                continue
+            if column_name in {column['name'] for column in inspector.get_columns(table_name)}:
+                continue
+            table = db.metadata.tables[table_name]
+            column = table.c[column_name]
+            ddl = f'{quote(column.name)} {column.type.compile(dialect=engine.dialect)}'
+            for fk in column.foreign_keys:
+                ddl += f' REFERENCES {quote(fk.column.table.name)} ({quote(fk.column.name)})'
+            conn.execute(text(f'ALTER TABLE {quote(table_name)} ADD COLUMN {ddl}'))
+            for index in table.indexes:
+                if column_name in index.columns.keys():
+                    index.create(conn, checkfirst=True)
+            added.append(f'{table_name}.{column_name}')
+    if added:
+        logger.info(f'数据库升级完成，新增列: {", ".join(added)}')
+    return added
+
 def get_db():
     """获取数据库实例"""
     return db
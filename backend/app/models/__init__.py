@@ -3,6 +3,12 @@
 """
 from .user import User
 from .email import Email
-from .chat import ChatHistory
+from .chat import ChatHistory, ChatSession
+from .topic import EmailTopic
+from .analysis import EmailAnalysis
+from .analysis_job import AnalysisJob
+from .ai_usage import AIUsage
+from .sync_state import SyncState
 
-__all__ = ['User', 'Email', 'ChatHistory']
+__all__ = ['User', 'Email', 'ChatHistory', 'ChatSession', 'EmailTopic', 'EmailAnalysis', 'AnalysisJob', 'AIUsage',
+           'SyncState']
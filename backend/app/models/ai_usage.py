@@ -0,0 +1,49 @@
+"""
+AI 用量记录模型
+"""
+from ..db.database import db, BaseModel
+
+class AIUsage(BaseModel):
+    """AI 用量记录模型
+
+    每次模型调用（包括命中响应缓存的调用）记录一行，按用户和功能统计 token 与费用
+    """
+    __tablename__ = 'ai_usage'
+    __table_args__ = (
+        db.Index('ix_ai_usage_user_created', 'user_id', 'created_at'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)  # 后台任务可能没有用户
+    feature = db.Column(db.String(64), nullable=False, default='unknown')
+    provider = db.Column(db.String(32))
+    model = db.Column(db.String(64))
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    cached_tokens = db.Column(db.Integer, default=0)  # 上游前缀缓存命中的输入 token
+    latency_ms = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0.0)  # 估算费用（美元）
+    cache_hit = db.Column(db.Boolean, default=False)  # 命中本地响应缓存，未请求上游
+    estimated = db.Column(db.Boolean, default=False)  # 上游未返回用量，按文本长度估算
+    success = db.Column(db.Boolean, default=True)
+
+    def __repr__(self):
+        return f'<AIUsage {self.user_id} {self.feature} {self.model}>'
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update({
+            'user_id': self.user_id,
+            'feature': self.feature,
+            'provider': self.provider,
+            'model': self.model,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_tokens': self.cached_tokens,
+            'latency_ms': self.latency_ms,
+            'cost': self.cost,
+            'cache_hit': self.cache_hit,
+            'estimated': self.estimated,
+            'success': self.success
+        })
+        return base_dict
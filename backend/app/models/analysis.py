@@ -0,0 +1,59 @@
+"""
+邮件分析结果模型
+"""
+from ..db.database import db, BaseModel
+
+class EmailAnalysis(BaseModel):
+    """邮件分析结果模型
+
+    同一封邮件按 分析器版本 + 模型 各保存一份结果，
+    分析逻辑或模型变化后旧结果不再视为当前结果
+    """
+    __tablename__ = 'email_analyses'
+    __table_args__ = (
+        db.UniqueConstraint('email_id', 'analyzer_version', 'model', name='uq_email_analysis_version'),
+    )
+
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    analyzer_version = db.Column(db.String(32), nullable=False)
+    model = db.Column(db.String(64), nullable=False)
+    sentiment = db.Column(db.String(16))
+    priority = db.Column(db.String(16))
+    keywords = db.Column(db.JSON)
+    categories = db.Column(db.JSON)
+    source = db.Column(db.String(16))  # local（本地预分类）/ llm / default
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Integer, default=0)
+
+    # 关系
+    email = db.relationship('Email', backref=db.backref('analyses', lazy=True, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<EmailAnalysis {self.email_id} {self.analyzer_version}>'
+
+    def result(self):
+        """分析结果字段，与 EmailAnalysisService 的返回格式一致"""
+        return {
+            'sentiment': self.sentiment,
+            'keywords': self.keywords or [],
+            'categories': self.categories or [],
+            'priority': self.priority
+        }
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update(self.result())
+        base_dict.update({
+            'email_id': self.email_id,
+            'user_id': self.user_id,
+            'analyzer_version': self.analyzer_version,
+            'model': self.model,
+            'source': self.source,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency_ms': self.latency_ms
+        })
+        return base_dict
@@ -0,0 +1,52 @@
+"""
+邮件分析任务模型
+"""
+from ..db.database import db, BaseModel
+
+class AnalysisJob(BaseModel):
+    """邮件分析任务模型
+
+    priority 越小越先执行；status 取值 queued / running / done / failed
+    """
+    __tablename__ = 'analysis_jobs'
+    __table_args__ = (
+        db.Index('ix_analysis_jobs_status_priority', 'status', 'priority', 'id'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False, index=True)
+    provider = db.Column(db.String(32), nullable=False, default='deepseek')
+    model = db.Column(db.String(64), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    force = db.Column(db.Boolean, default=False)  # 是否忽略已保存的结果重新分析
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('email_analyses.id'))
+
+    # 关系
+    analysis = db.relationship('EmailAnalysis')
+
+    def __repr__(self):
+        return f'<AnalysisJob {self.id} {self.status}>'
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update({
+            'user_id': self.user_id,
+            'email_id': self.email_id,
+            'provider': self.provider,
+            'model': self.model,
+            'priority': self.priority,
+            'status': self.status,
+            'force': self.force,
+            'attempts': self.attempts,
+            'error': self.error,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'analysis_id': self.analysis_id
+        })
+        return base_dict
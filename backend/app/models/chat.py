@@ -12,6 +12,7 @@ class ChatHistory(BaseModel):
     email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=False)
+    embedding = db.Column(db.JSON)  # 问答的归一化向量，用于召回相关的早期对话
     created_at = db.Column(db.DateTime, default=datetime.now)
 
     # 关系
@@ -31,3 +32,35 @@ class ChatHistory(BaseModel):
             'answer': self.answer
         })
         return base_dict
+
+
+class ChatSession(BaseModel):
+    """聊天会话模型
+
+    保存同一用户针对同一封邮件的对话摘要：summarized_until 之前（含）的问答已合并进 summary，
+    之后的问答仍以原文保存在 ChatHistory 中
+    """
+    __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'email_id', name='uq_chat_sessions_user_email'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    email_id = db.Column(db.Integer, db.ForeignKey('emails.id'), nullable=False)
+    summary = db.Column(db.Text, default='')
+    summarized_until = db.Column(db.Integer, default=0)  # 已合并进摘要的最后一条 ChatHistory ID
+    summarized_turns = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return f'<ChatSession {self.user_id}:{self.email_id}>'
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update({
+            'user_id': self.user_id,
+            'email_id': self.email_id,
+            'summary': self.summary,
+            'summarized_turns': self.summarized_turns
+        })
+        return base_dict
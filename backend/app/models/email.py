@@ -17,6 +17,10 @@ class Email(BaseModel):
     html_body = db.Column(db.Text)
     received_at = db.Column(db.DateTime, default=datetime.now)
     attachments = db.Column(db.JSON)
+    simhash = db.Column(db.String(16), index=True)  # 近似重复检测指纹
+    labels = db.Column(db.JSON)  # Gmail 标签ID列表
+    headers = db.Column(db.JSON)  # 用于预分类的部分邮件头（小写名称）
+    topic_id = db.Column(db.Integer, db.ForeignKey('email_topics.id'), index=True)  # 所属主题
 
     # 关系
     user = db.relationship('User', backref=db.backref('emails', lazy=True))
@@ -36,6 +40,10 @@ class Email(BaseModel):
             'body': self.body,
             'html_body': self.html_body,
             'received_at': self.received_at.isoformat() if self.received_at else None,
-            'attachments': self.attachments
+            'attachments': self.attachments,
+            'simhash': self.simhash,
+            'labels': self.labels,
+            'headers': self.headers,
+            'topic_id': self.topic_id
         })
         return base_dict
@@ -0,0 +1,34 @@
+"""
+邮件同步状态模型
+"""
+from ..db.database import db, BaseModel
+
+class SyncState(BaseModel):
+    """邮件同步状态模型
+
+    每个用户一行，记录按同步结果估计的新邮件到达率（每小时封数的指数加权平均）和当前的同步间隔
+    """
+    __tablename__ = 'sync_states'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    rate = db.Column(db.Float, default=0.0)  # 新邮件到达率（封/小时）
+    interval_seconds = db.Column(db.Integer)  # 当前的同步间隔
+    last_sync_at = db.Column(db.DateTime)
+    last_new_messages = db.Column(db.Integer, default=0)
+    syncs = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return f'<SyncState {self.user_id} {self.rate:.2f}/h>'
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update({
+            'user_id': self.user_id,
+            'rate': self.rate,
+            'interval_seconds': self.interval_seconds,
+            'last_sync_at': self.last_sync_at.isoformat() if self.last_sync_at else None,
+            'last_new_messages': self.last_new_messages,
+            'syncs': self.syncs
+        })
+        return base_dict
@@ -0,0 +1,29 @@
+"""
+邮件主题模型
+"""
+from ..db.database import db, BaseModel
+
+class EmailTopic(BaseModel):
+    """邮件主题（聚类）模型"""
+    __tablename__ = 'email_topics'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    label = db.Column(db.String(64))  # 由 AI 根据代表邮件生成，未标注时为空
+    size = db.Column(db.Integer, default=0)
+    centroid = db.Column(db.JSON)  # 归一化的聚类中心向量
+
+    # 关系
+    user = db.relationship('User', backref=db.backref('email_topics', lazy=True))
+
+    def __repr__(self):
+        return f'<EmailTopic {self.label or self.id}>'
+
+    def to_dict(self):
+        """转换为字典格式"""
+        base_dict = super().to_dict()
+        base_dict.update({
+            'user_id': self.user_id,
+            'label': self.label,
+            'size': self.size
+        })
+        return base_dict
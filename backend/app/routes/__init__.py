@@ -4,6 +4,7 @@
 from .auth_routes import auth_bp
 from .ai_routes import ai_bp
 from .email_routes import email_bp
+from .scheduler_routes import scheduler_bp
 from .views import views
 
-__all__ = ['auth_bp', 'ai_bp', 'email_bp', 'views']
+__all__ = ['auth_bp', 'ai_bp', 'email_bp', 'scheduler_bp', 'views']
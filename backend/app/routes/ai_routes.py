@@ -2,11 +2,27 @@
 AI 路由模块
 处理 AI 相关的API路由
 """
-from flask import Blueprint, jsonify, request
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from ..service.service_manager import ServiceManager
+from ..service.ai.response_cache import get_response_cache
+from ..service.ai.ai_service import AIServiceFactory, DEFAULT_PROVIDER
+from ..service.ai.gateway import gateway_stats
+from ..service.ai.resilience import BackendUnavailableError, resilience_stats
+from ..service.ai.usage import get_usage_ledger
+from ..service.ai.prompts import get_prompt_cache_stats, list_templates
+from ..service.ai.structured import structured_stats
+from ..service.ai.chunking import estimate_tokens
+from ..service.ai.summarizer import MapReduceSummarizer, DEFAULT_QUERY
+from ..service.chat_session import ChatSessionService
+from ..service.email_dedup import DedupService
+from ..service.embedding import EmbeddingService, build_rag_prompt
+from ..service.email_classifier import get_local_classifier
+from ..service.analysis_queue import get_analysis_queue
 from ..utils.logger import get_logger
 from ..utils.decorators import login_required
-from ..models import User
+from ..models import User, Email
 
 logger = get_logger(__name__)
 ai_bp = Blueprint('ai', __name__)
@@ -34,7 +50,7 @@ def analyze_text(user: User):
 
         # 获取 AI 服务
         ai_service = ServiceManager.get_ai_service(
-            provider='deepseek',
+            provider=data.get('provider', DEFAULT_PROVIDER),
             api_key=api_key,
             model=model
         )
@@ -59,6 +75,291 @@ def analyze_text(user: User):
         logger.error(f"文本分析失败: {str(e)}")
         return jsonify({'error': f'文本分析失败: {str(e)}'}), 500
 
+def _sse(data, event: str = None) -> str:
+    """格式化一条 Server-Sent Events 消息"""
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+def _apply_budget(user: User, model: str, estimated_tokens: int = 0):
+    """请求发出前检查用户的每日 token 预算
+    Returns:
+        tuple: (应使用的模型, 超出预算时的 429 响应，否则为 None)
+    """
+    decision = get_usage_ledger().check_budget(user.id, model, estimated_tokens)
+    if not decision.allowed:
+        return model, (jsonify({
+            'error': '今日 AI 用量已达上限',
+            'used': decision.used,
+            'limit': decision.limit,
+            'retry_after': decision.retry_after
+        }), 429, {'Retry-After': str(decision.retry_after)})
+    if decision.action == 'downgrade':
+        logger.info(f"用户 {user.email} 今日 AI 用量接近上限，模型 {model} 降级为 {decision.model}")
+    return decision.model, None
+
+def _parse_datetime(value):
+    """解析 ISO 格式的时间参数"""
+    return datetime.fromisoformat(value) if value else None
+
+def _with_mailbox_context(user: User, data: dict, message: str):
+    """按请求参数检索相关邮件，返回改写后的提示和引用列表
+    请求参数 use_mailbox 为真时生效，可选 top_k、date_from、date_to、sender、labels
+    """
+    if not data.get('use_mailbox'):
+        return message, []
+
+    hits = EmbeddingService.retrieve(
+        user.id,
+        message,
+        k=int(data.get('top_k', 5)),
+        date_from=_parse_datetime(data.get('date_from')),
+        date_to=_parse_datetime(data.get('date_to')),
+        sender=data.get('sender'),
+        labels=data.get('labels')
+    )
+    if not hits:
+        return message, []
+
+    citations = [{
+        'index': number,
+        'email_id': email.id,
+        'subject': email.subject,
+        'from_email': email.from_email,
+        'received_at': email.received_at.isoformat() if email.received_at else None,
+        'score': round(score, 4)
+    } for number, (email, score) in enumerate(hits, start=1)]
+    return build_rag_prompt(message, [email for email, _ in hits]), citations
+
+def _open_session(user: User, data: dict, ai_service):
+    """请求参数带 email_id 时打开针对该邮件的对话会话
+    Returns:
+        tuple: (会话服务, 会话, 邮件)，未指定邮件时均为 None
+    Raises:
+        LookupError: 邮件不存在
+    """
+    email_id = data.get('email_id')
+    if not email_id:
+        return None, None, None
+    email = Email.query.filter_by(id=int(email_id), user_id=user.id).first()
+    if not email:
+        raise LookupError('邮件不存在')
+    sessions = ChatSessionService(ai_service)
+    return sessions, sessions.get_session(user.id, email.id), email
+
+@ai_bp.route('/chat', methods=['POST'])
+@login_required
+def chat(user: User):
+    """AI 对话"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': '请求数据不能为空'}), 400
+
+        message = data.get('message')
+        api_key = data.get('api_key')
+        model = data.get('model', 'deepseek-chat')
+
+        if not message:
+            return jsonify({'error': '消息内容不能为空'}), 400
+        if not api_key:
+            return jsonify({'error': 'API密钥不能为空'}), 400
+
+        max_tokens = int(data.get('max_tokens', 2000))
+        model, over_budget = _apply_budget(user, model, estimate_tokens(message) + max_tokens)
+        if over_budget:
+            return over_budget
+
+        # 获取 AI 服务
+        ai_service = ServiceManager.get_ai_service(
+            provider=data.get('provider', DEFAULT_PROVIDER),
+            api_key=api_key,
+            model=model
+        )
+        if not ai_service:
+            return jsonify({'error': 'AI服务初始化失败'}), 500
+
+        try:
+            sessions, session, email = _open_session(user, data, ai_service)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+
+        prompt, citations = _with_mailbox_context(user, data, message)
+        options = {}
+        if session:
+            # 邮件对话：带上邮件正文、历史摘要、相关的早期问答和最近几轮问答
+            options = {'prefix_messages': sessions.build_context(session, email, message)}
+        result = ai_service.chat(
+            prompt,
+            temperature=float(data.get('temperature', 0.7)),
+            max_tokens=max_tokens,
+            **options
+        )
+        if session:
+            sessions.record_turn(session, message, result['response'])
+        return jsonify({'reply': result['response'], 'model': model, 'citations': citations})
+
+    except BackendUnavailableError as e:
+        retry_after = max(1, int(e.retry_after))
+        return jsonify({'error': str(e), 'retry_after': retry_after}), 503, {'Retry-After': str(retry_after)}
+    except Exception as e:
+        logger.error(f"AI 对话失败: {str(e)}")
+        return jsonify({'error': f'AI 对话失败: {str(e)}'}), 500
+
+@ai_bp.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream(user: User):
+    """AI 流式对话
+    以 Server-Sent Events 逐段返回模型输出：
+    - 默认事件: {"delta": "..."}
+    - done 事件: 输出结束，附带引用的邮件
+    - error 事件: {"error": "..."}
+    客户端断开时生成器被关闭，上游请求随之中止
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': '请求数据不能为空'}), 400
+
+        message = data.get('message')
+        api_key = data.get('api_key')
+        model = data.get('model', 'deepseek-chat')
+
+        if not message:
+            return jsonify({'error': '消息内容不能为空'}), 400
+        if not api_key:
+            return jsonify({'error': 'API密钥不能为空'}), 400
+
+        max_tokens = int(data.get('max_tokens', 2000))
+        model, over_budget = _apply_budget(user, model, estimate_tokens(message) + max_tokens)
+        if over_budget:
+            return over_budget
+
+        # 获取 AI 服务
+        ai_service = ServiceManager.get_ai_service(
+            provider=data.get('provider', DEFAULT_PROVIDER),
+            api_key=api_key,
+            model=model
+        )
+        if not ai_service:
+            return jsonify({'error': 'AI服务初始化失败'}), 500
+
+        try:
+            sessions, session, email = _open_session(user, data, ai_service)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+
+        prompt, citations = _with_mailbox_context(user, data, message)
+        options = {}
+        if session:
+            options = {'prefix_messages': sessions.build_context(session, email, message)}
+        upstream = ai_service.chat_stream(
+            prompt,
+            temperature=float(data.get('temperature', 0.7)),
+            max_tokens=max_tokens,
+            **options
+        )
+    except Exception as e:
+        logger.error(f"AI 流式对话失败: {str(e)}")
+        return jsonify({'error': f'AI 流式对话失败: {str(e)}'}), 500
+
+    def generate():
+        parts = []
+        try:
+            for delta in upstream:
+                parts.append(delta)
+                yield _sse({'delta': delta})
+            if session:
+                # 只保存完整输出的问答，客户端中途断开时不记录
+                sessions.record_turn(session, message, ''.join(parts))
+            yield _sse({'model': model, 'citations': citations}, event='done')
+        except GeneratorExit:
+            logger.info(f"用户 {user.email} 的流式对话客户端已断开")
+            raise
+        except Exception as e:
+            logger.error(f"AI 流式对话失败: {str(e)}")
+            yield _sse({'error': str(e)}, event='error')
+        finally:
+            # 关闭上游生成器，断开与模型服务的连接
+            upstream.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@ai_bp.route('/chat/history', methods=['GET'])
+@login_required
+def get_chat_history(user: User):
+    """获取针对某封邮件的对话摘要与最近的问答"""
+    try:
+        email_id = request.args.get('email_id', type=int)
+        if not email_id:
+            return jsonify({'error': 'email_id 不能为空'}), 400
+        if not Email.query.filter_by(id=email_id, user_id=user.id).first():
+            return jsonify({'error': '邮件不存在'}), 404
+
+        sessions = ChatSessionService(None)
+        session = sessions.get_session(user.id, email_id)
+        return jsonify(sessions.history(session, limit=min(request.args.get('limit', 50, type=int), 200)))
+
+    except Exception as e:
+        logger.error(f"获取对话历史失败: {str(e)}")
+        return jsonify({'error': f'获取对话历史失败: {str(e)}'}), 500
+
+@ai_bp.route('/summarize', methods=['POST'])
+@login_required
+def summarize_emails(user: User):
+    """归纳一段时间内的邮件
+    按天分块并行摘要后逐层合并，已计算过的节点直接复用
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': '请求数据不能为空'}), 400
+
+        api_key = data.get('api_key')
+        model = data.get('model', 'deepseek-chat')
+        days = int(data.get('days', 30))
+        query = data.get('query') or DEFAULT_QUERY
+
+        if not api_key:
+            return jsonify({'error': 'API密钥不能为空'}), 400
+        if days <= 0:
+            return jsonify({'error': '天数必须大于 0'}), 400
+
+        # 归纳的调用次数取决于邮件量，只检查当天是否已超出预算
+        model, over_budget = _apply_budget(user, model)
+        if over_budget:
+            return over_budget
+
+        # 获取 AI 服务
+        ai_service = ServiceManager.get_ai_service(
+            provider=data.get('provider', DEFAULT_PROVIDER),
+            api_key=api_key,
+            model=model
+        )
+        if not ai_service:
+            return jsonify({'error': 'AI服务初始化失败'}), 500
+
+        since = datetime.utcnow() - timedelta(days=days)
+        emails = Email.query.filter(
+            Email.user_id == user.id,
+            Email.received_at >= since
+        ).order_by(Email.received_at.asc()).all()
+
+        cluster_ids = {email.id: DedupService.cluster_of(email) for email in emails}
+        result = MapReduceSummarizer(ai_service).summarize(emails, query, cluster_ids)
+        result['model'] = model
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(f"邮件归纳失败: {str(e)}")
+        return jsonify({'error': f'邮件归纳失败: {str(e)}'}), 500
+
 @ai_bp.route('/validate', methods=['POST'])
 def validate_api():
     """验证 API 配置"""
@@ -75,7 +376,7 @@ def validate_api():
 
         # 获取 AI 服务
         ai_service = ServiceManager.get_ai_service(
-            provider='deepseek',
+            provider=data.get('provider', DEFAULT_PROVIDER),
             api_key=api_key,
             model=model
         )
@@ -99,7 +400,7 @@ def validate_api():
 def get_config():
     """获取服务配置"""
     try:
-        provider = request.args.get('provider', 'deepseek')
+        provider = request.args.get('provider', DEFAULT_PROVIDER)
         config = ServiceManager.get_ai_service_config(provider)
         return jsonify(config)
 
@@ -108,3 +409,54 @@ def get_config():
         return jsonify({
             'error': f'获取配置失败: {str(e)}'
         }), 500
+
+@ai_bp.route('/metrics', methods=['GET'])
+@login_required
+def get_metrics(user: User):
+    """获取 AI 服务运行指标（需要登录）"""
+    try:
+        cache = get_response_cache()
+        classifier = get_local_classifier()
+        queue = get_analysis_queue()
+        return jsonify({
+            'cache': cache.stats() if cache else {'enabled': False},
+            'classifier': dict(classifier.stats) if classifier else {'enabled': False},
+            'analysis_queue': queue.get_stats() if queue else {'enabled': False},
+            'clients': AIServiceFactory.get_registry_stats(),
+            'gateway': gateway_stats(),
+            'resilience': resilience_stats(),
+            'usage': get_usage_ledger().get_stats(),
+            'prompts': {
+                'templates': list_templates(),
+                'cache': get_prompt_cache_stats().stats()
+            },
+            'structured_output': structured_stats()
+        })
+
+    except Exception as e:
+        logger.error(f"获取 AI 服务指标失败: {str(e)}")
+        return jsonify({
+            'error': f'获取 AI 服务指标失败: {str(e)}'
+        }), 500
+
+@ai_bp.route('/usage', methods=['GET'])
+@login_required
+def get_usage(user: User):
+    """获取当前用户的 AI 用量
+    按日期汇总，可选参数 days（默认 7）和 by_feature（按功能拆分）
+    """
+    try:
+        days = int(request.args.get('days', 7))
+        by_feature = request.args.get('by_feature', 'false').lower() == 'true'
+        ledger = get_usage_ledger()
+        return jsonify({
+            'daily': ledger.summary(user.id, days=max(days, 1), by_feature=by_feature),
+            'today': {
+                'used': ledger.used_today(user.id),
+                'limit': ledger.daily_budget
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"获取 AI 用量失败: {str(e)}")
+        return jsonify({'error': f'获取 AI 用量失败: {str(e)}'}), 500
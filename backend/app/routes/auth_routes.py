@@ -111,6 +111,7 @@ def google_logout():
                             logger.error(f"停止邮件同步服务失败: {email_service.sync_error}")
                         else:
                             logger.info(f"已停止用户 {user.email} 的邮件同步服务")
+                        auth_service.clear_tokens(user)
 
         # 清除session
         session.clear()
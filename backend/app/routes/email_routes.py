@@ -4,6 +4,15 @@
 """
 from flask import Blueprint, jsonify, request, session
 from ..service.service_manager import ServiceManager
+from ..service.ai.ai_service import DEFAULT_PROVIDER
+from ..service.ai.usage import get_usage_ledger
+from ..service.email_analyzer import EmailAnalysisService
+from ..service.email_analysis_store import AnalysisStore
+from ..service.analysis_queue import (
+    get_analysis_queue, server_api_key, QueueFullError, PRIORITY_BACKFILL, PRIORITY_INTERACTIVE
+)
+from ..service.email_topics import TopicService
+from ..service.email_classifier import get_local_classifier
 from ..utils.logger import get_logger
 from ..db.database import db
 from ..models import User, Email
@@ -92,7 +101,10 @@ def get_email(user: User, email_id: str):
 @email_bp.route('/<int:email_id>/analyze', methods=['POST'])
 @login_required
 def analyze_email(email_id: int, user: User):
-    """分析邮件内容"""
+    """分析邮件内容
+    已有当前版本的分析结果时直接返回，否则提交交互优先级的分析任务并返回 202，
+    客户端通过 /api/email/analysis/jobs/<job_id> 查询结果；force 为真时重新分析
+    """
     try:
         # 获取邮件服务
         email_service = ServiceManager.get_email_service()
@@ -103,30 +115,191 @@ def analyze_email(email_id: int, user: User):
         data = request.get_json() or {}
         api_key = data.get('api_key')
         model = data.get('model', 'deepseek-chat')
+        force = bool(data.get('force'))
 
-        if not api_key:
+        email = email_service.get_email_by_id(user, email_id)
+        if not email:
+            return jsonify({'error': '邮件不存在'}), 404
+
+        # 已分析过的邮件直接读库，不再创建 AI 服务
+        stored = None if force else AnalysisStore.get(email.id, model)
+        if stored:
+            return jsonify(stored.to_dict())
+
+        if not api_key and not server_api_key():
             return jsonify({'error': 'API密钥不能为空'}), 400
 
-        # 获取 AI 服务
+        queue = get_analysis_queue()
+        budget = get_usage_ledger().check_budget(user.id, model)
+        if queue:
+            # 今日用量已达上限时按后台优先级排队，预算重置后再执行
+            priority = PRIORITY_INTERACTIVE if budget.allowed else PRIORITY_BACKFILL
+            job = queue.enqueue(user.id, [email.id], model, priority=priority, api_key=api_key,
+                                force=force, provider=data.get('provider', DEFAULT_PROVIDER))[0]
+            return jsonify({'job': job.to_dict(), 'deferred': not budget.allowed}), 202
+        if not budget.allowed:
+            return jsonify({'error': '今日 AI 用量已达上限', 'retry_after': budget.retry_after}), 429, \
+                {'Retry-After': str(budget.retry_after)}
+        model = budget.model
+
+        # 未启用任务队列时在请求中直接分析
         ai_service = ServiceManager.get_ai_service(
-            provider='deepseek',
-            api_key=api_key,
+            provider=data.get('provider', DEFAULT_PROVIDER),
+            api_key=api_key or server_api_key(),
             model=model
         )
         if not ai_service:
             return jsonify({'error': 'AI服务初始化失败'}), 500
 
-        # 获取邮件内容并分析
-        email = email_service.get_email_by_id(user, email_id)
+        analyzer = EmailAnalysisService(ai_service, classifier=get_local_classifier())
+        analysis = AnalysisStore.analyze_email(email, analyzer, force=force)
+        return jsonify(analysis.to_dict())
+
+    except QueueFullError as e:
+        logger.warning(f"分析任务被拒绝: {str(e)}")
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        logger.error(f"分析邮件失败: {str(e)}")
+        return jsonify({'error': '分析邮件失败'}), 500
+
+@email_bp.route('/analysis/jobs', methods=['POST'])
+@login_required
+def enqueue_analysis_jobs(user: User):
+    """批量提交邮件分析任务
+    priority 为 interactive（默认）或 backfill
+    """
+    try:
+        queue = get_analysis_queue()
+        if not queue:
+            return jsonify({'error': '分析任务队列未启用'}), 503
+
+        data = request.get_json() or {}
+        email_ids = data.get('email_ids') or []
+        model = data.get('model', 'deepseek-chat')
+        if not isinstance(email_ids, list) or not email_ids:
+            return jsonify({'error': 'email_ids 不能为空'}), 400
+        if not data.get('api_key') and not server_api_key():
+            return jsonify({'error': 'API密钥不能为空'}), 400
+
+        owned = [row[0] for row in Email.query.with_entities(Email.id).filter(
+            Email.user_id == user.id, Email.id.in_(email_ids)
+        ).all()]
+        if len(owned) != len(set(email_ids)):
+            return jsonify({'error': '邮件不存在'}), 404
+
+        priority = PRIORITY_BACKFILL if data.get('priority') == 'backfill' else PRIORITY_INTERACTIVE
+        jobs = queue.enqueue(user.id, email_ids, model, priority=priority,
+                             api_key=data.get('api_key'), force=bool(data.get('force')),
+                             provider=data.get('provider', DEFAULT_PROVIDER))
+        return jsonify({'jobs': [job.to_dict() for job in jobs]}), 202
+
+    except QueueFullError as e:
+        logger.warning(f"分析任务被拒绝: {str(e)}")
+        return jsonify({'error': str(e), 'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        logger.error(f"提交分析任务失败: {str(e)}")
+        return jsonify({'error': '提交分析任务失败'}), 500
+
+@email_bp.route('/analysis/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_analysis_job(job_id: int, user: User):
+    """查询分析任务状态"""
+    try:
+        queue = get_analysis_queue()
+        if not queue:
+            return jsonify({'error': '分析任务队列未启用'}), 503
+
+        job = queue.get_job(job_id, user.id)
+        if not job:
+            return jsonify({'error': '任务不存在'}), 404
+        return jsonify(job)
+
+    except Exception as e:
+        logger.error(f"查询分析任务失败: {str(e)}")
+        return jsonify({'error': '查询分析任务失败'}), 500
+
+@email_bp.route('/<int:email_id>/analysis', methods=['GET'])
+@login_required
+def get_email_analysis(email_id: int, user: User):
+    """获取已保存的邮件分析结果"""
+    try:
+        email = Email.query.filter_by(id=email_id, user_id=user.id).first()
         if not email:
             return jsonify({'error': '邮件不存在'}), 404
 
-        result = ai_service.analyze_email(email)
-        return jsonify(result)
+        model = request.args.get('model')
+        analysis = AnalysisStore.get(email.id, model) if model else AnalysisStore.latest(email.id)
+        if not analysis:
+            return jsonify({'error': '邮件尚未分析'}), 404
+        return jsonify(analysis.to_dict())
 
     except Exception as e:
-        logger.error(f"分析邮件失败: {str(e)}")
-        return jsonify({'error': '分析邮件失败'}), 500
+        logger.error(f"获取邮件分析结果失败: {str(e)}")
+        return jsonify({'error': '获取邮件分析结果失败'}), 500
+
+@email_bp.route('/analyses', methods=['GET'])
+@login_required
+def list_email_analyses(user: User):
+    """获取已保存的邮件分析结果列表"""
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+        return jsonify(AnalysisStore.list_analyses(
+            user.id,
+            model=request.args.get('model'),
+            page=page,
+            per_page=per_page
+        ))
+
+    except Exception as e:
+        logger.error(f"获取邮件分析结果列表失败: {str(e)}")
+        return jsonify({'error': '获取邮件分析结果列表失败'}), 500
+
+@email_bp.route('/topics', methods=['GET'])
+@login_required
+def list_topics(user: User):
+    """获取邮件主题列表"""
+    try:
+        return jsonify({'topics': TopicService.list_topics(user.id)})
+
+    except Exception as e:
+        logger.error(f"获取邮件主题失败: {str(e)}")
+        return jsonify({'error': f'获取邮件主题失败: {str(e)}'}), 500
+
+@email_bp.route('/topics/label', methods=['POST'])
+@login_required
+def label_topics(user: User):
+    """为未命名的主题生成名称
+    请求参数 rebuild 为真时先对全部邮件重新聚类
+    """
+    try:
+        data = request.get_json() or {}
+        api_key = data.get('api_key')
+        model = data.get('model', 'deepseek-chat')
+
+        if not api_key:
+            return jsonify({'error': 'API密钥不能为空'}), 400
+
+        # 获取 AI 服务
+        ai_service = ServiceManager.get_ai_service(
+            provider=data.get('provider', DEFAULT_PROVIDER),
+            api_key=api_key,
+            model=model
+        )
+        if not ai_service:
+            return jsonify({'error': 'AI服务初始化失败'}), 500
+
+        if data.get('rebuild'):
+            TopicService.rebuild_topics(user.id, data.get('n_topics'))
+        labeled = TopicService.label_topics(user.id, ai_service)
+        return jsonify({
+            'labeled': labeled,
+            'topics': TopicService.list_topics(user.id)
+        })
+
+    except Exception as e:
+        logger.error(f"标注邮件主题失败: {str(e)}")
+        return jsonify({'error': f'标注邮件主题失败: {str(e)}'}), 500
 
 @email_bp.route('/analyze', methods=['POST'])
 def analyze_file():
@@ -159,7 +332,7 @@ def analyze_file():
 
         # 获取 AI 服务
         ai_service = ServiceManager.get_ai_service(
-            provider='deepseek',
+            provider=data.get('provider', DEFAULT_PROVIDER),
             api_key=api_key,
             model=model
         )
@@ -200,7 +373,7 @@ def validate_api():
 
         # 获取 AI 服务
         ai_service = ServiceManager.get_ai_service(
-            provider='deepseek',
+            provider=data.get('provider', DEFAULT_PROVIDER),
             api_key=api_key,
             model=model
         )
@@ -224,7 +397,7 @@ def validate_api():
 def get_config():
     """获取服务配置"""
     try:
-        provider = request.args.get('provider', 'deepseek')
+        provider = request.args.get('provider', DEFAULT_PROVIDER)
         config = ServiceManager.get_ai_service_config(provider)
         return jsonify(config)
 
@@ -1,54 +1,122 @@
 """
 调度器路由模块
 处理定时任务相关的API路由
+
+所有路由共享应用的调度器；用户只能查看和操作名称以自己用户ID结尾的任务（如 email_sync_1），
+任务函数的参数由服务器绑定为当前用户ID。
+用户只能创建 USER_TASKS 中的任务，任务ID带有该任务的分组前缀（如 email_sync_），
+与系统创建的同类任务共享同时执行数上限；触发间隔不能短于 SCHEDULER_MIN_INTERVAL_SECONDS
 """
-from flask import Blueprint, jsonify, request
-from ..service.scheduler_service import SchedulerService
+import uuid
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request
+from apscheduler.triggers.date import DateTrigger
+from ..service.scheduler_service import SchedulerService, get_scheduler_service
 from ..utils.logger import get_logger
+from ..utils.decorators import login_required
+from ..models import User
 
 logger = get_logger(__name__)
 scheduler_bp = Blueprint('scheduler', __name__)
 
-def get_scheduler_service():
-    """获取调度器服务实例"""
-    return SchedulerService()
+def _owns(job, user: User) -> bool:
+    """任务是否属于该用户"""
+    return bool(job) and (job.get('name') or '').endswith(f"_{user.id}")
+
+# 用户可以通过接口创建的任务：任务函数 -> 任务ID前缀（执行器按前缀限制同类任务的同时执行数）
+USER_TASKS = {
+    'app.service.email_sync:sync_emails_task': 'email_sync_',
+    'app.service.email_analysis_store:analyze_pending_task': 'email_analysis_',
+}
+DEFAULT_MIN_INTERVAL_SECONDS = 900
+# 校验 cron 触发器时检查的连续执行次数
+CRON_CHECK_RUNS = 20
+
+def _task_ref(func) -> str:
+    """校验通过接口指定的任务函数：只允许 USER_TASKS 中的任务"""
+    if func not in USER_TASKS:
+        raise ValueError(f"不允许的任务函数，可选: {', '.join(USER_TASKS)}")
+    return func
+
+def _job_id(func: str, user: User) -> str:
+    """用户创建的任务ID：分组前缀 + 用户ID + 随机后缀，不与系统任务（如 email_sync_1）冲突"""
+    return f"{USER_TASKS[func]}{user.id}_{uuid.uuid4().hex[:8]}"
+
+def _trigger(trigger) -> str:
+    """校验触发器：相邻两次执行的间隔不能短于 SCHEDULER_MIN_INTERVAL_SECONDS"""
+    if not isinstance(trigger, str):
+        raise ValueError('触发器格式应为 cron:表达式、interval:秒数 或 date:ISO 时间')
+    try:
+        parsed = SchedulerService._parse_trigger(trigger)
+    except ValueError as e:
+        raise ValueError(f"无效的触发器: {str(e)}")
+    if isinstance(parsed, DateTrigger):
+        return trigger
+
+    min_interval = current_app.config.get('SCHEDULER_MIN_INTERVAL_SECONDS', DEFAULT_MIN_INTERVAL_SECONDS)
+    interval = getattr(parsed, 'interval', None)
+    if interval is not None:
+        shortest = interval.total_seconds()
+    else:
+        # cron 触发器的间隔不固定，检查接下来若干次执行中最短的间隔
+        now = datetime.now(timezone.utc)
+        runs = [parsed.get_next_fire_time(None, now)]
+        while len(runs) <= CRON_CHECK_RUNS and runs[-1] is not None:
+            runs.append(parsed.get_next_fire_time(runs[-1], runs[-1]))
+        runs = [run for run in runs if run is not None]
+        shortest = min(((b - a).total_seconds() for a, b in zip(runs, runs[1:])), default=min_interval)
+    if shortest < min_interval:
+        raise ValueError(f"任务执行间隔不能短于 {min_interval} 秒")
+    return trigger
+
+def _task_args(data, user: User) -> list:
+    """任务函数只接收用户ID一个参数，由服务器绑定为当前用户；客户端指定其他参数时拒绝"""
+    if data.get('args') not in (None, [], [user.id]) or data.get('kwargs'):
+        raise ValueError('任务参数由服务器绑定为当前用户，不能指定')
+    return [user.id]
 
 @scheduler_bp.route('/jobs', methods=['GET'])
-def list_jobs():
-    """获取所有定时任务"""
+@login_required
+def list_jobs(user: User):
+    """获取当前用户的定时任务"""
     try:
-        scheduler_service = get_scheduler_service()
-        jobs = scheduler_service.get_all_jobs()
-        return jsonify(jobs)
+        jobs = get_scheduler_service().get_all_jobs()
+        return jsonify([job for job in jobs if _owns(job, user)])
     except Exception as e:
         logger.error(f"获取定时任务列表失败: {str(e)}")
         return jsonify({'error': '获取定时任务列表失败'}), 500
 
 @scheduler_bp.route('/jobs', methods=['POST'])
-def create_job():
+@login_required
+def create_job(user: User):
     """创建定时任务"""
     try:
-        data = request.get_json()
-        scheduler_service = get_scheduler_service()
-        job = scheduler_service.create_job(
-            name=data.get('name'),
-            func=data.get('func'),
-            trigger=data.get('trigger'),
-            args=data.get('args', []),
-            kwargs=data.get('kwargs', {})
+        data = request.get_json() or {}
+        if not data.get('name') or not data.get('trigger'):
+            return jsonify({'error': '任务名称和触发器不能为空'}), 400
+        func = _task_ref(data.get('func'))
+        job = get_scheduler_service().create_job(
+            name=f"{data['name']}_{user.id}",
+            func=func,
+            trigger=_trigger(data['trigger']),
+            args=_task_args(data, user),
+            kwargs={},
+            id=_job_id(func, user)
         )
         return jsonify(job)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"创建定时任务失败: {str(e)}")
         return jsonify({'error': '创建定时任务失败'}), 500
 
 @scheduler_bp.route('/jobs/<job_id>', methods=['GET'])
-def get_job(job_id):
+@login_required
+def get_job(job_id, user: User):
     """获取定时任务详情"""
     try:
-        scheduler_service = get_scheduler_service()
-        job = scheduler_service.get_job(job_id)
-        if not job:
+        job = get_scheduler_service().get_job(job_id)
+        if not _owns(job, user):
             return jsonify({'error': '定时任务不存在'}), 404
         return jsonify(job)
     except Exception as e:
@@ -56,32 +124,41 @@ def get_job(job_id):
         return jsonify({'error': '获取定时任务详情失败'}), 500
 
 @scheduler_bp.route('/jobs/<job_id>', methods=['PUT'])
-def update_job(job_id):
+@login_required
+def update_job(job_id, user: User):
     """更新定时任务"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         scheduler_service = get_scheduler_service()
+        if not _owns(scheduler_service.get_job(job_id), user):
+            return jsonify({'error': '定时任务不存在'}), 404
+        # 任务ID的分组前缀由任务函数决定，不能改成其他分组的任务
+        if data.get('func') and not job_id.startswith(USER_TASKS.get(_task_ref(data['func']), '')):
+            raise ValueError('不能修改任务函数，请删除后重新创建')
         job = scheduler_service.update_job(
             job_id,
-            name=data.get('name'),
+            name=f"{data['name']}_{user.id}" if data.get('name') else None,
             func=data.get('func'),
-            trigger=data.get('trigger'),
-            args=data.get('args', []),
-            kwargs=data.get('kwargs', {})
+            trigger=_trigger(data['trigger']) if data.get('trigger') else None,
+            args=_task_args(data, user),
+            kwargs={}
         )
         if not job:
             return jsonify({'error': '定时任务不存在'}), 404
         return jsonify(job)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"更新定时任务失败: {str(e)}")
         return jsonify({'error': '更新定时任务失败'}), 500
 
 @scheduler_bp.route('/jobs/<job_id>', methods=['DELETE'])
-def delete_job(job_id):
+@login_required
+def delete_job(job_id, user: User):
     """删除定时任务"""
     try:
         scheduler_service = get_scheduler_service()
-        if scheduler_service.delete_job(job_id):
+        if _owns(scheduler_service.get_job(job_id), user) and scheduler_service.remove_job(job_id):
             return jsonify({'message': '定时任务删除成功'})
         return jsonify({'error': '定时任务不存在'}), 404
     except Exception as e:
@@ -89,11 +166,12 @@ def delete_job(job_id):
         return jsonify({'error': '删除定时任务失败'}), 500
 
 @scheduler_bp.route('/jobs/<job_id>/pause', methods=['POST'])
-def pause_job(job_id):
+@login_required
+def pause_job(job_id, user: User):
     """暂停定时任务"""
     try:
         scheduler_service = get_scheduler_service()
-        if scheduler_service.pause_job(job_id):
+        if _owns(scheduler_service.get_job(job_id), user) and scheduler_service.pause_job(job_id):
             return jsonify({'message': '定时任务暂停成功'})
         return jsonify({'error': '定时任务不存在'}), 404
     except Exception as e:
@@ -101,13 +179,24 @@ def pause_job(job_id):
         return jsonify({'error': '暂停定时任务失败'}), 500
 
 @scheduler_bp.route('/jobs/<job_id>/resume', methods=['POST'])
-def resume_job(job_id):
+@login_required
+def resume_job(job_id, user: User):
     """恢复定时任务"""
     try:
         scheduler_service = get_scheduler_service()
-        if scheduler_service.resume_job(job_id):
+        if _owns(scheduler_service.get_job(job_id), user) and scheduler_service.resume_job(job_id):
             return jsonify({'message': '定时任务恢复成功'})
         return jsonify({'error': '定时任务不存在'}), 404
     except Exception as e:
         logger.error(f"恢复定时任务失败: {str(e)}")
         return jsonify({'error': '恢复定时任务失败'}), 500
+
+@scheduler_bp.route('/stats', methods=['GET'])
+@login_required
+def get_stats(user: User):
+    """获取调度器运行状态"""
+    try:
+        return jsonify(get_scheduler_service().stats())
+    except Exception as e:
+        logger.error(f"获取调度器状态失败: {str(e)}")
+        return jsonify({'error': '获取调度器状态失败'}), 500
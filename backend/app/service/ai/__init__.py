@@ -3,6 +3,11 @@ AI服务模块
 """
 from .base_ai_service import BaseAIService
 from .deepseek_service import DeepSeekService
+from .async_deepseek_service import AsyncDeepSeekService
+from .openai_service import OpenAICompatibleService
+from .cached_ai_service import CachedAIService
+from .gateway import AIGateway
 from .ai_service import AIServiceFactory
 
-__all__ = ['BaseAIService', 'DeepSeekService', 'AIServiceFactory']
+__all__ = ['BaseAIService', 'DeepSeekService', 'AsyncDeepSeekService', 'OpenAICompatibleService',
+           'CachedAIService', 'AIGateway', 'AIServiceFactory']
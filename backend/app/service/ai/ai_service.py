@@ -2,30 +2,41 @@
 AI 服务工厂模块
 用于创建和管理 AI 服务实例
 """
+import os
 from typing import Dict, Any, Type, Optional
 from .base_ai_service import BaseAIService, AIServiceError
 from .deepseek_service import DeepSeekService
+from .async_deepseek_service import AsyncDeepSeekService
+from .openai_service import OpenAICompatibleService
+from .gateway import AIGateway, AI_GATEWAY_BACKENDS, gateway_stats
+from .chunking import MODEL_CONTEXT_WINDOWS, DEFAULT_CONTEXT_WINDOW
+from .cached_ai_service import CachedAIService
+from .response_cache import get_response_cache
+from .client_registry import get_client_registry
+from .usage import MeteredAIService
 from ...utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 路由未指定 provider 时使用的服务提供商
+DEFAULT_PROVIDER = os.getenv('AI_PROVIDER', 'deepseek').lower()
+
 class AIServiceFactory:
     """AI 服务工厂类"""
 
     # 支持的服务提供商
     PROVIDERS: Dict[str, Type[BaseAIService]] = {
         'deepseek': DeepSeekService,
+        'deepseek-async': AsyncDeepSeekService,
+        'openai': OpenAICompatibleService,
+        'gateway': AIGateway,
     }
 
-    # 单例实例
-    _instance: Optional[BaseAIService] = None
-    _current_provider: Optional[str] = None
-    _current_api_key: Optional[str] = None
-    _current_model: Optional[str] = None
-
     @classmethod
     def create_service(cls, provider: str, **kwargs) -> BaseAIService:
         """创建或获取 AI 服务实例
+        实例按 (服务提供商, API 密钥摘要, 模型) 在进程内复用，不同用户交替请求时
+        不会重建连接，也不会重复验证密钥
 
         Args:
             provider: 服务提供商名称
@@ -48,35 +59,24 @@ class AIServiceFactory:
             if not api_key or not model:
                 raise AIServiceError("缺少必要参数：api_key 和 model")
 
-            # 如果实例已存在且配置相同，直接返回
-            if (cls._instance and
-                cls._current_provider == provider and
-                cls._current_api_key == api_key and
-                cls._current_model == model):
-                logger.info("使用现有的 AI 服务实例")
-                return cls._instance
-
-            # 创建新实例
-            service_class = cls.PROVIDERS[provider]
-            service = service_class(**kwargs)
-
-            # 验证配置
-            if not service.validate_config({'api_key': api_key, 'model': model}):
-                raise AIServiceError("API 配置验证失败")
-
-            # 更新实例信息
-            cls._instance = service
-            cls._current_provider = provider
-            cls._current_api_key = api_key
-            cls._current_model = model
-
-            logger.info(f"成功创建新的 {provider} AI 服务实例")
-            return service
+            return get_client_registry().get(
+                provider, api_key, model,
+                lambda: cls._build_service(provider, **kwargs)
+            )
 
         except Exception as e:
             logger.error(f"创建 AI 服务失败: {str(e)}")
             raise AIServiceError(f"创建 AI 服务失败: {str(e)}")
 
+    @classmethod
+    def _build_service(cls, provider: str, **kwargs) -> BaseAIService:
+        """创建新的服务实例，外层依次加上响应缓存和用量记录"""
+        service = cls.PROVIDERS[provider](**kwargs)
+        cache = get_response_cache()
+        if cache is not None:
+            service = CachedAIService(service, cache, provider)
+        return MeteredAIService(service, provider)
+
     @classmethod
     def get_service_config(cls, provider: str) -> Dict[str, Any]:
         """获取服务配置信息
@@ -95,7 +95,7 @@ class AIServiceFactory:
             if provider not in cls.PROVIDERS:
                 raise AIServiceError(f"不支持的 AI 服务提供商: {provider}")
 
-            if provider == "deepseek":
+            if provider in ("deepseek", "deepseek-async"):
                 return {
                     "name": "DeepSeek",
                     "models": [
@@ -104,10 +104,32 @@ class AIServiceFactory:
                             "name": "DeepSeek-V3",
                             "description": "通用对话模型，支持多种任务",
                             "max_tokens": 8192,
+                            "context_window": MODEL_CONTEXT_WINDOWS["deepseek-chat"],
+                            "temperature_range": [0, 2]
+                        }
+                    ]
+                }
+            elif provider == "openai":
+                model = os.getenv('OPENAI_MODEL', OpenAICompatibleService.DEFAULT_MODEL)
+                return {
+                    "name": "OpenAI 兼容接口",
+                    "base_url": os.getenv('OPENAI_BASE_URL', OpenAICompatibleService.BASE_URL),
+                    "models": [
+                        {
+                            "id": model,
+                            "name": model,
+                            "description": "OpenAI 兼容的对话模型",
+                            "context_window": MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW),
                             "temperature_range": [0, 2]
                         }
                     ]
                 }
+            elif provider == "gateway":
+                return {
+                    "name": "AI 网关",
+                    "backends": AI_GATEWAY_BACKENDS,
+                    "latency": gateway_stats()
+                }
             else:
                 raise AIServiceError(f"暂未实现 {provider} 的配置信息")
 
@@ -116,21 +138,12 @@ class AIServiceFactory:
             raise AIServiceError(f"获取 AI 服务配置失败: {str(e)}")
 
     @classmethod
-    def get_instance(cls) -> Optional[BaseAIService]:
-        """获取当前的 AI 服务实例
-
-        Returns:
-            Optional[BaseAIService]: AI 服务实例，如果未创建则返回 None
-        """
-        return cls._instance
+    def get_registry_stats(cls) -> Dict[str, Any]:
+        """获取 AI 客户端注册表的统计信息"""
+        return get_client_registry().stats()
 
     @classmethod
     def reset_instance(cls):
-        """重置 AI 服务实例"""
-        if cls._instance:
-            cls._instance.close()
-            cls._instance = None
-            cls._current_provider = None
-            cls._current_api_key = None
-            cls._current_model = None
-            logger.info("AI 服务实例已重置")
+        """关闭并清除所有 AI 服务实例"""
+        get_client_registry().clear()
+        logger.info("AI 服务实例已重置")
@@ -0,0 +1,229 @@
+"""
+异步 DeepSeek AI 服务模块
+基于 httpx.AsyncClient 实现并发的 DeepSeek API 调用
+"""
+import asyncio
+import importlib.util
+import threading
+from typing import Any, Coroutine, Dict, List, Optional, Union
+import httpx
+from .base_ai_service import BaseAIService, AIServiceError
+from .deepseek_service import PROXIES, build_chat_payload, parse_chat_response
+from .resilience import BackendUnavailableError, classify_error, get_backend_guard
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# HTTP/2 依赖 h2 包，未安装时退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class AsyncDeepSeekService(BaseAIService):
+    """异步 DeepSeek AI 服务类
+
+    服务持有一个专用的事件循环线程，连接池和并发信号量都绑定在该循环上。
+    无论调用方处在哪个事件循环（Flask 异步视图、调度任务）或是同步代码，
+    请求都会转交到这个循环执行，因此所有调用共享同一个连接池和并发上限。
+    """
+
+    BASE_URL = "https://api.deepseek.com/v1"
+    DEFAULT_MODEL = "deepseek-chat"
+    DEFAULT_TIMEOUT = 30.0
+
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL,
+                 max_concurrency: int = 8, timeout: float = DEFAULT_TIMEOUT):
+        """初始化异步 DeepSeek 服务
+
+        Args:
+            api_key: API 密钥
+            model: 模型名称
+            max_concurrency: 最大并发请求数
+            timeout: 默认单次请求超时（秒）
+        """
+        super().__init__(api_key, model)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        # 启动专用事件循环线程
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name=f"deepseek-async-{id(self):x}",
+            daemon=True
+        )
+        self._thread.start()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 与同步服务共享熔断器；并发由本服务的信号量控制，不使用阻塞的自适应并发上限
+        self.breaker = get_backend_guard('deepseek').breaker
+
+        if not HTTP2_AVAILABLE:
+            logger.warning("未安装 h2，异步 DeepSeek 客户端使用 HTTP/1.1")
+
+        # 创建客户端，保持长连接
+        self.client = httpx.AsyncClient(
+            base_url=self.BASE_URL,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            proxies=PROXIES,
+            timeout=httpx.Timeout(connect=5.0, read=timeout, write=5.0, pool=timeout),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+                keepalive_expiry=60.0
+            ),
+            http2=HTTP2_AVAILABLE,
+            verify=False,  # 与同步客户端保持一致
+            follow_redirects=True
+        )
+        logger.info(f"异步 DeepSeek 服务初始化完成，最大并发: {max_concurrency}")
+
+    async def _dispatch(self, coro: Coroutine) -> Any:
+        """在服务的事件循环上执行协程
+        调用方被取消时，取消会传递到服务循环上的任务
+        """
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return await asyncio.wrap_future(future)
+
+    def _run_sync(self, coro: Coroutine) -> Any:
+        """在同步代码中执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _achat(self, message: str, timeout: Optional[float] = None, **kwargs) -> Dict[str, Any]:
+        """发送单个对话请求（运行在服务循环上）"""
+        timeout = timeout or self.timeout
+        data = build_chat_payload(self.model, message, **kwargs)
+        async with self._semaphore:
+            if not self.breaker.allow():
+                raise BackendUnavailableError("AI 后端 deepseek 暂时不可用，请稍后重试",
+                                              self.breaker.retry_after())
+            try:
+                response = await asyncio.wait_for(
+                    self.client.post("/chat/completions", json=data),
+                    timeout=timeout
+                )
+                response.raise_for_status()
+                self.breaker.record_success()
+                return parse_chat_response(response.json())
+            except asyncio.TimeoutError:
+                self.breaker.record_failure()
+                logger.error(f"DeepSeek API 请求超时（{timeout} 秒）")
+                raise AIServiceError(f"API 请求超时: {timeout} 秒")
+            except httpx.HTTPError as e:
+                if classify_error(e) is None:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                logger.error(f"DeepSeek API 请求失败: {str(e)}")
+                raise AIServiceError(f"API 请求失败: {str(e)}")
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except (KeyError, IndexError, ValueError) as e:
+                logger.error(f"DeepSeek 响应解析失败: {str(e)}")
+                raise AIServiceError(f"服务处理失败: {str(e)}")
+
+    async def _abatch_chat(self, messages: List[str], timeout: Optional[float] = None,
+                           **kwargs) -> List[Union[Dict[str, Any], AIServiceError]]:
+        """并发发送多个对话请求（运行在服务循环上）"""
+        results = await asyncio.gather(
+            *(self._achat(message, timeout=timeout, **kwargs) for message in messages),
+            return_exceptions=True
+        )
+        return [
+            r if isinstance(r, (dict, AIServiceError)) else AIServiceError(f"服务处理失败: {str(r)}")
+            for r in results
+        ]
+
+    async def achat(self, message: str, timeout: Optional[float] = None, **kwargs) -> Dict[str, Any]:
+        """异步发送对话请求
+
+        Args:
+            message: 用户消息
+            timeout: 本次请求的超时（秒），默认使用服务超时
+            **kwargs: 其他参数
+
+        Returns:
+            Dict[str, Any]: 响应结果
+
+        Raises:
+            AIServiceError: 请求失败或超时时抛出
+        """
+        return await self._dispatch(self._achat(message, timeout=timeout, **kwargs))
+
+    async def abatch_chat(self, messages: List[str], timeout: Optional[float] = None,
+                          **kwargs) -> List[Union[Dict[str, Any], AIServiceError]]:
+        """异步并发发送多个对话请求
+        并发数受 max_concurrency 限制，总耗时约等于最慢的一批请求
+
+        Args:
+            messages: 用户消息列表
+            timeout: 每个请求的超时（秒）
+            **kwargs: 其他参数
+
+        Returns:
+            List: 与输入顺序一致的结果，失败的请求对应 AIServiceError
+        """
+        return await self._dispatch(self._abatch_chat(messages, timeout=timeout, **kwargs))
+
+    def chat(self, message: str, **kwargs) -> Dict[str, Any]:
+        """同步发送对话请求
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Returns:
+            Dict[str, Any]: 响应结果
+
+        Raises:
+            AIServiceError: 请求失败时抛出
+        """
+        return self._run_sync(self._achat(message, **kwargs))
+
+    def batch_chat(self, messages: List[str], **kwargs) -> List[Union[Dict[str, Any], AIServiceError]]:
+        """同步代码中并发发送多个对话请求
+
+        Args:
+            messages: 用户消息列表
+            **kwargs: 其他参数
+
+        Returns:
+            List: 与输入顺序一致的结果，失败的请求对应 AIServiceError
+        """
+        return self._run_sync(self._abatch_chat(messages, **kwargs))
+
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证配置
+
+        Args:
+            config: 配置信息
+
+        Returns:
+            bool: 配置是否有效
+        """
+        try:
+            response = self._run_sync(self.client.get("/models"))
+            if response.status_code == 200:
+                logger.info("DeepSeek API 验证成功")
+                return True
+            logger.warning(f"API 验证失败，状态码: {response.status_code}")
+            return False
+        except Exception as e:
+            logger.error(f"DeepSeek API 验证失败: {str(e)}")
+            return False
+
+    def close(self):
+        """关闭服务"""
+        if self._loop.is_closed():
+            return
+        try:
+            self._run_sync(self.client.aclose())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            logger.info("异步 DeepSeek 服务已关闭")
@@ -2,16 +2,49 @@
 AI 服务基类模块
 定义 AI 服务的基本接口
 """
-from typing import Dict, Any, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Dict, Any, Callable, Iterator, List, Optional
 from abc import ABC, abstractmethod
 from ...utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 服务没有批量接口时，批量请求逐条并发发送的线程数
+AI_BATCH_MAX_WORKERS = int(os.getenv('AI_BATCH_MAX_WORKERS', 8))
+
 class AIServiceError(Exception):
     """AI 服务错误"""
     pass
 
+def chat_concurrently(chat: Callable[..., Dict[str, Any]], messages: List[str],
+                      max_workers: int = AI_BATCH_MAX_WORKERS, **kwargs) -> List[Any]:
+    """在有界线程池中并发发送多个对话请求
+    每个请求在调用方上下文的副本中执行，应用上下文和用量归属在工作线程中同样可见
+
+    Args:
+        chat: 单个对话请求的函数
+        messages: 用户消息列表
+        max_workers: 并发线程数
+        **kwargs: 其他参数
+
+    Returns:
+        List: 与输入顺序一致的结果，失败的请求对应 AIServiceError
+    """
+    def run(context, message: str) -> Any:
+        try:
+            return context.run(chat, message, **kwargs)
+        except Exception as e:
+            return e if isinstance(e, AIServiceError) else AIServiceError(f"服务处理失败: {str(e)}")
+
+    contexts = [copy_context() for _ in messages]
+    if len(messages) <= 1 or max_workers <= 1:
+        return [run(context, message) for context, message in zip(contexts, messages)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(messages)),
+                            thread_name_prefix='ai-batch') as executor:
+        return list(executor.map(run, contexts, messages))
+
 class BaseAIService(ABC):
     """AI 服务基类"""
 
@@ -51,6 +84,19 @@ class BaseAIService(ABC):
         """
         pass
 
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式发送对话请求
+        默认实现等待完整响应后一次性返回，支持流式的服务应覆盖此方法
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Yields:
+            str: 模型输出的文本片段
+        """
+        yield self.chat(message, **kwargs)["response"]
+
     def close(self):
         """关闭服务"""
         pass
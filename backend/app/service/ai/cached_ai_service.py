@@ -0,0 +1,155 @@
+"""
+带缓存的 AI 服务模块
+在任意 BaseAIService 外层加上响应缓存
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .base_ai_service import AIServiceError, BaseAIService, chat_concurrently
+from .deepseek_service import chat_messages
+from .response_cache import ResponseCache, make_cache_key
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 1000
+
+
+def service_endpoint(service: Any) -> str:
+    """服务的标识：实现类和接口地址，网关为其全部后端"""
+    backends = getattr(service, 'backends', None)
+    if isinstance(backends, dict):
+        parts = [f"{name}={service_endpoint(backend)}/{backend.model}" for name, backend in backends.items()]
+        return f"{type(service).__name__}:{','.join(parts)}"
+    base_url = getattr(service, 'base_url', None) or getattr(service, 'BASE_URL', None) or ''
+    return f"{type(service).__name__}:{base_url}"
+
+
+class CachedAIService(BaseAIService):
+    """带响应缓存的 AI 服务
+
+    确定性请求（temperature 为 0）默认缓存；其他请求可通过 cache=True 显式开启，
+    也可通过 cache=False 关闭。提示模板变更时通过 prompt_version 使旧缓存失效。
+    """
+
+    def __init__(self, service: BaseAIService, cache: ResponseCache, provider: Optional[str] = None):
+        """初始化带缓存的 AI 服务
+
+        Args:
+            service: 被包装的 AI 服务
+            cache: 响应缓存
+            provider: 服务提供商名称，与接口地址一起计入缓存键
+        """
+        super().__init__(service.api_key, service.model)
+        self.service = service
+        self.cache = cache
+        self.endpoint = f"{provider or ''}|{service_endpoint(service)}"
+
+    def __getattr__(self, name: str) -> Any:
+        # 其余属性（client 等）交给被包装的服务
+        if name == 'service':
+            raise AttributeError(name)
+        return getattr(self.service, name)
+
+    def _cache_key(self, message: str, kwargs: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """计算请求的缓存键
+        Returns:
+            Tuple: (缓存键，不缓存时为 None; 去掉缓存参数后的请求参数)
+        """
+        kwargs = dict(kwargs)
+        cache = kwargs.pop('cache', None)
+        prompt_version = kwargs.pop('prompt_version', None)
+        temperature = kwargs.get('temperature', DEFAULT_TEMPERATURE)
+        if cache is None:
+            cache = temperature == 0
+        if not cache or kwargs.get('stream'):
+            return None, kwargs
+
+        messages = chat_messages(message, **kwargs)
+        key = make_cache_key(
+            self.model,
+            messages,
+            temperature,
+            kwargs.get('max_tokens', DEFAULT_MAX_TOKENS),
+            prompt_version,
+            kwargs.get('response_format'),
+            self.endpoint
+        )
+        return key, kwargs
+
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证配置"""
+        return self.service.validate_config(config)
+
+    def chat(self, message: str, **kwargs) -> Dict[str, Any]:
+        """发送对话请求，命中缓存时直接返回
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数；cache 控制是否缓存，prompt_version 为提示模板版本
+
+        Returns:
+            Dict[str, Any]: 响应结果，命中缓存时带 cached=True
+        """
+        key, kwargs = self._cache_key(message, kwargs)
+        if key is None:
+            return self.service.chat(message, **kwargs)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.debug(f"AI 响应缓存命中: {key[:12]}")
+            return dict(cached, cached=True)
+
+        result = self.service.chat(message, **kwargs)
+        self.cache.set(key, result)
+        return result
+
+    def batch_chat(self, messages: List[str], **kwargs) -> List[Any]:
+        """批量发送对话请求，只有未命中缓存的请求会发给模型
+
+        Args:
+            messages: 用户消息列表
+            **kwargs: 其他参数
+
+        Returns:
+            List: 与输入顺序一致的结果，失败的请求对应异常对象
+        """
+        results: List[Any] = [None] * len(messages)
+        misses: List[Tuple[int, Optional[str]]] = []
+        request_kwargs = kwargs
+        for i, message in enumerate(messages):
+            key, request_kwargs = self._cache_key(message, kwargs)
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                results[i] = dict(cached, cached=True)
+            else:
+                misses.append((i, key))
+
+        if not misses:
+            return results
+
+        pending = [messages[i] for i, _ in misses]
+        if hasattr(self.service, 'batch_chat'):
+            try:
+                responses = self.service.batch_chat(pending, **request_kwargs)
+            except Exception as e:
+                error = e if isinstance(e, AIServiceError) else AIServiceError(f"服务处理失败: {str(e)}")
+                responses = [error] * len(pending)
+        else:
+            # 被包装的服务没有批量接口时逐条并发发送，单个请求失败不影响其他请求
+            responses = chat_concurrently(self.service.chat, pending, **request_kwargs)
+
+        for (i, key), response in zip(misses, responses):
+            results[i] = response
+            if key and isinstance(response, dict):
+                self.cache.set(key, response)
+        return results
+
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式对话不经过缓存"""
+        kwargs.pop('cache', None)
+        kwargs.pop('prompt_version', None)
+        return self.service.chat_stream(message, **kwargs)
+
+    def close(self):
+        """关闭服务"""
+        self.service.close()
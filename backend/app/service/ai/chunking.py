@@ -0,0 +1,194 @@
+"""
+文本分块模块
+用于：
+1. 快速估算文本的 token 数
+2. 按段落边界切分长文本，并保留块间重叠
+3. 规划一次请求中能放下多少封邮件
+"""
+import math
+import re
+from dataclasses import dataclass
+from typing import List, Sequence
+
+# DeepSeek 官方换算：1 个英文字符约 0.3 token，1 个中文字符约 0.6 token
+ASCII_TOKEN_RATIO = 0.3
+CJK_TOKEN_RATIO = 0.6
+
+# 各模型的上下文窗口（输入 + 输出）
+MODEL_CONTEXT_WINDOWS = {
+    'deepseek-chat': 65536,
+    'deepseek-reasoner': 65536,
+}
+DEFAULT_CONTEXT_WINDOW = 65536
+DEFAULT_MAX_OUTPUT_TOKENS = 8192
+
+_CJK_RE = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+_SENTENCE_RE = re.compile(r'(?<=[.!?。！？；;])\s*')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数
+    按字符类别计数，比真实分词器快两个数量级，误差在 10% 左右
+    :param text: 文本
+    :return: token 数（向上取整）
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return math.ceil(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * ASCII_TOKEN_RATIO)
+
+
+def _split_oversized(piece: str, max_tokens: int) -> List[str]:
+    """切分超过预算的单个段落：先按句子，仍超出时按字符硬切"""
+    sentences = [s for s in _SENTENCE_RE.split(piece) if s.strip()]
+    if len(sentences) > 1:
+        return sentences
+
+    # 按估算比例换算出安全的字符窗口
+    ratio = max(estimate_tokens(piece) / max(len(piece), 1), ASCII_TOKEN_RATIO)
+    window = max(int(max_tokens / ratio), 1)
+    return [piece[i:i + window] for i in range(0, len(piece), window)]
+
+
+def _units(text: str, max_tokens: int) -> List[str]:
+    """将文本拆成不超过预算的最小单元（段落或句子）"""
+    units: List[str] = []
+    pending = [p.strip() for p in _PARAGRAPH_RE.split(text) if p.strip()]
+    while pending:
+        piece = pending.pop(0)
+        if estimate_tokens(piece) <= max_tokens:
+            units.append(piece)
+            continue
+        parts = _split_oversized(piece, max_tokens)
+        if len(parts) == 1:
+            units.append(parts[0])
+        else:
+            pending[0:0] = parts
+    return units
+
+
+def split_text(text: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """按段落边界将文本切分为不超过预算的块
+    :param text: 文本
+    :param max_tokens: 每块的最大 token 数
+    :param overlap_tokens: 相邻块之间重叠的 token 数
+    :return: 文本块列表
+    """
+    if not text or not text.strip():
+        return []
+    if max_tokens <= 0:
+        raise ValueError("max_tokens 必须大于 0")
+    if estimate_tokens(text) <= max_tokens:
+        return [text.strip()]
+
+    overlap_tokens = min(max(overlap_tokens, 0), max_tokens // 2)
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for unit in _units(text, max_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append('\n\n'.join(current))
+
+            # 从上一块末尾带入不超过 overlap_tokens 的单元
+            carried: List[str] = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if carried_tokens + previous_tokens > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            if carried_tokens + unit_tokens > max_tokens:
+                carried, carried_tokens = [], 0
+            current, current_tokens = carried, carried_tokens
+
+        current.append(unit)
+        current_tokens += unit_tokens
+
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """截取文本开头不超过预算的部分，尽量在段落或句子边界截断
+    :param text: 文本
+    :param max_tokens: 最大 token 数
+    :return: 截取后的文本
+    """
+    # 先按最低的字符换算比例粗截，避免对超长文本做完整切分
+    text = (text or '')[:int(max_tokens / ASCII_TOKEN_RATIO) + 1]
+    chunks = split_text(text, max_tokens)
+    return chunks[0] if chunks else ''
+
+
+@dataclass
+class TokenBudget:
+    """单次请求的 token 预算
+
+    Attributes:
+        context_window: 模型上下文窗口
+        max_output_tokens: 预留给输出的 token 数
+        prompt_overhead: 系统指令等固定提示占用的 token 数
+    """
+    context_window: int = DEFAULT_CONTEXT_WINDOW
+    max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS
+    prompt_overhead: int = 512
+
+    @classmethod
+    def for_model(cls, model: str, **kwargs) -> 'TokenBudget':
+        """按模型名称创建预算"""
+        return cls(context_window=MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW), **kwargs)
+
+    @property
+    def input_tokens(self) -> int:
+        """可用于动态内容的输入 token 数"""
+        return max(self.context_window - self.max_output_tokens - self.prompt_overhead, 0)
+
+    def fits(self, text: str) -> bool:
+        """文本能否放入一次请求"""
+        return estimate_tokens(text) <= self.input_tokens
+
+    def split(self, text: str, overlap_ratio: float = 0.1) -> List[str]:
+        """按预算切分文本
+        :param text: 文本
+        :param overlap_ratio: 重叠部分占块大小的比例
+        :return: 文本块列表
+        """
+        return split_text(text, self.input_tokens, int(self.input_tokens * overlap_ratio))
+
+    def plan_batches(self, texts: Sequence[str], item_overhead: int = 16,
+                     max_items: int = 0, output_tokens_per_item: int = 0) -> List[List[int]]:
+        """规划批次：决定每个请求放入哪些文本
+        按顺序贪心装箱，单个超出预算的文本独占一批（调用方需自行切分）
+        :param texts: 文本列表
+        :param item_overhead: 每项额外占用的 token 数（编号、分隔符等）
+        :param max_items: 每批最多项数，0 表示不限
+        :param output_tokens_per_item: 每项预计的输出 token 数
+        :return: 每批包含的文本下标
+        """
+        batches: List[List[int]] = []
+        current: List[int] = []
+        used_input = 0
+        used_output = 0
+
+        for i, text in enumerate(texts):
+            cost = estimate_tokens(text) + item_overhead
+            full = (
+                used_input + cost > self.input_tokens
+                or used_output + output_tokens_per_item > self.max_output_tokens
+                or (max_items and len(current) >= max_items)
+            )
+            if current and full:
+                batches.append(current)
+                current, used_input, used_output = [], 0, 0
+            current.append(i)
+            used_input += cost
+            used_output += output_tokens_per_item
+
+        if current:
+            batches.append(current)
+        return batches
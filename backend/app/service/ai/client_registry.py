@@ -0,0 +1,242 @@
+"""
+AI 客户端注册表模块
+用于：
+1. 按 (服务提供商, API 密钥摘要, 模型) 复用进程内的 AI 服务实例及其连接池
+2. 按最近最少使用和空闲时间淘汰实例，并在宽限期后关闭连接；定时任务定期清理，不依赖新的请求
+3. 缓存 API 密钥的验证结果，避免重复请求 /models
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .base_ai_service import BaseAIService, AIServiceError
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 注册表配置
+AI_CLIENT_MAX_ENTRIES = int(os.getenv('AI_CLIENT_MAX_ENTRIES', 32))
+AI_CLIENT_IDLE_SECONDS = int(os.getenv('AI_CLIENT_IDLE_SECONDS', 900))
+AI_VALIDATION_TTL = int(os.getenv('AI_VALIDATION_TTL', 3600))
+# 被淘汰的实例延迟关闭，让仍在使用它的请求（读取超时 30 秒）先完成
+CLOSE_GRACE_SECONDS = 60
+# 定时清理空闲实例的间隔（秒）
+AI_CLIENT_SWEEP_SECONDS = int(os.getenv('AI_CLIENT_SWEEP_SECONDS', CLOSE_GRACE_SECONDS))
+
+ClientKey = Tuple[str, str, str]
+
+
+def hash_api_key(api_key: str) -> str:
+    """计算 API 密钥的摘要，注册表中不以明文保存密钥"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class AIClientRegistry:
+    """AI 客户端注册表
+
+    线程安全。创建实例和验证密钥在按键划分的锁内进行，
+    不同用户的首次请求互不阻塞，同一组参数并发请求时只创建一次。
+    """
+
+    def __init__(self, max_entries: int = AI_CLIENT_MAX_ENTRIES,
+                 idle_seconds: float = AI_CLIENT_IDLE_SECONDS,
+                 validation_ttl: float = AI_VALIDATION_TTL,
+                 close_grace: float = CLOSE_GRACE_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """初始化注册表
+        Args:
+            max_entries: 最多保留的实例数
+            idle_seconds: 空闲超过该时间的实例被淘汰
+            validation_ttl: 密钥验证结果的有效期（秒）
+            close_grace: 被淘汰实例的关闭宽限期（秒）
+            clock: 时钟函数，便于测试
+        """
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self.validation_ttl = validation_ttl
+        self.close_grace = close_grace
+        self.clock = clock
+        self._entries: 'OrderedDict[ClientKey, Tuple[BaseAIService, float]]' = OrderedDict()
+        self._validated: Dict[Tuple[str, str], float] = {}
+        self._retired: List[Tuple[BaseAIService, float]] = []
+        self._lock = threading.Lock()
+        self._key_locks: Dict[ClientKey, threading.Lock] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'validations': 0, 'evictions': 0}
+
+    def get(self, provider: str, api_key: str, model: str,
+            create: Callable[[], BaseAIService]) -> BaseAIService:
+        """获取或创建 AI 服务实例
+        Args:
+            provider: 服务提供商
+            api_key: API 密钥
+            model: 模型名称
+            create: 创建实例的函数
+        Returns:
+            BaseAIService: AI 服务实例
+        Raises:
+            AIServiceError: 密钥验证失败时抛出
+        """
+        key = (provider, hash_api_key(api_key), model)
+        service = self._lookup(key)
+        if service is not None:
+            return service
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # 等锁期间其他线程可能已创建
+                service = self._lookup(key)
+                if service is not None:
+                    return service
+
+                service = create()
+                try:
+                    self._validate(provider, key[1], api_key, model, service)
+                except Exception:
+                    service.close()
+                    raise
+
+                with self._lock:
+                    self._stats['misses'] += 1
+                    self._entries[key] = (service, self.clock())
+                    to_close = self._evict_locked()
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+        self._close(to_close)
+        logger.info(f"创建 {provider} AI 服务实例: 模型 {model}, 密钥 {key[1][:8]}")
+        return service
+
+    def _lookup(self, key: ClientKey) -> Optional[BaseAIService]:
+        """命中时刷新最近使用时间"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], self.clock())
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def _validate(self, provider: str, key_hash: str, api_key: str, model: str, service: BaseAIService):
+        """验证密钥，有效期内的验证结果直接复用"""
+        now = self.clock()
+        with self._lock:
+            expires_at = self._validated.get((provider, key_hash))
+            if expires_at is not None and expires_at > now:
+                return
+            self._stats['validations'] += 1
+
+        if not service.validate_config({'api_key': api_key, 'model': model}):
+            raise AIServiceError("API 配置验证失败")
+        with self._lock:
+            self._validated[(provider, key_hash)] = now + self.validation_ttl
+
+    def _evict_locked(self) -> List[BaseAIService]:
+        """淘汰空闲和超出容量的实例（需持有锁）
+        Returns:
+            List[BaseAIService]: 宽限期已过、可以关闭的实例
+        """
+        now = self.clock()
+        idle = [key for key, (_, last_used) in self._entries.items()
+                if now - last_used > self.idle_seconds]
+        for key in idle:
+            self._retired.append((self._entries.pop(key)[0], now))
+            self._stats['evictions'] += 1
+        while len(self._entries) > self.max_entries:
+            _, (service, _) = self._entries.popitem(last=False)
+            self._retired.append((service, now))
+            self._stats['evictions'] += 1
+
+        expired = [service for service, retired_at in self._retired if now - retired_at >= self.close_grace]
+        self._retired = [(service, retired_at) for service, retired_at in self._retired
+                         if now - retired_at < self.close_grace]
+        return expired
+
+    @staticmethod
+    def _close(services: List[BaseAIService]):
+        """关闭实例的连接，失败只记录日志"""
+        for service in services:
+            try:
+                service.close()
+            except Exception as e:
+                logger.warning(f"关闭 AI 服务实例失败: {str(e)}")
+
+    def sweep(self) -> int:
+        """淘汰空闲实例并关闭宽限期已过的实例
+        Returns:
+            int: 关闭的实例数
+        """
+        with self._lock:
+            to_close = self._evict_locked()
+        self._close(to_close)
+        return len(to_close)
+
+    def invalidate(self, provider: str, api_key: str):
+        """清除密钥的验证结果，例如上游返回 401 之后"""
+        with self._lock:
+            self._validated.pop((provider, hash_api_key(api_key)), None)
+
+    def clear(self):
+        """关闭并清除全部实例"""
+        with self._lock:
+            services = [service for service, _ in self._entries.values()]
+            services += [service for service, _ in self._retired]
+            self._entries.clear()
+            self._retired.clear()
+            self._validated.clear()
+        self._close(services)
+
+    def stats(self) -> Dict[str, Any]:
+        """注册表统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': len(self._entries),
+                'retired': len(self._retired),
+                'validated_keys': len(self._validated)
+            })
+        return stats
+
+
+_client_registry: Optional[AIClientRegistry] = None
+_client_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> AIClientRegistry:
+    """获取进程内共享的 AI 客户端注册表"""
+    global _client_registry
+    if _client_registry is None:
+        with _client_registry_lock:
+            if _client_registry is None:
+                _client_registry = AIClientRegistry()
+    return _client_registry
+
+
+def sweep_clients_task():
+    """定时清理任务执行函数：淘汰空闲实例并关闭宽限期已过的实例"""
+    closed = get_client_registry().sweep()
+    if closed:
+        logger.info(f"关闭空闲的 AI 服务实例 {closed} 个")
+
+
+def schedule_client_sweep(scheduler, interval_seconds: int = AI_CLIENT_SWEEP_SECONDS) -> Optional[Dict[str, Any]]:
+    """创建（或替换）AI 客户端注册表的定时清理任务，间隔为 0 时不创建
+    Args:
+        scheduler: 调度器服务
+        interval_seconds: 清理间隔（秒）
+    Returns:
+        Optional[Dict[str, Any]]: 任务信息
+    """
+    if interval_seconds <= 0:
+        return None
+    return scheduler.create_job(
+        name='ai_client_sweep',
+        func=sweep_clients_task,
+        trigger=f'interval:{interval_seconds}',
+        id='ai_client_sweep',
+        replace_existing=True
+    )
@@ -3,9 +3,11 @@ DeepSeek AI 服务模块
 实现 DeepSeek API 的调用
 """
 import os
+import json
 import httpx
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
 from .base_ai_service import BaseAIService, AIServiceError
+from .resilience import BackendUnavailableError, get_backend_guard
 from ...utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -18,6 +20,74 @@ PROXIES = {
     'https://': f'http://{PROXY_HOST}:{PROXY_PORT}'
 }
 
+def build_chat_payload(model: str, message: str, **kwargs) -> Dict[str, Any]:
+    """构建对话请求数据
+
+    Args:
+        model: 模型名称
+        message: 用户消息，作为最后一条消息
+        **kwargs: 其他参数；prefix_messages 为放在用户消息之前的固定前缀（系统指令、少样本示例），
+            messages 为完整的消息列表（提供时忽略 message 和 prefix_messages），
+            response_format 为输出格式（如 JSON 模式 {"type": "json_object"}）
+
+    Returns:
+        Dict[str, Any]: 请求数据
+    """
+    payload = {
+        "model": model,
+        "messages": chat_messages(message, **kwargs),
+        "temperature": kwargs.get("temperature", 0.7),
+        "max_tokens": kwargs.get("max_tokens", 1000),
+        "stream": kwargs.get("stream", False)
+    }
+    if kwargs.get("response_format"):
+        payload["response_format"] = kwargs["response_format"]
+    return payload
+
+
+def chat_messages(message: str, **kwargs) -> List[Dict[str, str]]:
+    """请求中的消息列表，固定前缀在前、用户消息在最后"""
+    if kwargs.get("messages"):
+        return list(kwargs["messages"])
+    return list(kwargs.get("prefix_messages") or []) + [{"role": "user", "content": message}]
+
+
+def parse_chat_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """解析对话响应数据
+
+    Args:
+        result: 接口返回的 JSON 数据
+
+    Returns:
+        Dict[str, Any]: 响应结果，接口返回用量时带 usage
+    """
+    parsed = {
+        "response": result["choices"][0]["message"]["content"]
+    }
+    if result.get("usage"):
+        parsed["usage"] = result["usage"]
+    return parsed
+
+
+def parse_stream_line(line: str) -> Optional[str]:
+    """解析流式响应中的一行 SSE 数据
+
+    Args:
+        line: SSE 文本行，例如 `data: {...}`
+
+    Returns:
+        Optional[str]: 文本增量；非数据行或无内容时返回空字符串，流结束时返回 None
+    """
+    if not line.startswith("data:"):
+        return ""
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    choices = chunk.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content") or ""
+
+
 class DeepSeekService(BaseAIService):
     """DeepSeek AI 服务类"""
 
@@ -41,11 +111,12 @@ class DeepSeekService(BaseAIService):
             pool=5.0        # 连接池超时
         )
 
-        # 设置重试
+        # 重试、熔断和并发上限由 BackendGuard 统一处理，传输层不再自行重试
         transport = httpx.HTTPTransport(
-            retries=3,
+            retries=0,
             verify=False  # 禁用SSL验证
         )
+        self.guard = get_backend_guard('deepseek')
 
         # 创建客户端
         self.client = httpx.Client(
@@ -70,23 +141,17 @@ class DeepSeekService(BaseAIService):
         Returns:
             bool: 配置是否有效
         """
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # 测试 API 连接
-                response = self.client.get("/models")
-                if response.status_code == 200:
-                    logger.info("DeepSeek API 验证成功")
-                    return True
-                logger.warning(f"API 验证失败，状态码: {response.status_code}")
-                return False
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"API 验证失败，第 {attempt + 1} 次重试: {str(e)}")
-                    continue
-                logger.error(f"DeepSeek API 验证失败: {str(e)}")
-                return False
-        return False
+        try:
+            # 测试 API 连接
+            response = self.guard.call(lambda: self.client.get("/models"))
+            if response.status_code == 200:
+                logger.info("DeepSeek API 验证成功")
+                return True
+            logger.warning(f"API 验证失败，状态码: {response.status_code}")
+            return False
+        except Exception as e:
+            logger.error(f"DeepSeek API 验证失败: {str(e)}")
+            return False
 
     def chat(self, message: str, **kwargs) -> Dict[str, Any]:
         """发送对话请求
@@ -98,49 +163,76 @@ class DeepSeekService(BaseAIService):
         Returns:
             Dict[str, Any]: 响应结果
 
+        Raises:
+            AIServiceError: 请求失败时抛出，熔断或并发已满时为 BackendUnavailableError
+        """
+        # 构建请求数据
+        data = build_chat_payload(self.model, message, **kwargs)
+
+        def post() -> Dict[str, Any]:
+            response = self.client.post("/chat/completions", json=data)
+            response.raise_for_status()
+            return response.json()
+
+        try:
+            # 超时、连接错误、429 和 5xx 由 guard 退避重试
+            result = self.guard.call(post)
+            return parse_chat_response(result)
+        except BackendUnavailableError as e:
+            logger.warning(f"DeepSeek 请求被拒绝: {str(e)}")
+            raise
+        except httpx.TimeoutException as e:
+            logger.error(f"DeepSeek API 请求超时: {str(e)}")
+            raise AIServiceError(f"API 请求超时: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error(f"DeepSeek API 请求失败: {str(e)}")
+            raise AIServiceError(f"API 请求失败: {str(e)}")
+        except Exception as e:
+            logger.error(f"DeepSeek 服务处理失败: {str(e)}")
+            raise AIServiceError(f"服务处理失败: {str(e)}")
+
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式发送对话请求
+        逐个返回模型输出的文本片段。调用方关闭生成器时（例如客户端断开），
+        上游连接随之关闭，不再继续生成
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Yields:
+            str: 模型输出的文本片段
+
         Raises:
             AIServiceError: 请求失败时抛出
         """
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # 构建请求数据
-                data = {
-                    "model": self.model,
-                    "messages": [{"role": "user", "content": message}],
-                    "temperature": kwargs.get("temperature", 0.7),
-                    "max_tokens": kwargs.get("max_tokens", 1000),
-                    "stream": kwargs.get("stream", False)
-                }
-
-                # 发送请求
-                response = self.client.post("/chat/completions", json=data)
+        data = build_chat_payload(self.model, message, **kwargs)
+        data["stream"] = True
+        try:
+            # 流式请求不重试，整个流期间占用一个并发名额
+            with self.guard.slot(), self.client.stream("POST", "/chat/completions", json=data) as response:
                 response.raise_for_status()
-
-                # 解析响应
-                result = response.json()
-                return {
-                    "response": result["choices"][0]["message"]["content"]
-                }
-
-            except httpx.TimeoutException as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"请求超时，第 {attempt + 1} 次重试: {str(e)}")
-                    continue
-                logger.error(f"DeepSeek API 请求超时: {str(e)}")
-                raise AIServiceError(f"API 请求超时: {str(e)}")
-            except httpx.HTTPError as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"HTTP 错误，第 {attempt + 1} 次重试: {str(e)}")
-                    continue
-                logger.error(f"DeepSeek API 请求失败: {str(e)}")
-                raise AIServiceError(f"API 请求失败: {str(e)}")
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"请求失败，第 {attempt + 1} 次重试: {str(e)}")
-                    continue
-                logger.error(f"DeepSeek 服务处理失败: {str(e)}")
-                raise AIServiceError(f"服务处理失败: {str(e)}")
+                for line in response.iter_lines():
+                    delta = parse_stream_line(line)
+                    if delta is None:
+                        break
+                    if delta:
+                        yield delta
+        except BackendUnavailableError as e:
+            logger.warning(f"DeepSeek 流式请求被拒绝: {str(e)}")
+            raise
+        except GeneratorExit:
+            logger.info("流式请求被调用方关闭，已断开上游连接")
+            raise
+        except httpx.TimeoutException as e:
+            logger.error(f"DeepSeek 流式请求超时: {str(e)}")
+            raise AIServiceError(f"API 请求超时: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error(f"DeepSeek 流式请求失败: {str(e)}")
+            raise AIServiceError(f"API 请求失败: {str(e)}")
+        except ValueError as e:
+            logger.error(f"DeepSeek 流式响应解析失败: {str(e)}")
+            raise AIServiceError(f"服务处理失败: {str(e)}")
 
     def close(self):
         """关闭服务"""
@@ -0,0 +1,337 @@
+"""
+AI 网关模块
+用于：
+1. 统一调度多个 OpenAI 兼容后端
+2. 按后端统计滚动 p50/p95 延迟和错误率，优先选择最快的健康后端
+3. 首个请求超过 p95 仍未返回时向另一后端发出对冲请求，取先返回的结果
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional
+from .base_ai_service import BaseAIService, AIServiceError, chat_concurrently
+from .openai_service import OpenAICompatibleService
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 网关后端列表，第一个为主后端并使用请求中的 API 密钥和模型；
+# 其余后端从环境变量 {NAME}_API_KEY、{NAME}_BASE_URL、{NAME}_MODEL 读取配置
+AI_GATEWAY_BACKENDS = [name.strip().lower() for name in
+                       os.getenv('AI_GATEWAY_BACKENDS', 'deepseek').split(',') if name.strip()]
+# 备用后端使用服务器的密钥，费用由服务器承担，只有显式开启时才为客户端请求创建备用后端
+AI_GATEWAY_SERVER_BACKUPS = os.getenv('AI_GATEWAY_SERVER_BACKUPS', 'false').lower() == 'true'
+AI_GATEWAY_HEDGE = os.getenv('AI_GATEWAY_HEDGE', 'true').lower() == 'true'
+# 对冲请求占全部请求的比例上限，避免慢后端时请求量翻倍
+AI_GATEWAY_HEDGE_RATIO = float(os.getenv('AI_GATEWAY_HEDGE_RATIO', 0.1))
+AI_GATEWAY_MAX_ERROR_RATE = float(os.getenv('AI_GATEWAY_MAX_ERROR_RATE', 0.5))
+AI_GATEWAY_MAX_WORKERS = int(os.getenv('AI_GATEWAY_MAX_WORKERS', 8))
+# 滚动窗口大小、计算分位数所需的最少样本数、随机探测其他后端的概率
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 10
+EXPLORE_RATE = 0.05
+
+DEFAULT_BASE_URLS = {
+    'deepseek': 'https://api.deepseek.com/v1',
+    'openai': 'https://api.openai.com/v1'
+}
+
+
+class LatencyTracker:
+    """单个后端的滚动延迟与错误率统计"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float, ok: bool = True):
+        """记录一次请求的耗时和结果"""
+        with self._lock:
+            self._samples.append((seconds, ok))
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+
+    def record_hedge(self, won: bool = False):
+        """记录一次对冲请求，won 表示对冲请求先返回"""
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """成功请求的延迟分位数，样本不足时返回 None"""
+        with self._lock:
+            latencies = sorted(seconds for seconds, ok in self._samples if ok)
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def error_rate(self) -> float:
+        """滚动窗口内的错误率"""
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def healthy(self, max_error_rate: float = AI_GATEWAY_MAX_ERROR_RATE) -> bool:
+        """样本足够且错误率超过上限时视为不健康"""
+        with self._lock:
+            enough = len(self._samples) >= MIN_SAMPLES
+        return not enough or self.error_rate() <= max_error_rate
+
+    def stats(self) -> Dict[str, Any]:
+        """统计信息"""
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.error_rate(), 4),
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins
+        }
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """获取后端的延迟统计，同名后端在进程内共享统计"""
+    with _trackers_lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = _trackers[name] = LatencyTracker()
+        return tracker
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_gateway_executor() -> ThreadPoolExecutor:
+    """获取网关请求共享的线程池，进程内所有网关实例共用，不随实例关闭"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 对冲请求和落后的请求都占用线程，线程数为并发请求数的两倍
+            _executor = ThreadPoolExecutor(max_workers=AI_GATEWAY_MAX_WORKERS * 2,
+                                           thread_name_prefix='ai-gateway')
+        return _executor
+
+
+def gateway_stats() -> Dict[str, Dict[str, Any]]:
+    """所有后端的延迟与错误率统计"""
+    with _trackers_lock:
+        trackers = dict(_trackers)
+    return {name: tracker.stats() for name, tracker in trackers.items()}
+
+
+def build_backends(api_key: str, model: str,
+                   server_backups: bool = AI_GATEWAY_SERVER_BACKUPS) -> Dict[str, BaseAIService]:
+    """按 AI_GATEWAY_BACKENDS 创建后端
+    Args:
+        api_key: 主后端使用的 API 密钥
+        model: 主后端使用的模型
+        server_backups: 是否创建使用服务器密钥的备用后端，未开启时只有主后端
+    Returns:
+        Dict[str, BaseAIService]: 后端名称到服务实例的映射，未配置密钥的后端被跳过
+    """
+    backends: Dict[str, BaseAIService] = {}
+    names = AI_GATEWAY_BACKENDS if server_backups else AI_GATEWAY_BACKENDS[:1]
+    for position, name in enumerate(names):
+        prefix = name.upper().replace('-', '_')
+        backend_key = api_key if position == 0 else os.getenv(f'{prefix}_API_KEY')
+        backend_model = model if position == 0 else os.getenv(f'{prefix}_MODEL')
+        if not backend_key or not backend_model:
+            logger.warning(f"网关后端 {name} 未配置 API 密钥或模型，已跳过")
+            continue
+        base_url = os.getenv(f'{prefix}_BASE_URL') or DEFAULT_BASE_URLS.get(name)
+        # 后端自身不重试，失败时由网关切换到下一个后端
+        backends[name] = OpenAICompatibleService(backend_key, backend_model, base_url=base_url,
+                                                 name=name, max_attempts=1)
+    return backends
+
+
+class AIGateway(BaseAIService):
+    """AI 网关服务类
+
+    对外表现为一个普通的 AI 服务。每个请求发给排名最前的健康后端，
+    失败时依次尝试其他后端；样本足够时，首个请求超过该后端 p95 仍未返回，
+    就向下一个后端（只有一个后端时为同一后端）发出对冲请求。
+    """
+
+    def __init__(self, api_key: str, model: str, backends: Optional[Dict[str, BaseAIService]] = None,
+                 hedge: bool = AI_GATEWAY_HEDGE, hedge_ratio: float = AI_GATEWAY_HEDGE_RATIO):
+        """初始化 AI 网关
+
+        Args:
+            api_key: 主后端的 API 密钥
+            model: 主后端的模型
+            backends: 后端名称到服务实例的映射，默认按 AI_GATEWAY_BACKENDS 创建
+            hedge: 是否启用对冲请求
+            hedge_ratio: 对冲请求占比上限
+        """
+        super().__init__(api_key, model)
+        self.backends = backends if backends is not None else build_backends(api_key, model)
+        if not self.backends:
+            raise AIServiceError("AI 网关没有可用的后端")
+        self.primary = next(iter(self.backends))
+        self.trackers = {name: get_latency_tracker(f"{name}:{service.model}")
+                         for name, service in self.backends.items()}
+        self.hedge = hedge
+        self.hedge_ratio = hedge_ratio
+        # 对冲请求使用进程内共享的线程池；批量请求由调用线程逐条并发，不占用该线程池
+        self._executor = get_gateway_executor()
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+        logger.info(f"AI 网关初始化完成，后端: {', '.join(self.backends)}")
+
+    def rank(self) -> List[str]:
+        """按健康状况和 p50 延迟排序后端，偶尔随机探测其他后端以更新统计
+        熔断打开的后端与错误率过高的后端一起排在最后
+        """
+        def latency(name: str) -> float:
+            p50 = self.trackers[name].percentile(0.5)
+            return p50 if p50 is not None else 0.0
+
+        def available(name: str) -> bool:
+            guard = getattr(self.backends[name], 'guard', None)
+            return guard is None or guard.breaker.state != guard.breaker.OPEN
+
+        names = list(self.backends)
+        healthy = sorted((n for n in names if self.trackers[n].healthy() and available(n)), key=latency)
+        unhealthy = sorted((n for n in names if n not in healthy), key=lambda n: self.trackers[n].error_rate())
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + unhealthy
+
+    def _call(self, name: str, message: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """向单个后端发送请求并记录耗时，结果中的 model 为实际返回结果的后端模型"""
+        start = time.perf_counter()
+        try:
+            result = self.backends[name].chat(message, **kwargs)
+        except Exception:
+            self.trackers[name].record(time.perf_counter() - start, ok=False)
+            raise
+        self.trackers[name].record(time.perf_counter() - start, ok=True)
+        return dict(result, backend=name, model=self.backends[name].model)
+
+    def _can_hedge(self) -> bool:
+        """对冲请求占比未超过上限"""
+        with self._lock:
+            return self._hedges < self.hedge_ratio * self._requests
+
+    def _hedged_call(self, order: List[str], message: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """主请求超过 p95 未返回时发出对冲请求，返回先成功的结果"""
+        primary = order[0]
+        threshold = self.trackers[primary].percentile(0.95)
+        first = self._executor.submit(self._call, primary, message, kwargs)
+        hedge = None
+        done, _ = wait([first], timeout=threshold)
+        if not done and self._can_hedge():
+            backup = order[1] if len(order) > 1 else primary
+            with self._lock:
+                self._hedges += 1
+            self.trackers[primary].record_hedge()
+            hedge = self._executor.submit(self._call, backup, message, kwargs)
+            logger.debug(f"请求超过 {primary} 的 p95（{threshold:.2f} 秒），向 {backup} 发出对冲请求")
+
+        error: Optional[BaseException] = None
+        pending = {first, hedge} - {None}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.trackers[primary].record_hedge(won=True)
+                    # 落后的请求在后台完成，只用于更新延迟统计
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def chat(self, message: str, **kwargs) -> Dict[str, Any]:
+        """发送对话请求
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Returns:
+            Dict[str, Any]: 响应结果，backend 和 model 为实际返回结果的后端及其模型
+
+        Raises:
+            AIServiceError: 所有后端都失败时抛出
+        """
+        with self._lock:
+            self._requests += 1
+        order = self.rank()
+        error: Optional[Exception] = None
+        for position, name in enumerate(order):
+            try:
+                if (position == 0 and self.hedge
+                        and self.trackers[name].percentile(0.95) is not None):
+                    return self._hedged_call(order, message, kwargs)
+                return self._call(name, message, kwargs)
+            except Exception as e:
+                logger.warning(f"网关后端 {name} 请求失败: {str(e)}")
+                error = e
+        raise AIServiceError(f"所有 AI 后端请求失败: {str(error)}")
+
+    def batch_chat(self, messages: List[str], **kwargs) -> List[Any]:
+        """并发发送多个对话请求
+
+        Args:
+            messages: 用户消息列表
+            **kwargs: 其他参数
+
+        Returns:
+            List: 与输入顺序一致的结果，失败的请求对应异常对象
+        """
+        return chat_concurrently(self.chat, messages, max_workers=AI_GATEWAY_MAX_WORKERS, **kwargs)
+
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式对话发给排名最前的后端，首个片段前失败时切换后端，不做对冲"""
+        error: Optional[Exception] = None
+        for name in self.rank():
+            start = time.perf_counter()
+            started = False
+            try:
+                for delta in self.backends[name].chat_stream(message, **kwargs):
+                    if not started:
+                        # 流式请求以首个片段的耗时计入延迟统计
+                        self.trackers[name].record(time.perf_counter() - start, ok=True)
+                        started = True
+                    yield delta
+                return
+            except AIServiceError as e:
+                if started:
+                    raise
+                self.trackers[name].record(time.perf_counter() - start, ok=False)
+                logger.warning(f"网关后端 {name} 流式请求失败: {str(e)}")
+                error = e
+        raise AIServiceError(f"所有 AI 后端请求失败: {str(error)}")
+
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证主后端的配置（其余后端使用服务端配置的密钥）"""
+        return self.backends[self.primary].validate_config(config)
+
+    def stats(self) -> Dict[str, Any]:
+        """各后端的延迟与错误率统计"""
+        return {name: self.trackers[name].stats() for name in self.backends}
+
+    def close(self):
+        """关闭所有后端（共享线程池不随网关关闭）"""
+        for service in self.backends.values():
+            service.close()
@@ -0,0 +1,138 @@
+"""
+OpenAI 兼容 AI 服务模块
+通过 openai SDK 调用任意兼容 /chat/completions 接口的服务（OpenAI、DeepSeek 等）
+"""
+import os
+from typing import Any, Dict, Iterator, Optional
+import openai
+from .base_ai_service import BaseAIService, AIServiceError
+from .deepseek_service import build_chat_payload
+from .resilience import AI_RETRY_ATTEMPTS, BackendUnavailableError, get_backend_guard
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class OpenAICompatibleService(BaseAIService):
+    """OpenAI 兼容 AI 服务类"""
+
+    BASE_URL = "https://api.openai.com/v1"
+    DEFAULT_MODEL = "gpt-3.5-turbo"
+    DEFAULT_TIMEOUT = 30.0
+
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL, base_url: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT, name: str = 'openai',
+                 max_attempts: int = AI_RETRY_ATTEMPTS):
+        """初始化 OpenAI 兼容服务
+
+        Args:
+            api_key: API 密钥
+            model: 模型名称
+            base_url: 接口地址，默认为 OpenAI 官方地址
+            timeout: 单次请求超时（秒）
+            name: 服务名称，用于日志、指标和共享熔断状态
+            max_attempts: 上游故障时的最多尝试次数，网关中为 1，由网关切换后端
+        """
+        super().__init__(api_key, model)
+        self.name = name
+        self.base_url = base_url or os.getenv('OPENAI_BASE_URL') or self.BASE_URL
+        self.max_attempts = max_attempts
+        self.guard = get_backend_guard(name)
+        # 重试由 guard 和网关决定，SDK 不再自行重试
+        self.client = openai.OpenAI(api_key=api_key, base_url=self.base_url,
+                                    timeout=timeout, max_retries=0)
+        logger.info(f"OpenAI 兼容服务初始化完成: {self.name} ({self.base_url})")
+
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证配置
+
+        Args:
+            config: 配置信息
+
+        Returns:
+            bool: 配置是否有效
+        """
+        try:
+            self.guard.call(self.client.models.list, self.max_attempts)
+            logger.info(f"{self.name} API 验证成功")
+            return True
+        except Exception as e:
+            logger.error(f"{self.name} API 验证失败: {str(e)}")
+            return False
+
+    def chat(self, message: str, **kwargs) -> Dict[str, Any]:
+        """发送对话请求
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Returns:
+            Dict[str, Any]: 响应结果，接口返回用量时带 usage
+
+        Raises:
+            AIServiceError: 请求失败时抛出
+        """
+        data = build_chat_payload(self.model, message, **kwargs)
+        data.pop("stream", None)
+        try:
+            completion = self.guard.call(lambda: self.client.chat.completions.create(**data), self.max_attempts)
+        except BackendUnavailableError as e:
+            logger.warning(f"{self.name} 请求被拒绝: {str(e)}")
+            raise
+        except openai.APITimeoutError as e:
+            logger.error(f"{self.name} API 请求超时: {str(e)}")
+            raise AIServiceError(f"API 请求超时: {str(e)}")
+        except openai.APIError as e:
+            logger.error(f"{self.name} API 请求失败: {str(e)}")
+            raise AIServiceError(f"API 请求失败: {str(e)}")
+
+        result = {"response": completion.choices[0].message.content or ""}
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            # 保留 prompt_tokens_details 等明细，用于统计前缀缓存命中
+            result["usage"] = usage.model_dump(exclude_none=True)
+        return result
+
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式发送对话请求
+
+        Args:
+            message: 用户消息
+            **kwargs: 其他参数
+
+        Yields:
+            str: 模型输出的文本片段
+
+        Raises:
+            AIServiceError: 请求失败时抛出
+        """
+        data = build_chat_payload(self.model, message, **kwargs)
+        data["stream"] = True
+        try:
+            with self.guard.slot():
+                stream = self.client.chat.completions.create(**data)
+                try:
+                    for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            yield delta
+                finally:
+                    stream.close()
+        except BackendUnavailableError as e:
+            logger.warning(f"{self.name} 流式请求被拒绝: {str(e)}")
+            raise
+        except GeneratorExit:
+            logger.info(f"{self.name} 流式请求被调用方关闭，已断开上游连接")
+            raise
+        except openai.APITimeoutError as e:
+            logger.error(f"{self.name} 流式请求超时: {str(e)}")
+            raise AIServiceError(f"API 请求超时: {str(e)}")
+        except openai.APIError as e:
+            logger.error(f"{self.name} 流式请求失败: {str(e)}")
+            raise AIServiceError(f"API 请求失败: {str(e)}")
+
+    def close(self):
+        """关闭服务"""
+        self.client.close()
+        logger.info(f"{self.name} 服务已关闭")
@@ -0,0 +1,127 @@
+"""
+提示模板模块
+用于：
+1. 以版本化的模板组织提示：固定的系统指令和少样本示例在前，动态内容（邮件、问题）只放在最后一条用户消息
+2. 同一模板的请求共享完全相同的前缀，命中上游的上下文缓存（DeepSeek 对命中缓存的输入 token 计费更低、响应更快）
+3. 按模板统计上游返回的缓存命中 token
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .chunking import estimate_tokens
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+Message = Dict[str, str]
+
+
+@dataclass
+class PromptTemplate:
+    """提示模板
+
+    修改 system、examples 或 user 时递增 version：版本号参与响应缓存键，旧缓存随之失效。
+
+    Attributes:
+        name: 模板名称
+        version: 模板版本
+        system: 系统指令（固定前缀）
+        user: 最后一条用户消息的格式串，只包含动态内容
+        examples: 少样本示例，(用户消息, 助手回复) 列表，位于系统指令之后
+    """
+    name: str
+    version: int
+    system: str
+    user: str = '{content}'
+    examples: Sequence[Tuple[str, str]] = ()
+    _prefix: List[Message] = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self):
+        self._prefix = [{'role': 'system', 'content': self.system}]
+        for question, answer in self.examples:
+            self._prefix.append({'role': 'user', 'content': question})
+            self._prefix.append({'role': 'assistant', 'content': answer})
+
+    @property
+    def key(self) -> str:
+        """模板标识，用作 prompt_version"""
+        return f"{self.name}-v{self.version}"
+
+    @property
+    def prefix(self) -> List[Message]:
+        """固定前缀消息（系统指令 + 少样本示例），每次返回副本"""
+        return [dict(message) for message in self._prefix]
+
+    @property
+    def prefix_tokens(self) -> int:
+        """固定前缀的估算 token 数，用于预算中的 prompt_overhead"""
+        return sum(estimate_tokens(message['content']) + 4 for message in self._prefix)
+
+    def render(self, **variables: Any) -> str:
+        """渲染最后一条用户消息"""
+        return self.user.format(**variables)
+
+    def messages(self, **variables: Any) -> List[Message]:
+        """完整的消息列表"""
+        return self.prefix + [{'role': 'user', 'content': self.render(**variables)}]
+
+    def options(self) -> Dict[str, Any]:
+        """调用 AI 服务时附带的参数：固定前缀和模板版本"""
+        return {'prefix_messages': self.prefix, 'prompt_version': self.key}
+
+
+_templates: Dict[str, PromptTemplate] = {}
+
+
+def register_template(template: PromptTemplate) -> PromptTemplate:
+    """注册模板，同名模板以最后注册的为准"""
+    _templates[template.name] = template
+    return template
+
+
+def get_template(name: str) -> Optional[PromptTemplate]:
+    """按名称获取模板"""
+    return _templates.get(name)
+
+
+def list_templates() -> List[Dict[str, Any]]:
+    """已注册模板的概要"""
+    return [{'name': t.name, 'version': t.version, 'key': t.key, 'prefix_tokens': t.prefix_tokens}
+            for t in _templates.values()]
+
+
+class PromptCacheStats:
+    """按模板统计上游上下文缓存的命中情况"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, prompt_tokens: int, cached_tokens: int):
+        """记录一次上游请求的输入 token 与其中命中缓存的部分"""
+        with self._lock:
+            stats = self._stats.setdefault(key, {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0})
+            stats['requests'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['cached_tokens'] += cached_tokens
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各模板的请求数、输入 token、命中缓存 token 与命中率"""
+        with self._lock:
+            snapshot = {key: dict(stats) for key, stats in self._stats.items()}
+        for stats in snapshot.values():
+            stats['hit_rate'] = round(stats['cached_tokens'] / stats['prompt_tokens'], 4) \
+                if stats['prompt_tokens'] else 0.0
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+_prompt_cache_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """获取进程内共享的模板缓存命中统计"""
+    return _prompt_cache_stats
@@ -0,0 +1,339 @@
+"""
+AI 服务容错模块
+用于：
+1. 按后端的熔断器（关闭 / 打开 / 半开），上游持续故障时快速失败，不再占用工作线程
+2. 指数退避加随机抖动的重试，只重试超时、连接错误、429 和 5xx
+3. AIMD 自适应并发上限：成功时缓慢增加，超时或限流时减半
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+import httpx
+import openai
+from .base_ai_service import AIServiceError
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 重试配置
+AI_RETRY_ATTEMPTS = int(os.getenv('AI_RETRY_ATTEMPTS', 3))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', 0.5))
+AI_RETRY_MAX_DELAY = float(os.getenv('AI_RETRY_MAX_DELAY', 8.0))
+# 熔断配置：连续失败次数达到阈值后打开，经过冷却时间后放行一个探测请求
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', 5))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', 30))
+# 自适应并发配置
+AI_CONCURRENCY_INITIAL = int(os.getenv('AI_CONCURRENCY_INITIAL', 8))
+AI_CONCURRENCY_MIN = int(os.getenv('AI_CONCURRENCY_MIN', 1))
+AI_CONCURRENCY_MAX = int(os.getenv('AI_CONCURRENCY_MAX', 32))
+# 等待并发名额的最长时间（秒），超过后直接返回服务繁忙
+AI_CONCURRENCY_WAIT = float(os.getenv('AI_CONCURRENCY_WAIT', 10))
+# 并发上限两次减半之间的最短间隔（秒），避免同一次故障中的多个超时把上限连续压到最低
+DECREASE_INTERVAL = 1.0
+
+# 失败类型：超时、限流（429）、其他可重试错误（连接失败、5xx）
+TIMEOUT = 'timeout'
+OVERLOAD = 'overload'
+ERROR = 'error'
+
+
+class BackendUnavailableError(AIServiceError):
+    """后端熔断或并发已满，请求未发出"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """提取 httpx 或 openai 异常中的 HTTP 状态码"""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        response = getattr(exc, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(exc: BaseException) -> Optional[str]:
+    """判断异常是否由上游故障引起
+    Args:
+        exc: 请求抛出的异常
+    Returns:
+        Optional[str]: TIMEOUT / OVERLOAD / ERROR；客户端错误（如 400、401）或解析错误返回 None，不重试也不计入熔断
+    """
+    if isinstance(exc, (httpx.TimeoutException, openai.APITimeoutError, TimeoutError)):
+        return TIMEOUT
+    status = _status_code(exc)
+    if status == 429:
+        return OVERLOAD
+    if status is not None:
+        return ERROR if status >= 500 else None
+    if isinstance(exc, (httpx.TransportError, openai.APIConnectionError, ConnectionError)):
+        return ERROR
+    return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """读取响应中的 Retry-After 秒数"""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """熔断器
+
+    关闭状态下正常放行并统计连续失败；达到阈值后打开，冷却期内的请求直接拒绝；
+    冷却结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURES,
+                 reset_timeout: float = AI_BREAKER_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """请求是否可以发出"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        """距离下一次探测的秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        """上游正常响应（包括客户端错误）"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("AI 后端恢复，熔断器关闭")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """上游故障"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    logger.warning(f"AI 后端连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+                self._probing = False
+
+    def release(self):
+        """请求未发出就放弃时归还半开状态的探测名额"""
+        with self._lock:
+            self._probing = False
+
+
+class AdaptiveLimiter:
+    """AIMD 自适应并发上限
+
+    每个成功请求使上限增加 1/上限（约每轮增加 1），超时或限流时上限减半。
+    """
+
+    def __init__(self, initial: int = AI_CONCURRENCY_INITIAL, min_limit: int = AI_CONCURRENCY_MIN,
+                 max_limit: int = AI_CONCURRENCY_MAX, clock: Callable[[], float] = time.monotonic):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.in_flight = 0
+        self.clock = clock
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """等待并占用一个并发名额
+        Returns:
+            bool: 超时未获得名额时返回 False
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, outcome: Optional[str]):
+        """归还名额并按结果调整上限
+        Args:
+            outcome: 'success'、失败类型或 None（结果与上游负载无关）
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == 'success':
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome in (TIMEOUT, OVERLOAD):
+                now = self.clock()
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+
+class BackendGuard:
+    """单个后端的容错组合：并发上限 + 熔断器 + 退避重试"""
+
+    def __init__(self, name: str, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AdaptiveLimiter] = None, max_attempts: int = AI_RETRY_ATTEMPTS,
+                 base_delay: float = AI_RETRY_BASE_DELAY, max_delay: float = AI_RETRY_MAX_DELAY,
+                 acquire_timeout: float = AI_CONCURRENCY_WAIT,
+                 sleep: Callable[[float], None] = time.sleep):
+        """初始化后端容错
+        Args:
+            name: 后端名称
+            breaker: 熔断器
+            limiter: 自适应并发上限
+            max_attempts: 最多尝试次数（含首次）
+            base_delay: 首次重试的最大退避时间（秒）
+            max_delay: 单次退避时间上限（秒）
+            acquire_timeout: 等待并发名额的最长时间（秒）
+            sleep: 退避等待函数，便于测试
+        """
+        self.name = name
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveLimiter()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.sleep = sleep
+        self._stats = {'requests': 0, 'failures': 0, 'retries': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """占用一个并发名额执行一次请求，并按结果更新熔断器和并发上限
+        Raises:
+            BackendUnavailableError: 熔断打开或等待并发名额超时
+        """
+        if not self.limiter.acquire(self.acquire_timeout):
+            self._count('rejected')
+            raise BackendUnavailableError(f"AI 后端 {self.name} 繁忙，请稍后重试", self.acquire_timeout)
+        if not self.breaker.allow():
+            self.limiter.release(None)
+            self._count('rejected')
+            raise BackendUnavailableError(f"AI 后端 {self.name} 暂时不可用，请稍后重试",
+                                          self.breaker.retry_after())
+        self._count('requests')
+        try:
+            yield
+        except Exception as e:
+            kind = classify_error(e)
+            self.limiter.release(kind)
+            if kind is None:
+                self.breaker.record_success()
+            else:
+                self._count('failures')
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            # 调用方提前关闭（例如流式请求的客户端断开）
+            self.limiter.release(None)
+            self.breaker.release()
+            raise
+        else:
+            self.limiter.release('success')
+            self.breaker.record_success()
+
+    def backoff(self, attempt: int, exc: Optional[BaseException] = None) -> float:
+        """第 attempt 次失败后的退避时间：完全随机抖动的指数退避，限流时不少于 Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        retry_after = _retry_after(exc) if exc is not None else None
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def call(self, func: Callable[[], Any], max_attempts: Optional[int] = None) -> Any:
+        """执行请求，上游故障时退避重试
+        Args:
+            func: 发出一次请求的函数
+            max_attempts: 最多尝试次数，默认使用初始化时的配置
+        Returns:
+            Any: func 的返回值
+        Raises:
+            BackendUnavailableError: 熔断打开或并发已满
+            Exception: 最后一次尝试的异常，或不可重试的异常
+        """
+        attempts = max_attempts or self.max_attempts
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.slot():
+                    return func()
+            except BackendUnavailableError:
+                raise
+            except Exception as e:
+                if attempt >= attempts or classify_error(e) is None:
+                    raise
+                delay = self.backoff(attempt, e)
+                self._count('retries')
+                logger.warning(f"AI 后端 {self.name} 请求失败，{delay:.2f} 秒后第 {attempt} 次重试: {str(e)}")
+                self.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """容错状态与统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'state': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'trips': self.breaker.trips,
+            'concurrency_limit': round(self.limiter.limit, 2),
+            'in_flight': self.limiter.in_flight
+        })
+        return stats
+
+
+_guards: Dict[str, BackendGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def get_backend_guard(name: str) -> BackendGuard:
+    """获取后端的容错组合，同名后端在进程内共享熔断与并发状态"""
+    with _guards_lock:
+        guard = _guards.get(name)
+        if guard is None:
+            guard = _guards[name] = BackendGuard(name)
+        return guard
+
+
+def resilience_stats() -> Dict[str, Dict[str, Any]]:
+    """所有后端的容错状态"""
+    with _guards_lock:
+        guards = dict(_guards)
+    return {name: guard.stats() for name, guard in guards.items()}
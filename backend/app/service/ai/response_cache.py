@@ -0,0 +1,326 @@
+"""
+AI 响应缓存模块
+用于：
+1. 按 (服务提供商与接口地址, 模型, 消息, 温度, 最大 token, 输出格式, 提示模板版本) 计算规范化缓存键
+2. 内存 LRU 一级缓存，与二级缓存使用相同的 TTL
+3. SQLite 二级缓存，支持 TTL 和按条数淘汰
+4. 命中率统计
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 缓存配置
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'true').lower() == 'true'
+AI_CACHE_PATH = os.getenv(
+    'AI_CACHE_PATH',
+    # backend/instance/ai_cache.db，与应用数据库放在同一目录
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+                 'instance', 'ai_cache.db')
+)
+AI_CACHE_TTL = int(os.getenv('AI_CACHE_TTL', 7 * 24 * 3600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', 10000))
+AI_CACHE_MEMORY_SIZE = int(os.getenv('AI_CACHE_MEMORY_SIZE', 512))
+
+
+def make_cache_key(model: str, messages: List[Dict[str, Any]], temperature: float,
+                   max_tokens: int, prompt_version: Optional[str] = None,
+                   response_format: Optional[Dict[str, Any]] = None, endpoint: Optional[str] = None) -> str:
+    """计算缓存键
+    Args:
+        model: 模型名称
+        messages: 对话消息列表
+        temperature: 温度
+        max_tokens: 最大输出 token 数
+        prompt_version: 提示模板版本
+        response_format: 输出格式（如 JSON 模式）
+        endpoint: 服务提供商与接口地址，同名模型在不同服务上的回答互不复用
+    Returns:
+        str: SHA-256 十六进制摘要
+    """
+    canonical = json.dumps(
+        {
+            'endpoint': endpoint,
+            'model': model,
+            'messages': messages,
+            'temperature': round(float(temperature), 4),
+            'max_tokens': int(max_tokens),
+            'response_format': response_format,
+            'prompt_version': prompt_version
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """线程安全的内存 LRU 缓存，支持 TTL"""
+
+    def __init__(self, max_entries: int = AI_CACHE_MEMORY_SIZE, ttl: int = AI_CACHE_TTL):
+        """初始化缓存
+        Args:
+            max_entries: 最大条目数
+            ttl: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取缓存值，命中时移动到最近使用位置，过期条目视为未命中并删除"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if time.time() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], created_at: Optional[float] = None) -> int:
+        """写入缓存
+        Args:
+            key: 缓存键
+            value: 缓存值
+            created_at: 条目的创建时间，从二级缓存回填时沿用原创建时间
+        Returns:
+            int: 被淘汰的条目数
+        """
+        with self._lock:
+            self._data[key] = (value, created_at if created_at is not None else time.time())
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCacheStore:
+    """SQLite 持久化缓存，支持 TTL 与按条数淘汰"""
+
+    def __init__(self, path: str = AI_CACHE_PATH, ttl: int = AI_CACHE_TTL,
+                 max_entries: int = AI_CACHE_MAX_ENTRIES):
+        """初始化缓存存储
+        Args:
+            path: 数据库文件路径，':memory:' 表示内存数据库
+            ttl: 条目有效期（秒）
+            max_entries: 最大条目数
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ai_response_cache ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_ai_response_cache_accessed '
+            'ON ai_response_cache (accessed_at)'
+        )
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM ai_response_cache').fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取缓存值，过期条目视为未命中并删除"""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """获取缓存值及其创建时间，过期条目视为未命中并删除"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM ai_response_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute('DELETE FROM ai_response_cache WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                'UPDATE ai_response_cache SET accessed_at = ? WHERE key = ?', (now, key)
+            )
+            self._conn.commit()
+        return json.loads(value), created_at
+
+    def set(self, key: str, value: Dict[str, Any]) -> int:
+        """写入缓存，每写入一定次数执行一次淘汰
+        Returns:
+            int: 被淘汰的条目数
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO ai_response_cache (key, value, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+            self._writes_since_evict += 1
+            if self._writes_since_evict < max(self.max_entries // 100, 1):
+                return 0
+            self._writes_since_evict = 0
+            return self._evict(now)
+
+    def _evict(self, now: float) -> int:
+        """删除过期条目，并按最近访问时间淘汰超出上限的条目（需持有锁）"""
+        cursor = self._conn.execute(
+            'DELETE FROM ai_response_cache WHERE created_at < ?', (now - self.ttl,)
+        )
+        evicted = cursor.rowcount
+        count = self._conn.execute('SELECT COUNT(*) FROM ai_response_cache').fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                'DELETE FROM ai_response_cache WHERE key IN ('
+                ' SELECT key FROM ai_response_cache ORDER BY accessed_at ASC LIMIT ?)',
+                (count - self.max_entries,)
+            )
+            evicted += cursor.rowcount
+        self._conn.commit()
+        return evicted
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute('DELETE FROM ai_response_cache')
+            self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCache:
+    """两级 AI 响应缓存"""
+
+    def __init__(self, memory: Optional[LRUCache] = None,
+                 store: Optional[SQLiteCacheStore] = None):
+        """初始化缓存
+        Args:
+            memory: 内存一级缓存
+            store: SQLite 二级缓存，为空时只使用内存缓存
+        """
+        self.memory = memory if memory is not None else LRUCache()
+        self.store = store
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'store_hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'evictions': 0
+        }
+
+    def _incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """获取缓存值，二级缓存命中时回填一级缓存"""
+        value = self.memory.get(key)
+        if value is not None:
+            self._incr('memory_hits')
+            return value
+
+        if self.store is not None:
+            try:
+                entry = self.store.get_entry(key)
+            except sqlite3.Error as e:
+                logger.warning(f"读取 AI 响应缓存失败: {str(e)}")
+                entry = None
+            if entry is not None:
+                value, created_at = entry
+                self._incr('store_hits')
+                # 回填时沿用原创建时间，条目不会因回填而延长有效期
+                self._incr('evictions', self.memory.set(key, value, created_at))
+                return value
+
+        self._incr('misses')
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """写入两级缓存"""
+        self._incr('writes')
+        self._incr('evictions', self.memory.set(key, value))
+        if self.store is not None:
+            try:
+                self._incr('evictions', self.store.set(key, value))
+            except sqlite3.Error as e:
+                logger.warning(f"写入 AI 响应缓存失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取命中率统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats['memory_hits'] + stats['store_hits']
+        lookups = hits + stats['misses']
+        stats['hits'] = hits
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        return stats
+
+    def clear(self):
+        """清空两级缓存"""
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """获取进程内共享的响应缓存，未启用时返回 None"""
+    global _response_cache
+    if not AI_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                try:
+                    store = SQLiteCacheStore()
+                except sqlite3.Error as e:
+                    logger.warning(f"SQLite 响应缓存不可用，仅使用内存缓存: {str(e)}")
+                    store = None
+                _response_cache = ResponseCache(LRUCache(), store)
+                logger.info(f"AI 响应缓存初始化完成: {AI_CACHE_PATH}")
+    return _response_cache
@@ -0,0 +1,271 @@
+"""
+结构化输出模块
+用于：
+1. 声明模型输出的 JSON 字段（类型、可选值、数组长度）并校验
+2. 本地修复常见的 JSON 语法问题（代码块、尾随逗号、单引号、被截断的括号等），不为语法错误重新请求
+3. 只针对不合法的字段发送简短的修复请求，而不是重新完整分析
+"""
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .base_ai_service import BaseAIService
+from .prompts import PromptTemplate
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 请求 JSON 模式（response_format=json_object）；不支持该参数的 OpenAI 兼容后端可以关闭
+AI_JSON_MODE = os.getenv('AI_JSON_MODE', 'true').lower() == 'true'
+# 单个请求针对不合法字段的最大修复请求次数
+AI_STRUCTURED_REPAIRS = int(os.getenv('AI_STRUCTURED_REPAIRS', 1))
+
+JSON_MODE = {'type': 'json_object'}
+
+REPAIR_PROMPT = """上面的回答中以下字段缺失或不合法：
+{fields}
+请只返回包含这些字段的 JSON 对象，不要输出其他内容。"""
+
+_CLOSERS = {'{': '}', '[': ']'}
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+
+
+@dataclass
+class SchemaField:
+    """输出字段声明
+
+    Attributes:
+        name: 字段名
+        type: 'string' 或 'array'（字符串数组）
+        enum: 字符串字段的可选值
+        max_items: 数组字段保留的最大元素数
+        description: 修复提示中的字段说明
+    """
+    name: str
+    type: str = 'string'
+    enum: Optional[Sequence[str]] = None
+    max_items: Optional[int] = None
+    description: str = ''
+
+    def coerce(self, value: Any) -> Tuple[bool, Any]:
+        """校验并规整字段值
+        Returns:
+            Tuple[bool, Any]: (是否合法, 规整后的值)
+        """
+        if self.type == 'array':
+            if isinstance(value, str) and value.strip():
+                # 模型偶尔把数组写成逗号分隔的字符串
+                value = [part for part in re.split(r'[,，、;；]', value) if part.strip()]
+            if not isinstance(value, list):
+                return False, None
+            items = [str(item).strip() for item in value if str(item).strip()]
+            return True, items[:self.max_items] if self.max_items else items
+        if not isinstance(value, str):
+            return False, None
+        value = value.strip()
+        if self.enum is not None:
+            value = value.lower()
+            if value not in self.enum:
+                return False, None
+        return bool(value), value
+
+    def describe(self) -> str:
+        """字段的一行说明"""
+        if self.description:
+            return f"- {self.name}: {self.description}"
+        if self.enum is not None:
+            return f"- {self.name}: {' / '.join(self.enum)} 之一"
+        if self.type == 'array':
+            limit = f"不超过 {self.max_items} 个元素的" if self.max_items else ''
+            return f"- {self.name}: {limit}字符串数组"
+        return f"- {self.name}: 字符串"
+
+
+class OutputSchema:
+    """模型输出的 JSON 对象结构"""
+
+    def __init__(self, fields: Sequence[SchemaField]):
+        self.fields = {f.name: f for f in fields}
+
+    def validate(self, data: Any) -> Tuple[Dict[str, Any], List[str]]:
+        """逐字段校验
+        Args:
+            data: 解析出的 JSON 值
+        Returns:
+            Tuple: (合法字段的值, 缺失或不合法的字段名)
+        """
+        if not isinstance(data, dict):
+            return {}, list(self.fields)
+        values, invalid = {}, []
+        for name, spec in self.fields.items():
+            ok, value = spec.coerce(data.get(name))
+            if ok:
+                values[name] = value
+            else:
+                invalid.append(name)
+        return values, invalid
+
+    def parse(self, text: str) -> Tuple[Dict[str, Any], List[str]]:
+        """从模型文本中解析（必要时本地修复）并校验 JSON 对象"""
+        return self.validate(repair_json(text, '{'))
+
+    def describe(self, names: Sequence[str]) -> str:
+        """指定字段的说明，用于修复提示"""
+        return '\n'.join(self.fields[name].describe() for name in names if name in self.fields)
+
+
+class StructuredStats:
+    """结构化输出的解析统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'parsed': 0, 'repaired_locally': 0, 'unparseable': 0,
+                       'repair_requests': 0, 'repaired_fields': 0, 'failed_fields': 0}
+
+    def incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_structured_stats = StructuredStats()
+
+
+def structured_stats() -> Dict[str, int]:
+    """进程内的结构化输出统计"""
+    return _structured_stats.stats()
+
+
+def _balance(text: str) -> str:
+    """补全被截断的字符串和括号"""
+    stack: List[str] = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+        elif char in '}]' and stack and stack[-1] == char:
+            stack.pop()
+    if in_string:
+        text += '"'
+    if stack:
+        text = re.sub(r'[,:\s]+$', '', text) + ''.join(reversed(stack))
+    return text
+
+
+def _repairs(candidate: str):
+    """依次产生逐步修复后的候选文本"""
+    text = candidate.translate(_SMART_QUOTES)
+    yield text
+    text = re.sub(r',\s*([}\]])', r'\1', text)
+    yield text
+    text = re.sub(r'\bTrue\b', 'true', re.sub(r'\bFalse\b', 'false', re.sub(r'\bNone\b', 'null', text)))
+    text = re.sub(r'([{,]\s*)([A-Za-z_]\w*)\s*:', r'\1"\2":', text)
+    yield text
+    if '"' not in text:
+        text = text.replace("'", '"')
+        yield text
+    yield re.sub(r',\s*([}\]])', r'\1', _balance(text))
+
+
+def repair_json(text: str, container: str = '{') -> Any:
+    """从模型返回的文本中解析 JSON，必要时在本地修复语法
+    Args:
+        text: 模型返回的文本
+        container: 期望的最外层类型，'{' 或 '['
+    Returns:
+        Any: 解析结果，无法解析时返回 None
+    """
+    text = re.sub(r'```(?:json)?', '', text or '')
+    start = text.find(container)
+    if start < 0:
+        _structured_stats.incr('unparseable')
+        return None
+    end = text.rfind(_CLOSERS[container])
+    candidates = [text[start:end + 1]] if end > start else []
+    # 输出被截断时，最后一个右括号之后可能还有内容
+    if text[end + 1:].strip() or end < start:
+        candidates.append(text[start:])
+
+    for candidate in candidates:
+        for attempt, fixed in enumerate(_repairs(candidate)):
+            try:
+                data = json.loads(fixed)
+            except json.JSONDecodeError:
+                continue
+            repaired = attempt or candidate is not candidates[0]
+            _structured_stats.incr('repaired_locally' if repaired else 'parsed')
+            return data
+    logger.warning(f"无法解析模型返回的 JSON: {text[start:start + 80]}")
+    _structured_stats.incr('unparseable')
+    return None
+
+
+def structured_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """在请求参数中加入 JSON 模式"""
+    if AI_JSON_MODE:
+        return dict(options, response_format=JSON_MODE)
+    return dict(options)
+
+
+def repair_fields(ai_service: BaseAIService, schema: OutputSchema, template: PromptTemplate,
+                  prompt: str, answer: str, invalid: Sequence[str],
+                  max_repairs: int = AI_STRUCTURED_REPAIRS, **options) -> Tuple[Dict[str, Any], List[str]]:
+    """只针对不合法的字段重新请求
+    原始提示和上一次回答作为对话历史放在模板前缀之后（命中上游缓存），
+    最后一条消息只列出需要修复的字段，输出也只包含这些字段
+    Args:
+        ai_service: AI 服务实例
+        schema: 输出结构
+        template: 原始请求使用的提示模板
+        prompt: 原始请求的用户消息
+        answer: 上一次的模型回答
+        invalid: 需要修复的字段
+        max_repairs: 最大修复请求次数
+        **options: 请求参数
+    Returns:
+        Tuple: (修复得到的字段值, 仍不合法的字段)
+    """
+    values: Dict[str, Any] = {}
+    invalid = list(invalid)
+    for _ in range(max_repairs):
+        if not invalid:
+            break
+        history = template.prefix + [
+            {'role': 'user', 'content': prompt},
+            {'role': 'assistant', 'content': answer or '{}'}
+        ]
+        request_options = structured_options(dict(
+            options,
+            prefix_messages=history,
+            prompt_version=f"{template.key}-repair",
+            max_tokens=32 * len(invalid) + 32
+        ))
+        _structured_stats.incr('repair_requests')
+        try:
+            response = ai_service.chat(REPAIR_PROMPT.format(fields=schema.describe(invalid)),
+                                       **request_options)
+        except Exception as e:
+            logger.warning(f"修复字段 {', '.join(invalid)} 失败: {str(e)}")
+            break
+        answer = response.get('response', '')
+        repaired, _ = schema.validate(repair_json(answer, '{'))
+        repaired = {name: value for name, value in repaired.items() if name in invalid}
+        values.update(repaired)
+        _structured_stats.incr('repaired_fields', len(repaired))
+        invalid = [name for name in invalid if name not in repaired]
+    _structured_stats.incr('failed_fields', len(invalid))
+    return values, invalid
@@ -0,0 +1,268 @@
+"""
+邮件分层摘要模块
+用于“分析我一个月的邮件信息，将相同类型的归纳”这类大范围查询：
+1. Map：按天将邮件摘要分成叶子块，并行生成每块的摘要
+2. Reduce：把相邻摘要按 ISO 周、月、季度、年逐层合并，直到能放入一次请求
+3. 中间节点按内容哈希缓存；分组边界对齐到日历而不是窗口起点，
+   时间窗口延伸或平移时只需重算边界所在的周、月和新叶子的祖先
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from .base_ai_service import BaseAIService, AIServiceError, chat_concurrently
+from .chunking import TokenBudget, estimate_tokens, truncate_text
+from .prompts import PromptTemplate, register_template
+from .response_cache import ResponseCache, get_response_cache
+from ...utils.logger import get_logger
+from ...utils.text import get_email_text
+
+logger = get_logger(__name__)
+
+# 修改提示时递增版本号，使缓存的中间节点失效
+SUMMARY_PROMPT_VERSION = 'summary-v2'
+
+DEFAULT_QUERY = "将相同类型的邮件归纳在一起，并列出需要关注的事项"
+
+# 单封邮件摘要的 token 上限、每个摘要的输出上限、每层合并的最大子节点数
+DIGEST_MAX_TOKENS = 120
+SUMMARY_MAX_TOKENS = 800
+REDUCE_FAN_IN = 8
+
+# 逐层合并的日历分组：先把同一 ISO 周的节点合并，再依次按月、季度、年合并；
+# 组内节点过多时从组内第一个节点开始按扇入和预算装箱，不受窗口起点影响
+CALENDAR_LEVELS: Tuple[Tuple[str, Callable[[date], Hashable]], ...] = (
+    ('week', lambda day: tuple(day.isocalendar())[:2]),
+    ('month', lambda day: (day.year, day.month)),
+    ('quarter', lambda day: (day.year, (day.month - 1) // 3)),
+    ('year', lambda day: day.year),
+)
+
+# 指令放在固定的系统前缀中，日期、摘要和用户要求只出现在最后一条用户消息
+MAP_TEMPLATE = register_template(PromptTemplate(
+    name='summary-map',
+    version=2,
+    system=f"""你是邮件归纳助手。用户会给出某一天的邮件摘要，每封以 - 开头，[xN] 表示有 N 封近似相同的邮件。
+请按邮件类型（例如 工作、通知、推广、账单、社交）归纳要点，保留重要的人名、金额、日期和待办事项，
+不超过 {SUMMARY_MAX_TOKENS} 字。""",
+    user="日期：{day}\n\n{digests}"
+))
+
+REDUCE_TEMPLATE = register_template(PromptTemplate(
+    name='summary-reduce',
+    version=2,
+    system=f"""你是邮件归纳助手。用户会给出若干时间段的邮件归纳，每段以【时间段】开头。
+请合并为一份按邮件类型组织的归纳，合并同类项，保留重要的人名、金额、日期和待办事项，
+不超过 {SUMMARY_MAX_TOKENS} 字。""",
+    user="{summaries}"
+))
+
+FINAL_TEMPLATE = register_template(PromptTemplate(
+    name='summary-final',
+    version=2,
+    system="你是邮件归纳助手。用户会给出某段时间的邮件归纳和自己的要求，请根据要求给出最终回答。",
+    user="时间段：{period}\n\n用户要求：{query}\n\n邮件归纳：\n{summary}"
+))
+
+
+@dataclass
+class SummaryNode:
+    """摘要树节点"""
+    key: str
+    label: str
+    start: date = date.min
+    summary: str = ''
+    children: List['SummaryNode'] = field(default_factory=list)
+
+
+class MapReduceSummarizer:
+    """分层 Map-Reduce 摘要器"""
+
+    def __init__(self, ai_service: BaseAIService, cache: Optional[ResponseCache] = None,
+                 max_workers: int = 4, fan_in: int = REDUCE_FAN_IN):
+        """初始化摘要器
+        Args:
+            ai_service: AI 服务实例
+            cache: 中间节点缓存，默认使用进程共享的响应缓存
+            max_workers: 并行请求数
+            fan_in: 每个合并节点的最大子节点数
+        """
+        self.ai_service = ai_service
+        self.cache = cache if cache is not None else get_response_cache()
+        self.max_workers = max_workers
+        self.fan_in = fan_in
+        self.budget = TokenBudget.for_model(
+            getattr(ai_service, 'model', ''),
+            max_output_tokens=SUMMARY_MAX_TOKENS,
+            prompt_overhead=REDUCE_TEMPLATE.prefix_tokens
+        )
+        self.stats = {'llm_calls': 0, 'cached_nodes': 0}
+
+    def _node_key(self, kind: str, content: Sequence[str]) -> str:
+        """根据节点内容计算缓存键"""
+        payload = json.dumps(
+            [SUMMARY_PROMPT_VERSION, getattr(self.ai_service, 'model', ''), kind, list(content)],
+            ensure_ascii=False
+        )
+        return 'summary:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _digest(self, email: Any, count: int = 1) -> str:
+        """构建单封邮件的摘要行"""
+        text = truncate_text(get_email_text(email), DIGEST_MAX_TOKENS).replace('\n', ' ')
+        repeat = f" [x{count}]" if count > 1 else ''
+        return f"- {email.from_email or ''}{repeat}: {text}"
+
+    def _build_leaves(self, emails: Sequence[Any], cluster_ids: Optional[Dict[int, int]] = None) -> List[SummaryNode]:
+        """按天构建叶子节点，近似重复的邮件只保留代表并记录数量
+        Args:
+            emails: 按时间排序的邮件
+            cluster_ids: 邮件ID到近似重复簇代表ID的映射
+        Returns:
+            List[SummaryNode]: 叶子节点（尚未生成摘要）
+        """
+        cluster_ids = cluster_ids or {}
+        days: Dict[date, Dict[int, List[Any]]] = {}
+        for email in emails:
+            day = email.received_at.date() if email.received_at else date.min
+            cluster = cluster_ids.get(email.id, email.id)
+            days.setdefault(day, {}).setdefault(cluster, []).append(email)
+
+        leaf_budget = TokenBudget.for_model(
+            getattr(self.ai_service, 'model', ''),
+            max_output_tokens=SUMMARY_MAX_TOKENS,
+            prompt_overhead=MAP_TEMPLATE.prefix_tokens + estimate_tokens(MAP_TEMPLATE.user)
+        )
+        leaves = []
+        for day in sorted(days):
+            digests = [self._digest(group[0], len(group)) for group in days[day].values()]
+            # 单日邮件过多时拆成多个叶子
+            for part, batch in enumerate(leaf_budget.plan_batches(digests, item_overhead=2)):
+                content = [digests[i] for i in batch]
+                label = day.isoformat() if part == 0 else f"{day.isoformat()}#{part + 1}"
+                leaves.append(SummaryNode(key=self._node_key('map', [label] + content),
+                                          label=label, start=day, summary='\n'.join(content)))
+        return leaves
+
+    def _run_prompts(self, nodes: List[SummaryNode], prompts: List[str], template: PromptTemplate):
+        """并行执行未命中缓存的节点请求并写回摘要"""
+        pending = []
+        for node, prompt in zip(nodes, prompts):
+            cached = self.cache.get(node.key) if self.cache else None
+            if cached is not None:
+                node.summary = cached['response']
+                self.stats['cached_nodes'] += 1
+            else:
+                pending.append((node, prompt))
+        if not pending:
+            return
+
+        options = {'temperature': 0, 'max_tokens': SUMMARY_MAX_TOKENS, 'cache': False, **template.options()}
+        prompt_list = [prompt for _, prompt in pending]
+        responses = chat_concurrently(self.ai_service.chat, prompt_list, self.max_workers, **options)
+        self.stats['llm_calls'] += len(pending)
+
+        for (node, _), response in zip(pending, responses):
+            if isinstance(response, Exception):
+                raise AIServiceError(f"生成摘要失败（{node.label}）: {str(response)}")
+            node.summary = response['response']
+            if self.cache:
+                self.cache.set(node.key, {'response': node.summary})
+
+    def _map(self, leaves: List[SummaryNode]):
+        """为叶子节点生成摘要"""
+        prompts = [
+            MAP_TEMPLATE.render(day=leaf.label, digests=leaf.summary)
+            for leaf in leaves
+        ]
+        self._run_prompts(leaves, prompts, MAP_TEMPLATE)
+
+    def _reduce_level(self, nodes: List[SummaryNode],
+                      calendar_key: Optional[Callable[[date], Hashable]] = None) -> List[SummaryNode]:
+        """将一层节点合并为上一层
+        相邻且日历分组相同的节点才会合并，组内从组的第一个节点开始按扇入和预算装箱
+        Args:
+            nodes: 按时间排序的节点
+            calendar_key: 节点起始日期到日历分组的映射，为空时所有节点同组
+        Returns:
+            List[SummaryNode]: 上一层节点，单独成批的节点直接上移
+        """
+        texts = [f"【{n.label}】\n{n.summary}" for n in nodes]
+        groups: List[List[int]] = []
+        last_key = None
+        for i, node in enumerate(nodes):
+            key = calendar_key(node.start) if calendar_key else None
+            if groups and key == last_key:
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+            last_key = key
+
+        batches = [[group[i] for i in batch]
+                   for group in groups
+                   for batch in self.budget.plan_batches([texts[i] for i in group], max_items=self.fan_in)]
+        parents = []
+        prompts = []
+        for batch in batches:
+            children = [nodes[i] for i in batch]
+            content = [texts[i] for i in batch]
+            label = children[0].label if len(children) == 1 else f"{children[0].label}~{children[-1].label}"
+            if len(children) == 1:
+                parents.append(children[0])
+                continue
+            parent = SummaryNode(key=self._node_key('reduce', content), label=label,
+                                 start=children[0].start, children=children)
+            parents.append(parent)
+            prompts.append((parent, REDUCE_TEMPLATE.render(summaries='\n\n'.join(content))))
+        if prompts:
+            self._run_prompts([p for p, _ in prompts], [prompt for _, prompt in prompts], REDUCE_TEMPLATE)
+        return parents
+
+    def summarize(self, emails: Sequence[Any], query: str = DEFAULT_QUERY,
+                  cluster_ids: Optional[Dict[int, int]] = None) -> Dict[str, Any]:
+        """生成邮件归纳
+        Args:
+            emails: 按时间排序的邮件
+            query: 用户的归纳要求
+            cluster_ids: 邮件ID到近似重复簇代表ID的映射
+        Returns:
+            Dict[str, Any]: 归纳结果与统计信息
+        """
+        self.stats = {'llm_calls': 0, 'cached_nodes': 0}
+        if not emails:
+            return {'summary': '', 'email_count': 0, 'leaves': 0, 'levels': 0, **self.stats}
+
+        leaves = self._build_leaves(emails, cluster_ids)
+        self._map(leaves)
+
+        level = leaves
+        levels = 1
+        # 每种日历分组合并到组内只剩一个节点，再换更粗的分组；最后不分组合并剩余节点
+        for _, calendar_key in CALENDAR_LEVELS + ((None, None),):
+            while len(level) > 1:
+                next_level = self._reduce_level(level, calendar_key)
+                if len(next_level) == len(level):
+                    break
+                level = next_level
+                levels += 1
+        if len(level) > 1:
+            # 单个节点已超出预算，无法继续合并
+            raise AIServiceError("摘要过长，无法合并")
+
+        root = level[0]
+        period = f"{leaves[0].label.split('#')[0]} ~ {leaves[-1].label.split('#')[0]}"
+        final_node = SummaryNode(key=self._node_key('final', [query, root.key, root.summary]),
+                                 label='final')
+        self._run_prompts([final_node], [FINAL_TEMPLATE.render(period=period, query=query,
+                                                               summary=root.summary)], FINAL_TEMPLATE)
+
+        logger.info(f"邮件归纳完成: {len(emails)} 封邮件, {len(leaves)} 个叶子, {levels} 层, "
+                    f"模型调用 {self.stats['llm_calls']} 次, 缓存命中 {self.stats['cached_nodes']} 个节点")
+        return {
+            'summary': final_node.summary,
+            'period': period,
+            'email_count': len(emails),
+            'leaves': len(leaves),
+            'levels': levels,
+            **self.stats
+        }
@@ -0,0 +1,461 @@
+"""
+AI 用量记录模块
+用于：
+1. 记录每次模型调用的 token（输入、输出、前缀缓存命中）、延迟、模型和估算费用，按用户和功能标记
+2. 按用户和日期汇总用量
+3. 请求发出前检查用户的每日 token 预算，接近上限时降级模型，超过上限时推迟
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import has_app_context, has_request_context, request
+from sqlalchemy import func
+from .base_ai_service import BaseAIService, chat_concurrently
+from .chunking import estimate_tokens
+from .deepseek_service import chat_messages
+from .prompts import get_prompt_cache_stats
+from ...db.database import db
+from ...models import AIUsage
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 每个用户每天的 token 上限（输入 + 输出），0 表示不限制
+AI_DAILY_TOKEN_BUDGET = int(os.getenv('AI_DAILY_TOKEN_BUDGET', 0))
+# 当天用量超过上限的该比例后，请求改用 AI_BUDGET_DOWNGRADE_MODEL（未配置时不降级）
+AI_BUDGET_DOWNGRADE_RATIO = float(os.getenv('AI_BUDGET_DOWNGRADE_RATIO', 0.8))
+AI_BUDGET_DOWNGRADE_MODEL = os.getenv('AI_BUDGET_DOWNGRADE_MODEL', '')
+# 写库失败时内存中最多保留的记录数
+MAX_BUFFER = 10000
+
+# 模型单价（美元 / 百万 token）：输入（未命中缓存）、输入（命中缓存）、输出
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    'deepseek-chat': (0.27, 0.07, 1.10),
+    'deepseek-reasoner': (0.55, 0.14, 2.19),
+    'gpt-3.5-turbo': (0.50, 0.50, 1.50),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+}
+
+_usage_user: ContextVar[Optional[int]] = ContextVar('ai_usage_user', default=None)
+_usage_feature: ContextVar[Optional[str]] = ContextVar('ai_usage_feature', default=None)
+
+
+@contextmanager
+def usage_context(user_id: Optional[int] = None, feature: Optional[str] = None) -> Iterator[None]:
+    """在上下文内发出的模型调用记到指定用户和功能名下
+    Args:
+        user_id: 用户ID，为 None 时沿用外层设置
+        feature: 功能名称，为 None 时沿用外层设置，都没有时使用当前路由的端点名
+    """
+    tokens = []
+    if user_id is not None:
+        tokens.append((_usage_user, _usage_user.set(user_id)))
+    if feature is not None:
+        tokens.append((_usage_feature, _usage_feature.set(feature)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_usage_context() -> Tuple[Optional[int], str]:
+    """当前的 (用户ID, 功能名称)"""
+    feature = _usage_feature.get()
+    if feature is None and has_request_context():
+        feature = request.endpoint
+    return _usage_user.get(), feature or 'unknown'
+
+
+def normalize_usage(usage: Optional[Dict[str, Any]]) -> Tuple[int, int, int]:
+    """统一不同接口的用量字段
+    DeepSeek 返回 prompt_cache_hit_tokens，OpenAI 返回 prompt_tokens_details.cached_tokens
+    Returns:
+        Tuple[int, int, int]: (输入 token, 输出 token, 命中前缀缓存的输入 token)
+    """
+    usage = usage or {}
+    cached = usage.get('prompt_cache_hit_tokens')
+    if cached is None:
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+    return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0, cached or 0
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """按 MODEL_PRICES 估算费用（美元），未知模型返回 0"""
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    miss_price, hit_price, output_price = prices
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    return ((prompt_tokens - cached_tokens) * miss_price + cached_tokens * hit_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+@dataclass
+class BudgetDecision:
+    """预算检查结果
+
+    Attributes:
+        action: allow（正常发出）/ downgrade（改用 model）/ defer（推迟到 retry_after 秒后）
+        model: 应使用的模型
+        used: 用户当天已用 token
+        limit: 每日上限，0 表示不限制
+        retry_after: 推迟时距离预算重置的秒数
+    """
+    action: str
+    model: str
+    used: int = 0
+    limit: int = 0
+    retry_after: int = 0
+
+    @property
+    def allowed(self) -> bool:
+        return self.action != 'defer'
+
+
+class UsageLedger:
+    """AI 用量账本
+
+    调用记录先写入内存缓冲，由后台线程定期批量写库，不阻塞模型调用；
+    用户当天的用量在内存中累加，首次检查预算时从数据库加载基数。
+    """
+
+    def __init__(self, daily_budget: int = AI_DAILY_TOKEN_BUDGET,
+                 downgrade_ratio: float = AI_BUDGET_DOWNGRADE_RATIO,
+                 downgrade_model: str = AI_BUDGET_DOWNGRADE_MODEL):
+        """初始化用量账本
+        Args:
+            daily_budget: 每个用户每天的 token 上限，0 表示不限制
+            downgrade_ratio: 开始降级模型的用量比例
+            downgrade_model: 降级使用的模型，为空时不降级
+        """
+        self.daily_budget = daily_budget
+        self.downgrade_ratio = downgrade_ratio
+        self.downgrade_model = downgrade_model
+        self.app = None
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._day = datetime.now().date()
+        self._today: Dict[int, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'recorded': 0, 'flushed': 0, 'deferred': 0, 'downgraded': 0}
+
+    def _roll_day_locked(self):
+        """跨天后清空当天用量（需持有锁）"""
+        today = datetime.now().date()
+        if today != self._day:
+            self._day = today
+            self._today.clear()
+
+    def record(self, provider: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               cached_tokens: int = 0, latency_ms: int = 0, cache_hit: bool = False,
+               estimated: bool = False, success: bool = True,
+               user_id: Optional[int] = None, feature: Optional[str] = None):
+        """记录一次模型调用，用户和功能默认取自 usage_context"""
+        context_user, context_feature = current_usage_context()
+        user_id = user_id if user_id is not None else context_user
+        row = {
+            'user_id': user_id,
+            'feature': (feature or context_feature)[:64],
+            'provider': provider,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cached_tokens': cached_tokens,
+            'latency_ms': latency_ms,
+            'cost': estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens),
+            'cache_hit': cache_hit,
+            'estimated': estimated,
+            'success': success,
+            'created_at': datetime.now()
+        }
+        with self._lock:
+            self._roll_day_locked()
+            self._buffer.append(row)
+            self.stats['recorded'] += 1
+            if user_id is not None and user_id in self._today:
+                self._today[user_id] += prompt_tokens + completion_tokens
+
+    def flush(self) -> int:
+        """将缓冲的记录写入数据库
+        Returns:
+            int: 写入的记录数
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        context = self.app.app_context() if self.app is not None and not has_app_context() else nullcontext()
+        try:
+            with context:
+                try:
+                    db.session.add_all([AIUsage(**row) for row in rows])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception as e:
+            logger.error(f"写入 AI 用量记录失败: {str(e)}")
+            with self._lock:
+                self._buffer = (rows + self._buffer)[-MAX_BUFFER:]
+            return 0
+        with self._lock:
+            self.stats['flushed'] += len(rows)
+        return len(rows)
+
+    def used_today(self, user_id: int) -> int:
+        """用户当天已用的 token 数（需要应用上下文）"""
+        with self._lock:
+            self._roll_day_locked()
+            if user_id in self._today:
+                return self._today[user_id]
+            buffered = sum(row['prompt_tokens'] + row['completion_tokens'] for row in self._buffer
+                           if row['user_id'] == user_id and row['created_at'].date() == self._day)
+
+        start = datetime.combine(datetime.now().date(), datetime.min.time())
+        stored = db.session.query(
+            func.coalesce(func.sum(AIUsage.prompt_tokens + AIUsage.completion_tokens), 0)
+        ).filter(AIUsage.user_id == user_id, AIUsage.created_at >= start).scalar()
+        with self._lock:
+            # 并发加载时保留第一个结果；加载期间新增的少量记录可能漏计，预算检查允许这点误差
+            return self._today.setdefault(user_id, int(stored) + buffered)
+
+    def check_budget(self, user_id: Optional[int], model: str, estimated_tokens: int = 0) -> BudgetDecision:
+        """请求发出前检查用户的每日预算
+        Args:
+            user_id: 用户ID，为 None 时不检查
+            model: 请求的模型
+            estimated_tokens: 本次请求预计消耗的 token 数
+        Returns:
+            BudgetDecision: 检查结果
+        """
+        if not self.daily_budget or user_id is None:
+            return BudgetDecision('allow', model)
+
+        used = self.used_today(user_id)
+        if used + estimated_tokens > self.daily_budget:
+            tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+            self.stats['deferred'] += 1
+            logger.info(f"用户 {user_id} 今日 AI 用量 {used} 已达上限 {self.daily_budget}，请求推迟")
+            return BudgetDecision('defer', model, used, self.daily_budget,
+                                  max(1, int((tomorrow - datetime.now()).total_seconds())))
+        if (self.downgrade_model and model != self.downgrade_model
+                and used + estimated_tokens > self.daily_budget * self.downgrade_ratio):
+            self.stats['downgraded'] += 1
+            return BudgetDecision('downgrade', self.downgrade_model, used, self.daily_budget)
+        return BudgetDecision('allow', model, used, self.daily_budget)
+
+    def summary(self, user_id: Optional[int] = None, days: int = 7,
+                by_feature: bool = False) -> List[Dict[str, Any]]:
+        """按用户和日期汇总用量（需要应用上下文）
+        Args:
+            user_id: 只汇总该用户，为 None 时汇总所有用户
+            days: 最近的天数
+            by_feature: 是否再按功能拆分
+        Returns:
+            List[Dict[str, Any]]: 每个 (日期, 用户[, 功能]) 一行，按日期倒序
+        """
+        self.flush()
+        day = func.date(AIUsage.created_at)
+        columns = [day.label('day'), AIUsage.user_id]
+        if by_feature:
+            columns.append(AIUsage.feature)
+        start = datetime.combine(datetime.now().date() - timedelta(days=days - 1), datetime.min.time())
+        query = db.session.query(
+            *columns,
+            func.count(AIUsage.id),
+            func.sum(AIUsage.prompt_tokens),
+            func.sum(AIUsage.completion_tokens),
+            func.sum(AIUsage.cached_tokens),
+            func.sum(AIUsage.cost),
+            func.avg(AIUsage.latency_ms),
+            func.sum(db.case((AIUsage.cache_hit.is_(True), 1), else_=0))
+        ).filter(AIUsage.created_at >= start)
+        if user_id is not None:
+            query = query.filter(AIUsage.user_id == user_id)
+        rows = query.group_by(*columns).order_by(day.desc(), AIUsage.user_id).all()
+
+        results = []
+        for row in rows:
+            key, (calls, prompt, completion, cached, cost, latency, cache_hits) = row[:len(columns)], row[len(columns):]
+            item = {'day': str(key[0]), 'user_id': key[1]}
+            if by_feature:
+                item['feature'] = key[2]
+            item.update({
+                'calls': calls,
+                'cache_hits': int(cache_hits or 0),
+                'prompt_tokens': int(prompt or 0),
+                'completion_tokens': int(completion or 0),
+                'cached_tokens': int(cached or 0),
+                'total_tokens': int((prompt or 0) + (completion or 0)),
+                'cost': round(cost or 0.0, 6),
+                'avg_latency_ms': round(latency or 0.0, 1)
+            })
+            results.append(item)
+        return results
+
+    def start(self, interval: float):
+        """启动定期写库的后台线程"""
+        def run():
+            while not self._stop.wait(interval):
+                self.flush()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='ai-usage-flush', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        """停止后台线程并写入剩余记录"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """账本统计"""
+        with self._lock:
+            return dict(self.stats, buffered=len(self._buffer), daily_budget=self.daily_budget)
+
+
+def prompt_text(message: str, kwargs: Dict[str, Any]) -> str:
+    """请求实际发送的全部文本（含模板前缀），用于上游未返回用量时估算输入 token"""
+    return '\n'.join(m.get('content') or '' for m in chat_messages(message, **kwargs))
+
+
+class MeteredAIService(BaseAIService):
+    """记录用量的 AI 服务
+
+    包在缓存层外面，命中响应缓存的调用也会记录（token 为 0），便于统计缓存节省的用量。
+    """
+
+    def __init__(self, service: BaseAIService, provider: str, ledger: Optional[UsageLedger] = None):
+        """初始化记录用量的 AI 服务
+
+        Args:
+            service: 被包装的 AI 服务
+            provider: 服务提供商名称
+            ledger: 用量账本，默认使用进程内共享的账本
+        """
+        super().__init__(service.api_key, service.model)
+        self.service = service
+        self.provider = provider
+        self.ledger = ledger or get_usage_ledger()
+
+    def __getattr__(self, name: str) -> Any:
+        # 其余属性（client、cache 等）交给被包装的服务
+        if name == 'service':
+            raise AttributeError(name)
+        return getattr(self.service, name)
+
+    def _record(self, result: Any, latency_ms: int, message: str = '', prompt_version: Optional[str] = None):
+        """按响应记录一次调用，上游未返回用量时按文本长度估算；
+        使用提示模板的请求同时按模板统计上游缓存命中；
+        响应中带有 model 时（如网关对冲或切换后端）按实际返回结果的模型记录"""
+        if not isinstance(result, dict):
+            self.ledger.record(self.provider, self.model, latency_ms=latency_ms, success=False)
+            return
+        model = result.get('model') or self.model
+        if result.get('cached'):
+            self.ledger.record(self.provider, model, latency_ms=latency_ms, cache_hit=True)
+            return
+        prompt, completion, cached = normalize_usage(result.get('usage'))
+        estimated = not result.get('usage')
+        if estimated:
+            prompt, completion = estimate_tokens(message), estimate_tokens(result.get('response') or '')
+        elif prompt_version:
+            get_prompt_cache_stats().record(prompt_version, prompt, cached)
+        self.ledger.record(self.provider, model, prompt, completion, cached,
+                           latency_ms=latency_ms, estimated=estimated)
+
+    def validate_config(self, config: Dict[str, Any]) -> bool:
+        """验证配置"""
+        return self.service.validate_config(config)
+
+    def chat(self, message: str, **kwargs) -> Dict[str, Any]:
+        """发送对话请求并记录用量"""
+        start = time.perf_counter()
+        try:
+            result = self.service.chat(message, **kwargs)
+        except Exception:
+            self._record(None, int((time.perf_counter() - start) * 1000))
+            raise
+        self._record(result, int((time.perf_counter() - start) * 1000), prompt_text(message, kwargs),
+                     kwargs.get('prompt_version'))
+        return result
+
+    def batch_chat(self, messages: List[str], **kwargs) -> List[Any]:
+        """并发发送多个对话请求，每个请求单独计时并记录用量，失败的请求不记录
+
+        Returns:
+            List: 与输入顺序一致的结果，失败的请求对应 AIServiceError
+        """
+        def timed_chat(message: str, **options) -> Dict[str, Any]:
+            start = time.perf_counter()
+            result = self.service.chat(message, **options)
+            self._record(result, int((time.perf_counter() - start) * 1000), prompt_text(message, options),
+                         options.get('prompt_version'))
+            return result
+
+        return chat_concurrently(timed_chat, messages, **kwargs)
+
+    def chat_stream(self, message: str, **kwargs) -> Iterator[str]:
+        """流式对话，结束（或被关闭）时按文本长度估算用量
+        用户和功能在调用时确定，流在请求上下文结束后继续迭代也能记到正确的用户名下
+        """
+        user_id, feature = current_usage_context()
+        upstream = self.service.chat_stream(message, **kwargs)
+
+        def generate() -> Iterator[str]:
+            start = time.perf_counter()
+            parts: List[str] = []
+            success = False
+            try:
+                for delta in upstream:
+                    parts.append(delta)
+                    yield delta
+                success = True
+            finally:
+                upstream.close()
+                self.ledger.record(self.provider, self.model, estimate_tokens(prompt_text(message, kwargs)),
+                                   estimate_tokens(''.join(parts)),
+                                   latency_ms=int((time.perf_counter() - start) * 1000),
+                                   estimated=True, success=success, user_id=user_id, feature=feature)
+
+        return generate()
+
+    def close(self):
+        """关闭服务"""
+        self.service.close()
+
+
+_usage_ledger: Optional[UsageLedger] = None
+_usage_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """获取进程内共享的用量账本"""
+    global _usage_ledger
+    if _usage_ledger is None:
+        with _usage_ledger_lock:
+            if _usage_ledger is None:
+                _usage_ledger = UsageLedger()
+    return _usage_ledger
+
+
+def init_usage_ledger(app) -> UsageLedger:
+    """将用量账本绑定到应用，并按 AI_USAGE_FLUSH_SECONDS 启动定期写库线程"""
+    ledger = get_usage_ledger()
+    ledger.app = app
+    app.extensions['usage_ledger'] = ledger
+    interval = app.config.get('AI_USAGE_FLUSH_SECONDS', 10)
+    if interval and ledger._thread is None:
+        ledger.start(interval)
+    return ledger
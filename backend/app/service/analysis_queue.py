@@ -0,0 +1,432 @@
+"""
+邮件分析任务队列模块
+用于：
+1. 分析任务持久化到数据库，Web 请求只负责入队，进程重启后继续执行
+2. 交互请求优先于后台补分析，同一优先级内按用户轮转，避免单个用户占满工作线程
+3. 固定大小的工作线程池执行任务，积压超过上限时拒绝新的交互任务
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from flask import current_app
+from sqlalchemy import func
+from ..db.database import db
+from ..models import AnalysisJob, Email
+from ..utils.logger import get_logger
+from .email_analyzer import EmailAnalysisService
+from .email_analysis_store import AnalysisStore, ANALYSIS_BATCH_SIZE, ANALYSIS_MAX_PER_RUN
+from .email_classifier import get_local_classifier
+from .ai.ai_service import DEFAULT_PROVIDER
+from .ai.usage import get_usage_ledger, usage_context
+
+logger = get_logger(__name__)
+
+# 任务优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKFILL = 10
+
+# 排队与执行中的交互任务上限（全局 / 单用户），超过后返回 429
+ANALYSIS_MAX_PENDING = int(os.getenv('ANALYSIS_MAX_PENDING', 200))
+ANALYSIS_MAX_PENDING_PER_USER = int(os.getenv('ANALYSIS_MAX_PENDING_PER_USER', 50))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+# 执行超过该时长仍未完成的任务视为所在进程已退出，重新放回队列；
+# 多进程部署时其他进程正在执行的任务不会被提前放回
+ANALYSIS_JOB_STALE_SECONDS = int(os.getenv('ANALYSIS_JOB_STALE_SECONDS', 1800))
+# 工作线程没有收到新任务通知时的轮询间隔（秒）
+POLL_INTERVAL = 5.0
+# 检查中断任务的间隔（秒）
+RECOVER_INTERVAL = 60.0
+
+
+def server_api_key(app=None, interactive: bool = True) -> Optional[str]:
+    """可使用的服务器密钥 DEEPSEEK_API_KEY，未配置时返回 None
+    服务器自身发起的定时补分析总是可以使用；用户未提交密钥的交互分析只有显式开启
+    ANALYSIS_USE_SERVER_KEY 时才可使用
+    Args:
+        app: Flask 应用，默认为当前应用
+        interactive: 是否为用户发起的交互分析
+    """
+    app = app or current_app
+    if interactive and not app.config.get('ANALYSIS_USE_SERVER_KEY'):
+        return None
+    return os.getenv('DEEPSEEK_API_KEY') or None
+
+
+class QueueFullError(Exception):
+    """分析队列积压超过上限"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AnalysisQueue:
+    """邮件分析任务队列
+
+    每个工作线程每次领取同一用户、同一优先级和模型的一批任务，
+    交给 AnalysisStore 一次分析，从而复用打包请求和近似重复合并。
+    用户提交的 API 密钥只保存在内存中，不写入数据库；进程重启后只有开启 ANALYSIS_USE_SERVER_KEY
+    时才改用服务器密钥，否则这些任务因缺少密钥而失败。补分析任务由服务器发起，总是使用服务器密钥。
+    """
+
+    def __init__(self, app, workers: int = 2, batch_size: int = ANALYSIS_BATCH_SIZE,
+                 max_pending: int = ANALYSIS_MAX_PENDING,
+                 max_pending_per_user: int = ANALYSIS_MAX_PENDING_PER_USER,
+                 max_attempts: int = ANALYSIS_JOB_MAX_ATTEMPTS,
+                 stale_seconds: float = ANALYSIS_JOB_STALE_SECONDS):
+        """初始化任务队列
+        Args:
+            app: Flask 应用，工作线程在其应用上下文中运行
+            workers: 工作线程数，为 0 时不启动线程（可调用 process_next 手动执行）
+            batch_size: 每次领取的最大任务数
+            max_pending: 全局交互任务积压上限
+            max_pending_per_user: 单用户交互任务积压上限
+            max_attempts: 单个任务的最大执行次数
+            stale_seconds: 执行超过该时长的任务视为已中断
+        """
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.max_attempts = max_attempts
+        self.stale_seconds = stale_seconds
+        self._next_recover = 0.0
+        self._recover_lock = threading.Lock()
+        self._keys: Dict[int, str] = {}
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Semaphore(0)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # 用户最近一次被调度的序号，用于同优先级内轮转
+        self._served: Dict[int, int] = {}
+        self._tick = 0
+        # 今日 AI 用量已达上限的用户，在预算重置前不再领取其任务
+        self._deferred: Dict[int, float] = {}
+        # 单个任务平均耗时（秒）的指数移动平均，用于估算 Retry-After
+        self._avg_job_seconds = 5.0
+        self.stats = {'enqueued': 0, 'rejected': 0, 'done': 0, 'failed': 0, 'retried': 0, 'deferred': 0}
+
+    def start(self):
+        """恢复中断的任务并启动工作线程"""
+        with self.app.app_context():
+            self._maybe_recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"analysis-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"分析任务队列启动成功: {self.workers} 个工作线程")
+
+    def shutdown(self, timeout: float = 5.0):
+        """停止工作线程，执行中的任务会在当前批次完成后退出"""
+        self._stop.set()
+        for _ in self._threads:
+            self._wakeup.release()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def recover(self) -> int:
+        """将执行超过 stale_seconds 仍未完成的任务（所在进程已退出）重新放回队列
+        启动时和工作线程运行期间定期执行；只看开始时间，多进程部署时不会放回其他进程正在执行的任务
+        """
+        cutoff = datetime.now() - timedelta(seconds=self.stale_seconds)
+        count = AnalysisJob.query.filter(
+            AnalysisJob.status == 'running',
+            (AnalysisJob.started_at.is_(None)) | (AnalysisJob.started_at < cutoff)
+        ).update({'status': 'queued', 'started_at': None}, synchronize_session=False)
+        db.session.commit()
+        if count:
+            logger.info(f"恢复中断的分析任务 {count} 个")
+        return count
+
+    def _pending_count(self, user_id: Optional[int] = None) -> int:
+        """统计排队和执行中的交互任务数"""
+        query = AnalysisJob.query.filter(
+            AnalysisJob.status.in_(('queued', 'running')),
+            AnalysisJob.priority == PRIORITY_INTERACTIVE
+        )
+        if user_id is not None:
+            query = query.filter(AnalysisJob.user_id == user_id)
+        return query.count()
+
+    def _retry_after(self, pending: int) -> int:
+        """按当前积压和平均耗时估算客户端应等待的秒数"""
+        return max(1, math.ceil(pending * self._avg_job_seconds / max(self.workers, 1)))
+
+    def enqueue(self, user_id: int, email_ids: Sequence[int], model: str,
+                priority: int = PRIORITY_INTERACTIVE, api_key: Optional[str] = None,
+                force: bool = False, provider: str = DEFAULT_PROVIDER) -> List[AnalysisJob]:
+        """提交分析任务
+        同一邮件和模型已有未完成的任务时复用该任务，必要时提升其优先级
+        Args:
+            user_id: 用户ID
+            email_ids: 邮件ID列表
+            model: 模型名称
+            priority: 优先级
+            api_key: API 密钥，只保存在内存中
+            force: 是否忽略已保存的结果重新分析
+            provider: AI 服务提供商
+        Returns:
+            List[AnalysisJob]: 与 email_ids 顺序一致的任务
+        Raises:
+            QueueFullError: 交互任务积压超过上限
+        """
+        email_ids = list(dict.fromkeys(email_ids))
+        existing = {job.email_id: job for job in AnalysisJob.query.filter(
+            AnalysisJob.user_id == user_id,
+            AnalysisJob.email_id.in_(email_ids),
+            AnalysisJob.model == model,
+            AnalysisJob.status.in_(('queued', 'running'))
+        ).all()} if email_ids else {}
+        new_ids = [email_id for email_id in email_ids if email_id not in existing]
+
+        if priority == PRIORITY_INTERACTIVE and new_ids:
+            pending = self._pending_count()
+            user_pending = self._pending_count(user_id)
+            if (pending + len(new_ids) > self.max_pending
+                    or user_pending + len(new_ids) > self.max_pending_per_user):
+                self.stats['rejected'] += 1
+                raise QueueFullError(f"分析队列已满: {pending} 个任务等待中", self._retry_after(pending))
+
+        jobs = []
+        for email_id in email_ids:
+            job = existing.get(email_id)
+            if job is None:
+                job = AnalysisJob(user_id=user_id, email_id=email_id, provider=provider, model=model,
+                                  priority=priority, status='queued', force=force, attempts=0)
+                db.session.add(job)
+            elif job.status == 'queued' and priority < job.priority:
+                job.priority = priority
+            jobs.append(job)
+        db.session.commit()
+
+        if api_key:
+            for job in jobs:
+                self._keys[job.id] = api_key
+        self.stats['enqueued'] += len(new_ids)
+        for _ in range(min(len(new_ids), max(self.workers, 1))):
+            self._wakeup.release()
+        return jobs
+
+    def enqueue_backfill(self, user_id: int, model: str, limit: int = ANALYSIS_MAX_PER_RUN) -> int:
+        """为还没有当前版本结果、也不在队列中的邮件提交后台补分析任务
+        Returns:
+            int: 新提交的任务数
+        """
+        queued = {row[0] for row in db.session.query(AnalysisJob.email_id).filter(
+            AnalysisJob.user_id == user_id,
+            AnalysisJob.model == model,
+            AnalysisJob.status.in_(('queued', 'running'))
+        ).all()}
+        emails = [e for e in AnalysisStore.pending_emails(user_id, model, limit=limit + len(queued))
+                  if e.id not in queued][:limit]
+        if emails:
+            self.enqueue(user_id, [e.id for e in emails], model, priority=PRIORITY_BACKFILL)
+            logger.info(f"用户 {user_id} 提交补分析任务 {len(emails)} 个")
+        return len(emails)
+
+    def claim(self) -> List[AnalysisJob]:
+        """领取下一批任务
+        先取最高优先级；同优先级内选执行中任务最少、最久未被调度的用户，
+        再取该用户同模型的若干任务
+        Returns:
+            List[AnalysisJob]: 已标记为执行中的任务，没有任务时为空
+        """
+        with self._claim_lock:
+            clock = time.monotonic()
+            self._deferred = {user_id: until for user_id, until in self._deferred.items() if until > clock}
+            heads = [head for head in db.session.query(
+                AnalysisJob.priority, AnalysisJob.user_id, func.min(AnalysisJob.id)
+            ).filter(AnalysisJob.status == 'queued')
+                .group_by(AnalysisJob.priority, AnalysisJob.user_id).all()
+                if head[1] not in self._deferred]
+            if not heads:
+                return []
+
+            top = min(priority for priority, _, _ in heads)
+            running = dict(db.session.query(AnalysisJob.user_id, func.count(AnalysisJob.id))
+                           .filter(AnalysisJob.status == 'running')
+                           .group_by(AnalysisJob.user_id).all())
+            user_id, head_id = min(
+                ((user_id, head_id) for priority, user_id, head_id in heads if priority == top),
+                key=lambda c: (running.get(c[0], 0), self._served.get(c[0], 0), c[1])
+            )
+            head = db.session.get(AnalysisJob, head_id)
+            head_key = self._keys.get(head.id)
+            candidates = AnalysisJob.query.filter_by(
+                status='queued', user_id=user_id, priority=top,
+                provider=head.provider, model=head.model, force=head.force
+            ).order_by(AnalysisJob.id).limit(self.batch_size * 2).all()
+            # 同一批任务使用同一个密钥
+            ids = [job.id for job in candidates if self._keys.get(job.id) == head_key][:self.batch_size]
+
+            now = datetime.now()
+            AnalysisJob.query.filter(AnalysisJob.id.in_(ids), AnalysisJob.status == 'queued').update(
+                {'status': 'running', 'started_at': now, 'attempts': AnalysisJob.attempts + 1},
+                synchronize_session=False
+            )
+            db.session.commit()
+            self._tick += 1
+            self._served[user_id] = self._tick
+            # 多进程部署时其他进程可能已领取部分任务
+            return AnalysisJob.query.filter(
+                AnalysisJob.id.in_(ids), AnalysisJob.status == 'running', AnalysisJob.started_at == now
+            ).order_by(AnalysisJob.id).all()
+
+    def _run(self, jobs: List[AnalysisJob]):
+        """执行一批任务，失败的任务在次数上限内重新排队"""
+        from .ai.ai_service import AIServiceFactory
+
+        start = time.perf_counter()
+        job_ids = [job.id for job in jobs]
+        user_id = jobs[0].user_id
+        try:
+            api_key = self._keys.get(jobs[0].id) or server_api_key(
+                self.app, interactive=jobs[0].priority < PRIORITY_BACKFILL)
+            if not api_key:
+                raise ValueError("缺少 API 密钥")
+            budget = get_usage_ledger().check_budget(user_id, jobs[0].model)
+            if not budget.allowed:
+                self._defer(jobs, budget.retry_after)
+                return
+            ai_service = AIServiceFactory.create_service(jobs[0].provider, api_key=api_key, model=budget.model)
+            analyzer = EmailAnalysisService(ai_service, classifier=get_local_classifier())
+
+            emails = {e.id: e for e in Email.query.filter(Email.id.in_([j.email_id for j in jobs])).all()}
+            present = [job for job in jobs if job.email_id in emails]
+            with usage_context(user_id=user_id, feature='email_analysis'):
+                analyses = AnalysisStore.analyze_emails(
+                    [emails[job.email_id] for job in present], analyzer, force=jobs[0].force
+                ) if present else []
+
+            now = datetime.now()
+            for job, analysis in zip(present, analyses):
+                job.status = 'done'
+                job.analysis_id = analysis.id
+                job.finished_at = now
+            for job in jobs:
+                if job.email_id not in emails:
+                    job.status = 'failed'
+                    job.error = '邮件不存在'
+                    job.finished_at = now
+            db.session.commit()
+            self.stats['done'] += len(present)
+            self.stats['failed'] += len(jobs) - len(present)
+        except Exception as e:
+            logger.error(f"执行分析任务失败: {str(e)}")
+            db.session.rollback()
+            jobs = AnalysisJob.query.filter(AnalysisJob.id.in_(job_ids)).all()
+            for job in jobs:
+                job.error = str(e)
+                if job.attempts < self.max_attempts:
+                    job.status = 'queued'
+                    self.stats['retried'] += 1
+                else:
+                    job.status = 'failed'
+                    job.finished_at = datetime.now()
+                    self.stats['failed'] += 1
+            db.session.commit()
+        finally:
+            for job in jobs:
+                if job.status in ('done', 'failed'):
+                    self._keys.pop(job.id, None)
+            elapsed = (time.perf_counter() - start) / max(len(job_ids), 1)
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    def _defer(self, jobs: List[AnalysisJob], retry_after: int):
+        """用户今日 AI 用量已达上限：任务放回队列且不计入执行次数，预算重置前不再领取该用户的任务"""
+        for job in jobs:
+            job.status = 'queued'
+            job.started_at = None
+            job.attempts = max((job.attempts or 1) - 1, 0)
+        db.session.commit()
+        with self._claim_lock:
+            self._deferred[jobs[0].user_id] = time.monotonic() + retry_after
+        self.stats['deferred'] += len(jobs)
+        logger.info(f"用户 {jobs[0].user_id} 今日 AI 用量已达上限，{len(jobs)} 个分析任务推迟 {retry_after} 秒")
+
+    def _maybe_recover(self):
+        """距上次检查超过 RECOVER_INTERVAL 时放回中断的任务"""
+        with self._recover_lock:
+            now = time.monotonic()
+            if now < self._next_recover:
+                return
+            self._next_recover = now + RECOVER_INTERVAL
+        self.recover()
+
+    def process_next(self) -> int:
+        """领取并执行一批任务（需要应用上下文）
+        Returns:
+            int: 本次执行的任务数
+        """
+        jobs = self.claim()
+        if jobs:
+            self._run(jobs)
+        return len(jobs)
+
+    def _worker(self):
+        """工作线程主循环"""
+        while not self._stop.is_set():
+            processed = 0
+            with self.app.app_context():
+                try:
+                    self._maybe_recover()
+                    processed = self.process_next()
+                except Exception as e:
+                    logger.error(f"分析工作线程异常: {str(e)}")
+                finally:
+                    db.session.remove()
+            if not processed:
+                self._wakeup.acquire(timeout=POLL_INTERVAL)
+
+    def get_job(self, job_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """获取任务状态，执行完成时附带分析结果，排队中时附带前面的任务数
+        Args:
+            job_id: 任务ID
+            user_id: 用户ID
+        Returns:
+            Optional[Dict[str, Any]]: 任务信息，不存在时返回 None
+        """
+        job = AnalysisJob.query.filter_by(id=job_id, user_id=user_id).first()
+        if not job:
+            return None
+        result = job.to_dict()
+        if job.status == 'done' and job.analysis:
+            result['analysis'] = job.analysis.to_dict()
+        elif job.status == 'queued':
+            result['position'] = AnalysisJob.query.filter(
+                AnalysisJob.status == 'queued',
+                (AnalysisJob.priority < job.priority)
+                | ((AnalysisJob.priority == job.priority) & (AnalysisJob.id < job.id))
+            ).count()
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """队列统计：各状态和优先级的任务数与累计计数"""
+        counts = db.session.query(AnalysisJob.status, AnalysisJob.priority, func.count(AnalysisJob.id)) \
+            .filter(AnalysisJob.status.in_(('queued', 'running'))) \
+            .group_by(AnalysisJob.status, AnalysisJob.priority).all()
+        return {
+            'workers': self.workers,
+            'queued': {str(priority): count for status, priority, count in counts if status == 'queued'},
+            'running': sum(count for status, _, count in counts if status == 'running'),
+            'avg_job_seconds': round(self._avg_job_seconds, 3),
+            **self.stats
+        }
+
+
+def init_analysis_queue(app) -> AnalysisQueue:
+    """创建应用的分析任务队列并启动工作线程"""
+    queue = AnalysisQueue(app, workers=app.config.get('ANALYSIS_WORKERS', 2))
+    app.extensions['analysis_queue'] = queue
+    queue.start()
+    return queue
+
+
+def get_analysis_queue() -> Optional[AnalysisQueue]:
+    """获取当前应用的分析任务队列，未初始化时返回 None"""
+    return current_app.extensions.get('analysis_queue')
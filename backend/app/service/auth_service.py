@@ -32,6 +32,24 @@ def credentials_to_dict(credentials: Credentials) -> dict:
         'scopes': credentials.scopes
     }
 
+def user_credentials(user: User) -> Optional[Credentials]:
+    """根据用户保存的令牌重建 Gmail 凭据，供不在请求中执行的定时同步使用
+    访问令牌过期时由 Google 客户端用刷新令牌自动刷新
+    Args:
+        user: 用户对象
+    Returns:
+        Optional[Credentials]: 凭据，用户没有保存刷新令牌时返回 None
+    """
+    if not user.refresh_token:
+        return None
+    return Credentials(
+        token=user.access_token,
+        refresh_token=user.refresh_token,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
+    )
+
 class AuthService:
     """认证服务类"""
 
@@ -188,6 +206,21 @@ class AuthService:
             logger.error(f"撤销令牌失败: {str(e)}")
             return False
 
+    def clear_tokens(self, user: User) -> bool:
+        """清除用户保存的令牌
+        退出登录时令牌已撤销，清除后应用启动时不再为该用户恢复定时同步
+        """
+        try:
+            user.access_token = None
+            user.refresh_token = None
+            db.session.commit()
+            logger.info(f"已清除用户 {user.email} 的令牌")
+            return True
+        except Exception as e:
+            logger.error(f"清除用户令牌失败: {str(e)}")
+            db.session.rollback()
+            return False
+
     def get_or_create_user(self, user_info: Dict[str, Any], credentials: Dict[str, Any]) -> Optional[User]:
         """获取或创建用户"""
         logger.debug(f"开始获取或创建用户，邮箱: {user_info.get('email')}")
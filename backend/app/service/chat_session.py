@@ -0,0 +1,211 @@
+"""
+邮件对话会话模块
+用于：
+1. 针对单封邮件的多轮对话，只发送最近几轮原文，更早的问答增量合并为摘要
+2. 按向量相似度召回与当前问题相关的早期问答
+3. 提示大小与对话长度无关：邮件正文、摘要、召回和窗口内的问答都有 token 上限
+"""
+import os
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from ..db.database import db
+from ..models import ChatHistory, ChatSession
+from ..utils.logger import get_logger
+from ..utils.text import get_email_text
+from .ai.base_ai_service import BaseAIService
+from .ai.chunking import truncate_text
+from .ai.prompts import PromptTemplate, register_template
+from .embedding import EmbeddingService
+from .embedding.backends import BaseEmbeddingBackend
+
+logger = get_logger(__name__)
+
+# 原文发送的最近问答轮数；窗口外累计多少轮后合并一次摘要
+CHAT_WINDOW_TURNS = int(os.getenv('CHAT_WINDOW_TURNS', 6))
+CHAT_COMPACT_TURNS = int(os.getenv('CHAT_COMPACT_TURNS', 4))
+# 召回的早期问答数及最低相似度
+CHAT_RECALL_TURNS = int(os.getenv('CHAT_RECALL_TURNS', 3))
+CHAT_RECALL_MIN_SCORE = float(os.getenv('CHAT_RECALL_MIN_SCORE', 0.3))
+# 各部分的 token 上限
+CHAT_EMAIL_MAX_TOKENS = int(os.getenv('CHAT_EMAIL_MAX_TOKENS', 1500))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', 400))
+CHAT_TURN_MAX_TOKENS = 300
+
+CHAT_TEMPLATE = register_template(PromptTemplate(
+    name='email-chat',
+    version=1,
+    system="""你是邮件助手，正在和用户讨论一封邮件。请根据邮件内容和之前的对话回答用户的问题，
+邮件中没有相关信息时直接说明。"""
+))
+
+CHAT_SUMMARY_TEMPLATE = register_template(PromptTemplate(
+    name='email-chat-summary',
+    version=1,
+    system=f"""你是对话记录助手。用户会给出已有的对话摘要和之后新增的几轮问答，
+请把新增内容合并进摘要，保留用户关心的问题、得到的结论以及提到的人名、金额、日期和待办事项，
+只返回更新后的摘要，不超过 {CHAT_SUMMARY_MAX_TOKENS} 字。""",
+    user="已有摘要：\n{summary}\n\n新增问答：\n{turns}"
+))
+
+
+def format_turn(turn: ChatHistory) -> str:
+    """问答的文本形式，用于摘要和召回"""
+    question = truncate_text(turn.question, CHAT_TURN_MAX_TOKENS)
+    answer = truncate_text(turn.answer, CHAT_TURN_MAX_TOKENS)
+    return f"用户：{question}\n助手：{answer}"
+
+
+class ChatSessionService:
+    """邮件对话会话服务类"""
+
+    def __init__(self, ai_service: BaseAIService, backend: Optional[BaseEmbeddingBackend] = None,
+                 window: int = CHAT_WINDOW_TURNS, compact_turns: int = CHAT_COMPACT_TURNS,
+                 recall: int = CHAT_RECALL_TURNS):
+        """初始化会话服务
+        Args:
+            ai_service: AI 服务实例，用于生成摘要
+            backend: 向量化后端，默认使用邮件检索的后端
+            window: 原文发送的最近问答轮数
+            compact_turns: 窗口外累计多少轮后合并一次摘要
+            recall: 召回的早期问答数
+        """
+        self.ai_service = ai_service
+        self.backend = backend
+        self.window = window
+        self.compact_turns = compact_turns
+        self.recall = recall
+
+    def _embed(self, texts: Sequence[str]) -> Optional[np.ndarray]:
+        """向量化文本，后端不可用时返回 None（召回降级为不召回）"""
+        try:
+            backend = self.backend or EmbeddingService.get_backend()
+            return backend.embed(list(texts))
+        except Exception as e:
+            logger.warning(f"对话向量化失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def get_session(user_id: int, email_id: int) -> ChatSession:
+        """获取会话，不存在时创建"""
+        session = ChatSession.query.filter_by(user_id=user_id, email_id=email_id).first()
+        if session is None:
+            session = ChatSession(user_id=user_id, email_id=email_id, summary='',
+                                  summarized_until=0, summarized_turns=0)
+            db.session.add(session)
+            db.session.commit()
+        return session
+
+    @staticmethod
+    def _turns(session: ChatSession) -> List[ChatHistory]:
+        return ChatHistory.query.filter_by(
+            user_id=session.user_id, email_id=session.email_id
+        ).order_by(ChatHistory.id).all()
+
+    def _recall(self, question: str, candidates: List[ChatHistory]) -> List[ChatHistory]:
+        """在窗口外的问答中召回与问题最相关的几轮，按时间顺序返回"""
+        candidates = [turn for turn in candidates if turn.embedding]
+        if not self.recall or not candidates:
+            return []
+        query = self._embed([question])
+        if query is None:
+            return []
+        matrix = np.asarray([turn.embedding for turn in candidates], dtype=np.float32)
+        if matrix.shape[1] != query.shape[1]:
+            # 向量化后端更换过，旧向量不可比较
+            return []
+        scores = matrix @ query[0]
+        top = [i for i in np.argsort(-scores)[:self.recall] if scores[i] >= CHAT_RECALL_MIN_SCORE]
+        return [candidates[i] for i in sorted(top)]
+
+    def build_context(self, session: ChatSession, email: Any, question: str) -> List[Dict[str, str]]:
+        """构建问题之前的消息：系统指令、邮件正文、摘要与召回、最近几轮问答
+        顺序由稳定到易变，同一会话的连续请求共享尽量长的前缀
+        Args:
+            session: 会话
+            email: 讨论的邮件
+            question: 用户问题（用于召回）
+        Returns:
+            List[Dict[str, str]]: 作为 prefix_messages 传给 AI 服务的消息列表
+        """
+        turns = self._turns(session)
+        window = turns[-self.window:] if self.window else []
+        older = turns[:len(turns) - len(window)]
+
+        email_text = truncate_text(get_email_text(email), CHAT_EMAIL_MAX_TOKENS)
+        messages = CHAT_TEMPLATE.prefix + [{
+            'role': 'system',
+            'content': f"邮件主题: {email.subject or ''}\n发件人: {email.from_email or ''}\n\n{email_text}"
+        }]
+
+        memory = []
+        if session.summary:
+            memory.append(f"之前对话的摘要：\n{session.summary}")
+        recalled = self._recall(question, older)
+        if recalled:
+            memory.append("与当前问题相关的早期对话：\n" + '\n\n'.join(format_turn(t) for t in recalled))
+        if memory:
+            messages.append({'role': 'system', 'content': '\n\n'.join(memory)})
+
+        for turn in window:
+            messages.append({'role': 'user', 'content': truncate_text(turn.question, CHAT_TURN_MAX_TOKENS)})
+            messages.append({'role': 'assistant', 'content': truncate_text(turn.answer, CHAT_TURN_MAX_TOKENS)})
+        return messages
+
+    def record_turn(self, session: ChatSession, question: str, answer: str) -> ChatHistory:
+        """保存一轮问答，窗口外积累足够多的问答时合并进摘要
+        Args:
+            session: 会话
+            question: 用户问题
+            answer: 模型回答
+        Returns:
+            ChatHistory: 保存的问答
+        """
+        turn = ChatHistory(user_id=session.user_id, email_id=session.email_id,
+                           question=question, answer=answer)
+        vectors = self._embed([f"{question}\n{answer}"])
+        if vectors is not None:
+            turn.embedding = [round(float(v), 6) for v in vectors[0]]
+        db.session.add(turn)
+        db.session.commit()
+        self.compact(session)
+        return turn
+
+    def compact(self, session: ChatSession, force: bool = False) -> int:
+        """将窗口外尚未合并的问答增量合并进摘要
+        每次只把新增的几轮与已有摘要一起发送，摘要请求的大小同样与对话长度无关
+        Args:
+            session: 会话
+            force: 是否不等积累到 compact_turns 轮就合并
+        Returns:
+            int: 本次合并的问答轮数
+        """
+        turns = [turn for turn in self._turns(session) if turn.id > (session.summarized_until or 0)]
+        overflow = turns[:max(len(turns) - self.window, 0)]
+        if not overflow or (len(overflow) < self.compact_turns and not force):
+            return 0
+
+        prompt = CHAT_SUMMARY_TEMPLATE.render(
+            summary=session.summary or '（无）',
+            turns='\n\n'.join(format_turn(turn) for turn in overflow)
+        )
+        try:
+            result = self.ai_service.chat(prompt, temperature=0, max_tokens=CHAT_SUMMARY_MAX_TOKENS * 2,
+                                          **CHAT_SUMMARY_TEMPLATE.options())
+        except Exception as e:
+            # 摘要失败不影响对话，未合并的问答仍可被召回，下次再合并
+            logger.warning(f"合并会话 {session.id} 的对话摘要失败: {str(e)}")
+            return 0
+
+        session.summary = truncate_text(result.get('response', '').strip(), CHAT_SUMMARY_MAX_TOKENS)
+        session.summarized_until = overflow[-1].id
+        session.summarized_turns = (session.summarized_turns or 0) + len(overflow)
+        db.session.commit()
+        logger.info(f"会话 {session.id} 合并 {len(overflow)} 轮问答进摘要，累计 {session.summarized_turns} 轮")
+        return len(overflow)
+
+    def history(self, session: ChatSession, limit: int = 50) -> Dict[str, Any]:
+        """会话的摘要与最近的问答"""
+        turns = ChatHistory.query.filter_by(
+            user_id=session.user_id, email_id=session.email_id
+        ).order_by(ChatHistory.id.desc()).limit(limit).all()
+        return dict(session.to_dict(), turns=[turn.to_dict() for turn in reversed(turns)])
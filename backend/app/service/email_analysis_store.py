@@ -0,0 +1,250 @@
+"""
+邮件分析结果存储模块
+用于：
+1. 按 邮件 + 分析器版本 + 模型 保存分析结果、token 用量和耗时
+2. 查看邮件分析时直接读取已保存的结果，不再重复调用 AI
+3. 定时任务只分析还没有当前版本结果的邮件
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import and_
+from ..db.database import db
+from ..models import Email, EmailAnalysis
+from ..utils.logger import get_logger
+from .email_analyzer import ANALYZER_VERSION, EmailAnalysisService
+from .email_classifier import get_local_classifier
+
+logger = get_logger(__name__)
+
+# 定时分析：执行间隔、每轮最多分析的邮件数、每批交给分析服务的邮件数
+ANALYSIS_INTERVAL_MINUTES = int(os.getenv('ANALYSIS_INTERVAL_MINUTES', 30))
+ANALYSIS_MAX_PER_RUN = int(os.getenv('ANALYSIS_MAX_PER_RUN', 200))
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', 40))
+
+
+class AnalysisStore:
+    """邮件分析结果存储服务类"""
+
+    @staticmethod
+    def get(email_id: int, model: str, version: str = ANALYZER_VERSION) -> Optional[EmailAnalysis]:
+        """获取邮件的当前版本分析结果
+        Args:
+            email_id: 邮件ID
+            model: 模型名称
+            version: 分析器版本
+        Returns:
+            Optional[EmailAnalysis]: 分析结果，未分析时返回 None
+        """
+        return EmailAnalysis.query.filter_by(
+            email_id=email_id, analyzer_version=version, model=model
+        ).first()
+
+    @staticmethod
+    def get_many(email_ids: Sequence[int], model: str,
+                 version: str = ANALYZER_VERSION) -> Dict[int, EmailAnalysis]:
+        """批量获取邮件的当前版本分析结果
+        Returns:
+            Dict[int, EmailAnalysis]: 邮件ID到分析结果的映射
+        """
+        if not email_ids:
+            return {}
+        analyses = EmailAnalysis.query.filter(
+            EmailAnalysis.email_id.in_(list(email_ids)),
+            EmailAnalysis.analyzer_version == version,
+            EmailAnalysis.model == model
+        ).all()
+        return {analysis.email_id: analysis for analysis in analyses}
+
+    @staticmethod
+    def latest(email_id: int, version: str = ANALYZER_VERSION) -> Optional[EmailAnalysis]:
+        """获取邮件最近一次的当前版本分析结果，不限模型"""
+        return EmailAnalysis.query.filter_by(email_id=email_id, analyzer_version=version) \
+            .order_by(EmailAnalysis.updated_at.desc(), EmailAnalysis.id.desc()) \
+            .first()
+
+    @staticmethod
+    def pending_emails(user_id: int, model: str, version: str = ANALYZER_VERSION,
+                       limit: Optional[int] = None) -> List[Email]:
+        """查找没有当前版本分析结果的邮件，新邮件优先
+        Args:
+            user_id: 用户ID
+            model: 模型名称
+            version: 分析器版本
+            limit: 最多返回的邮件数
+        Returns:
+            List[Email]: 待分析的邮件
+        """
+        query = Email.query.outerjoin(EmailAnalysis, and_(
+            EmailAnalysis.email_id == Email.id,
+            EmailAnalysis.analyzer_version == version,
+            EmailAnalysis.model == model
+        )).filter(Email.user_id == user_id, EmailAnalysis.id.is_(None)) \
+            .order_by(Email.received_at.desc(), Email.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+    @staticmethod
+    def save(email: Email, result: Dict[str, Any], model: str, version: str = ANALYZER_VERSION,
+             prompt_tokens: int = 0, completion_tokens: int = 0, latency_ms: int = 0) -> EmailAnalysis:
+        """写入或覆盖邮件的分析结果（不提交事务）
+        Args:
+            email: 邮件对象
+            result: EmailAnalysisService 返回的分析结果
+            model: 模型名称
+            version: 分析器版本
+            prompt_tokens: 输入 token 数
+            completion_tokens: 输出 token 数
+            latency_ms: 分析耗时（毫秒）
+        Returns:
+            EmailAnalysis: 分析结果
+        """
+        analysis = EmailAnalysis.query.filter_by(
+            email_id=email.id, analyzer_version=version, model=model
+        ).first()
+        if analysis is None:
+            analysis = EmailAnalysis(email_id=email.id, user_id=email.user_id,
+                                     analyzer_version=version, model=model)
+            db.session.add(analysis)
+        analysis.sentiment = result.get('sentiment')
+        analysis.priority = result.get('priority')
+        analysis.keywords = result.get('keywords') or []
+        analysis.categories = result.get('categories') or []
+        analysis.source = result.get('source')
+        analysis.prompt_tokens = prompt_tokens
+        analysis.completion_tokens = completion_tokens
+        analysis.latency_ms = latency_ms
+        return analysis
+
+    @classmethod
+    def analyze_emails(cls, emails: Sequence[Email], analyzer: EmailAnalysisService,
+                       force: bool = False) -> List[EmailAnalysis]:
+        """返回邮件的分析结果，只有没有当前版本结果的邮件才会交给分析服务
+        打包请求的 token 用量无法精确到单封邮件，按交给 AI 的邮件平均分摊；
+        耗时按本次分析的全部邮件平均分摊
+        Args:
+            emails: 邮件列表
+            analyzer: 邮件分析服务
+            force: 是否忽略已保存的结果重新分析
+        Returns:
+            List[EmailAnalysis]: 与输入顺序一致的分析结果
+        """
+        stored = {} if force else cls.get_many([e.id for e in emails], analyzer.model)
+        todo = [email for email in emails if email.id not in stored]
+        if not todo:
+            return [stored[email.id] for email in emails]
+
+        usage_before = dict(analyzer.usage)
+        start = time.perf_counter()
+        if len(todo) == 1:
+            results = [analyzer.analyze_email(todo[0])]
+        else:
+            results = analyzer.analyze_emails(todo)
+        latency_ms = int((time.perf_counter() - start) * 1000 / len(todo))
+
+        llm_count = sum(1 for result in results if result.get('source') == 'llm') or 1
+        prompt_tokens = (analyzer.usage['prompt_tokens'] - usage_before['prompt_tokens']) // llm_count
+        completion_tokens = (analyzer.usage['completion_tokens'] - usage_before['completion_tokens']) // llm_count
+        for email, result in zip(todo, results):
+            charged = result.get('source') == 'llm'
+            stored[email.id] = cls.save(
+                email, result, analyzer.model,
+                prompt_tokens=prompt_tokens if charged else 0,
+                completion_tokens=completion_tokens if charged else 0,
+                latency_ms=latency_ms
+            )
+        db.session.commit()
+        return [stored[email.id] for email in emails]
+
+    @classmethod
+    def analyze_email(cls, email: Email, analyzer: EmailAnalysisService,
+                      force: bool = False) -> EmailAnalysis:
+        """返回单封邮件的分析结果，已有当前版本结果时直接读取"""
+        return cls.analyze_emails([email], analyzer, force=force)[0]
+
+    @classmethod
+    def analyze_pending(cls, user_id: int, analyzer: EmailAnalysisService,
+                        limit: int = ANALYSIS_MAX_PER_RUN, batch_size: int = ANALYSIS_BATCH_SIZE) -> int:
+        """分析用户还没有当前版本结果的邮件
+        Args:
+            user_id: 用户ID
+            analyzer: 邮件分析服务
+            limit: 本轮最多分析的邮件数
+            batch_size: 每批邮件数
+        Returns:
+            int: 本轮分析的邮件数
+        """
+        emails = cls.pending_emails(user_id, analyzer.model, limit=limit)
+        for start in range(0, len(emails), batch_size):
+            cls.analyze_emails(emails[start:start + batch_size], analyzer, force=True)
+        if emails:
+            logger.info(f"用户 {user_id} 增量分析 {len(emails)} 封邮件，"
+                        f"AI 请求 {analyzer.usage['requests']} 次")
+        return len(emails)
+
+    @staticmethod
+    def list_analyses(user_id: int, model: Optional[str] = None, version: str = ANALYZER_VERSION,
+                      page: int = 1, per_page: int = 20) -> Dict[str, Any]:
+        """分页列出用户已保存的分析结果，按邮件接收时间降序
+        Args:
+            user_id: 用户ID
+            model: 模型名称，为空时不限
+            version: 分析器版本
+            page: 页码
+            per_page: 每页数量
+        Returns:
+            Dict[str, Any]: 分析结果列表和分页信息
+        """
+        query = EmailAnalysis.query.join(Email, EmailAnalysis.email_id == Email.id).filter(
+            EmailAnalysis.user_id == user_id, EmailAnalysis.analyzer_version == version
+        )
+        if model:
+            query = query.filter(EmailAnalysis.model == model)
+        total = query.count()
+        analyses = query.order_by(Email.received_at.desc(), EmailAnalysis.id.desc()) \
+            .offset((page - 1) * per_page) \
+            .limit(per_page) \
+            .all()
+        return {
+            'analyses': [analysis.to_dict() for analysis in analyses],
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'total_pages': (total + per_page - 1) // per_page
+        }
+
+
+def analyze_pending_task(user_id: int):
+    """定时分析任务执行函数
+    任务保存在数据库中，参数只有用户ID；调度器的执行器负责进入应用上下文。使用环境变量中的 DeepSeek 配置。
+    应用启用了分析任务队列时只提交低优先级的补分析任务，由队列工作线程执行；
+    与队列使用同一规则取得服务器密钥，没有可用密钥时不提交任务
+    Args:
+        user_id: 用户ID
+    """
+    from flask import current_app
+    from .ai.ai_service import AIServiceFactory, DEFAULT_PROVIDER
+    from .ai.usage import get_usage_ledger, usage_context
+    from .analysis_queue import server_api_key
+
+    api_key = server_api_key(current_app, interactive=False)
+    if not api_key:
+        logger.warning(f"没有可用于定时分析的服务器密钥（DEEPSEEK_API_KEY），跳过用户 {user_id} 的定时分析")
+        return
+
+    model = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+    try:
+        queue = current_app.extensions.get('analysis_queue')
+        if queue is not None:
+            queue.enqueue_backfill(user_id, model)
+            return
+        if not get_usage_ledger().check_budget(user_id, model).allowed:
+            logger.info(f"用户 {user_id} 今日 AI 用量已达上限，跳过定时分析")
+            return
+        ai_service = AIServiceFactory.create_service(DEFAULT_PROVIDER, api_key=api_key, model=model)
+        analyzer = EmailAnalysisService(ai_service, classifier=get_local_classifier())
+        with usage_context(user_id=user_id, feature='email_analysis'):
+            AnalysisStore.analyze_pending(user_id, analyzer)
+    except Exception as e:
+        logger.error(f"定时分析任务执行失败: {str(e)}")
@@ -5,10 +5,21 @@
 2. 提取纯文本
 3. 格式化元数据
 """
-from typing import List, Dict, Any
+from collections import Counter
+from typing import List, Dict, Any, Optional
 from bs4 import BeautifulSoup
 from ..utils.logger import get_logger
+from ..utils.text import get_email_text
 from ..models import Email
+from .email_dedup import DedupService
+from .email_topics import TopicService
+from .email_classifier import LocalClassifier
+from .ai.base_ai_service import BaseAIService
+from .ai.chunking import TokenBudget, truncate_text
+from .ai.prompts import PromptTemplate, register_template
+from .ai.structured import (
+    OutputSchema, SchemaField, repair_fields, repair_json, structured_options
+)
 
 logger = get_logger(__name__)
 
@@ -171,32 +182,341 @@ class EmailAnalyzer:
         return results
 
 
+# 分析提示模板：指令和示例是所有请求共享的固定前缀，邮件内容只出现在最后一条用户消息，
+# 同类邮件的请求因此能命中上游的上下文缓存
+ANALYSIS_FIELDS = """- sentiment: positive / neutral / negative 之一
+- keywords: 不超过 5 个关键词的数组
+- categories: 邮件分类的数组，例如 工作、通知、推广、账单、社交
+- priority: high / normal / low 之一"""
+
+ANALYSIS_EXAMPLE_BILL = """发件人: billing@cloud.example.com
+您的 3 月云服务账单为 ¥1,280.00，请在 4 月 15 日前完成支付，逾期将暂停服务。"""
+ANALYSIS_EXAMPLE_PROMO = """发件人: news@shop.example.com
+周末大促！全场商品低至 5 折，会员再享 9 折，活动截止本周日。"""
+
+ANALYSIS_TEMPLATE = register_template(PromptTemplate(
+    name='email-analysis',
+    version=2,
+    system=f"""你是邮件分析助手。请分析用户给出的邮件内容，只返回一个 JSON 对象，不要输出其他内容。
+JSON 字段：
+{ANALYSIS_FIELDS}
+长邮件会分块发送，并注明是第几部分，只需分析给出的部分。""",
+    examples=[
+        (f"邮件内容：\n{ANALYSIS_EXAMPLE_BILL}",
+         '{"sentiment": "neutral", "keywords": ["账单", "云服务", "支付", "暂停服务"], '
+         '"categories": ["账单"], "priority": "high"}'),
+        (f"邮件内容：\n{ANALYSIS_EXAMPLE_PROMO}",
+         '{"sentiment": "positive", "keywords": ["大促", "折扣", "会员"], '
+         '"categories": ["推广"], "priority": "low"}'),
+    ],
+    user="{part_hint}邮件内容：\n{content}"
+))
+
+BATCH_ANALYSIS_TEMPLATE = register_template(PromptTemplate(
+    name='email-batch-analysis',
+    version=3,
+    system=f"""你是邮件分析助手。用户会给出多封邮件的摘要，每封以 [id=编号] 开头。请逐封分析，
+只返回一个 JSON 数组，不要输出其他内容。数组中每个元素对应一封邮件，字段：
+- id: 邮件编号（整数，与输入一致）
+{ANALYSIS_FIELDS}
+摘要后注明“只需字段”的邮件，只返回 id 和列出的字段。""",
+    examples=[
+        (f"[id=1] {ANALYSIS_EXAMPLE_BILL}\n\n[id=2] {ANALYSIS_EXAMPLE_PROMO}",
+         '[{"id": 1, "sentiment": "neutral", "keywords": ["账单", "云服务", "支付"], '
+         '"categories": ["账单"], "priority": "high"}, '
+         '{"id": 2, "sentiment": "positive", "keywords": ["大促", "折扣"], '
+         '"categories": ["推广"], "priority": "low"}]'),
+    ],
+    user="{digests}"
+))
+
+# 打包分析的参数：每封邮件摘要的 token 上限、每项预计输出、每批最多邮件数
+DIGEST_MAX_TOKENS = 300
+BATCH_OUTPUT_TOKENS_PER_ITEM = 80
+MAX_BATCH_ITEMS = 40
+
+# 分析器版本：修改提示模板、结果解析或预分类规则时递增，已保存的旧版本结果会重新分析
+ANALYZER_VERSION = 'analyzer-v3'
+
+PRIORITY_ORDER = {'low': 0, 'normal': 1, 'high': 2}
+SENTIMENTS = ('positive', 'neutral', 'negative')
+
+ANALYSIS_SCHEMA = OutputSchema([
+    SchemaField('sentiment', enum=SENTIMENTS),
+    SchemaField('keywords', type='array', max_items=5, description='不超过 5 个关键词的数组'),
+    SchemaField('categories', type='array', description='邮件分类的数组，例如 工作、通知、推广、账单、社交'),
+    SchemaField('priority', enum=tuple(PRIORITY_ORDER)),
+])
+
+
 class EmailAnalysisService:
     """邮件分析服务类"""
 
-    def __init__(self):
-        """初始化邮件分析服务"""
-        pass
+    DEFAULT_RESULT = {
+        "sentiment": "neutral",
+        "keywords": [],
+        "categories": [],
+        "priority": "normal"
+    }
+
+    def __init__(self, ai_service: Optional[BaseAIService] = None,
+                 budget: Optional[TokenBudget] = None,
+                 classifier: Optional[LocalClassifier] = None):
+        """初始化邮件分析服务
+        Args:
+            ai_service: AI 服务实例，为空时返回默认分析结果
+            budget: token 预算，默认按 AI 服务的模型确定
+            classifier: 本地预分类器，能确定的邮件不再交给 AI
+        """
+        self.ai_service = ai_service
+        self.classifier = classifier
+        self.model = getattr(ai_service, 'model', None) or 'none'
+        # 实际发给模型的请求数和 token 用量，命中响应缓存的请求不计入
+        self.usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        if budget is None:
+            model = getattr(ai_service, 'model', '')
+            budget = TokenBudget.for_model(model, max_output_tokens=512,
+                                           prompt_overhead=ANALYSIS_TEMPLATE.prefix_tokens + 32)
+        self.budget = budget
+        self.batch_budget = TokenBudget.for_model(
+            getattr(ai_service, 'model', ''),
+            max_output_tokens=4096,
+            prompt_overhead=BATCH_ANALYSIS_TEMPLATE.prefix_tokens
+        )
 
     def analyze_email(self, email: Email) -> Dict[str, Any]:
         """分析邮件内容
+        超出上下文预算的长邮件按段落切块分别分析，再合并结果
         Args:
             email: 邮件对象
         Returns:
             Dict[str, Any]: 分析结果
         """
         try:
-            # TODO: 实现邮件分析逻辑
-            return {
-                "sentiment": "neutral",
-                "keywords": [],
-                "categories": [],
-                "priority": "normal"
-            }
+            local = self.classifier.classify(email) if self.classifier else None
+            if local:
+                return self._apply_topic(email, dict(local, source='local'))
+            if not self.ai_service:
+                return self._apply_topic(email, dict(self.DEFAULT_RESULT, source='default'))
+
+            result = self._analyze_with_llm(email)
+            if self.classifier:
+                self.classifier.record(email, result)
+            return self._apply_topic(email, dict(result, source='llm'))
         except Exception as e:
             logger.error(f"分析邮件失败: {str(e)}")
             raise
 
+    def _analyze_with_llm(self, email: Email) -> Dict[str, Any]:
+        """调用 AI 分析单封邮件，长邮件分块后合并"""
+        prompts = self._build_prompts(email)
+        if len(prompts) > 1:
+            logger.info(f"长邮件 {email.id} 切分为 {len(prompts)} 块分析")
+        responses = self._chat_many(prompts, json_mode=True)
+        return self._merge_results([self._parse_result(p, r) for p, r in zip(prompts, responses)])
+
+    def _build_prompts(self, email: Email) -> List[str]:
+        """构建邮件的分析提示（模板的动态部分），长邮件每块一个提示
+        Args:
+            email: 邮件对象
+        Returns:
+            List[str]: 提示列表
+        """
+        chunks = self.budget.split(get_email_text(email)) or ['']
+        prompts = []
+        for i, chunk in enumerate(chunks):
+            part_hint = f"（这是一封长邮件的第 {i + 1}/{len(chunks)} 部分）\n" if len(chunks) > 1 else ''
+            prompts.append(ANALYSIS_TEMPLATE.render(part_hint=part_hint, content=chunk))
+        return prompts
+
+    def _chat_many(self, prompts: List[str], max_tokens: Optional[int] = None,
+                   template: PromptTemplate = ANALYSIS_TEMPLATE, json_mode: bool = False) -> List[str]:
+        """发送多个分析请求
+        AI 服务支持 batch_chat（如 AsyncDeepSeekService）时并发发送，否则逐个发送
+        Args:
+            prompts: 提示列表（模板的动态部分）
+            max_tokens: 每个请求的最大输出 token 数
+            template: 提示模板，提供固定前缀和版本
+            json_mode: 是否请求 JSON 模式（要求输出为 JSON 对象）
+        Returns:
+            List[str]: 模型返回的文本，失败的请求为空字符串
+        """
+        options = {
+            'temperature': 0,
+            'max_tokens': max_tokens or self.budget.max_output_tokens,
+            **template.options()
+        }
+        if json_mode:
+            options = structured_options(options)
+        if len(prompts) > 1 and hasattr(self.ai_service, 'batch_chat'):
+            responses = self.ai_service.batch_chat(prompts, **options)
+        else:
+            responses = [self.ai_service.chat(prompt, **options) for prompt in prompts]
+
+        texts = []
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.warning(f"分析请求失败: {str(response)}")
+                texts.append('')
+            else:
+                self._record_usage(response)
+                texts.append(response.get('response', ''))
+        return texts
+
+    def _record_usage(self, response: Dict[str, Any]):
+        """累计模型请求的 token 用量"""
+        if response.get('cached'):
+            return
+        usage = response.get('usage') or {}
+        self.usage['requests'] += 1
+        self.usage['prompt_tokens'] += usage.get('prompt_tokens', 0)
+        self.usage['completion_tokens'] += usage.get('completion_tokens', 0)
+
+    def _parse_result(self, prompt: str, text: str) -> Dict[str, Any]:
+        """解析并校验模型返回的 JSON 结果
+        语法问题在本地修复；缺失或不合法的字段只针对这些字段发送一次简短的修复请求
+        Args:
+            prompt: 请求的用户消息
+            text: 模型返回的文本
+        Returns:
+            Dict[str, Any]: 分析结果，修复后仍不合法的字段取默认值
+        """
+        values, invalid = ANALYSIS_SCHEMA.parse(text)
+        if invalid:
+            logger.warning(f"分析结果字段不合法: {', '.join(invalid)}")
+            repaired, invalid = repair_fields(
+                self.ai_service, ANALYSIS_SCHEMA, ANALYSIS_TEMPLATE, prompt, text, invalid,
+                temperature=0
+            )
+            values.update(repaired)
+        return {key: values.get(key, default) for key, default in self.DEFAULT_RESULT.items()}
+
+    def _build_digest(self, email: Email) -> str:
+        """构建打包分析用的邮件摘要
+        Args:
+            email: 邮件对象
+        Returns:
+            str: 以 [id=编号] 开头的紧凑摘要
+        """
+        text = truncate_text(get_email_text(email), DIGEST_MAX_TOKENS)
+        return f"[id={email.id}] 发件人: {email.from_email or ''}\n{text}"
+
+    def _parse_batch_result(self, text: str) -> Dict[int, Dict[str, Any]]:
+        """解析打包分析返回的 JSON 数组，按邮件ID映射
+        Args:
+            text: 模型返回的文本
+        Returns:
+            Dict[int, Dict[str, Any]]: 邮件ID到校验通过字段的映射
+        """
+        items = repair_json(text, '[')
+        results = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            try:
+                email_id = int(item.get('id'))
+            except (TypeError, ValueError):
+                continue
+            values, _ = ANALYSIS_SCHEMA.validate(item)
+            if values:
+                results[email_id] = values
+        return results
+
+    def _analyze_packed(self, emails: List[Email], max_rounds: int = 2) -> List[Dict[str, Any]]:
+        """打包分析：每个请求放入多封邮件摘要
+        每批邮件数按 token 预算自适应；结果按ID映射回邮件，
+        缺失的邮件重新打包重试，部分字段不合法的邮件重试时只要求这些字段，仍失败的逐封单独分析
+        Args:
+            emails: 邮件列表（ID 需唯一）
+            max_rounds: 打包请求的最大轮数
+        Returns:
+            List[Dict[str, Any]]: 与输入顺序一致的分析结果
+        """
+        digests = {email.id: self._build_digest(email) for email in emails}
+        fields = list(ANALYSIS_SCHEMA.fields)
+        partial: Dict[int, Dict[str, Any]] = {email.id: {} for email in emails}
+        pending = [email.id for email in emails]
+
+        def digest(email_id: int) -> str:
+            missing = [name for name in fields if name not in partial[email_id]]
+            if len(missing) < len(fields):
+                return f"{digests[email_id]}\n（只需字段: {', '.join(missing)}）"
+            return digests[email_id]
+
+        for round_no in range(max_rounds):
+            if not pending:
+                break
+            texts = [digest(email_id) for email_id in pending]
+            batches = self.batch_budget.plan_batches(
+                texts,
+                output_tokens_per_item=BATCH_OUTPUT_TOKENS_PER_ITEM,
+                max_items=MAX_BATCH_ITEMS
+            )
+            batch_ids = [[pending[i] for i in batch] for batch in batches]
+            prompts = [
+                BATCH_ANALYSIS_TEMPLATE.render(digests='\n\n'.join(texts[i] for i in batch))
+                for batch in batches
+            ]
+            responses = self._chat_many(
+                prompts,
+                max_tokens=self.batch_budget.max_output_tokens,
+                template=BATCH_ANALYSIS_TEMPLATE
+            )
+            for ids, text in zip(batch_ids, responses):
+                parsed = self._parse_batch_result(text)
+                for email_id in ids:
+                    # 已通过校验的字段保留，不被后续回答覆盖
+                    partial[email_id] = dict(parsed.get(email_id, {}), **partial[email_id])
+
+            pending = [email_id for email_id in pending if len(partial[email_id]) < len(fields)]
+            logger.info(f"第 {round_no + 1} 轮打包分析: {len(batches)} 个请求，"
+                        f"{len(pending)} 封邮件待重试")
+
+        # 多轮打包后完全没有结果的邮件逐封分析，只缺部分字段的取默认值
+        by_id = {email.id: email for email in emails}
+        results: Dict[int, Dict[str, Any]] = {}
+        for email in emails:
+            if email.id in pending and not partial[email.id]:
+                results[email.id] = self._analyze_with_llm(by_id[email.id])
+            else:
+                results[email.id] = {key: partial[email.id].get(key, default)
+                                     for key, default in self.DEFAULT_RESULT.items()}
+        return [results[email.id] for email in emails]
+
+    def _apply_topic(self, email: Email, result: Dict[str, Any]) -> Dict[str, Any]:
+        """将邮件所属主题的名称作为首个分类
+        Args:
+            email: 邮件对象
+            result: 分析结果
+        Returns:
+            Dict[str, Any]: 补充分类后的结果
+        """
+        label = TopicService.topic_label(email)
+        if label:
+            result['categories'] = [label] + [c for c in result['categories'] if c != label]
+        return result
+
+    def _merge_results(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并多个分块的分析结果
+        Args:
+            results: 分块结果列表
+        Returns:
+            Dict[str, Any]: 合并后的结果
+        """
+        if len(results) == 1:
+            return results[0]
+
+        keywords = Counter(k for r in results for k in r['keywords'])
+        categories = list(dict.fromkeys(c for r in results for c in r['categories']))
+        sentiments = Counter(r['sentiment'] for r in results)
+        priority = max((r['priority'] for r in results), key=lambda p: PRIORITY_ORDER.get(p, 1))
+        return {
+            "sentiment": sentiments.most_common(1)[0][0],
+            "keywords": [k for k, _ in keywords.most_common(5)],
+            "categories": categories,
+            "priority": priority
+        }
+
     def analyze_emails(self, emails: List[Email]) -> List[Dict[str, Any]]:
         """批量分析邮件
         Args:
@@ -205,7 +525,44 @@ class EmailAnalysisService:
             List[Dict[str, Any]]: 分析结果列表
         """
         try:
-            return [self.analyze_email(email) for email in emails]
+            # 近似重复的邮件归为一簇，每簇只分析一次，结果分发给簇内所有成员
+            clusters: Dict[int, List[int]] = {}
+            for position, email in enumerate(emails):
+                cluster_id = DedupService.cluster_of(email) if email.id else None
+                key = cluster_id if cluster_id is not None else -(position + 1)
+                clusters.setdefault(key, []).append(position)
+
+            groups = list(clusters.values())
+            representatives = [emails[g[0]] for g in groups]
+            group_results: List[Optional[Dict[str, Any]]] = [
+                self.classifier.classify(e) if self.classifier else None for e in representatives
+            ]
+            remote = [i for i, result in enumerate(group_results) if result is None]
+            remote_emails = [representatives[i] for i in remote]
+            sources = ['local'] * len(groups)
+            if not self.ai_service:
+                remote_results = [dict(self.DEFAULT_RESULT) for _ in remote]
+            elif len(remote_emails) > 1 and all(e.id for e in remote_emails):
+                # 多封邮件打包到少量请求中
+                remote_results = self._analyze_packed(remote_emails)
+            else:
+                remote_results = [self._analyze_with_llm(e) for e in remote_emails]
+            for i, result in zip(remote, remote_results):
+                group_results[i] = result
+                sources[i] = 'llm' if self.ai_service else 'default'
+                if self.classifier and self.ai_service:
+                    self.classifier.record(representatives[i], result)
+            if self.classifier and len(remote) < len(groups):
+                logger.info(f"本地预分类: {len(groups) - len(remote)}/{len(groups)} 封邮件无需 AI 分析")
+
+            results: List[Dict[str, Any]] = [{} for _ in emails]
+            for positions, result, source in zip(groups, group_results, sources):
+                for position in positions:
+                    results[position] = self._apply_topic(emails[position], dict(result, source=source))
+
+            if len(clusters) < len(emails):
+                logger.info(f"近似重复合并: {len(emails)} 封邮件只需分析 {len(clusters)} 次")
+            return results
         except Exception as e:
             logger.error(f"批量分析邮件失败: {str(e)}")
             raise
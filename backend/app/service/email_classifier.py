@@ -0,0 +1,497 @@
+"""
+本地邮件预分类模块
+用于：
+1. 根据邮件头（List-Unsubscribe、Precedence 等）、Gmail 分类标签和已知发件人识别推广/通知/社交邮件
+2. 用历史 AI 分析结果训练特征哈希线性模型，样本文件有条数上限，由定时任务压缩样本并重新训练
+3. 只有规则和模型都无法确信的邮件才交给 AI 分析
+4. 离线评估不同置信度阈值下的覆盖率与准确率
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from ..utils.logger import get_logger
+from ..utils.text import get_email_text
+
+logger = get_logger(__name__)
+
+_INSTANCE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'instance'
+)
+CLASSIFIER_ENABLED = os.getenv('CLASSIFIER_ENABLED', 'true').lower() == 'true'
+CLASSIFIER_MODEL_PATH = os.getenv('CLASSIFIER_MODEL_PATH', os.path.join(_INSTANCE_DIR, 'classifier.npz'))
+CLASSIFIER_SAMPLES_PATH = os.getenv('CLASSIFIER_SAMPLES_PATH', os.path.join(_INSTANCE_DIR, 'classifier_samples.jsonl'))
+CLASSIFIER_THRESHOLD = float(os.getenv('CLASSIFIER_THRESHOLD', 0.9))
+# 定时任务检查时，积累到该数量的新样本才重新训练
+CLASSIFIER_RETRAIN_EVERY = int(os.getenv('CLASSIFIER_RETRAIN_EVERY', 500))
+CLASSIFIER_RETRAIN_MINUTES = int(os.getenv('CLASSIFIER_RETRAIN_MINUTES', 60))
+# 样本文件保留的最多样本数（每封邮件一条，保留最新的），0 表示不限
+CLASSIFIER_MAX_SAMPLES = int(os.getenv('CLASSIFIER_MAX_SAMPLES', 20000))
+
+# 同步时保存的邮件头（小写）
+CAPTURED_HEADERS = (
+    'list-unsubscribe', 'list-id', 'precedence', 'auto-submitted',
+    'x-auto-response-suppress', 'x-campaign', 'x-mailer'
+)
+
+# 可在本地判定的类别；OTHER 表示需要交给 AI
+PROMOTION = '推广'
+NOTIFICATION = '通知'
+SOCIAL = '社交'
+OTHER = 'other'
+CLASSES = (PROMOTION, NOTIFICATION, SOCIAL, OTHER)
+
+_GMAIL_CATEGORY_LABELS = {
+    'CATEGORY_PROMOTIONS': PROMOTION,
+    'CATEGORY_SOCIAL': SOCIAL,
+    'CATEGORY_UPDATES': NOTIFICATION,
+    'CATEGORY_FORUMS': NOTIFICATION,
+}
+KNOWN_SENDER_DOMAINS = {
+    'facebookmail.com': SOCIAL,
+    'linkedin.com': SOCIAL,
+    'twitter.com': SOCIAL,
+    'x.com': SOCIAL,
+    'instagram.com': SOCIAL,
+    'github.com': NOTIFICATION,
+    'gitlab.com': NOTIFICATION,
+    'atlassian.net': NOTIFICATION,
+    'slack.com': NOTIFICATION,
+    'accounts.google.com': NOTIFICATION,
+    'mailchimp.com': PROMOTION,
+    'sendgrid.net': PROMOTION,
+}
+_NO_REPLY_RE = re.compile(r'^(no-?reply|do-?not-?reply|notifications?|notify|alerts?|mailer-daemon)([+.\-_]|$)')
+_SENDER_RE = re.compile(r'<?([^<>\s@]+)@([^<>\s]+?)>?$')
+_WORD_RE = re.compile(r'[a-z0-9]+|[一-鿿]')
+_PROMOTION_CATEGORIES = ('推广', '广告', '营销', '促销', '优惠')
+_SOCIAL_CATEGORIES = ('社交',)
+_NOTIFICATION_CATEGORIES = ('通知', '系统通知', '订阅', '提醒')
+
+N_FEATURES = 2 ** 18
+BODY_FEATURE_WORDS = 300
+
+
+def parse_sender(sender: str) -> Tuple[str, str]:
+    """拆分发件人地址
+    :param sender: From 头，例如 "Name <user@example.com>"
+    :return: (用户名, 域名)，均为小写
+    """
+    match = _SENDER_RE.search((sender or '').strip().lower())
+    return (match.group(1), match.group(2)) if match else ('', '')
+
+
+def header_rules(email: Any) -> Optional[str]:
+    """根据邮件头、Gmail 分类标签和已知发件人判定类别
+    :param email: 邮件对象
+    :return: 可确定的类别，无法判断时返回 None
+    """
+    headers = getattr(email, 'headers', None) or {}
+    labels = getattr(email, 'labels', None) or []
+    if 'IMPORTANT' in labels or 'STARRED' in labels:
+        return None
+
+    for label in labels:
+        if label in _GMAIL_CATEGORY_LABELS:
+            return _GMAIL_CATEGORY_LABELS[label]
+
+    local, domain = parse_sender(getattr(email, 'from_email', ''))
+    for known, category in KNOWN_SENDER_DOMAINS.items():
+        if domain == known or domain.endswith('.' + known):
+            return category
+
+    precedence = headers.get('precedence', '').lower()
+    if headers.get('list-unsubscribe') and (precedence in ('bulk', 'list') or headers.get('x-campaign')):
+        return PROMOTION
+    auto_submitted = headers.get('auto-submitted', '').lower()
+    if (auto_submitted and auto_submitted != 'no') or precedence == 'junk':
+        return NOTIFICATION
+    if _NO_REPLY_RE.match(local):
+        return NOTIFICATION
+    return None
+
+
+def label_from_result(result: Dict[str, Any]) -> str:
+    """将 AI 分析结果映射为预分类的训练标签
+    高优先级或不属于可本地处理类别的邮件标为 OTHER
+    """
+    if result.get('priority') == 'high':
+        return OTHER
+    categories = [str(c) for c in result.get('categories') or []]
+    for category in categories:
+        if category in _PROMOTION_CATEGORIES:
+            return PROMOTION
+        if category in _SOCIAL_CATEGORIES:
+            return SOCIAL
+        if category in _NOTIFICATION_CATEGORIES:
+            return NOTIFICATION
+    return OTHER
+
+
+def extract_features(email: Any) -> List[str]:
+    """提取用于线性模型的离散特征"""
+    local, domain = parse_sender(getattr(email, 'from_email', ''))
+    features = [f"d:{domain}", f"u:{local}"]
+    if _NO_REPLY_RE.match(local):
+        features.append('u:noreply')
+    features.extend(f"h:{name}" for name in (getattr(email, 'headers', None) or {}))
+    features.extend(f"l:{label}" for label in (getattr(email, 'labels', None) or []))
+    features.extend(f"s:{w}" for w in _WORD_RE.findall((getattr(email, 'subject', '') or '').lower()))
+    body_words = _WORD_RE.findall(get_email_text(email).lower())[:BODY_FEATURE_WORDS]
+    features.extend(f"b:{w}" for w in set(body_words))
+    return features
+
+
+def hash_features(features: Sequence[str], n_features: int = N_FEATURES) -> List[int]:
+    """将特征哈希为去重后的下标"""
+    return sorted({
+        int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'little') % n_features
+        for f in features
+    })
+
+
+class HashedLinearModel:
+    """特征哈希多分类逻辑回归（SGD 训练，纯 NumPy）"""
+
+    def __init__(self, classes: Sequence[str] = CLASSES, n_features: int = N_FEATURES):
+        """初始化模型
+        Args:
+            classes: 类别列表
+            n_features: 哈希空间大小
+        """
+        self.classes = list(classes)
+        self.n_features = n_features
+        self.weights = np.zeros((len(self.classes), n_features), dtype=np.float32)
+        self.bias = np.zeros(len(self.classes), dtype=np.float32)
+
+    def _logits(self, indices: Sequence[int]) -> np.ndarray:
+        scale = 1.0 / np.sqrt(max(len(indices), 1))
+        return self.weights[:, indices].sum(axis=1) * scale + self.bias
+
+    def predict_proba(self, indices: Sequence[int]) -> np.ndarray:
+        """计算各类别的概率"""
+        logits = self._logits(indices)
+        logits -= logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def predict(self, indices: Sequence[int]) -> Tuple[str, float]:
+        """预测类别
+        Returns:
+            Tuple[str, float]: (类别, 概率)
+        """
+        proba = self.predict_proba(indices)
+        best = int(np.argmax(proba))
+        return self.classes[best], float(proba[best])
+
+    def fit(self, samples: Sequence[Tuple[List[int], str]], epochs: int = 8,
+            learning_rate: float = 0.5, l2: float = 1e-6, seed: int = 0) -> 'HashedLinearModel':
+        """训练模型
+        Args:
+            samples: (特征下标, 标签) 列表
+            epochs: 训练轮数
+            learning_rate: 初始学习率
+            l2: L2 正则系数
+            seed: 随机种子
+        """
+        rng = np.random.default_rng(seed)
+        targets = [self.classes.index(label) for _, label in samples]
+        for epoch in range(epochs):
+            rate = learning_rate / (1 + epoch)
+            for i in rng.permutation(len(samples)):
+                indices = samples[i][0]
+                if not indices:
+                    continue
+                gradient = self.predict_proba(indices)
+                gradient[targets[i]] -= 1.0
+                scale = 1.0 / np.sqrt(len(indices))
+                self.weights[:, indices] *= (1 - rate * l2)
+                self.weights[:, indices] -= rate * scale * gradient[:, None]
+                self.bias -= rate * gradient
+        return self
+
+    def save(self, path: str):
+        """保存模型"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez_compressed(tmp_path, weights=self.weights, bias=self.bias, classes=np.array(self.classes))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'HashedLinearModel':
+        """加载模型"""
+        with np.load(path) as data:
+            model = cls(data['classes'].tolist(), data['weights'].shape[1])
+            model.weights = data['weights']
+            model.bias = data['bias']
+        return model
+
+
+def evaluate(model: HashedLinearModel, samples: Sequence[Tuple[List[int], str]],
+             thresholds: Sequence[float] = (0.6, 0.7, 0.8, 0.9, 0.95)) -> List[Dict[str, float]]:
+    """评估不同置信度阈值下的效果
+    Args:
+        model: 已训练的模型
+        samples: 留出的 (特征下标, 标签) 样本
+        thresholds: 置信度阈值
+    Returns:
+        List[Dict[str, float]]: 每个阈值的本地处理比例（即减少的 AI 请求比例）、
+            本地判定的准确率，以及被本地误处理的需 AI 邮件比例
+    """
+    predictions = [model.predict(indices) for indices, _ in samples]
+    needs_llm = sum(1 for _, label in samples if label == OTHER)
+    report = []
+    for threshold in thresholds:
+        local = [(pred, label) for (pred, proba), (_, label) in zip(predictions, samples)
+                 if pred != OTHER and proba >= threshold]
+        correct = sum(1 for pred, label in local if pred == label)
+        missed = sum(1 for _, label in local if label == OTHER)
+        report.append({
+            'threshold': threshold,
+            'coverage': round(len(local) / len(samples), 4) if samples else 0.0,
+            'precision': round(correct / len(local), 4) if local else 0.0,
+            'missed_rate': round(missed / needs_llm, 4) if needs_llm else 0.0
+        })
+    return report
+
+
+class LocalClassifier:
+    """本地预分类器
+
+    先用邮件头规则判定，再用线性模型判定；置信度不足的邮件交给 AI。
+    AI 的分析结果作为样本追加到样本文件，分析过程中不训练；
+    定时任务 retrain_classifier_task 在积累足够的新样本后压缩样本文件并重新训练。
+    """
+
+    def __init__(self, model_path: str = CLASSIFIER_MODEL_PATH,
+                 samples_path: str = CLASSIFIER_SAMPLES_PATH,
+                 threshold: float = CLASSIFIER_THRESHOLD,
+                 retrain_every: int = CLASSIFIER_RETRAIN_EVERY,
+                 max_samples: int = CLASSIFIER_MAX_SAMPLES):
+        """初始化预分类器
+        Args:
+            model_path: 模型文件路径
+            samples_path: 训练样本文件路径（JSON Lines）
+            threshold: 模型判定的最低置信度
+            retrain_every: 新增多少样本后由定时任务重新训练，0 表示不自动训练
+            max_samples: 样本文件保留的最多样本数，0 表示不限
+        """
+        self.model_path = model_path
+        self.samples_path = samples_path
+        self.threshold = threshold
+        self.retrain_every = retrain_every
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._new_samples = 0
+        self._lines: Optional[int] = None
+        self.stats = {'rules': 0, 'model': 0, 'llm': 0}
+        self.model: Optional[HashedLinearModel] = None
+        if os.path.exists(model_path):
+            try:
+                self.model = HashedLinearModel.load(model_path)
+            except Exception as e:
+                logger.warning(f"加载预分类模型失败: {str(e)}")
+
+    def predict(self, email: Any) -> Tuple[str, float, str]:
+        """预测邮件类别
+        Returns:
+            Tuple[str, float, str]: (类别, 置信度, 来源 rules/model/none)
+        """
+        category = header_rules(email)
+        if category:
+            return category, 1.0, 'rules'
+        if self.model is None:
+            return OTHER, 0.0, 'none'
+        category, confidence = self.model.predict(hash_features(extract_features(email)))
+        return category, confidence, 'model'
+
+    def classify(self, email: Any) -> Optional[Dict[str, Any]]:
+        """尝试在本地给出分析结果
+        Args:
+            email: 邮件对象
+        Returns:
+            Optional[Dict[str, Any]]: 本地分析结果；需要交给 AI 时返回 None
+        """
+        category, confidence, source = self.predict(email)
+        if category == OTHER or confidence < self.threshold:
+            self._count('llm')
+            return None
+        self._count(source)
+        return {
+            "sentiment": "neutral",
+            "keywords": [],
+            "categories": [category],
+            "priority": "low"
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def record(self, email: Any, result: Dict[str, Any]):
+        """记录 AI 分析结果作为训练样本"""
+        sample = {
+            'email_id': getattr(email, 'id', None),
+            'features': hash_features(extract_features(email)),
+            'label': label_from_result(result)
+        }
+        with self._lock:
+            if self._lines is None:
+                self._lines = self._count_lines()
+            os.makedirs(os.path.dirname(os.path.abspath(self.samples_path)), exist_ok=True)
+            with open(self.samples_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(sample) + '\n')
+            self._new_samples += 1
+            self._lines += 1
+            if self.max_samples and self._lines > 2 * self.max_samples:
+                # 定时任务没有运行时的兜底：样本文件超过上限两倍时就地压缩
+                self._compact_locked()
+
+    def _count_lines(self) -> int:
+        """样本文件的行数"""
+        if not os.path.exists(self.samples_path):
+            return 0
+        with open(self.samples_path, 'r', encoding='utf-8') as f:
+            return sum(1 for line in f if line.strip())
+
+    def _read_samples(self) -> List[Dict[str, Any]]:
+        """读取样本文件，同一封邮件只保留最后一条，按最后写入的顺序排列"""
+        if not os.path.exists(self.samples_path):
+            return []
+        samples: Dict[Any, Dict[str, Any]] = {}
+        with open(self.samples_path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f):
+                if not line.strip():
+                    continue
+                sample = json.loads(line)
+                key = sample.get('email_id') or f"line-{number}"
+                samples.pop(key, None)
+                samples[key] = sample
+        return list(samples.values())
+
+    def _compact_locked(self) -> List[Dict[str, Any]]:
+        """去掉重复样本并只保留最新的 max_samples 条，原子替换样本文件（需持有锁）
+        Returns:
+            List[Dict[str, Any]]: 保留的样本
+        """
+        samples = self._read_samples()
+        if self.max_samples:
+            samples = samples[-self.max_samples:]
+        if samples:
+            tmp_path = self.samples_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(sample) + '\n' for sample in samples)
+            os.replace(tmp_path, self.samples_path)
+        self._lines = len(samples)
+        return samples
+
+    def load_samples(self) -> List[Tuple[List[int], str]]:
+        """读取训练样本，同一封邮件只保留最后一条"""
+        return [(sample['features'], sample['label']) for sample in self._read_samples()]
+
+    def retrain_if_needed(self) -> bool:
+        """新样本积累到 retrain_every 条时压缩样本文件并重新训练
+        Returns:
+            bool: 是否重新训练
+        """
+        with self._lock:
+            if not self.retrain_every or self._new_samples < self.retrain_every:
+                return False
+            self._new_samples = 0
+            samples = self._compact_locked()
+        self.train([(sample['features'], sample['label']) for sample in samples])
+        return True
+
+    def train(self, samples: Optional[Sequence[Tuple[List[int], str]]] = None) -> HashedLinearModel:
+        """训练并保存模型
+        Args:
+            samples: 训练样本，默认读取样本文件
+        Returns:
+            HashedLinearModel: 新模型
+        """
+        samples = self.load_samples() if samples is None else samples
+        model = HashedLinearModel().fit(samples)
+        model.save(self.model_path)
+        self.model = model
+        logger.info(f"预分类模型训练完成: {len(samples)} 条样本")
+        return model
+
+
+_local_classifier: Optional[LocalClassifier] = None
+_local_classifier_lock = threading.Lock()
+
+
+def get_local_classifier() -> Optional[LocalClassifier]:
+    """获取进程内共享的预分类器，未启用时返回 None"""
+    global _local_classifier
+    if not CLASSIFIER_ENABLED:
+        return None
+    if _local_classifier is None:
+        with _local_classifier_lock:
+            if _local_classifier is None:
+                _local_classifier = LocalClassifier()
+    return _local_classifier
+
+
+def retrain_classifier_task():
+    """定时重新训练任务执行函数：积累了足够的新样本时压缩样本文件并重新训练"""
+    classifier = get_local_classifier()
+    if classifier is not None and classifier.retrain_if_needed():
+        logger.info("预分类模型已按新样本重新训练")
+
+
+def schedule_classifier_retrain(scheduler, interval_minutes: int = CLASSIFIER_RETRAIN_MINUTES) -> Optional[Dict[str, Any]]:
+    """创建（或替换）预分类模型的定时重新训练任务，未启用预分类或间隔为 0 时不创建
+    Args:
+        scheduler: 调度器服务
+        interval_minutes: 检查间隔（分钟）
+    Returns:
+        Optional[Dict[str, Any]]: 任务信息
+    """
+    if not CLASSIFIER_ENABLED or interval_minutes <= 0:
+        return None
+    return scheduler.create_job(
+        name='classifier_retrain',
+        func=retrain_classifier_task,
+        trigger=f'interval:{interval_minutes * 60}',
+        id='classifier_retrain',
+        replace_existing=True
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """离线训练与评估：python -m app.service.email_classifier [train|evaluate]"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='本地邮件预分类器')
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('--samples', default=CLASSIFIER_SAMPLES_PATH)
+    parser.add_argument('--model', default=CLASSIFIER_MODEL_PATH)
+    parser.add_argument('--holdout', type=float, default=0.2, help='评估时留出的样本比例')
+    args = parser.parse_args(argv)
+
+    classifier = LocalClassifier(args.model, args.samples, retrain_every=0)
+    samples = classifier.load_samples()
+    if not samples:
+        print(f"没有训练样本: {args.samples}")
+        return
+    if args.command == 'train':
+        classifier.train(samples)
+        print(f"已训练 {len(samples)} 条样本: {args.model}")
+        return
+
+    order = np.random.default_rng(0).permutation(len(samples))
+    split = int(len(samples) * (1 - args.holdout))
+    train = [samples[i] for i in order[:split]]
+    test = [samples[i] for i in order[split:]]
+    model = HashedLinearModel().fit(train)
+    print(f"训练 {len(train)} 条，评估 {len(test)} 条")
+    for row in evaluate(model, test):
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+邮件近似重复检测模块
+用于：
+1. 在入库时为邮件计算 SimHash 指纹
+2. 按用户维护分段 LSH 桶索引
+3. 将近似相同的邮件（模板通知、订阅邮件等）归入同一簇
+"""
+import hashlib
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from ..utils.logger import get_logger
+from ..utils.text import get_email_text
+
+logger = get_logger(__name__)
+
+# 汉明距离不超过 MAX_HAMMING_DISTANCE 的两个指纹，按抽屉原理
+# 在 MAX_HAMMING_DISTANCE + 1 段中至少有一段完全相同
+FINGERPRINT_BITS = 64
+MAX_HAMMING_DISTANCE = 5
+BANDS = MAX_HAMMING_DISTANCE + 1
+
+
+def _band_layout(bits: int, bands: int) -> List[Tuple[int, int]]:
+    """计算每段的 (偏移, 掩码)，位数不能整除时前几段多分一位"""
+    layout = []
+    shift = 0
+    for i in range(bands):
+        width = bits // bands + (1 if i < bits % bands else 0)
+        layout.append((shift, (1 << width) - 1))
+        shift += width
+    return layout
+
+
+_BAND_LAYOUT = _band_layout(FINGERPRINT_BITS, BANDS)
+
+_WORD_RE = re.compile(r'[a-z0-9]+|[一-鿿]')
+_DIGIT_RE = re.compile(r'\d+')
+
+
+def _tokenize(text: str) -> List[str]:
+    """切分文本为特征
+    数字统一替换为 0，只有编号或金额不同的模板邮件因此得到相同特征
+    :param text: 文本
+    :return: 特征列表（单词及相邻词二元组）
+    """
+    words = _WORD_RE.findall(_DIGIT_RE.sub('0', text.lower()))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _hash_feature(feature: str) -> int:
+    """计算特征的 64 位哈希"""
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def simhash(text: str) -> int:
+    """计算文本的 SimHash 指纹
+    :param text: 文本
+    :return: 64 位指纹
+    """
+    weights = [0] * FINGERPRINT_BITS
+    for feature in _tokenize(text or ''):
+        h = _hash_feature(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """计算两个指纹的汉明距离"""
+    return (a ^ b).bit_count()
+
+
+def fingerprint_to_hex(fingerprint: int) -> str:
+    """指纹转为定长十六进制字符串（用于数据库存储）"""
+    return f"{fingerprint:016x}"
+
+
+def fingerprint_from_hex(value: str) -> int:
+    """十六进制字符串转为指纹"""
+    return int(value, 16)
+
+
+def fingerprint_email(email) -> str:
+    """计算邮件指纹
+    :param email: 邮件对象
+    :return: 十六进制指纹
+    """
+    return fingerprint_to_hex(simhash(get_email_text(email)))
+
+
+class NearDuplicateIndex:
+    """单个用户的近似重复索引
+
+    使用分段 LSH 桶查找候选，再用汉明距离确认，并用并查集维护簇。
+    查询簇只是字典查找，与邮箱规模无关。
+    """
+
+    def __init__(self, max_distance: int = MAX_HAMMING_DISTANCE):
+        """初始化索引
+        Args:
+            max_distance: 判定为近似重复的最大汉明距离
+        """
+        self.max_distance = max_distance
+        self._fingerprints: Dict[int, int] = {}
+        self._buckets: Dict[Tuple[int, int], Set[int]] = {}
+        self._parent: Dict[int, int] = {}
+        self._members: Dict[int, Set[int]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, email_id: int) -> bool:
+        return email_id in self._fingerprints
+
+    @staticmethod
+    def _bands(fingerprint: int) -> List[Tuple[int, int]]:
+        return [(i, (fingerprint >> shift) & mask) for i, (shift, mask) in enumerate(_BAND_LAYOUT)]
+
+    def _find(self, email_id: int) -> int:
+        root = email_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # 路径压缩
+        while self._parent[email_id] != root:
+            self._parent[email_id], email_id = root, self._parent[email_id]
+        return root
+
+    def _union(self, a: int, b: int) -> int:
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return root_a
+        # 以较早入库（ID 较小）的邮件作为簇代表
+        if root_b < root_a:
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._members[root_a] |= self._members.pop(root_b)
+        return root_a
+
+    def add(self, email_id: int, fingerprint: int) -> int:
+        """加入一封邮件
+        Args:
+            email_id: 邮件ID
+            fingerprint: SimHash 指纹
+        Returns:
+            int: 所属簇的代表邮件ID
+        """
+        with self._lock:
+            if email_id in self._fingerprints:
+                if self._fingerprints[email_id] == fingerprint:
+                    return self._find(email_id)
+                self.remove(email_id)
+
+            candidates: Set[int] = set()
+            bands = self._bands(fingerprint)
+            for key in bands:
+                candidates |= self._buckets.get(key, set())
+
+            self._fingerprints[email_id] = fingerprint
+            self._parent[email_id] = email_id
+            self._members[email_id] = {email_id}
+            for key in bands:
+                self._buckets.setdefault(key, set()).add(email_id)
+
+            root = email_id
+            for candidate in candidates:
+                if hamming_distance(fingerprint, self._fingerprints[candidate]) <= self.max_distance:
+                    root = self._union(candidate, email_id)
+            return root
+
+    def remove(self, email_id: int):
+        """移除一封邮件，簇内其余成员保持原有归属"""
+        with self._lock:
+            fingerprint = self._fingerprints.pop(email_id, None)
+            if fingerprint is None:
+                return
+            for key in self._bands(fingerprint):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.discard(email_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+            root = self._find(email_id)
+            members = self._members.pop(root)
+            members.discard(email_id)
+            del self._parent[email_id]
+            if not members:
+                return
+            # 重新挂接剩余成员到新的代表
+            new_root = min(members)
+            for member in members:
+                self._parent[member] = new_root
+            self._members[new_root] = members
+
+    def cluster_of(self, email_id: int) -> Optional[int]:
+        """获取邮件所属簇的代表邮件ID，未索引时返回 None"""
+        with self._lock:
+            if email_id not in self._parent:
+                return None
+            return self._find(email_id)
+
+    def members(self, cluster_id: int) -> List[int]:
+        """获取簇内全部邮件ID"""
+        with self._lock:
+            if cluster_id not in self._parent:
+                return []
+            return sorted(self._members.get(self._find(cluster_id), set()))
+
+    def clusters(self, min_size: int = 2) -> Dict[int, List[int]]:
+        """获取所有成员数不少于 min_size 的簇"""
+        with self._lock:
+            return {
+                root: sorted(members)
+                for root, members in self._members.items()
+                if len(members) >= min_size
+            }
+
+
+class DedupService:
+    """近似重复检测服务类
+
+    进程内按用户缓存索引，首次访问时从数据库中已存储的指纹重建。
+    """
+
+    _indexes: Dict[int, NearDuplicateIndex] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_index(cls, user_id: int) -> NearDuplicateIndex:
+        """获取用户的近似重复索引
+        Args:
+            user_id: 用户ID
+        Returns:
+            NearDuplicateIndex: 索引实例
+        """
+        index = cls._indexes.get(user_id)
+        if index is not None:
+            return index
+
+        with cls._lock:
+            index = cls._indexes.get(user_id)
+            if index is None:
+                index = cls._load_index(user_id)
+                cls._indexes[user_id] = index
+        return index
+
+    @classmethod
+    def _load_index(cls, user_id: int) -> NearDuplicateIndex:
+        """从数据库加载用户的指纹并构建索引"""
+        from ..models import Email
+
+        index = NearDuplicateIndex()
+        rows = Email.query.with_entities(Email.id, Email.simhash) \
+            .filter(Email.user_id == user_id, Email.simhash.isnot(None)) \
+            .order_by(Email.id) \
+            .all()
+        for email_id, value in rows:
+            index.add(email_id, fingerprint_from_hex(value))
+        logger.info(f"加载用户 {user_id} 的近似重复索引: {len(index)} 封邮件")
+        return index
+
+    @classmethod
+    def index_email(cls, email) -> Optional[int]:
+        """将已入库的邮件加入索引
+        Args:
+            email: 邮件对象（需已有 ID 和指纹）
+        Returns:
+            Optional[int]: 所属簇的代表邮件ID
+        """
+        if not email.id or not email.simhash:
+            return None
+        index = cls.get_index(email.user_id)
+        return index.add(email.id, fingerprint_from_hex(email.simhash))
+
+    @classmethod
+    def cluster_of(cls, email) -> int:
+        """获取邮件所属簇的代表邮件ID，未索引时返回邮件自身ID"""
+        if not email.id or not email.user_id:
+            return email.id
+        index = cls.get_index(email.user_id)
+        cluster_id = index.cluster_of(email.id)
+        if cluster_id is None and getattr(email, 'simhash', None):
+            cluster_id = index.add(email.id, fingerprint_from_hex(email.simhash))
+        return cluster_id if cluster_id is not None else email.id
+
+    @classmethod
+    def reset(cls, user_id: Optional[int] = None):
+        """清除缓存的索引
+        Args:
+            user_id: 用户ID，为空时清除全部
+        """
+        with cls._lock:
+            if user_id is None:
+                cls._indexes.clear()
+            else:
+                cls._indexes.pop(user_id, None)
@@ -1,19 +1,161 @@
 """
 邮件同步服务模块
 处理邮件同步相关的业务逻辑
+
+定时同步和分析任务保存在调度器的任务存储中，只引用模块级函数和用户ID，
+执行时根据用户保存的令牌重建 Gmail 凭据；应用启动时 reconcile_sync_jobs 为缺少任务的已授权用户补建任务。
+各用户的任务按用户ID散列到间隔内的固定时刻并加随机抖动，不随登录时间集中触发；
+同步间隔由 AdaptiveSyncPolicy 按邮箱的新邮件到达率和最近登录时间调整
 """
+import asyncio
+import os
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
-from googleapiclient.discovery import Resource
+from googleapiclient.discovery import Resource, build
+from ..db.database import db
 from ..models import Email, User
 from ..utils.logger import get_logger
-from .scheduler_service import SchedulerService
+from .auth_service import user_credentials
+from .scheduler_service import SchedulerService, get_scheduler_service, spread_interval_trigger
+from .email_dedup import DedupService, fingerprint_email
+from .embedding import EmbeddingService
+from .email_topics import TopicService
+from .email_classifier import CAPTURED_HEADERS
+from .email_analysis_store import ANALYSIS_INTERVAL_MINUTES, analyze_pending_task
+from .sync_policy import AdaptiveSyncPolicy
 import json
 import traceback
 import pytz
 
 logger = get_logger(__name__)
 
+DEFAULT_SYNC_INTERVAL_HOURS = 6
+# 同步和分析任务在散列时刻上叠加的随机抖动上限（秒）
+SYNC_JITTER_SECONDS = int(os.getenv('SYNC_JITTER_SECONDS', 120))
+
+
+def sync_trigger(user_id: int, seconds: int):
+    """用户同步任务的触发器"""
+    return spread_interval_trigger(f"email_sync:{user_id}", seconds, SYNC_JITTER_SECONDS)
+
+
+def schedule_sync_jobs(scheduler: SchedulerService, user: User,
+                       interval_hours: int = DEFAULT_SYNC_INTERVAL_HOURS):
+    """创建（或替换）用户的定时同步任务和定时分析任务
+    任务ID固定，重复创建时替换已有任务；执行时刻由用户ID决定，与创建时间无关。
+    已有同步记录的用户沿用按到达率估计的间隔，interval_hours 只用于还没有同步记录的用户
+    Args:
+        scheduler: 调度器服务
+        user: 用户对象
+        interval_hours: 默认同步间隔（小时）
+    """
+    user_id = user.id
+    interval = AdaptiveSyncPolicy().current_interval(user, interval_hours * 3600)
+    # 同步任务是协程，在调度器的事件循环线程上执行
+    job = scheduler.create_job(
+        name=f"email_sync_{user_id}",
+        func=sync_emails_task,
+        trigger=sync_trigger(user_id, interval),
+        args=[user_id],
+        id=f"email_sync_{user_id}",
+        replace_existing=True
+    )
+    logger.info(f"邮件同步任务启动成功: {job['id']}, 间隔 {interval // 60} 分钟")
+
+    # 定时分析尚未有当前版本结果的新邮件
+    job = scheduler.create_job(
+        name=f"email_analysis_{user_id}",
+        func=analyze_pending_task,
+        trigger=spread_interval_trigger(f"email_analysis:{user_id}", ANALYSIS_INTERVAL_MINUTES * 60,
+                                        SYNC_JITTER_SECONDS),
+        args=[user_id],
+        id=f"email_analysis_{user_id}",
+        replace_existing=True
+    )
+    logger.info(f"邮件分析任务启动成功: {job['id']}")
+
+
+def reconcile_sync_jobs(scheduler: Optional[SchedulerService] = None,
+                        interval_hours: int = DEFAULT_SYNC_INTERVAL_HOURS) -> int:
+    """为缺少定时任务的已授权用户补建任务
+    应用启动时调用：持久化的任务已由任务存储恢复，这里只补建缺失的（如首次启用持久化、任务存储被清空），
+    用户不需要重新登录。已退出登录（令牌已清除）的用户不补建
+    Args:
+        scheduler: 调度器服务，默认使用应用共享的调度器
+        interval_hours: 同步间隔（小时）
+    Returns:
+        int: 补建任务的用户数
+    """
+    scheduler = scheduler or get_scheduler_service()
+    existing = {job['id'] for job in scheduler.get_all_jobs()}
+    users = User.query.filter(User.is_active.is_(True), User.refresh_token.isnot(None)).all()
+    created = 0
+    for user in users:
+        if f"email_sync_{user.id}" in existing and f"email_analysis_{user.id}" in existing:
+            continue
+        try:
+            schedule_sync_jobs(scheduler, user, interval_hours)
+            created += 1
+        except Exception as e:
+            logger.error(f"补建用户 {user.id} 的同步任务失败: {str(e)}")
+    logger.info(f"同步任务核对完成: {len(users)} 个已授权用户，补建 {created} 个")
+    return created
+
+
+async def sync_emails_task(user_id: int):
+    """定时同步任务执行函数
+    在调度器的事件循环线程上执行，应用上下文由执行器提供；
+    根据用户保存的令牌重建 Gmail 凭据，刷新后的访问令牌写回用户。
+    同步后按新邮件数更新到达率，间隔变化时重新安排本任务
+    Args:
+        user_id: 用户ID
+    """
+    user = User.query.get(user_id)
+    if not user or not user.is_active:
+        logger.warning(f"用户不存在或已停用，跳过同步: {user_id}")
+        return
+    credentials = user_credentials(user)
+    if credentials is None:
+        logger.warning(f"用户 {user_id} 没有保存的授权令牌，跳过同步")
+        return
+    try:
+        gmail_service = await asyncio.to_thread(build, 'gmail', 'v1', credentials=credentials,
+                                                cache_discovery=False)
+    except Exception as e:
+        logger.error(f"创建用户 {user_id} 的 Gmail 服务失败: {str(e)}")
+        return
+
+    new_messages = await EmailSyncService(db, gmail_service).sync_user(user_id)
+
+    if credentials.token and credentials.token != user.access_token:
+        user.access_token = credentials.token
+        db.session.commit()
+
+    if new_messages is not None:
+        try:
+            state = AdaptiveSyncPolicy().observe(user, new_messages)
+            reschedule_sync_job(get_scheduler_service(), user_id, state.interval_seconds)
+        except Exception as e:
+            logger.warning(f"更新用户 {user_id} 的同步频率失败: {str(e)}")
+
+
+def reschedule_sync_job(scheduler: SchedulerService, user_id: int, seconds: int) -> bool:
+    """同步间隔变化时重新安排用户的同步任务
+    Args:
+        scheduler: 调度器服务
+        user_id: 用户ID
+        seconds: 新的同步间隔（秒）
+    Returns:
+        bool: 是否重新安排
+    """
+    job_id = f"email_sync_{user_id}"
+    current = scheduler.get_interval(job_id)
+    if current is None or current == seconds:
+        return False
+    scheduler.update_job(job_id, trigger=sync_trigger(user_id, seconds))
+    logger.info(f"用户 {user_id} 的同步间隔调整为 {seconds // 60} 分钟（原 {current // 60} 分钟）")
+    return True
+
 
 class EmailSyncService:
     """邮件同步服务类"""
@@ -25,7 +167,8 @@ class EmailSyncService:
             gmail_service: Gmail API 服务实例
         """
         self.db = db
-        self.scheduler = SchedulerService()
+        # 共享应用的调度器，不为每个服务实例创建调度线程
+        self.scheduler = get_scheduler_service()
         self.service = gmail_service
         logger.debug(f'Gmail 服务: {gmail_service}')
         if gmail_service:
@@ -33,7 +176,7 @@ class EmailSyncService:
         else:
             logger.warning("Gmail 服务未初始化，部分功能可能不可用")
 
-    def start_sync(self, user: User, interval_hours: int = 6) -> bool:
+    def start_sync(self, user: User, interval_hours: int = DEFAULT_SYNC_INTERVAL_HOURS) -> bool:
         """启动邮件同步
         Args:
             user: 用户对象
@@ -45,15 +188,7 @@ class EmailSyncService:
             if not self.service:
                 raise ValueError("Gmail 服务未初始化")
 
-            # 创建定时同步任务
-            job = self.scheduler.create_job(
-                name=f"email_sync_{user.id}",
-                func=self._sync_emails_task,
-                trigger=f"interval:{interval_hours * 3600}",
-                args=[user.id]
-            )
-
-            logger.info(f"邮件同步任务启动成功: {job['id']}")
+            schedule_sync_jobs(self.scheduler, user, interval_hours)
             return True
         except Exception as e:
             logger.error(f"启动邮件同步失败: {str(e)}")
@@ -67,14 +202,20 @@ class EmailSyncService:
             bool: 是否停止成功
         """
         try:
-            # 查找并删除用户的同步任务
+            # 查找并删除用户的同步任务和分析任务
+            stopped = False
             jobs = self.scheduler.get_all_jobs()
             for job in jobs:
                 if job['name'] == f"email_sync_{user.id}":
                     self.scheduler.remove_job(job['id'])
+                    # 正在执行的同步一并取消
+                    self.scheduler.cancel_running(job['id'])
                     logger.info(f"停止邮件同步任务: {job['id']}")
-                    return True
-            return False
+                    stopped = True
+                elif job['name'] == f"email_analysis_{user.id}":
+                    self.scheduler.remove_job(job['id'])
+                    logger.info(f"停止邮件分析任务: {job['id']}")
+            return stopped
         except Exception as e:
             logger.error(f"停止邮件同步失败: {str(e)}")
             return False
@@ -102,16 +243,18 @@ class EmailSyncService:
             logger.error(f"手动同步失败: {str(e)}")
             return False
 
-    async def _sync_emails_task(self, user_id: int):
-        """同步任务执行函数
+    async def sync_user(self, user_id: int) -> Optional[int]:
+        """从上次同步到的时间开始同步用户的邮件
         Args:
             user_id: 用户ID
+        Returns:
+            Optional[int]: 新邮件数，同步失败时返回 None
         """
         try:
             user = User.query.get(user_id)
             if not user:
                 logger.error(f"用户不存在: {user_id}")
-                return
+                return None
 
             # 获取上次同步时间
             last_sync = Email.query.filter_by(user_id=user_id) \
@@ -121,16 +264,24 @@ class EmailSyncService:
             start_date = last_sync.received_at if last_sync else datetime.now() - timedelta(days=1)
             end_date = datetime.now()
 
-            await self._sync_emails(user, start_date, end_date)
+            return await self._sync_emails(user, start_date, end_date)
+        except asyncio.CancelledError:
+            # 超时或停止同步时被取消，放弃未提交的修改
+            logger.warning(f"用户 {user_id} 的同步任务被取消")
+            self.db.session.rollback()
+            raise
         except Exception as e:
             logger.error(f"同步任务执行失败: {str(e)}")
+            return None
 
-    async def _sync_emails(self, user: User, start_date: datetime, end_date: datetime):
+    async def _sync_emails(self, user: User, start_date: datetime, end_date: datetime) -> int:
         """同步邮件
         Args:
             user: 用户对象
             start_date: 开始时间
             end_date: 结束时间
+        Returns:
+            int: 新入库的邮件数
         """
         try:
             logger.info(f"开始同步邮件 - 用户: {user.email}, 开始时间: {start_date}, 结束时间: {end_date}")
@@ -156,11 +307,13 @@ class EmailSyncService:
             while True:
                 logger.debug("正在从Gmail获取邮件列表...")
                 try:
-                    results = self.service.users().messages().list(
+                    # Gmail 客户端是阻塞的，请求放到线程中执行，不阻塞事件循环上的其他同步
+                    request = self.service.users().messages().list(
                         userId='me',
                         q=query,
                         pageToken=next_page_token
-                    ).execute(num_retries=3)  # 增加重试机制
+                    )
+                    results = await asyncio.to_thread(request.execute, num_retries=3)  # 增加重试机制
 
                     messages = results.get('messages', [])
                     all_messages.extend(messages)
@@ -177,15 +330,17 @@ class EmailSyncService:
 
             if not all_messages:
                 logger.info("没有新的邮件需要同步")
-                return
+                return 0
 
             # 同步每封邮件
             success_count = 0
             error_count = 0
+            new_count = 0
             for message in all_messages:
                 try:
                     logger.debug(f"开始同步邮件 - ID: {message['id']}")
-                    await self._sync_email(user, message['id'])
+                    if await self._sync_email(user, message['id']):
+                        new_count += 1
                     success_count += 1
                     logger.debug(f"邮件同步成功 - ID: {message['id']}")
                 except Exception as e:
@@ -193,28 +348,40 @@ class EmailSyncService:
                     logger.error(f"同步单封邮件失败 - ID: {message['id']}, 错误: {str(e)}")
                     logger.error(f"错误详情: {traceback.format_exc()}")  # 记录完整堆栈
 
-            logger.info(f"同步完成，成功: {success_count}/{len(all_messages)} 封邮件，失败: {error_count} 封")
+            logger.info(f"同步完成，成功: {success_count}/{len(all_messages)} 封邮件（新邮件 {new_count} 封），"
+                        f"失败: {error_count} 封")
+
+            # 保存本次同步累积的向量元数据，新邮件较多时重建向量索引，失败不影响同步结果
+            try:
+                EmbeddingService.flush(user.id)
+                EmbeddingService.maintain_index(user.id)
+            except Exception as e:
+                logger.warning(f"重建向量索引失败: {str(e)}")
+            return new_count
 
         except Exception as e:
             logger.error(f"同步邮件失败: {str(e)}")
             logger.error(f"错误详情: {traceback.format_exc()}")  # 记录完整堆栈
             raise
 
-    async def _sync_email(self, user: User, message_id: str):
+    async def _sync_email(self, user: User, message_id: str) -> bool:
         """同步单封邮件
         Args:
             user: 用户对象
             message_id: 邮件ID
+        Returns:
+            bool: 是否为新邮件（已存在的邮件只更新）
         """
         try:
             logger.debug(f"开始同步单封邮件 - 用户: {user.email}, 邮件ID: {message_id}")
 
             # 获取邮件详情
-            message = self.service.users().messages().get(
+            request = self.service.users().messages().get(
                 userId='me',
                 id=message_id,
                 format='full'
-            ).execute()
+            )
+            message = await asyncio.to_thread(request.execute)
 
             logger.debug(f"原始邮件数据: {json.dumps(message, indent=2)}")  # 记录完整响应
 
@@ -238,6 +405,12 @@ class EmailSyncService:
             body = self._get_email_body(message['payload'])
             html_body = self._get_email_html_body(message['payload'])
             attachments = self._get_email_attachments(message['payload'])
+            labels = message.get('labelIds', [])
+            captured_headers = {
+                header['name'].lower(): header['value']
+                for header in headers
+                if header['name'].lower() in CAPTURED_HEADERS
+            }
 
             logger.debug(f"获取邮件内容 - 文本长度: {len(body)}, HTML长度: {len(html_body)}, 附件数量: {len(attachments)}")
 
@@ -257,7 +430,11 @@ class EmailSyncService:
                 existing_email.html_body = html_body
                 existing_email.attachments = attachments
                 existing_email.received_at = received_at
+                existing_email.labels = labels
+                existing_email.headers = captured_headers
+                existing_email.simhash = fingerprint_email(existing_email)
                 existing_email.updated_at = datetime.now()
+                synced_email = existing_email
             else:
                 logger.debug("创建新邮件")
                 # 创建新邮件
@@ -270,12 +447,32 @@ class EmailSyncService:
                     body=body,
                     html_body=html_body,
                     attachments=attachments,
-                    received_at=received_at
+                    received_at=received_at,
+                    labels=labels,
+                    headers=captured_headers
                 )
+                new_email.simhash = fingerprint_email(new_email)
                 self.db.session.add(new_email)
+                synced_email = new_email
 
             self.db.session.commit()
+
+            # 入库后更新近似重复索引，索引失败不影响同步结果
+            try:
+                cluster_id = DedupService.index_email(synced_email)
+                if cluster_id is not None and cluster_id != synced_email.id:
+                    logger.debug(f"邮件 {synced_email.id} 与邮件 {cluster_id} 近似重复")
+            except Exception as e:
+                logger.warning(f"更新近似重复索引失败: {str(e)}")
+
+            # 写入检索向量并分配主题，失败时可通过 EmbeddingService.reindex_user 补建
+            try:
+                EmbeddingService.index_email(synced_email)
+                TopicService.assign_email(synced_email)
+            except Exception as e:
+                logger.warning(f"写入邮件向量失败: {str(e)}")
             logger.info(f"同步邮件成功: {subject}")
+            return existing_email is None
 
         except Exception as e:
             logger.error(f"同步邮件失败: {str(e)}")
@@ -0,0 +1,294 @@
+"""
+邮件主题聚类模块
+用于：
+1. 基于邮件向量的小批量球面 k-means 聚类
+2. 新邮件到达时增量分配主题并更新聚类中心
+3. 每个主题只让 AI 根据少量代表邮件标注一次名称
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from ..db.database import db
+from ..models import Email, EmailTopic
+from ..utils.logger import get_logger
+from ..utils.text import get_email_text
+from .ai.base_ai_service import BaseAIService
+from .ai.chunking import truncate_text
+from .ai.prompts import PromptTemplate, register_template
+from .embedding import EmbeddingService
+from .embedding.backends import normalize_rows
+
+logger = get_logger(__name__)
+
+# 新邮件与最近主题的相似度低于该值时开启新主题
+TOPIC_SIMILARITY_THRESHOLD = float(os.getenv('TOPIC_SIMILARITY_THRESHOLD', 0.3))
+MAX_TOPICS = int(os.getenv('MAX_TOPICS', 50))
+# 重建时旧主题名称沿用到新主题所需的中心相似度
+LABEL_CARRY_OVER_SIMILARITY = 0.9
+# 标注每个主题使用的代表邮件数与单封邮件摘要长度
+LABEL_SAMPLES = 5
+LABEL_DIGEST_TOKENS = 150
+
+TOPIC_LABEL_TEMPLATE = register_template(PromptTemplate(
+    name='topic-label',
+    version=2,
+    system="""你是邮件分类助手。用户会给出同一类邮件中的几封代表邮件，请用 2 到 6 个字给这类邮件起一个类别名称，
+例如 工作、会议通知、账单、推广、社交、系统通知。只返回类别名称，不要解释。""",
+    user="{digests}"
+))
+
+
+class MiniBatchKMeans:
+    """小批量球面 k-means
+
+    每个小批量只用批内样本更新中心，学习率为 批内样本数 / 该中心累计样本数，
+    因此同一个模型可以在新数据到达时继续 partial_fit。中心始终保持归一化。
+    """
+
+    def __init__(self, n_clusters: int, batch_size: int = 256, seed: int = 0):
+        """初始化模型
+        Args:
+            n_clusters: 聚类数
+            batch_size: 小批量大小
+            seed: 随机种子
+        """
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.centroids: Optional[np.ndarray] = None
+        self.counts: Optional[np.ndarray] = None
+
+    def _init_centroids(self, data: np.ndarray):
+        """k-means++ 初始化"""
+        k = min(self.n_clusters, len(data))
+        centroids = [data[self.rng.integers(len(data))]]
+        distance = 1.0 - data @ centroids[0]
+        for _ in range(1, k):
+            weights = np.clip(distance, 0, None)
+            total = weights.sum()
+            index = self.rng.choice(len(data), p=weights / total) if total > 0 else self.rng.integers(len(data))
+            centroids.append(data[index])
+            distance = np.minimum(distance, 1.0 - data @ data[index])
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.counts = np.zeros(k, dtype=np.int64)
+
+    def partial_fit(self, data: np.ndarray) -> 'MiniBatchKMeans':
+        """用一个小批量更新中心"""
+        data = np.asarray(data, dtype=np.float32)
+        if self.centroids is None:
+            self._init_centroids(data)
+        labels, _ = self.predict(data)
+        for cluster in np.unique(labels):
+            members = data[labels == cluster]
+            self.counts[cluster] += len(members)
+            rate = len(members) / self.counts[cluster]
+            self.centroids[cluster] = (1 - rate) * self.centroids[cluster] + rate * members.mean(axis=0)
+        self.centroids = normalize_rows(self.centroids)
+        return self
+
+    def fit(self, data: np.ndarray, epochs: int = 5) -> np.ndarray:
+        """多轮小批量训练
+        Args:
+            data: 已归一化的向量矩阵
+            epochs: 训练轮数
+        Returns:
+            np.ndarray: 每个样本的聚类编号
+        """
+        data = np.asarray(data, dtype=np.float32)
+        self._init_centroids(data)
+        for _ in range(epochs):
+            order = self.rng.permutation(len(data))
+            for start in range(0, len(data), self.batch_size):
+                self.partial_fit(data[order[start:start + self.batch_size]])
+        return self.predict(data)[0]
+
+    def predict(self, data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """计算最近的中心
+        Returns:
+            Tuple: (聚类编号, 与中心的余弦相似度)
+        """
+        similarity = np.asarray(data, dtype=np.float32) @ self.centroids.T
+        labels = np.argmax(similarity, axis=1)
+        return labels, similarity[np.arange(len(labels)), labels]
+
+
+def suggest_topic_count(count: int) -> int:
+    """按邮件数估算主题数（约 √(n/2)）"""
+    return int(min(max(np.sqrt(count / 2), 1), MAX_TOPICS))
+
+
+class TopicService:
+    """邮件主题服务类"""
+
+    @staticmethod
+    def _vectors(user_id: int, email_ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """从向量存储读取邮件向量，跳过尚未写入向量的邮件"""
+        store = EmbeddingService.get_store(user_id)
+        rows = [(email_id, store.row_of(email_id)) for email_id in email_ids]
+        rows = [(email_id, row) for email_id, row in rows if row is not None]
+        if not rows:
+            return [], np.zeros((0, store.dim), dtype=np.float32)
+        matrix = store.matrix()[[row for _, row in rows]].astype(np.float32)
+        return [email_id for email_id, _ in rows], matrix
+
+    @classmethod
+    def assign_email(cls, email: Email) -> Optional[EmailTopic]:
+        """为新邮件分配主题，并以在线 k-means 方式更新主题中心
+        与所有主题都不够相似时开启新主题（达到 MAX_TOPICS 后归入最近主题）
+        Args:
+            email: 已写入向量的邮件
+        Returns:
+            Optional[EmailTopic]: 分配到的主题
+        """
+        if email.topic_id:
+            return db.session.get(EmailTopic, email.topic_id)
+        _, vectors = cls._vectors(email.user_id, [email.id])
+        if not len(vectors):
+            return None
+        vector = vectors[0]
+
+        topics = EmailTopic.query.filter_by(user_id=email.user_id).all()
+        topic = None
+        if topics:
+            centroids = np.asarray([t.centroid for t in topics], dtype=np.float32)
+            similarity = centroids @ vector
+            best = int(np.argmax(similarity))
+            if similarity[best] >= TOPIC_SIMILARITY_THRESHOLD or len(topics) >= MAX_TOPICS:
+                topic = topics[best]
+
+        if topic is None:
+            topic = EmailTopic(user_id=email.user_id, size=1, centroid=vector.tolist())
+            db.session.add(topic)
+        else:
+            size = (topic.size or 0) + 1
+            centroid = np.asarray(topic.centroid, dtype=np.float32)
+            centroid += (vector - centroid) / size
+            topic.centroid = normalize_rows(centroid[None, :])[0].tolist()
+            topic.size = size
+        db.session.flush()
+        email.topic_id = topic.id
+        db.session.commit()
+        return topic
+
+    @classmethod
+    def rebuild_topics(cls, user_id: int, n_topics: Optional[int] = None) -> List[EmailTopic]:
+        """对用户全部邮件重新聚类
+        与旧主题中心足够接近的新主题沿用旧名称，避免重复标注
+        Args:
+            user_id: 用户ID
+            n_topics: 主题数，默认按邮件数估算
+        Returns:
+            List[EmailTopic]: 新的主题列表
+        """
+        email_ids = [row[0] for row in Email.query.with_entities(Email.id).filter_by(user_id=user_id).all()]
+        email_ids, vectors = cls._vectors(user_id, email_ids)
+        if not email_ids:
+            return []
+
+        model = MiniBatchKMeans(n_topics or suggest_topic_count(len(email_ids)))
+        labels = model.fit(vectors)
+
+        old_topics = [t for t in EmailTopic.query.filter_by(user_id=user_id).all() if t.label]
+        old_centroids = np.asarray([t.centroid for t in old_topics], dtype=np.float32)
+
+        Email.query.filter_by(user_id=user_id).update({'topic_id': None})
+        EmailTopic.query.filter_by(user_id=user_id).delete()
+
+        topics = []
+        for cluster in range(len(model.centroids)):
+            members = [email_ids[i] for i in np.flatnonzero(labels == cluster)]
+            if not members:
+                continue
+            centroid = model.centroids[cluster]
+            label = None
+            if old_topics:
+                similarity = old_centroids @ centroid
+                best = int(np.argmax(similarity))
+                if similarity[best] >= LABEL_CARRY_OVER_SIMILARITY:
+                    label = old_topics[best].label
+            topic = EmailTopic(user_id=user_id, label=label, size=len(members), centroid=centroid.tolist())
+            db.session.add(topic)
+            db.session.flush()
+            Email.query.filter(Email.id.in_(members)).update({'topic_id': topic.id}, synchronize_session=False)
+            topics.append(topic)
+        db.session.commit()
+        logger.info(f"用户 {user_id} 重新聚类完成: {len(email_ids)} 封邮件, {len(topics)} 个主题")
+        return topics
+
+    @classmethod
+    def _representatives(cls, topic: EmailTopic) -> List[Email]:
+        """选取最接近主题中心的代表邮件"""
+        member_ids = [row[0] for row in Email.query.with_entities(Email.id).filter_by(topic_id=topic.id).all()]
+        member_ids, vectors = cls._vectors(topic.user_id, member_ids)
+        if not member_ids:
+            return []
+        similarity = vectors @ np.asarray(topic.centroid, dtype=np.float32)
+        top = np.argsort(-similarity)[:LABEL_SAMPLES]
+        chosen = [member_ids[i] for i in top]
+        emails = {e.id: e for e in Email.query.filter(Email.id.in_(chosen)).all()}
+        return [emails[i] for i in chosen if i in emails]
+
+    @staticmethod
+    def _parse_label(text: str) -> str:
+        """从模型回复中提取类别名称"""
+        lines = [line.strip() for line in (text or '').splitlines() if line.strip()]
+        label = lines[0] if lines else ''
+        return label.strip('"\'“”「」[]【】*#:：。. ')[:64]
+
+    @classmethod
+    def label_topics(cls, user_id: int, ai_service: BaseAIService) -> int:
+        """为尚未命名的主题生成名称，每个主题只调用一次模型
+        Args:
+            user_id: 用户ID
+            ai_service: AI 服务实例
+        Returns:
+            int: 新标注的主题数
+        """
+        topics = EmailTopic.query.filter_by(user_id=user_id, label=None).all()
+        pending: List[Tuple[EmailTopic, str]] = []
+        for topic in topics:
+            samples = cls._representatives(topic)
+            if not samples:
+                continue
+            digests = '\n\n'.join(
+                f"- {email.from_email or ''}: {truncate_text(get_email_text(email), LABEL_DIGEST_TOKENS)}"
+                for email in samples
+            )
+            pending.append((topic, TOPIC_LABEL_TEMPLATE.render(digests=digests)))
+        if not pending:
+            return 0
+
+        options = {'temperature': 0, 'max_tokens': 20, **TOPIC_LABEL_TEMPLATE.options()}
+        prompts = [prompt for _, prompt in pending]
+        if hasattr(ai_service, 'batch_chat'):
+            responses = ai_service.batch_chat(prompts, **options)
+        else:
+            responses = [ai_service.chat(prompt, **options) for prompt in prompts]
+
+        labeled = 0
+        for (topic, _), response in zip(pending, responses):
+            if isinstance(response, Exception):
+                logger.warning(f"标注主题 {topic.id} 失败: {str(response)}")
+                continue
+            label = cls._parse_label(response.get('response', ''))
+            if label:
+                topic.label = label
+                labeled += 1
+        db.session.commit()
+        logger.info(f"用户 {user_id} 标注主题 {labeled}/{len(pending)} 个")
+        return labeled
+
+    @staticmethod
+    def topic_label(email: Any) -> Optional[str]:
+        """获取邮件所属主题的名称"""
+        topic_id = getattr(email, 'topic_id', None)
+        if not topic_id:
+            return None
+        topic = db.session.get(EmailTopic, topic_id)
+        return topic.label if topic else None
+
+    @staticmethod
+    def list_topics(user_id: int) -> List[Dict[str, Any]]:
+        """按规模降序列出用户的主题"""
+        topics = EmailTopic.query.filter_by(user_id=user_id).order_by(EmailTopic.size.desc()).all()
+        return [topic.to_dict() for topic in topics]
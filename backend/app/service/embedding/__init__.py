@@ -0,0 +1,17 @@
+"""
+邮件向量检索模块
+"""
+from .backends import (
+    BaseEmbeddingBackend,
+    HashingEmbeddingBackend,
+    OpenAIEmbeddingBackend,
+    EmbeddingError,
+    create_embedding_backend
+)
+from .ann import IVFIndex, benchmark_ivf
+from .store import VectorStore
+from .service import EmbeddingService, build_rag_prompt
+
+__all__ = ['BaseEmbeddingBackend', 'HashingEmbeddingBackend', 'OpenAIEmbeddingBackend',
+           'EmbeddingError', 'create_embedding_backend', 'IVFIndex', 'benchmark_ivf',
+           'VectorStore', 'EmbeddingService', 'build_rag_prompt']
@@ -0,0 +1,158 @@
+"""
+文本向量化后端模块
+用于：
+1. 定义向量化后端接口
+2. 本地 CPU 后端：特征哈希，无需下载模型
+3. OpenAI 兼容的远程向量化接口
+"""
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+import numpy as np
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 向量化配置
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'local')
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', 512))
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_BASE_URL = os.getenv('EMBEDDING_BASE_URL', os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1'))
+EMBEDDING_API_KEY = os.getenv('EMBEDDING_API_KEY', os.getenv('OPENAI_API_KEY', ''))
+
+_WORD_RE = re.compile(r'[a-z0-9]+|[一-鿿]')
+
+
+class EmbeddingError(Exception):
+    """向量化异常"""
+    pass
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化，零向量保持不变"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class BaseEmbeddingBackend(ABC):
+    """向量化后端基类"""
+
+    name = 'base'
+
+    @property
+    @abstractmethod
+    def dim(self) -> int:
+        """向量维度"""
+        pass
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """将文本转换为向量
+        Args:
+            texts: 文本列表
+        Returns:
+            np.ndarray: 形状为 (len(texts), dim) 的 float32 矩阵，每行已归一化
+        """
+        pass
+
+
+class HashingEmbeddingBackend(BaseEmbeddingBackend):
+    """本地特征哈希向量化后端
+
+    词、相邻词对和中文单字经带符号哈希映射到固定维度，结果做 TF 对数缩放后归一化。
+    不依赖模型文件，适合离线部署和测试；语义能力弱于神经网络模型。
+    """
+
+    name = 'local'
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        """初始化后端
+        Args:
+            dim: 向量维度
+        """
+        self._dim = dim
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _features(self, text: str) -> List[str]:
+        """提取文本特征：词与相邻词对"""
+        words = _WORD_RE.findall((text or '').lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                sign = 1.0 if value >> 63 else -1.0
+                vectors[row, value % self._dim] += sign
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        return normalize_rows(vectors)
+
+
+class OpenAIEmbeddingBackend(BaseEmbeddingBackend):
+    """OpenAI 兼容接口的向量化后端"""
+
+    name = 'openai'
+    BATCH_SIZE = 64
+
+    def __init__(self, api_key: str = EMBEDDING_API_KEY, model: str = EMBEDDING_MODEL,
+                 base_url: str = EMBEDDING_BASE_URL, dim: int = EMBEDDING_DIM):
+        """初始化后端
+        Args:
+            api_key: API 密钥
+            model: 向量模型名称
+            base_url: 接口地址
+            dim: 向量维度（模型支持时按此维度截断）
+        """
+        from openai import OpenAI
+
+        self.model = model
+        self._dim = dim
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = []
+        try:
+            for start in range(0, len(texts), self.BATCH_SIZE):
+                batch = [text or ' ' for text in texts[start:start + self.BATCH_SIZE]]
+                response = self.client.embeddings.create(
+                    model=self.model, input=batch, dimensions=self._dim
+                )
+                vectors.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+        except Exception as e:
+            logger.error(f"调用向量化接口失败: {str(e)}")
+            raise EmbeddingError(f"调用向量化接口失败: {str(e)}")
+        if not vectors:
+            return np.zeros((0, self._dim), dtype=np.float32)
+        return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+BACKENDS = {
+    'local': HashingEmbeddingBackend,
+    'openai': OpenAIEmbeddingBackend,
+}
+
+
+def create_embedding_backend(name: Optional[str] = None, **kwargs) -> BaseEmbeddingBackend:
+    """按名称创建向量化后端
+    Args:
+        name: 后端名称，默认读取 EMBEDDING_BACKEND
+        **kwargs: 传给后端构造函数的参数
+    Returns:
+        BaseEmbeddingBackend: 后端实例
+    """
+    name = name or EMBEDDING_BACKEND
+    if name not in BACKENDS:
+        raise EmbeddingError(f"不支持的向量化后端: {name}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,230 @@
+"""
+邮件向量检索服务模块
+用于：
+1. 同步邮件时写入向量
+2. 按问题检索相关邮件
+3. 构建带引用编号的对话提示
+"""
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .backends import BaseEmbeddingBackend, create_embedding_backend
+from .store import VectorStore
+from ..ai.chunking import truncate_text
+from ...utils.logger import get_logger
+from ...utils.text import get_email_text
+
+logger = get_logger(__name__)
+
+EMBEDDING_DIR = os.getenv(
+    'EMBEDDING_DIR',
+    # backend/instance/embeddings，与应用数据库放在同一目录
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+                 'instance', 'embeddings')
+)
+# 单封邮件参与向量化的最大 token 数
+EMBED_MAX_TOKENS = 2000
+# 引用到对话提示中的单封邮件最大 token 数
+CONTEXT_MAX_TOKENS = 400
+
+RAG_PROMPT = """请根据下面的邮件回答用户的问题。引用邮件时使用对应的编号，例如 [1]。
+如果邮件中没有相关信息，请直接说明。
+
+{context}
+
+用户问题：{question}"""
+
+
+def email_metadata(email: Any) -> Dict[str, Any]:
+    """提取用于检索过滤的邮件元数据"""
+    return {
+        'received_at': email.received_at,
+        'sender': email.from_email,
+        'labels': getattr(email, 'labels', None) or []
+    }
+
+
+def build_rag_prompt(question: str, emails: Sequence[Any]) -> str:
+    """构建带引用编号的对话提示
+    Args:
+        question: 用户问题
+        emails: 检索到的邮件，按相关度排序
+    Returns:
+        str: 对话提示
+    """
+    blocks = []
+    for number, email in enumerate(emails, start=1):
+        received_at = email.received_at.strftime('%Y-%m-%d %H:%M') if email.received_at else ''
+        text = truncate_text(get_email_text(email), CONTEXT_MAX_TOKENS)
+        blocks.append(f"[{number}] 发件人: {email.from_email or ''} 时间: {received_at}\n{text}")
+    return RAG_PROMPT.format(context='\n\n'.join(blocks), question=question)
+
+
+class EmbeddingService:
+    """邮件向量检索服务类
+
+    进程内共享一个向量化后端，并按用户缓存打开的向量存储。
+    """
+
+    _backend: Optional[BaseEmbeddingBackend] = None
+    _stores: Dict[int, VectorStore] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_backend(cls) -> BaseEmbeddingBackend:
+        """获取向量化后端"""
+        if cls._backend is None:
+            with cls._lock:
+                if cls._backend is None:
+                    cls._backend = create_embedding_backend()
+                    logger.info(f"向量化后端初始化完成: {cls._backend.name}, 维度 {cls._backend.dim}")
+        return cls._backend
+
+    @classmethod
+    def set_backend(cls, backend: BaseEmbeddingBackend):
+        """替换向量化后端，已打开的存储会被关闭"""
+        cls.reset()
+        cls._backend = backend
+
+    @classmethod
+    def get_store(cls, user_id: int) -> VectorStore:
+        """获取用户的向量存储
+        Args:
+            user_id: 用户ID
+        Returns:
+            VectorStore: 向量存储
+        """
+        store = cls._stores.get(user_id)
+        if store is not None:
+            return store
+
+        backend = cls.get_backend()
+        with cls._lock:
+            store = cls._stores.get(user_id)
+            if store is None:
+                # 不同后端或维度的向量互不兼容，分目录存放
+                directory = os.path.join(EMBEDDING_DIR, f"{backend.name}-{backend.dim}", f"user_{user_id}")
+                store = VectorStore(directory, backend.dim)
+                cls._stores[user_id] = store
+        return store
+
+    @classmethod
+    def index_emails(cls, emails: Sequence[Any]) -> int:
+        """为邮件生成并写入向量
+        Args:
+            emails: 已入库的邮件
+        Returns:
+            int: 写入的条数
+        """
+        by_user: Dict[int, List[Any]] = {}
+        for email in emails:
+            if email.id and email.user_id:
+                by_user.setdefault(email.user_id, []).append(email)
+
+        backend = cls.get_backend()
+        for user_id, user_emails in by_user.items():
+            texts = [truncate_text(get_email_text(email), EMBED_MAX_TOKENS) for email in user_emails]
+            vectors = backend.embed(texts)
+            cls.get_store(user_id).add(
+                [email.id for email in user_emails],
+                vectors,
+                [email_metadata(email) for email in user_emails]
+            )
+        return sum(len(user_emails) for user_emails in by_user.values())
+
+    @classmethod
+    def index_email(cls, email: Any) -> bool:
+        """为单封邮件生成并写入向量"""
+        return cls.index_emails([email]) == 1
+
+    @classmethod
+    def remove_email(cls, email: Any) -> bool:
+        """删除邮件的向量"""
+        if not email.id or not email.user_id:
+            return False
+        return cls.get_store(email.user_id).remove([email.id]) == 1
+
+    @classmethod
+    def reindex_user(cls, user_id: int, batch_size: int = 256) -> int:
+        """为用户尚未写入向量的邮件补建向量
+        Args:
+            user_id: 用户ID
+            batch_size: 每批向量化的邮件数
+        Returns:
+            int: 新写入的条数
+        """
+        from ...models import Email
+
+        store = cls.get_store(user_id)
+        emails = [e for e in Email.query.filter_by(user_id=user_id).order_by(Email.id).all()
+                  if e.id not in store]
+        for start in range(0, len(emails), batch_size):
+            cls.index_emails(emails[start:start + batch_size])
+        store.flush()
+        logger.info(f"用户 {user_id} 补建向量 {len(emails)} 条")
+        return len(emails)
+
+    @classmethod
+    def flush(cls, user_id: int):
+        """写入用户向量存储中尚未保存的元数据"""
+        store = cls._stores.get(user_id)
+        if store is not None:
+            store.flush()
+
+    @classmethod
+    def maintain_index(cls, user_id: int) -> bool:
+        """规模达到阈值或明显增长后重建用户的 IVF 索引
+        Returns:
+            bool: 是否执行了重建
+        """
+        store = cls.get_store(user_id)
+        if not store.index_needs_rebuild():
+            return False
+        store.rebuild_index()
+        return True
+
+    @classmethod
+    def search(cls, user_id: int, query: str, k: int = 5,
+               date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+               sender: Optional[str] = None, labels: Optional[Sequence[str]] = None) -> List[Tuple[int, float]]:
+        """检索与问题最相关的邮件
+        Args:
+            user_id: 用户ID
+            query: 问题
+            k: 返回条数
+            date_from: 起始时间
+            date_to: 结束时间
+            sender: 发件人
+            labels: 标签
+        Returns:
+            List[Tuple[int, float]]: (邮件ID, 相似度)，按相似度降序
+        """
+        vector = cls.get_backend().embed([query])[0]
+        return cls.get_store(user_id).search(
+            vector, k, date_from=date_from, date_to=date_to, sender=sender, labels=labels
+        )
+
+    @classmethod
+    def retrieve(cls, user_id: int, query: str, k: int = 5, **filters) -> List[Tuple[Any, float]]:
+        """检索相关邮件并从数据库加载
+        Returns:
+            List[Tuple[Email, float]]: (邮件, 相似度)，按相似度降序
+        """
+        from ...models import Email
+
+        hits = cls.search(user_id, query, k, **filters)
+        if not hits:
+            return []
+        emails = {e.id: e for e in Email.query.filter(
+            Email.user_id == user_id, Email.id.in_([email_id for email_id, _ in hits])
+        ).all()}
+        return [(emails[email_id], score) for email_id, score in hits if email_id in emails]
+
+    @classmethod
+    def reset(cls):
+        """关闭并清除缓存的向量存储"""
+        with cls._lock:
+            for store in cls._stores.values():
+                store.close()
+            cls._stores.clear()
@@ -0,0 +1,341 @@
+"""
+向量存储模块
+用于：
+1. 以 float16 内存映射文件按用户保存邮件向量
+2. 在 JSON 旁路文件中保存邮件ID、时间、发件人和标签，写入按批累积后一次保存
+3. 带元数据预过滤的 top-k 余弦相似度检索，规模较大时经 IVF 索引检索
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from .ann import ANN_MIN_VECTORS, ANN_NPROBE, INDEX_FILE, IVFIndex
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+VECTOR_FILE = 'vectors.f16'
+META_FILE = 'meta.json'
+# 每次扩容的最小行数与分块计算相似度的行数
+MIN_CAPACITY = 1024
+SEARCH_BLOCK_ROWS = 65536
+# 未保存的增删达到该行数时写入元数据，其余的在 flush/close 时写入；
+# 进程异常退出时丢失的行不在元数据中，可通过 EmbeddingService.reindex_user 补建
+SAVE_BATCH_ROWS = 256
+
+
+def _timestamp(value: Optional[datetime]) -> float:
+    """将时间转换为时间戳，空值返回 NaN"""
+    return value.timestamp() if value else float('nan')
+
+
+class VectorStore:
+    """单个用户的向量存储
+
+    向量矩阵按行存储，删除时用最后一行填补空位，保持矩阵紧凑。
+    所有向量写入前已归一化，因此内积即余弦相似度。
+    """
+
+    def __init__(self, directory: str, dim: int):
+        """打开或创建向量存储
+        Args:
+            directory: 存储目录
+            dim: 向量维度
+        """
+        self.directory = directory
+        self.dim = dim
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.ids: List[int] = []
+        self.timestamps: List[float] = []
+        self.senders: List[str] = []
+        self.labels: List[List[str]] = []
+        self.capacity = 0
+        self._rows: Dict[int, int] = {}
+        self._vectors: Optional[np.memmap] = None
+        self._unsaved = 0
+        self.index = IVFIndex()
+        self._load()
+
+    @property
+    def vector_path(self) -> str:
+        return os.path.join(self.directory, VECTOR_FILE)
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, email_id: int) -> bool:
+        return email_id in self._rows
+
+    def _load(self):
+        """从磁盘加载元数据并映射向量文件，维度不一致时丢弃旧数据"""
+        if os.path.exists(self.meta_path) and os.path.exists(self.vector_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('dim') == self.dim:
+                self.ids = meta['ids']
+                self.timestamps = [float('nan') if t is None else t for t in meta['timestamps']]
+                self.senders = meta['senders']
+                self.labels = meta['labels']
+                self.capacity = meta['capacity']
+                self._rows = {email_id: row for row, email_id in enumerate(self.ids)}
+                self._vectors = np.memmap(self.vector_path, dtype=np.float16, mode='r+',
+                                          shape=(self.capacity, self.dim))
+                self._load_index()
+                return
+            logger.warning(f"向量维度已变更 ({meta.get('dim')} -> {self.dim})，重建向量存储: {self.directory}")
+        self._resize(MIN_CAPACITY)
+        self.save()
+
+    def _load_index(self):
+        """加载 IVF 索引，并补齐上次保存后新增或删除的向量"""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            index = IVFIndex.load(self.index_path)
+        except Exception as e:
+            logger.warning(f"加载向量索引失败，将使用精确检索: {str(e)}")
+            return
+        if index.centroids.shape[1] != self.dim:
+            return
+        index.remove([email_id for email_id in index.ids() if email_id not in self._rows])
+        missing = [email_id for email_id in self.ids if email_id not in index]
+        if missing:
+            index.add(missing, self._vectors[[self._rows[i] for i in missing]])
+        self.index = index
+
+    def _resize(self, capacity: int):
+        """调整向量文件容量并重新映射"""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vector_path, 'ab') as f:
+            f.truncate(capacity * self.dim * np.dtype(np.float16).itemsize)
+        self.capacity = capacity
+        self._vectors = np.memmap(self.vector_path, dtype=np.float16, mode='r+',
+                                  shape=(capacity, self.dim))
+
+    def save(self):
+        """刷新向量文件并原子写入元数据"""
+        with self._lock:
+            self._vectors.flush()
+            meta = {
+                'dim': self.dim,
+                'capacity': self.capacity,
+                'ids': self.ids,
+                'timestamps': [None if np.isnan(t) else t for t in self.timestamps],
+                'senders': self.senders,
+                'labels': self.labels
+            }
+            tmp_path = self.meta_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, self.meta_path)
+            self._unsaved = 0
+
+    def flush(self):
+        """写入尚未保存的增删"""
+        with self._lock:
+            if self._unsaved:
+                self.save()
+
+    def _mark_unsaved(self, rows: int):
+        """累计未保存的行数，达到批量阈值时保存"""
+        self._unsaved += rows
+        if self._unsaved >= SAVE_BATCH_ROWS:
+            self.save()
+
+    def matrix(self) -> np.ndarray:
+        """当前全部向量（内存映射视图）"""
+        return self._vectors[:len(self.ids)]
+
+    def row_of(self, email_id: int) -> Optional[int]:
+        """获取邮件向量所在行"""
+        return self._rows.get(email_id)
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray, metadata: Sequence[Dict[str, Any]]):
+        """添加或更新向量
+        Args:
+            ids: 邮件ID列表
+            vectors: 已归一化的向量矩阵
+            metadata: 每封邮件的元数据，包含 received_at、sender、labels
+        """
+        if len(ids) != len(vectors) or len(ids) != len(metadata):
+            raise ValueError("ids、vectors 和 metadata 的长度必须一致")
+        with self._lock:
+            needed = len(self.ids) + sum(1 for email_id in ids if email_id not in self._rows)
+            if needed > self.capacity:
+                self._resize(max(needed, self.capacity * 2))
+
+            for email_id, vector, meta in zip(ids, vectors, metadata):
+                row = self._rows.get(email_id)
+                if row is None:
+                    row = len(self.ids)
+                    self._rows[email_id] = row
+                    self.ids.append(email_id)
+                    self.timestamps.append(0.0)
+                    self.senders.append('')
+                    self.labels.append([])
+                self._vectors[row] = vector
+                self.timestamps[row] = _timestamp(meta.get('received_at'))
+                self.senders[row] = (meta.get('sender') or '').lower()
+                self.labels[row] = list(meta.get('labels') or [])
+            self.index.add(list(ids), vectors)
+            self._mark_unsaved(len(ids))
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """删除向量
+        Returns:
+            int: 实际删除的条数
+        """
+        ids = list(ids)
+        removed = 0
+        with self._lock:
+            for email_id in ids:
+                row = self._rows.pop(email_id, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    # 用最后一行填补空位
+                    self._vectors[row] = self._vectors[last]
+                    self.ids[row] = self.ids[last]
+                    self.timestamps[row] = self.timestamps[last]
+                    self.senders[row] = self.senders[last]
+                    self.labels[row] = self.labels[last]
+                    self._rows[self.ids[row]] = row
+                for column in (self.ids, self.timestamps, self.senders, self.labels):
+                    column.pop()
+                removed += 1
+            if removed:
+                self.index.remove(ids)
+                self._mark_unsaved(removed)
+        return removed
+
+    def index_needs_rebuild(self) -> bool:
+        """IVF 索引是否需要（重新）训练"""
+        return self.index.needs_rebuild(len(self.ids))
+
+    def rebuild_index(self, nlist: Optional[int] = None):
+        """用当前全部向量重新训练 IVF 索引
+        Args:
+            nlist: 倒排列表数，默认按向量数估算
+        """
+        with self._lock:
+            matrix = self.matrix()
+            index = IVFIndex()
+            index.train(matrix, nlist)
+            for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+                block = matrix[start:start + SEARCH_BLOCK_ROWS]
+                index.add(self.ids[start:start + len(block)], block)
+            index.save(self.index_path)
+            self.index = index
+        logger.info(f"向量索引重建完成: {self.directory}, {len(index)} 条向量, {len(index.centroids)} 个列表")
+
+    def filter_mask(self, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                    sender: Optional[str] = None, labels: Optional[Sequence[str]] = None) -> np.ndarray:
+        """按元数据计算候选行掩码
+        Args:
+            date_from: 起始时间（含）
+            date_to: 结束时间（含）
+            sender: 发件人（不区分大小写的子串匹配）
+            labels: 标签，命中任意一个即可
+        Returns:
+            np.ndarray: 布尔掩码
+        """
+        count = len(self.ids)
+        mask = np.ones(count, dtype=bool)
+        if date_from or date_to:
+            timestamps = np.asarray(self.timestamps, dtype=np.float64)
+            # NaN 与任何时间比较均为 False，无时间的邮件被排除
+            if date_from:
+                mask &= timestamps >= date_from.timestamp()
+            if date_to:
+                mask &= timestamps <= date_to.timestamp()
+        if sender:
+            sender = sender.lower()
+            mask &= np.fromiter((sender in s for s in self.senders), dtype=bool, count=count)
+        if labels:
+            wanted = set(labels)
+            mask &= np.fromiter((not wanted.isdisjoint(l) for l in self.labels), dtype=bool, count=count)
+        return mask
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """计算查询向量与存储向量的余弦相似度
+        Args:
+            query: 已归一化的查询向量
+            rows: 只计算这些行，为空时计算全部
+        Returns:
+            np.ndarray: 相似度
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        matrix = self.matrix()
+        if rows is not None:
+            return matrix[rows].astype(np.float32) @ query
+        result = np.empty(len(matrix), dtype=np.float32)
+        # 分块转换精度，避免一次性把整个映射文件读入内存
+        for start in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+            block = matrix[start:start + SEARCH_BLOCK_ROWS]
+            result[start:start + len(block)] = block.astype(np.float32) @ query
+        return result
+
+    def _ann_rows(self, query: np.ndarray, mask: np.ndarray, k: int, nprobe: int) -> Optional[np.ndarray]:
+        """经 IVF 索引获取候选行，不适合使用索引时返回 None
+        过滤后的候选较少时精确检索更快；索引候选不足 k 条时同样退回精确检索
+        """
+        if not self.index.is_trained or int(mask.sum()) < ANN_MIN_VECTORS:
+            return None
+        rows = np.fromiter((self._rows[i] for i in self.index.candidates(query, nprobe) if i in self._rows),
+                           dtype=np.int64)
+        rows = rows[mask[rows]]
+        return rows if len(rows) >= k else None
+
+    def search(self, query: np.ndarray, k: int = 5, exact: bool = False,
+               nprobe: int = ANN_NPROBE, **filters) -> List[Tuple[int, float]]:
+        """top-k 余弦相似度检索
+        Args:
+            query: 已归一化的查询向量
+            k: 返回条数
+            exact: 强制精确检索
+            nprobe: IVF 检索探测的列表数
+            **filters: 元数据过滤条件，见 filter_mask
+        Returns:
+            List[Tuple[int, float]]: (邮件ID, 相似度)，按相似度降序
+        """
+        with self._lock:
+            if not self.ids or k <= 0:
+                return []
+            mask = self.filter_mask(**filters)
+            rows = None if exact else self._ann_rows(query, mask, k, nprobe)
+            if rows is None:
+                rows = np.flatnonzero(mask)
+                if len(rows) == 0:
+                    return []
+                # 未过滤时行号即 0..n-1，按块计算全部相似度；索引候选按探测顺序排列，只能按行号取
+                scores = self.scores(query, None if len(rows) == len(self.ids) else rows)
+            else:
+                scores = self.scores(query, rows)
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    def close(self):
+        """保存并释放内存映射"""
+        with self._lock:
+            if self._vectors is not None:
+                self.save()
+                if self.index.is_trained:
+                    self.index.save(self.index_path)
+                self._vectors = None
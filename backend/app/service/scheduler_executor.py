@@ -0,0 +1,206 @@
+"""
+协程任务执行器模块
+用于：
+1. 在一个专用的事件循环线程上执行协程任务（async def），任务被真正 await，而不是返回未执行的协程
+2. 多个用户的同步任务在同一个循环上交错执行，等待 I/O 时不占用线程
+3. 单次执行超时后取消协程；可以按任务取消正在执行的协程，关闭调度器时取消所有未完成的执行
+4. 执行器持有 Flask 应用，每次执行都在应用上下文中进行，任务参数里不需要（也无法持久化）应用对象
+5. 按任务ID前缀限制某类任务的同时执行数（如所有用户的邮件同步），超出的执行排队等待
+"""
+import asyncio
+import sys
+import threading
+import traceback
+from contextlib import nullcontext
+from collections import defaultdict
+from concurrent.futures import CancelledError, Future
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Set
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, JobExecutionEvent
+from apscheduler.executors.base import BaseExecutor, run_job
+from apscheduler.executors.pool import ThreadPoolExecutor
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_ASYNC_TIMEOUT = 1800
+DEFAULT_ASYNC_CONCURRENCY = 20
+
+
+def app_context(app):
+    """应用上下文，未绑定应用时为空上下文"""
+    return app.app_context() if app is not None else nullcontext()
+
+
+def run_job_in_app(app, job, jobstore_alias, run_times, logger_name):
+    """在应用上下文中执行普通函数任务"""
+    with app_context(app):
+        return run_job(job, jobstore_alias, run_times, logger_name)
+
+
+class AppThreadPoolExecutor(ThreadPoolExecutor):
+    """在应用上下文中执行任务的线程池执行器类"""
+
+    def __init__(self, max_workers: int = 10, app=None):
+        super().__init__(max_workers)
+        self.app = app
+
+    def _do_submit_job(self, job, run_times):
+        def callback(f: Future):
+            exc, tb = f.exception(), getattr(f.exception(), '__traceback__', None)
+            if exc:
+                self._run_job_error(job.id, exc, tb)
+            else:
+                self._run_job_success(job.id, f.result())
+
+        f = self._pool.submit(run_job_in_app, self.app, job, job._jobstore_alias, run_times, self._logger.name)
+        f.add_done_callback(callback)
+
+
+class AsyncLoopExecutor(BaseExecutor):
+    """协程任务执行器类
+
+    执行器持有一个专用的事件循环线程（与调度器线程、线程池相互独立），
+    协程任务通过 run_coroutine_threadsafe 提交到该循环，并发数由信号量限制。
+    """
+
+    def __init__(self, timeout: Optional[float] = DEFAULT_ASYNC_TIMEOUT,
+                 max_concurrency: int = DEFAULT_ASYNC_CONCURRENCY, app=None,
+                 group_limits: Optional[Dict[str, int]] = None):
+        """初始化执行器
+        Args:
+            timeout: 单次执行的超时（秒），超时后取消协程；None 表示不限
+            max_concurrency: 同时执行的协程数上限，超出的执行在循环上排队
+            app: Flask 应用，每次执行前进入其应用上下文
+            group_limits: 任务ID前缀 -> 该类任务的同时执行数上限
+        """
+        super().__init__()
+        self.app = app
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.group_limits = dict(group_limits or {})
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._group_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._futures: Dict[str, Set[Future]] = defaultdict(set)
+        self._futures_lock = threading.Lock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name=f"scheduler-async-{alias}", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._group_semaphores = {prefix: asyncio.Semaphore(limit)
+                                  for prefix, limit in self.group_limits.items() if limit > 0}
+
+    def _group_semaphore(self, job_id: str):
+        """任务所属分组的信号量，不属于任何分组时为空上下文"""
+        for prefix, semaphore in self._group_semaphores.items():
+            if job_id.startswith(prefix):
+                return semaphore
+        return nullcontext()
+
+    def shutdown(self, wait: bool = True):
+        """取消未完成的执行并停止事件循环
+        Args:
+            wait: 是否等待被取消的协程处理完取消
+        """
+        if self._loop is None or self._loop.is_closed():
+            return
+        with self._futures_lock:
+            pending = [future for futures in self._futures.values() for future in futures]
+        for future in pending:
+            future.cancel()
+        if wait and pending:
+            # 等待被取消的协程处理完 CancelledError（回滚、释放连接）
+            try:
+                asyncio.run_coroutine_threadsafe(self._drain(), self._loop).result(timeout=5)
+            except Exception as e:
+                logger.warning(f"等待协程任务取消超时: {str(e)}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        logger.info(f"协程执行器已关闭，取消 {len(pending)} 个未完成的执行")
+
+    @staticmethod
+    async def _drain():
+        """等待循环上的其他任务结束"""
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def running(self) -> int:
+        """正在执行或排队的协程数"""
+        with self._futures_lock:
+            return sum(len(futures) for futures in self._futures.values())
+
+    def cancel(self, job_id: str) -> int:
+        """取消任务正在执行的协程
+        Args:
+            job_id: 任务ID
+        Returns:
+            int: 取消的执行数
+        """
+        with self._futures_lock:
+            futures = list(self._futures.get(job_id, ()))
+        cancelled = sum(1 for future in futures if future.cancel())
+        if cancelled:
+            logger.info(f"取消任务 {job_id} 的 {cancelled} 个执行")
+        return cancelled
+
+    def _do_submit_job(self, job, run_times):
+        future = asyncio.run_coroutine_threadsafe(self._run_job(job, run_times), self._loop)
+        with self._futures_lock:
+            self._futures[job.id].add(future)
+
+        def callback(f: Future):
+            with self._futures_lock:
+                futures = self._futures.get(job.id)
+                if futures is not None:
+                    futures.discard(f)
+                    if not futures:
+                        del self._futures[job.id]
+            try:
+                events = f.result()
+            except CancelledError as e:
+                self._run_job_error(job.id, e)
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        future.add_done_callback(callback)
+
+    async def _run_job(self, job, run_times):
+        """依次执行各个计划时间点，与 apscheduler 的 run_coroutine_job 一致，增加并发上限和超时"""
+        events = []
+        for run_time in run_times:
+            # 错过执行时间窗口的时间点不再执行
+            if job.misfire_grace_time is not None:
+                difference = datetime.now(timezone.utc) - run_time
+                if difference > timedelta(seconds=job.misfire_grace_time):
+                    events.append(JobExecutionEvent(EVENT_JOB_MISSED, job.id, job._jobstore_alias, run_time))
+                    logger.warning(f"任务 {job.id} 错过执行时间 {difference}")
+                    continue
+
+            try:
+                # 每个执行是独立的 asyncio 任务，应用上下文只对本次执行可见
+                # 先取得分组名额再占用全局名额，排队的同步任务不挤占其他协程任务
+                async with self._group_semaphore(job.id), self._semaphore:
+                    with app_context(self.app):
+                        logger.info(f"执行协程任务 {job.id}（计划时间 {run_time}）")
+                        retval = await asyncio.wait_for(job.func(*job.args, **job.kwargs), self.timeout)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    logger.error(f"协程任务 {job.id} 超过 {self.timeout} 秒未完成，已取消")
+                else:
+                    logger.error(f"协程任务 {job.id} 执行失败: {str(e)}")
+                events.append(JobExecutionEvent(EVENT_JOB_ERROR, job.id, job._jobstore_alias, run_time,
+                                                exception=e, traceback=traceback.format_exc()))
+            else:
+                events.append(JobExecutionEvent(EVENT_JOB_EXECUTED, job.id, job._jobstore_alias, run_time,
+                                                retval=retval))
+        return events
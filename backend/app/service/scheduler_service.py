@@ -1,26 +1,202 @@
 """
 调度器服务模块
 处理定时任务相关的业务逻辑
+
+每个应用只有一个调度器：create_app 中通过 init_scheduler 创建，线程池大小由 SCHEDULER_POOL_SIZE 配置，
+所有服务通过 get_scheduler_service 共享，路由也由此查看任务。
+普通函数在线程池中执行；协程函数（async def）交给 AsyncLoopExecutor，在专用的事件循环线程上 await，
+单次执行超时（SCHEDULER_ASYNC_TIMEOUT）后取消，同时执行数由 SCHEDULER_ASYNC_CONCURRENCY 限制。
+SCHEDULER_JOBSTORE 为 sqlalchemy 时任务保存在应用数据库的 apscheduler_jobs 表中，重启后恢复；
+停机期间错过的执行在 SCHEDULER_MISFIRE_GRACE_SECONDS 内补执行一次（多次合并为一次），超出则等下一次。
+持久化的任务只能引用模块级函数和可序列化的参数，应用上下文由执行器提供。
+按用户的周期任务用 spread_interval_trigger 散列到间隔内的固定偏移并加随机抖动，所有用户的邮件同步
+同时执行数不超过 SYNC_MAX_CONCURRENCY，避免大量用户同时登录后任务同步触发。
+同一主机上的多个进程（gunicorn 多个 worker、Flask 重载器）共享任务表时，只有取得 SCHEDULER_LOCK_FILE
+文件锁的进程执行任务，其余进程的调度器以暂停状态启动；多台主机部署时只在一台主机上开启 SCHEDULER_ENABLED
 """
-from typing import Dict, Any, List, Optional, Callable, Union
-from datetime import datetime, timedelta
+import hashlib
+import os
+import threading
+from typing import IO, Dict, Any, List, Optional, Callable, Union
+from datetime import datetime, timedelta, timezone
+from flask import current_app, has_app_context
+from apscheduler.jobstores.base import BaseJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import BaseScheduler, STATE_PAUSED, STATE_RUNNING, STATE_STOPPED
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import iscoroutinefunction_partial, ref_to_obj
 from ..utils.logger import get_logger
+from .scheduler_executor import (AppThreadPoolExecutor, AsyncLoopExecutor,
+                                 DEFAULT_ASYNC_CONCURRENCY, DEFAULT_ASYNC_TIMEOUT)
 
 logger = get_logger(__name__)
 
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MISFIRE_GRACE_SECONDS = 3600
+DEFAULT_SYNC_CONCURRENCY = 4
+JOBS_TABLE = 'apscheduler_jobs'
+# 散列偏移的基准时间，所有周期任务都相对它对齐
+SLOT_ANCHOR = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def slot_offset(key: str, seconds: int) -> int:
+    """键在周期内的固定偏移（秒）
+    按键的哈希均匀分布在 [0, seconds) 内，与任务创建时间无关，重启或重新登录后不变
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % max(int(seconds), 1)
+
+
+def spread_interval_trigger(key: str, seconds: int, jitter: int = 0) -> IntervalTrigger:
+    """按键散列到固定偏移的间隔触发器
+    每次执行时间为 基准时间 + 偏移 + k * 间隔，再加不超过 jitter 秒的随机抖动（最多为间隔的四分之一），
+    大量任务同时创建时也均匀分布在整个间隔内
+    Args:
+        key: 散列键，如 email_sync:1
+        seconds: 间隔（秒）
+        jitter: 随机抖动上限（秒）
+    Returns:
+        IntervalTrigger: 触发器
+    """
+    return IntervalTrigger(
+        seconds=seconds,
+        start_date=SLOT_ANCHOR + timedelta(seconds=slot_offset(key, seconds)),
+        jitter=min(jitter, seconds // 4) or None
+    )
+
+
+def acquire_scheduler_lock(path: str) -> Optional[IO]:
+    """取得执行定时任务的进程锁（非阻塞的排他文件锁），锁随文件关闭或进程退出释放
+    Args:
+        path: 锁文件路径
+    Returns:
+        Optional[IO]: 打开的锁文件，需在进程存活期间保持打开；其他进程已持有锁时返回 None
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(path, 'a+')
+    try:
+        import fcntl
+    except ImportError:
+        # 不支持文件锁的平台（Windows）只能单进程部署
+        logger.warning("当前平台不支持文件锁，请确保只有一个进程开启调度器")
+        return lock_file
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+class AppJobStore(SQLAlchemyJobStore):
+    """使用应用数据库引擎的任务存储类
+    引擎由 Flask-SQLAlchemy 管理，关闭调度器时不释放应用的连接池
+    """
+
+    def shutdown(self):
+        pass
+
+
 class SchedulerService:
     """调度器服务类"""
 
-    def __init__(self):
-        """初始化调度器服务"""
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
-        logger.info("调度器服务初始化成功")
+    def __init__(self, scheduler: Optional[BaseScheduler] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 start: bool = True, paused: bool = False,
+                 async_timeout: Optional[float] = DEFAULT_ASYNC_TIMEOUT,
+                 async_concurrency: int = DEFAULT_ASYNC_CONCURRENCY,
+                 app=None, jobstore: Optional[BaseJobStore] = None,
+                 misfire_grace_time: int = DEFAULT_MISFIRE_GRACE_SECONDS,
+                 group_limits: Optional[Dict[str, int]] = None):
+        """初始化调度器服务
+        不要在请求中直接创建：每个实例都有自己的调度线程、线程池和事件循环线程，应通过 get_scheduler_service 获取共享实例
+        Args:
+            scheduler: 调度器，默认创建使用固定大小线程池和协程执行器的 BackgroundScheduler
+            pool_size: 执行任务的线程池大小
+            start: 是否立即启动
+            paused: 以暂停状态启动，任务正常保存和替换但不执行
+            async_timeout: 协程任务单次执行的超时（秒）
+            async_concurrency: 同时执行的协程任务数上限
+            app: Flask 应用，任务在其应用上下文中执行
+            jobstore: 任务存储，默认保存在内存中
+            misfire_grace_time: 错过执行时间后仍补执行的时限（秒）
+            group_limits: 任务ID前缀 -> 该类协程任务的同时执行数上限
+        """
+        self.pool_size = pool_size
+        self.persistent = jobstore is not None
+        # 执行任务的进程锁，由 init_scheduler 设置，关闭调度器时释放
+        self.lock_file: Optional[IO] = None
+        self.scheduler = scheduler or BackgroundScheduler(
+            jobstores={'default': jobstore} if jobstore is not None else {},
+            executors={
+                'default': AppThreadPoolExecutor(max_workers=pool_size, app=app),
+                'asyncio': AsyncLoopExecutor(timeout=async_timeout, max_concurrency=async_concurrency, app=app,
+                                             group_limits=group_limits)
+            },
+            # 停机或阻塞期间错过的多次执行合并为一次，超过时限的不再补执行
+            job_defaults={'coalesce': True, 'misfire_grace_time': misfire_grace_time, 'max_instances': 1}
+        )
+        if start:
+            self.scheduler.start(paused=paused)
+        logger.info(f"调度器服务初始化成功: 线程池 {pool_size}, 状态 {self.state}, "
+                    f"任务数 {len(self.scheduler.get_jobs())}{'（持久化）' if self.persistent else ''}")
+
+    @property
+    def state(self) -> str:
+        """调度器状态：running / paused / stopped"""
+        return {STATE_RUNNING: 'running', STATE_PAUSED: 'paused'}.get(self.scheduler.state, 'stopped')
+
+    def _async_executor(self) -> Optional[AsyncLoopExecutor]:
+        """协程执行器，调度器未启动或未配置时返回 None"""
+        try:
+            executor = self.scheduler._lookup_executor('asyncio')
+        except KeyError:
+            return None
+        return executor if isinstance(executor, AsyncLoopExecutor) else None
+
+    @staticmethod
+    def _executor_options(func: Callable, options: Dict[str, Any]) -> Dict[str, Any]:
+        """协程函数默认交给协程执行器，否则 BackgroundScheduler 只会得到未执行的协程对象"""
+        if isinstance(func, str):
+            func = ref_to_obj(func)
+        if 'executor' not in options and iscoroutinefunction_partial(func):
+            return dict(options, executor='asyncio')
+        return options
+
+    @staticmethod
+    def _job_info(job) -> Dict[str, Any]:
+        """任务信息"""
+        return {
+            'id': job.id,
+            'name': job.name,
+            'next_run_time': job.next_run_time.isoformat() if getattr(job, 'next_run_time', None) else None,
+            'trigger': str(job.trigger)
+        }
+
+    @staticmethod
+    def _parse_trigger(trigger: Union[str, Dict[str, Any], Any]):
+        """解析触发器字符串：cron:表达式、interval:秒数、date:ISO 时间"""
+        if not isinstance(trigger, str):
+            return trigger
+        if trigger.startswith('cron:'):
+            # cron表达式
+            return CronTrigger.from_crontab(trigger[5:].strip())
+        if trigger.startswith('interval:'):
+            # 间隔时间（秒）
+            return IntervalTrigger(seconds=int(trigger[9:]))
+        if trigger.startswith('date:'):
+            # 具体时间
+            return DateTrigger(run_date=datetime.fromisoformat(trigger[5:]))
+        raise ValueError(f"不支持的触发器格式: {trigger}")
 
     def create_job(
             self,
@@ -43,40 +219,18 @@ class SchedulerService:
             Dict[str, Any]: 任务信息
         """
         try:
-            # 解析触发器
-            if isinstance(trigger, str):
-                if trigger.startswith('cron:'):
-                    # cron表达式
-                    cron_expr = trigger[6:]
-                    trigger = CronTrigger.from_crontab(cron_expr)
-                elif trigger.startswith('interval:'):
-                    # 间隔时间（秒）
-                    seconds = int(trigger[9:])
-                    trigger = IntervalTrigger(seconds=seconds)
-                elif trigger.startswith('date:'):
-                    # 具体时间
-                    date_str = trigger[5:]
-                    trigger = DateTrigger(run_date=datetime.fromisoformat(date_str))
-                else:
-                    raise ValueError(f"不支持的触发器格式: {trigger}")
-
             # 创建任务
             job = self.scheduler.add_job(
                 func=func,
-                trigger=trigger,
+                trigger=self._parse_trigger(trigger),
                 args=args or [],
                 kwargs=kwargs or {},
                 name=name,
-                **options
+                **self._executor_options(func, options)
             )
 
             logger.info(f"创建{name}定时任务成功")
-            return {
-                'id': job.id,
-                'name': job.name,
-                'next_run_time': job.next_run_time.isoformat() if job.next_run_time else None,
-                'trigger': str(job.trigger)
-            }
+            return self._job_info(job)
         except Exception as e:
             logger.error(f"创建定时任务失败: {str(e)}")
             raise
@@ -90,35 +244,66 @@ class SchedulerService:
         """
         try:
             job = self.scheduler.get_job(job_id)
-            if job:
-                return {
-                    'id': job.id,
-                    'name': job.name,
-                    'next_run_time': job.next_run_time.isoformat() if job.next_run_time else None,
-                    'trigger': str(job.trigger)
-                }
-            return None
+            return self._job_info(job) if job else None
         except Exception as e:
             logger.error(f"获取任务信息失败: {str(e)}")
             raise
 
+    def get_interval(self, job_id: str) -> Optional[int]:
+        """间隔触发器任务的间隔（秒）
+        Args:
+            job_id: 任务ID
+        Returns:
+            Optional[int]: 间隔，任务不存在或不是间隔触发器时返回 None
+        """
+        job = self.scheduler.get_job(job_id)
+        interval = getattr(job.trigger, 'interval', None) if job else None
+        return int(interval.total_seconds()) if interval is not None else None
+
     def get_all_jobs(self) -> List[Dict[str, Any]]:
         """获取所有任务
         Returns:
             List[Dict[str, Any]]: 任务列表
         """
         try:
-            jobs = self.scheduler.get_jobs()
-            return [{
-                'id': job.id,
-                'name': job.name,
-                'next_run_time': job.next_run_time.isoformat() if job.next_run_time else None,
-                'trigger': str(job.trigger)
-            } for job in jobs]
+            return [self._job_info(job) for job in self.scheduler.get_jobs()]
         except Exception as e:
             logger.error(f"获取任务列表失败: {str(e)}")
             raise
 
+    def update_job(self, job_id: str, name: Optional[str] = None, func: Optional[Callable] = None,
+                   trigger: Optional[Union[str, Dict[str, Any]]] = None,
+                   args: Optional[List[Any]] = None,
+                   kwargs: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """更新任务，未提供的参数保持不变
+        Args:
+            job_id: 任务ID
+            name: 任务名称
+            func: 要执行的函数
+            trigger: 触发器
+            args: 函数的位置参数
+            kwargs: 函数的关键字参数
+        Returns:
+            Optional[Dict[str, Any]]: 更新后的任务信息，任务不存在时返回 None
+        """
+        try:
+            if not self.scheduler.get_job(job_id):
+                return None
+            changes = {key: value for key, value in
+                       (('name', name), ('func', func), ('args', args), ('kwargs', kwargs))
+                       if value is not None}
+            if func is not None:
+                changes['executor'] = self._executor_options(func, {}).get('executor', 'default')
+            if changes:
+                self.scheduler.modify_job(job_id, **changes)
+            if trigger:
+                self.scheduler.reschedule_job(job_id, trigger=self._parse_trigger(trigger))
+            logger.info(f"更新任务成功: {job_id}")
+            return self.get_job(job_id)
+        except Exception as e:
+            logger.error(f"更新任务失败: {str(e)}")
+            raise
+
     def remove_job(self, job_id: str) -> bool:
         """删除任务
         Args:
@@ -164,11 +349,90 @@ class SchedulerService:
             logger.error(f"恢复任务失败: {str(e)}")
             return False
 
-    def shutdown(self):
+    def cancel_running(self, job_id: str) -> int:
+        """取消协程任务正在执行的协程，线程池中的任务无法取消
+        Args:
+            job_id: 任务ID
+        Returns:
+            int: 取消的执行数
+        """
+        executor = self._async_executor()
+        return executor.cancel(job_id) if executor else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """调度器运行状态"""
+        executor = self._async_executor()
+        return {
+            'state': self.state,
+            'pool_size': self.pool_size,
+            'jobs': len(self.scheduler.get_jobs()),
+            'persistent': self.persistent,
+            'async_running': executor.running() if executor else 0
+        }
+
+    def shutdown(self, wait: bool = True):
         """关闭调度器"""
         try:
-            self.scheduler.shutdown()
+            if self.scheduler.state != STATE_STOPPED:
+                self.scheduler.shutdown(wait=wait)
+            if self.lock_file is not None:
+                self.lock_file.close()
+                self.lock_file = None
             logger.info("调度器已关闭")
         except Exception as e:
             logger.error(f"关闭调度器失败: {str(e)}")
             raise
+
+
+_fallback: Optional[SchedulerService] = None
+_fallback_lock = threading.Lock()
+
+
+def init_scheduler(app) -> SchedulerService:
+    """创建应用共享的调度器
+    SCHEDULER_POOL_SIZE 为执行任务的线程数，SCHEDULER_ENABLED 为假时以暂停状态启动（任务保存但不执行），
+    SCHEDULER_ASYNC_TIMEOUT / SCHEDULER_ASYNC_CONCURRENCY 为协程任务的超时和并发上限，
+    SCHEDULER_JOBSTORE 为 sqlalchemy 时任务保存在应用数据库中（需在 init_db 之后调用），
+    SYNC_MAX_CONCURRENCY 为所有用户的邮件同步任务同时执行数上限。
+    开启调度器时先取得 SCHEDULER_LOCK_FILE（默认 instance/scheduler.lock）文件锁，未取得锁的进程以暂停状态启动：
+    仍可通过共享的任务表创建和修改任务，由持有锁的进程执行，每个任务只执行一次
+    """
+    enabled = app.config.get('SCHEDULER_ENABLED', True)
+    lock_file = None
+    if enabled:
+        lock_path = app.config.get('SCHEDULER_LOCK_FILE') or os.path.join(app.instance_path, 'scheduler.lock')
+        lock_file = acquire_scheduler_lock(lock_path)
+        if lock_file is None:
+            logger.info(f"其他进程已持有调度器锁 {lock_path}，本进程的调度器以暂停状态启动，只维护任务不执行")
+    jobstore = None
+    if app.config.get('SCHEDULER_JOBSTORE', 'memory') == 'sqlalchemy':
+        from ..db.database import db
+        with app.app_context():
+            jobstore = AppJobStore(engine=db.engine, tablename=JOBS_TABLE)
+    service = SchedulerService(
+        pool_size=app.config.get('SCHEDULER_POOL_SIZE', DEFAULT_POOL_SIZE),
+        paused=lock_file is None,
+        async_timeout=app.config.get('SCHEDULER_ASYNC_TIMEOUT', DEFAULT_ASYNC_TIMEOUT),
+        async_concurrency=app.config.get('SCHEDULER_ASYNC_CONCURRENCY', DEFAULT_ASYNC_CONCURRENCY),
+        app=app,
+        jobstore=jobstore,
+        misfire_grace_time=app.config.get('SCHEDULER_MISFIRE_GRACE_SECONDS', DEFAULT_MISFIRE_GRACE_SECONDS),
+        group_limits={'email_sync_': app.config.get('SYNC_MAX_CONCURRENCY', DEFAULT_SYNC_CONCURRENCY)}
+    )
+    service.lock_file = lock_file
+    app.extensions['scheduler'] = service
+    return service
+
+
+def get_scheduler_service() -> SchedulerService:
+    """获取共享的调度器服务
+    应用上下文中返回 create_app 创建的调度器；应用外（脚本等）使用进程内唯一的调度器
+    """
+    global _fallback
+    if has_app_context() and 'scheduler' in current_app.extensions:
+        return current_app.extensions['scheduler']
+    if _fallback is None:
+        with _fallback_lock:
+            if _fallback is None:
+                _fallback = SchedulerService()
+    return _fallback
@@ -62,16 +62,22 @@ class ServiceManager:
         return g.auth_service
 
     @staticmethod
-    def get_ai_service(model_name: str = None) -> Optional[Any]:
-        """获取AI服务实例"""
-        service_key = f'ai_service_{model_name}' if model_name else 'ai_service'
+    def get_ai_service(provider: str = 'deepseek', **kwargs) -> Optional[BaseAIService]:
+        """获取AI服务实例
+        Args:
+            provider: AI 服务提供商
+            **kwargs: 服务配置参数（api_key、model 等）
+        Returns:
+            Optional[BaseAIService]: AI 服务实例，创建失败时返回 None
+        """
+        service_key = f"ai_service_{provider}_{kwargs.get('model', '')}"
 
         if not hasattr(g, service_key):
             try:
                 # 创建新的服务实例
-                service = AIServiceFactory.create_service(model_name)
+                service = AIServiceFactory.create_service(provider, **kwargs)
                 setattr(g, service_key, service)
-                logger.debug(f"创建新的 {model_name} AI 服务实例")
+                logger.debug(f"创建新的 {provider} AI 服务实例")
             except Exception as e:
                 logger.error(f"创建 AI 服务实例失败: {str(e)}")
                 return None
@@ -108,20 +114,14 @@ class ServiceManager:
             all_attrs = [attr for attr in dir(g) if not attr.startswith('_')]
             ai_services = [attr for attr in all_attrs if attr.startswith('ai_service_')]
 
+            # AI 服务实例由客户端注册表跨请求复用，这里只解除引用，不关闭连接
             for service_name in ai_services:
-                service = getattr(g, service_name)
-                if hasattr(service, 'close'):
-                    service.close()
                 delattr(g, service_name)
                 logger.debug(f"清理AI服务: {service_name}")
 
-            # 清理调度器服务
+            # 调度器由应用共享，这里只解除引用，不关闭
             if hasattr(g, 'scheduler'):
-                scheduler = g.scheduler
-                if hasattr(scheduler, 'shutdown'):
-                    scheduler.shutdown()
                 delattr(g, 'scheduler')
-                logger.debug("清理调度器服务")
 
             logger.info("服务实例清理完成")
             return True
@@ -133,8 +133,8 @@ class ServiceManager:
 
     @staticmethod
     def get_scheduler():
-        """获取调度器实例"""
+        """获取应用共享的调度器服务"""
         if not hasattr(g, 'scheduler'):
-            from .scheduler import Scheduler
-            g.scheduler = Scheduler()
+            from .scheduler_service import get_scheduler_service
+            g.scheduler = get_scheduler_service()
         return g.scheduler
@@ -0,0 +1,148 @@
+"""
+自适应同步频率模块
+用于：
+1. 根据每次同步取到的新邮件数，按时间衰减的指数加权平均估计邮箱的新邮件到达率（封/小时）
+2. 按到达率计算同步间隔：新邮件多的邮箱更频繁地同步，长期没有新邮件的邮箱拉长间隔，间隔限制在配置的上下限内
+3. 长时间没有登录的用户进一步退避，Gmail 调用集中在真正有新邮件的邮箱上
+"""
+import math
+import os
+from datetime import datetime
+from typing import Optional
+from ..db.database import db
+from ..models import SyncState, User
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 同步间隔的上下限；间隔按最小间隔取整，到达率小幅波动时不重新安排任务
+SYNC_MIN_INTERVAL_MINUTES = int(os.getenv('SYNC_MIN_INTERVAL_MINUTES', 15))
+SYNC_MAX_INTERVAL_HOURS = int(os.getenv('SYNC_MAX_INTERVAL_HOURS', 24))
+# 期望每次同步取到的新邮件数：间隔 = 期望封数 / 到达率
+SYNC_TARGET_MESSAGES = float(os.getenv('SYNC_TARGET_MESSAGES', 5))
+# 到达率估计的半衰期（小时）：该时长之前的观测权重减半
+SYNC_RATE_HALF_LIFE_HOURS = float(os.getenv('SYNC_RATE_HALF_LIFE_HOURS', 24))
+# 超过该天数未登录的用户开始退避，每多一个周期间隔翻倍，不超过退避上限
+SYNC_INACTIVE_DAYS = int(os.getenv('SYNC_INACTIVE_DAYS', 7))
+SYNC_INACTIVE_MAX_INTERVAL_HOURS = int(os.getenv('SYNC_INACTIVE_MAX_INTERVAL_HOURS', 72))
+
+# 首次同步没有上次同步时间，按默认同步一天的邮件估计
+FIRST_SYNC_WINDOW_HOURS = 24
+
+
+class AdaptiveSyncPolicy:
+    """自适应同步频率服务类"""
+
+    def __init__(self, min_interval: int = SYNC_MIN_INTERVAL_MINUTES * 60,
+                 max_interval: int = SYNC_MAX_INTERVAL_HOURS * 3600,
+                 target_messages: float = SYNC_TARGET_MESSAGES,
+                 half_life_hours: float = SYNC_RATE_HALF_LIFE_HOURS,
+                 inactive_days: int = SYNC_INACTIVE_DAYS,
+                 inactive_max_interval: int = SYNC_INACTIVE_MAX_INTERVAL_HOURS * 3600):
+        """初始化同步频率策略
+        Args:
+            min_interval: 最短同步间隔（秒）
+            max_interval: 活跃用户的最长同步间隔（秒）
+            target_messages: 期望每次同步取到的新邮件数
+            half_life_hours: 到达率估计的半衰期（小时）
+            inactive_days: 多少天未登录后开始退避
+            inactive_max_interval: 退避后的最长同步间隔（秒）
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_messages = target_messages
+        self.half_life_hours = half_life_hours
+        self.inactive_days = inactive_days
+        self.inactive_max_interval = max(inactive_max_interval, max_interval)
+
+    @staticmethod
+    def get_state(user_id: int) -> Optional[SyncState]:
+        """获取用户的同步状态"""
+        return SyncState.query.filter_by(user_id=user_id).first()
+
+    def estimate_rate(self, rate: Optional[float], new_messages: int, elapsed_hours: float) -> float:
+        """更新到达率估计
+        观测间隔不固定，权重按距上次观测的时长衰减：间隔越长，新观测的权重越大
+        Args:
+            rate: 之前的到达率，首次观测时为 None
+            new_messages: 本次同步取到的新邮件数
+            elapsed_hours: 距上次同步的时长（小时）
+        Returns:
+            float: 新的到达率（封/小时）
+        """
+        elapsed_hours = max(elapsed_hours, 1 / 60)
+        observed = new_messages / elapsed_hours
+        if rate is None:
+            return observed
+        alpha = 1 - 0.5 ** (elapsed_hours / self.half_life_hours)
+        return rate + alpha * (observed - rate)
+
+    def interval_for(self, rate: float, last_login: Optional[datetime] = None,
+                     now: Optional[datetime] = None) -> int:
+        """按到达率和最近登录时间计算同步间隔
+        Args:
+            rate: 新邮件到达率（封/小时）
+            last_login: 用户最近登录时间
+            now: 当前时间
+        Returns:
+            int: 同步间隔（秒），为最短间隔的整数倍
+        """
+        now = now or datetime.now()
+        seconds = self.target_messages / rate * 3600 if rate > 0 else self.max_interval
+        seconds = min(max(seconds, self.min_interval), self.max_interval)
+
+        upper = self.max_interval
+        if last_login and self.inactive_days > 0:
+            periods = (now - last_login).days // self.inactive_days
+            if periods > 0:
+                seconds *= 2 ** min(periods, 16)
+                upper = self.inactive_max_interval
+        seconds = min(seconds, upper)
+        # 取整到最短间隔的整数倍（向上取整不超过上限）
+        steps = max(1, math.ceil(seconds / self.min_interval))
+        return min(steps * self.min_interval, upper)
+
+    def observe(self, user: User, new_messages: int, now: Optional[datetime] = None) -> SyncState:
+        """记录一次同步结果，更新到达率和同步间隔
+        Args:
+            user: 用户对象
+            new_messages: 本次同步取到的新邮件数
+            now: 同步完成时间
+        Returns:
+            SyncState: 更新后的同步状态
+        """
+        now = now or datetime.now()
+        state = self.get_state(user.id)
+        if state is None:
+            state = SyncState(user_id=user.id, syncs=0)
+            db.session.add(state)
+            previous, elapsed = None, FIRST_SYNC_WINDOW_HOURS
+        else:
+            previous = state.rate
+            elapsed = ((now - state.last_sync_at).total_seconds() / 3600
+                       if state.last_sync_at else FIRST_SYNC_WINDOW_HOURS)
+
+        state.rate = self.estimate_rate(previous, new_messages, elapsed)
+        state.interval_seconds = self.interval_for(state.rate, user.last_login, now)
+        state.last_sync_at = now
+        state.last_new_messages = new_messages
+        state.syncs = (state.syncs or 0) + 1
+        db.session.commit()
+        logger.debug(f"用户 {user.id} 新邮件 {new_messages} 封，到达率 {state.rate:.2f}/h，"
+                     f"同步间隔 {state.interval_seconds // 60} 分钟")
+        return state
+
+    def current_interval(self, user: User, default: int, now: Optional[datetime] = None) -> int:
+        """用户当前应使用的同步间隔
+        还没有同步记录时使用默认间隔；有记录时按最近登录时间重新计算退避（登录后立即恢复）
+        Args:
+            user: 用户对象
+            default: 默认间隔（秒）
+            now: 当前时间
+        Returns:
+            int: 同步间隔（秒）
+        """
+        state = self.get_state(user.id)
+        if state is None or state.rate is None:
+            return default
+        return self.interval_for(state.rate, user.last_login, now)
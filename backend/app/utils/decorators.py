@@ -5,6 +5,7 @@ from functools import wraps
 from flask import session, jsonify
 from ..models import User
 from ..db.database import db
+from ..service.ai.usage import usage_context
 
 def login_required(f):
     """用户登录验证装饰器"""
@@ -19,5 +20,7 @@ def login_required(f):
 
         # 将用户对象添加到 kwargs
         kwargs['user'] = user
-        return f(*args, **kwargs)
+        # 请求中发出的模型调用记到该用户名下
+        with usage_context(user_id=user.id):
+            return f(*args, **kwargs)
     return decorated_function
@@ -0,0 +1,67 @@
+"""
+文本处理工具模块
+用于从邮件模型中提取可供分析的纯文本
+"""
+import base64
+import binascii
+import re
+from typing import Any
+from bs4 import BeautifulSoup
+
+# Gmail API 返回的正文是 base64url 编码的
+_BASE64URL_RE = re.compile(r'^[A-Za-z0-9_\-]+={0,2}$')
+_HTML_TAG_RE = re.compile(r'<[a-zA-Z/][^>]*>')
+
+
+def decode_body(data: str) -> str:
+    """解码 Gmail 正文数据
+    :param data: base64url 编码的正文（或已经是明文的正文）
+    :return: 解码后的文本，无法解码时原样返回
+    """
+    if not data:
+        return ''
+    data = data.strip()
+    if not _BASE64URL_RE.match(data):
+        return data
+    try:
+        padded = data + '=' * (-len(data) % 4)
+        return base64.urlsafe_b64decode(padded).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return data
+
+
+def html_to_text(html: str) -> str:
+    """将 HTML 转换为纯文本
+    :param html: HTML 内容
+    :return: 纯文本内容
+    """
+    if not html:
+        return ''
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['script', 'style']):
+        tag.decompose()
+    return soup.get_text(separator='\n')
+
+
+def normalize_whitespace(text: str) -> str:
+    """合并多余空白，保留段落分隔
+    :param text: 原始文本
+    :return: 规整后的文本
+    """
+    paragraphs = re.split(r'\n\s*\n', text or '')
+    cleaned = [' '.join(p.split()) for p in paragraphs]
+    return '\n\n'.join(p for p in cleaned if p)
+
+
+def get_email_text(email: Any) -> str:
+    """获取邮件的纯文本内容（主题 + 正文）
+    :param email: 邮件模型对象
+    :return: 纯文本内容
+    """
+    body = decode_body(getattr(email, 'body', '') or '')
+    if not body.strip():
+        body = html_to_text(decode_body(getattr(email, 'html_body', '') or ''))
+    elif _HTML_TAG_RE.search(body):
+        body = html_to_text(body)
+    subject = getattr(email, 'subject', '') or ''
+    return normalize_whitespace(f"{subject}\n\n{body}")
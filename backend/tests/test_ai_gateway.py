@@ -0,0 +1,144 @@
+"""
+AI 网关测试模块
+
+测试内容:
+1. 延迟统计的分位数与错误率
+2. 预热后请求发给最快的后端
+3. 后端失败时切换到其他后端
+4. 主后端偶发变慢时对冲请求降低尾延迟
+"""
+import itertools
+import time
+import pytest
+from app.service.ai import gateway
+from app.service.ai.base_ai_service import BaseAIService, AIServiceError
+from app.service.ai.gateway import AIGateway, LatencyTracker
+
+_names = itertools.count()
+
+
+class FakeBackend(BaseAIService):
+    """按给定延迟返回结果的后端"""
+
+    def __init__(self, delay=0.0, fail=False, slow_every=0, slow_delay=0.0):
+        super().__init__("key", f"model-{next(_names)}")
+        self.delay = delay
+        self.fail = fail
+        self.slow_every = slow_every
+        self.slow_delay = slow_delay
+        self.calls = 0
+
+    def validate_config(self, config):
+        return True
+
+    def chat(self, message, **kwargs):
+        self.calls += 1
+        if self.slow_every and self.calls % self.slow_every == 0:
+            time.sleep(self.slow_delay)
+        else:
+            time.sleep(self.delay)
+        if self.fail:
+            raise AIServiceError("后端不可用")
+        return {"response": message}
+
+
+@pytest.fixture(autouse=True)
+def no_explore(monkeypatch):
+    monkeypatch.setattr(gateway, "EXPLORE_RATE", 0.0)
+
+
+def make_gateway(hedge=False, hedge_ratio=0.1, **backends):
+    return AIGateway("key", "model", backends=backends, hedge=hedge, hedge_ratio=hedge_ratio)
+
+
+class TestLatencyTracker:
+    """测试延迟统计"""
+
+    def test_percentiles_and_error_rate(self):
+        tracker = LatencyTracker(window=50)
+        for _ in range(5):
+            tracker.record(0.1)
+        assert tracker.percentile(0.5) is None
+        for i in range(5, 20):
+            tracker.record(0.1 * (i + 1))
+        assert tracker.percentile(0.5) == pytest.approx(1.1)
+        assert tracker.percentile(0.95) == pytest.approx(2.0)
+        assert tracker.healthy(0.5)
+
+        for _ in range(30):
+            tracker.record(5.0, ok=False)
+        assert tracker.error_rate() == pytest.approx(0.6)
+        assert not tracker.healthy(0.5)
+        assert tracker.stats()["errors"] == 30
+
+
+class TestAIGateway:
+    """测试 AI 网关"""
+
+    def test_routes_to_fastest_backend(self):
+        slow, fast = FakeBackend(delay=0.02), FakeBackend(delay=0.001)
+        ai = make_gateway(slow=slow, fast=fast)
+        for _ in range(30):
+            ai.chat("hi")
+        assert ai.rank()[0] == "fast"
+        # 预热阶段两个后端各自积累样本后，其余请求都发给更快的后端
+        before = slow.calls
+        results = [ai.chat("hi") for _ in range(10)]
+        assert slow.calls == before
+        assert all(result["backend"] == "fast" for result in results)
+        ai.close()
+
+    def test_fails_over_to_next_backend(self):
+        broken, backup = FakeBackend(fail=True), FakeBackend()
+        ai = make_gateway(broken=broken, backup=backup)
+        for _ in range(12):
+            assert ai.chat("hi")["backend"] == "backup"
+        # 错误率超过上限后不再优先请求失败的后端
+        assert ai.rank() == ["backup", "broken"]
+        assert ai.stats()["broken"]["errors"] == broken.calls
+
+        with pytest.raises(AIServiceError):
+            make_gateway(only=FakeBackend(fail=True)).chat("hi")
+        ai.close()
+
+    def test_hedging_cuts_tail_latency(self):
+        # 主后端每 25 次有一次很慢，慢请求不影响其 p95
+        primary = FakeBackend(delay=0.002, slow_every=25, slow_delay=0.3)
+        backup = FakeBackend(delay=0.01)
+        ai = make_gateway(hedge=True, hedge_ratio=0.5, primary=primary, backup=backup)
+        for _ in range(20):
+            ai._call("backup", "warm", {})
+            ai._call("primary", "warm", {})
+
+        latencies = []
+        for _ in range(30):
+            start = time.perf_counter()
+            ai.chat("hi")
+            latencies.append(time.perf_counter() - start)
+        assert max(latencies) < 0.2
+        stats = ai.stats()["primary"]
+        assert stats["hedges"] >= 1 and stats["hedge_wins"] >= 1
+        ai.close()
+
+    def test_server_backups_require_opt_in(self, monkeypatch):
+        monkeypatch.setattr(gateway, "AI_GATEWAY_BACKENDS", ["deepseek", "openai"])
+        monkeypatch.setenv("OPENAI_API_KEY", "server-key")
+        monkeypatch.setenv("OPENAI_MODEL", "gpt-4o-mini")
+        # 未开启时客户端请求只使用自己的密钥
+        assert list(gateway.build_backends("client-key", "deepseek-chat")) == ["deepseek"]
+        backends = gateway.build_backends("client-key", "deepseek-chat", server_backups=True)
+        assert list(backends) == ["deepseek", "openai"]
+        assert backends["openai"].api_key == "server-key"
+        for service in backends.values():
+            service.close()
+
+    def test_reports_answering_model_and_shares_executor(self):
+        broken, backup = FakeBackend(fail=True), FakeBackend()
+        ai, other = make_gateway(broken=broken, backup=backup), make_gateway(only=FakeBackend())
+        assert ai._executor is other._executor
+        results = ai.batch_chat(["a", "b"])
+        assert [result["model"] for result in results] == [backup.model] * 2
+        other.close()
+        # 关闭一个网关不影响其他网关的对冲请求
+        assert not ai._executor._shutdown
+        ai.close()
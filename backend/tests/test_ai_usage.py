@@ -0,0 +1,231 @@
+"""
+AI 用量记录测试模块
+
+测试内容:
+1. 不同接口用量字段的统一与费用估算
+2. 按用户和功能记录调用，命中缓存与流式调用的记录方式
+3. 按用户和日期汇总用量
+4. 每日预算的降级与推迟，分析队列推迟超出预算的用户
+5. 运行指标接口需要登录
+"""
+import json
+import time
+from datetime import datetime
+import pytest
+from flask import Flask
+from app import create_app
+from app.db.database import db
+from app.models import AIUsage, AnalysisJob, Email, User
+from app.service import analysis_queue
+from app.service.ai.ai_service import AIServiceFactory
+from app.service.ai.base_ai_service import AIServiceError, BaseAIService
+from app.service.ai.usage import (
+    MeteredAIService, UsageLedger, estimate_cost, normalize_usage, usage_context
+)
+from app.service.analysis_queue import AnalysisQueue
+
+
+class FakeService(BaseAIService):
+    """返回固定用量的 AI 服务"""
+
+    def __init__(self, usage=None, cached=False):
+        super().__init__("key", "deepseek-chat")
+        self.usage = usage
+        self.cached = cached
+
+    def validate_config(self, config):
+        return True
+
+    def chat(self, message, **kwargs):
+        result = {"response": json.dumps({"sentiment": "neutral", "keywords": [],
+                                          "categories": ["工作"], "priority": "normal"})}
+        if self.usage:
+            result["usage"] = self.usage
+        if self.cached:
+            result["cached"] = True
+        return result
+
+    def chat_stream(self, message, **kwargs):
+        yield "hello "
+        yield "world"
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(email="a@example.com"), User(email="b@example.com")])
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+class TestUsageHelpers:
+    """测试用量字段与费用"""
+
+    def test_normalize_usage(self):
+        deepseek = {"prompt_tokens": 100, "completion_tokens": 20, "prompt_cache_hit_tokens": 64}
+        openai = {"prompt_tokens": 100, "completion_tokens": 20,
+                  "prompt_tokens_details": {"cached_tokens": 32}}
+        assert normalize_usage(deepseek) == (100, 20, 64)
+        assert normalize_usage(openai) == (100, 20, 32)
+        assert normalize_usage(None) == (0, 0, 0)
+
+    def test_estimate_cost(self):
+        full = estimate_cost("deepseek-chat", 1_000_000, 0)
+        cached = estimate_cost("deepseek-chat", 1_000_000, 0, cached_tokens=1_000_000)
+        assert full == pytest.approx(0.27) and cached == pytest.approx(0.07)
+        assert estimate_cost("unknown-model", 1000, 1000) == 0.0
+
+
+class TestMeteredAIService:
+    """测试记录用量的 AI 服务"""
+
+    def test_records_usage_with_context(self, app):
+        ledger = UsageLedger()
+        service = MeteredAIService(FakeService({"prompt_tokens": 120, "completion_tokens": 30,
+                                                "prompt_cache_hit_tokens": 100}), "deepseek", ledger)
+        with usage_context(user_id=1, feature="chat"):
+            service.chat("hi")
+        MeteredAIService(FakeService(cached=True), "deepseek", ledger).chat("hi")
+        MeteredAIService(FakeService(), "deepseek", ledger).chat("hello there")
+
+        assert ledger.flush() == 3
+        rows = AIUsage.query.order_by(AIUsage.id).all()
+        assert (rows[0].user_id, rows[0].feature, rows[0].prompt_tokens, rows[0].cached_tokens) == (1, "chat", 120, 100)
+        assert rows[0].cost > 0
+        assert rows[1].cache_hit and rows[1].prompt_tokens == 0 and rows[1].feature == "unknown"
+        assert rows[2].estimated and rows[2].prompt_tokens > 0
+
+    def test_stream_keeps_caller_context(self, app):
+        ledger = UsageLedger()
+        service = MeteredAIService(FakeService(), "deepseek", ledger)
+        with usage_context(user_id=2, feature="chat_stream"):
+            stream = service.chat_stream("hi")
+        # 流在上下文结束后才被迭代
+        assert "".join(stream) == "hello world"
+        ledger.flush()
+        row = AIUsage.query.one()
+        assert (row.user_id, row.feature, row.estimated, row.success) == (2, "chat_stream", True, True)
+        assert row.completion_tokens > 0
+
+    def test_batch_records_each_success_in_caller_context(self, app):
+        class SlowFailingService(FakeService):
+            def chat(self, message, **kwargs):
+                if message == "bad":
+                    raise ValueError("boom")
+                time.sleep(0.05 if message == "slow" else 0)
+                return super().chat(message, **kwargs)
+
+        ledger = UsageLedger()
+        service = MeteredAIService(SlowFailingService({"prompt_tokens": 10, "completion_tokens": 5}),
+                                   "deepseek", ledger)
+        with usage_context(user_id=1, feature="analysis"):
+            results = service.batch_chat(["fast", "bad", "slow"])
+
+        assert isinstance(results[1], AIServiceError)
+        # 失败的请求不记录；工作线程中的请求同样记到调用方的用户和功能名下，耗时各自计算
+        assert ledger.flush() == 2
+        rows = AIUsage.query.order_by(AIUsage.latency_ms).all()
+        assert [(r.user_id, r.feature, r.success) for r in rows] == [(1, "analysis", True)] * 2
+        assert rows[0].latency_ms < 50 <= rows[1].latency_ms
+
+    def test_records_answering_model(self, app):
+        class BackupService(FakeService):
+            def chat(self, message, **kwargs):
+                # 网关切换到备用后端时结果带有实际回答的模型
+                return dict(super().chat(message, **kwargs), model="gpt-4o-mini")
+
+        ledger = UsageLedger()
+        MeteredAIService(BackupService({"prompt_tokens": 10, "completion_tokens": 5}), "gateway", ledger).chat("hi")
+        ledger.flush()
+        assert AIUsage.query.one().model == "gpt-4o-mini"
+
+
+class TestMetricsRoute:
+    """测试运行指标接口"""
+
+    def test_metrics_require_login(self):
+        app = create_app('test')
+        client = app.test_client()
+        assert client.get('/api/ai/metrics').status_code == 401
+        with app.app_context():
+            db.session.add(User(email="a@example.com"))
+            db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user'] = {'email': 'a@example.com'}
+        response = client.get('/api/ai/metrics')
+        assert response.status_code == 200 and "usage" in response.get_json()
+        app.extensions['scheduler'].shutdown(wait=False)
+        with app.app_context():
+            db.drop_all()
+
+
+class TestUsageLedger:
+    """测试用量汇总与预算"""
+
+    def test_summary_per_user_and_day(self, app):
+        ledger = UsageLedger()
+        for user_id, feature, tokens in [(1, "chat", 100), (1, "summarize", 50), (2, "chat", 10)]:
+            ledger.record("deepseek", "deepseek-chat", tokens, tokens, user_id=user_id, feature=feature)
+
+        daily = ledger.summary(days=1)
+        assert [(row["user_id"], row["calls"], row["total_tokens"]) for row in daily] == [(1, 2, 300), (2, 1, 20)]
+        assert daily[0]["day"] == str(datetime.now().date())
+        by_feature = ledger.summary(user_id=1, by_feature=True)
+        assert {row["feature"]: row["total_tokens"] for row in by_feature} == {"chat": 200, "summarize": 100}
+
+    def test_budget_downgrade_and_defer(self, app):
+        ledger = UsageLedger(daily_budget=1000, downgrade_ratio=0.5, downgrade_model="deepseek-lite")
+        ledger.record("deepseek", "deepseek-chat", 300, 100, user_id=1)
+        ledger.flush()
+        ledger.record("deepseek", "deepseek-chat", 100, 0, user_id=1)
+        # 已写库和仍在缓冲中的记录都计入当天用量
+        assert ledger.used_today(1) == 500
+
+        assert ledger.check_budget(1, "deepseek-chat", 0).action == "allow"
+        decision = ledger.check_budget(1, "deepseek-chat", 100)
+        assert (decision.action, decision.model) == ("downgrade", "deepseek-lite")
+
+        ledger.record("deepseek", "deepseek-lite", 400, 100, user_id=1)
+        decision = ledger.check_budget(1, "deepseek-chat", 100)
+        assert decision.action == "defer" and not decision.allowed and decision.retry_after > 0
+        assert ledger.check_budget(2, "deepseek-chat", 100).action == "allow"
+        assert ledger.check_budget(None, "deepseek-chat", 10 ** 9).allowed
+
+
+class TestQueueBudget:
+    """测试分析队列的预算检查"""
+
+    def test_over_budget_user_is_deferred(self, app, monkeypatch):
+        ledger = UsageLedger(daily_budget=100)
+        monkeypatch.setattr(analysis_queue, "get_usage_ledger", lambda: ledger)
+        monkeypatch.setattr(analysis_queue, "get_local_classifier", lambda: None)
+        monkeypatch.setattr(AIServiceFactory, "create_service",
+                            lambda provider, **kwargs: MeteredAIService(FakeService(), provider, ledger))
+        monkeypatch.setenv("DEEPSEEK_API_KEY", "env-key")
+        monkeypatch.setitem(app.config, "ANALYSIS_USE_SERVER_KEY", True)
+
+        emails = [Email(user_id=user_id, subject="Report", from_email="boss@corp.com",
+                        body="Quarterly report needs review.", received_at=datetime(2024, 5, 1))
+                  for user_id in (1, 2)]
+        db.session.add_all(emails)
+        db.session.commit()
+        ledger.record("deepseek", "deepseek-chat", 100, 50, user_id=1)
+
+        queue = AnalysisQueue(app, workers=0)
+        queue.enqueue(1, [emails[0].id], "deepseek-chat")
+        queue.enqueue(2, [emails[1].id], "deepseek-chat")
+        processed = [queue.process_next() for _ in range(3)]
+
+        jobs = {job.user_id: job for job in AnalysisJob.query.all()}
+        assert jobs[1].status == "queued" and jobs[1].attempts == 0
+        assert jobs[2].status == "done"
+        assert processed == [1, 1, 0]
+        assert queue.get_stats()["deferred"] == 1
+        # 分析调用记到用户名下
+        assert ledger.used_today(2) > 0
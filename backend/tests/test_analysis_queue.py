@@ -0,0 +1,197 @@
+"""
+邮件分析任务队列测试模块
+
+测试内容:
+1. 交互任务优先于补分析任务
+2. 同优先级内按用户轮转
+3. 积压超过上限时拒绝新任务
+4. 失败任务重试与 API 密钥只保存在内存中
+5. 定时补分析默认使用服务器密钥
+"""
+import json
+from datetime import datetime
+import pytest
+from flask import Flask
+from app.db.database import db
+from app.models import User, Email, AnalysisJob
+from app.service.ai.ai_service import AIServiceFactory
+from app.service import analysis_queue
+from app.service.email_analysis_store import analyze_pending_task
+from app.service.analysis_queue import (
+    AnalysisQueue, QueueFullError, PRIORITY_BACKFILL, PRIORITY_INTERACTIVE
+)
+
+
+class FakeService:
+    """记录请求的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        if self.fail:
+            raise RuntimeError("upstream down")
+        self.prompts.append(message)
+        return {"response": json.dumps({"sentiment": "neutral", "keywords": [],
+                                        "categories": ["工作"], "priority": "normal"})}
+
+
+@pytest.fixture
+def queue_app(monkeypatch):
+    """使用内存数据库的应用和不启动线程的队列"""
+    service = FakeService()
+    keys = []
+
+    def create_service(provider, **kwargs):
+        keys.append(kwargs.get("api_key"))
+        return service
+
+    monkeypatch.setattr(AIServiceFactory, "create_service", create_service)
+    monkeypatch.setattr(analysis_queue, "get_local_classifier", lambda: None)
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "env-key")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["ANALYSIS_USE_SERVER_KEY"] = True
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        users = [User(email=f"u{i}@example.com") for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        queue = AnalysisQueue(app, workers=0, batch_size=2, max_pending=4, max_pending_per_user=3)
+        yield queue, users, service, keys
+        db.session.remove()
+        db.drop_all()
+
+
+def add_emails(user, count):
+    emails = [Email(user_id=user.id, subject=f"Report {i}", from_email="boss@corp.com",
+                    body=f"Quarterly report section {i} needs review.", received_at=datetime(2024, 5, 1))
+              for i in range(count)]
+    db.session.add_all(emails)
+    db.session.commit()
+    return [e.id for e in emails]
+
+
+def claimed_users(queue):
+    jobs = queue.claim()
+    for job in jobs:
+        job.status = "done"
+    db.session.commit()
+    return {job.user_id for job in jobs}, len(jobs)
+
+
+class TestAnalysisQueue:
+    """测试分析任务队列"""
+
+    def test_interactive_before_backfill_and_round_robin(self, queue_app):
+        queue, (alice, bob), _, _ = queue_app
+        queue.enqueue(alice.id, add_emails(alice, 4), "deepseek-chat", priority=PRIORITY_BACKFILL)
+        queue.enqueue(bob.id, add_emails(bob, 1), "deepseek-chat", priority=PRIORITY_BACKFILL)
+        queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")
+
+        assert claimed_users(queue) == ({alice.id}, 1)
+        # alice 刚被调度过，bob 的补分析任务先于 alice 剩余的任务
+        assert claimed_users(queue) == ({bob.id}, 1)
+        assert claimed_users(queue) == ({alice.id}, 2)
+        assert claimed_users(queue) == ({alice.id}, 2)
+        assert claimed_users(queue) == (set(), 0)
+
+    def test_backpressure(self, queue_app):
+        queue, (alice, bob), _, _ = queue_app
+        queue.enqueue(alice.id, add_emails(alice, 3), "deepseek-chat")
+        with pytest.raises(QueueFullError) as e:
+            queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")
+        assert e.value.retry_after >= 1
+
+        queue.enqueue(bob.id, add_emails(bob, 1), "deepseek-chat")
+        with pytest.raises(QueueFullError):
+            queue.enqueue(bob.id, add_emails(bob, 1), "deepseek-chat")
+        # 补分析任务不受交互上限限制
+        queue.enqueue(bob.id, add_emails(bob, 5), "deepseek-chat", priority=PRIORITY_BACKFILL)
+        assert queue.get_stats()["rejected"] == 2
+
+    def test_runs_jobs_and_keeps_key_in_memory(self, queue_app):
+        queue, (alice, _), service, keys = queue_app
+        email_ids = add_emails(alice, 2)
+        jobs = queue.enqueue(alice.id, email_ids, "deepseek-chat", api_key="user-key")
+        # 重复提交复用未完成的任务
+        assert [j.id for j in queue.enqueue(alice.id, email_ids, "deepseek-chat")] == [j.id for j in jobs]
+
+        assert queue.process_next() == 2
+        status = queue.get_job(jobs[0].id, alice.id)
+        assert status["status"] == "done"
+        assert status["analysis"]["categories"] == ["工作"]
+        assert keys == ["user-key"]
+        assert "user-key" not in json.dumps([j.to_dict() for j in AnalysisJob.query.all()])
+        assert queue.get_job(jobs[0].id, alice.id + 100) is None
+
+    def test_server_key_requires_opt_in(self, queue_app):
+        queue, (alice, _), _, keys = queue_app
+        job = queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")[0]
+        queue.app.config["ANALYSIS_USE_SERVER_KEY"] = False
+        queue.max_attempts = 1
+
+        # 未提交密钥且未开启服务器密钥时不创建 AI 服务，任务失败
+        queue.process_next()
+        assert keys == []
+        assert queue.get_job(job.id, alice.id)["status"] == "failed"
+
+        queue.app.config["ANALYSIS_USE_SERVER_KEY"] = True
+        job = queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")[0]
+        queue.process_next()
+        assert keys == ["env-key"]
+        assert queue.get_job(job.id, alice.id)["status"] == "done"
+
+    def test_scheduled_backfill_uses_server_key_by_default(self, queue_app):
+        queue, (alice, _), _, keys = queue_app
+        queue.app.config["ANALYSIS_USE_SERVER_KEY"] = False
+        queue.app.extensions["analysis_queue"] = queue
+        email_ids = add_emails(alice, 2)
+
+        # 定时任务只提交补分析任务，由服务器发起，不需要开启 ANALYSIS_USE_SERVER_KEY
+        analyze_pending_task(alice.id)
+        assert queue.process_next() == 2
+        assert keys == ["env-key"]
+        jobs = AnalysisJob.query.filter(AnalysisJob.email_id.in_(email_ids)).all()
+        assert [(job.priority, job.status) for job in jobs] == [(PRIORITY_BACKFILL, "done")] * 2
+
+    def test_scheduled_backfill_skipped_without_server_key(self, queue_app, monkeypatch):
+        queue, (alice, _), _, keys = queue_app
+        queue.app.extensions["analysis_queue"] = queue
+        monkeypatch.delenv("DEEPSEEK_API_KEY")
+        add_emails(alice, 2)
+
+        # 没有可用密钥时不提交注定失败的任务
+        analyze_pending_task(alice.id)
+        assert AnalysisJob.query.count() == 0
+        assert queue.process_next() == 0 and keys == []
+
+    def test_failed_jobs_retry_then_fail(self, queue_app):
+        queue, (alice, _), service, _ = queue_app
+        service.fail = True
+        queue.max_attempts = 2
+        job = queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")[0]
+
+        queue.process_next()
+        assert queue.get_job(job.id, alice.id)["status"] == "queued"
+        queue.process_next()
+        status = queue.get_job(job.id, alice.id)
+        assert status["status"] == "failed"
+        assert status["attempts"] == 2
+
+    def test_recover_requeues_running_jobs(self, queue_app):
+        queue, (alice, _), _, _ = queue_app
+        job = queue.enqueue(alice.id, add_emails(alice, 1), "deepseek-chat")[0]
+        queue.claim()
+        # 刚开始执行的任务可能属于其他存活的进程，不放回队列
+        assert queue.recover() == 0
+        assert queue.get_job(job.id, alice.id)["status"] == "running"
+        AnalysisJob.query.filter_by(id=job.id).update({"started_at": datetime(2024, 1, 1)})
+        db.session.commit()
+        assert queue.recover() == 1
+        assert queue.get_job(job.id, alice.id)["status"] == "queued"
+        assert queue.get_job(job.id, alice.id)["priority"] == PRIORITY_INTERACTIVE
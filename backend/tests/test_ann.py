@@ -0,0 +1,85 @@
+"""
+近似最近邻索引测试模块
+
+测试内容:
+1. IVF 索引召回率
+2. 增量插入与删除
+3. 向量存储在规模达到阈值后经索引检索，并在重启后恢复
+"""
+import numpy as np
+from app.service.embedding import ann
+from app.service.embedding.ann import IVFIndex, benchmark_ivf
+from app.service.embedding.backends import normalize_rows
+from app.service.embedding.store import VectorStore
+
+
+def clustered_vectors(count, dim=32, centers=20, seed=0):
+    rng = np.random.default_rng(seed)
+    base = normalize_rows(rng.standard_normal((centers, dim)).astype(np.float32))
+    noise = 0.1 * rng.standard_normal((count, dim)).astype(np.float32)
+    return normalize_rows(base[rng.integers(0, centers, count)] + noise)
+
+
+class TestIVFIndex:
+    """测试 IVF 索引"""
+
+    def test_recall_against_exact_search(self):
+        vectors = clustered_vectors(5000)
+        report = benchmark_ivf(vectors, vectors[:50], k=10, nprobes=(1, 16))
+        assert report[-1]["recall"] >= 0.95
+        assert report[0]["recall"] <= report[-1]["recall"]
+
+    def test_incremental_add_and_remove(self):
+        vectors = clustered_vectors(1000)
+        index = IVFIndex()
+        index.train(vectors, nlist=16)
+        index.add(list(range(1000)), vectors)
+
+        index.remove([0, 1])
+        index.add([5000], vectors[:1])
+
+        assert 0 not in index and 5000 in index
+        assert len(index) == 999
+        assert 5000 in index.candidates(vectors[0], nprobe=1)
+
+    def test_needs_rebuild(self):
+        index = IVFIndex()
+        assert not index.needs_rebuild(10, min_vectors=100)
+        assert index.needs_rebuild(100, min_vectors=100)
+        index.train(clustered_vectors(100), nlist=4)
+        assert not index.needs_rebuild(150, min_vectors=100)
+        assert index.needs_rebuild(250, min_vectors=100)
+
+
+class TestVectorStoreIndex:
+    """测试向量存储中的索引"""
+
+    def test_store_uses_index_and_restores_it(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("app.service.embedding.store.ANN_MIN_VECTORS", 500)
+        vectors = clustered_vectors(2000)
+        store = VectorStore(str(tmp_path), 32)
+        store.add(list(range(1, 2001)), vectors, [{}] * 2000)
+        store.rebuild_index(nlist=32)
+
+        exact = store.search(vectors[10], k=5, exact=True)
+        assert store.search(vectors[10], k=5) == exact
+
+        # 建索引后新增的向量在重新打开时补进索引
+        store.add([9999], vectors[10:11], [{}])
+        store._vectors.flush()
+        store.save()
+        reopened = VectorStore(str(tmp_path), 32)
+        assert reopened.index.is_trained
+        assert 9999 in reopened.index
+        assert 9999 in [i for i, _ in reopened.search(vectors[10], k=5)]
+
+    def test_probing_every_list_matches_exact_search(self, tmp_path, monkeypatch):
+        monkeypatch.setattr("app.service.embedding.store.ANN_MIN_VECTORS", 500)
+        vectors = clustered_vectors(2000)
+        store = VectorStore(str(tmp_path), 32)
+        store.add(list(range(1, 2001)), vectors, [{}] * 2000)
+        store.rebuild_index(nlist=16)
+
+        # 探测全部列表时候选即全部行（按列表顺序排列），结果必须与精确检索一致
+        for query in vectors[[3, 500, 1999]]:
+            assert store.search(query, k=10, nprobe=16) == store.search(query, k=10, exact=True)
@@ -0,0 +1,109 @@
+"""
+异步 DeepSeek 服务测试模块
+
+测试内容:
+1. 并发批量请求
+2. 单请求超时
+3. 调用方取消传递到上游请求
+"""
+import asyncio
+import json
+import time
+import httpx
+import pytest
+from app.service.ai.async_deepseek_service import AsyncDeepSeekService
+from app.service.ai.base_ai_service import AIServiceError
+
+
+def _completion(content: str) -> dict:
+    return {"choices": [{"message": {"content": content}}]}
+
+
+@pytest.fixture
+def make_service():
+    """创建使用模拟传输层的服务"""
+    services = []
+
+    def factory(handler, **kwargs):
+        service = AsyncDeepSeekService(api_key="test-key", **kwargs)
+        service.client = httpx.AsyncClient(
+            base_url=service.BASE_URL,
+            transport=httpx.MockTransport(handler)
+        )
+        services.append(service)
+        return service
+
+    yield factory
+    for service in services:
+        service.close()
+
+
+class TestAsyncDeepSeekService:
+    """测试异步 DeepSeek 服务"""
+
+    def test_batch_runs_concurrently(self, make_service):
+        """批量请求并发执行，耗时接近单个请求"""
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            message = json.loads(request.content)["messages"][0]["content"]
+            return httpx.Response(200, json=_completion(message.upper()))
+
+        service = make_service(handler, max_concurrency=8)
+
+        start = time.monotonic()
+        results = service.batch_chat([f"m{i}" for i in range(8)])
+        elapsed = time.monotonic() - start
+
+        assert [r["response"] for r in results] == [f"M{i}" for i in range(8)]
+        assert elapsed < 0.2 * 4
+
+    def test_concurrency_is_bounded(self, make_service):
+        """同时进行的请求数不超过 max_concurrency"""
+        state = {"active": 0, "peak": 0}
+
+        async def handler(request):
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.05)
+            state["active"] -= 1
+            return httpx.Response(200, json=_completion("ok"))
+
+        service = make_service(handler, max_concurrency=2)
+        service.batch_chat(["x"] * 6)
+
+        assert state["peak"] == 2
+
+    def test_timeout_per_request(self, make_service):
+        """超时的请求返回 AIServiceError，其余请求不受影响"""
+        async def handler(request):
+            message = json.loads(request.content)["messages"][0]["content"]
+            await asyncio.sleep(1.0 if message == "slow" else 0)
+            return httpx.Response(200, json=_completion(message))
+
+        service = make_service(handler)
+        results = service.batch_chat(["fast", "slow"], timeout=0.1)
+
+        assert results[0]["response"] == "fast"
+        assert isinstance(results[1], AIServiceError)
+
+    def test_cancellation_propagates(self, make_service):
+        """调用方取消时上游请求也被取消"""
+        state = {"cancelled": False}
+
+        async def handler(request):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+            return httpx.Response(200, json=_completion("late"))
+
+        service = make_service(handler)
+
+        async def caller():
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(service.achat("hi"), timeout=0.1)
+
+        asyncio.run(caller())
+        time.sleep(0.1)
+        assert state["cancelled"] is True
@@ -0,0 +1,141 @@
+"""
+邮件对话会话测试模块
+
+测试内容:
+1. 只发送最近几轮问答原文，提示大小不随对话长度增长
+2. 窗口外的问答增量合并进摘要
+3. 按向量相似度召回相关的早期问答
+4. 已有数据库升级时补齐问答向量列
+"""
+from datetime import datetime
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, inspect, text
+from app.db.database import db, upgrade_schema
+from app.models import ChatHistory, ChatSession, Email, User
+from app.service.chat_session import CHAT_TEMPLATE, ChatSessionService
+from app.service.embedding import HashingEmbeddingBackend
+
+
+class SummaryService:
+    """记录摘要请求并返回固定摘要的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        return {"response": f"摘要{len(self.prompts)}"}
+
+
+@pytest.fixture
+def chat_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(email="me@example.com")
+        db.session.add(user)
+        db.session.commit()
+        email = Email(user_id=user.id, subject="Contract renewal", from_email="legal@corp.com",
+                      body="The vendor contract expires on June 30 and must be renewed.",
+                      received_at=datetime(2024, 5, 1))
+        db.session.add(email)
+        db.session.commit()
+        yield user, email
+        db.session.remove()
+        db.drop_all()
+
+
+def context_size(messages):
+    return sum(len(m["content"]) for m in messages)
+
+
+class TestChatSession:
+    """测试邮件对话会话"""
+
+    def test_context_is_bounded(self, chat_app):
+        user, email = chat_app
+        ai = SummaryService()
+        sessions = ChatSessionService(ai, backend=HashingEmbeddingBackend(dim=128), window=3, compact_turns=2)
+        session = sessions.get_session(user.id, email.id)
+
+        sizes = []
+        for n in range(20):
+            messages = sessions.build_context(session, email, f"question {n}")
+            sizes.append(context_size(messages))
+            sessions.record_turn(session, f"question {n} about the renewal", f"answer {n} " * 20)
+
+        assert messages[:len(CHAT_TEMPLATE.prefix)] == CHAT_TEMPLATE.prefix
+        # 窗口内 3 轮问答原文，更早的问答在摘要中
+        assert sum(1 for m in messages if m["role"] == "assistant") == 3
+        assert max(sizes[8:]) - min(sizes[8:]) < 600
+        assert ChatHistory.query.count() == 20
+        assert session.summarized_turns >= 14 and session.summary.startswith("摘要")
+
+    def test_summary_is_incremental(self, chat_app):
+        user, email = chat_app
+        ai = SummaryService()
+        sessions = ChatSessionService(ai, backend=HashingEmbeddingBackend(dim=128), window=2, compact_turns=2)
+        session = sessions.get_session(user.id, email.id)
+        for n in range(6):
+            sessions.record_turn(session, f"q{n}", f"a{n}")
+
+        assert len(ai.prompts) == 2
+        # 第二次只发送新增的问答和已有摘要
+        assert "q0" in ai.prompts[0] and "q1" in ai.prompts[0]
+        assert "q0" not in ai.prompts[1] and "摘要1" in ai.prompts[1] and "q3" in ai.prompts[1]
+        assert session.summarized_until == ChatHistory.query.order_by(ChatHistory.id).all()[3].id
+        assert ChatSession.query.count() == 1
+
+    def test_recalls_relevant_old_turn(self, chat_app):
+        user, email = chat_app
+        sessions = ChatSessionService(SummaryService(), backend=HashingEmbeddingBackend(dim=256),
+                                      window=2, compact_turns=100, recall=1)
+        session = sessions.get_session(user.id, email.id)
+        sessions.record_turn(session, "What is the penalty fee for late renewal?",
+                             "The penalty fee is 500 USD per week.")
+        for n in range(4):
+            sessions.record_turn(session, f"Who signs page {n}?", f"Alice signs page {n}.")
+
+        messages = sessions.build_context(session, email, "How much is the penalty fee?")
+        memory = [m["content"] for m in messages if m["role"] == "system" and "早期对话" in m["content"]]
+        assert memory and "500 USD" in memory[0]
+        assert "Alice signs page 0" not in memory[0]
+
+    def test_summary_failure_keeps_turns(self, chat_app):
+        user, email = chat_app
+
+        class Broken(SummaryService):
+            def chat(self, message, **kwargs):
+                raise RuntimeError("down")
+
+        sessions = ChatSessionService(Broken(), backend=HashingEmbeddingBackend(dim=64), window=1, compact_turns=1)
+        session = sessions.get_session(user.id, email.id)
+        for n in range(3):
+            sessions.record_turn(session, f"q{n}", f"a{n}")
+        assert session.summarized_until == 0 and ChatHistory.query.count() == 3
+
+
+class TestSchemaUpgrade:
+    """测试已有数据库的升级"""
+
+    def test_adds_embedding_column_to_existing_table(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE chat_histories (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                              "email_id INTEGER NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL)"))
+            conn.execute(text("INSERT INTO chat_histories (id, user_id, email_id, question, answer) "
+                              "VALUES (1, 1, 1, 'q', 'a')"))
+
+        assert upgrade_schema(engine) == ["chat_histories.embedding"]
+        engine.dispose()
+        assert "embedding" in {column["name"] for column in inspect(engine).get_columns("chat_histories")}
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT embedding FROM chat_histories WHERE id = 1")).scalar() is None
+        # 再次启动时不重复添加
+        assert upgrade_schema(engine) == []
+        engine.dispose()
@@ -0,0 +1,69 @@
+"""
+文本分块测试模块
+
+测试内容:
+1. token 估算
+2. 按段落切分与重叠
+3. 批次规划
+"""
+from app.service.ai.chunking import TokenBudget, estimate_tokens, split_text
+
+
+class TestEstimateTokens:
+    """测试 token 估算"""
+
+    def test_empty(self):
+        assert estimate_tokens('') == 0
+
+    def test_cjk_costs_more_than_ascii(self):
+        """中文字符的估算高于同等数量的英文字符"""
+        assert estimate_tokens('你好' * 50) > estimate_tokens('ab' * 50)
+
+
+class TestSplitText:
+    """测试文本切分"""
+
+    def test_short_text_single_chunk(self):
+        assert split_text('hello world', 100) == ['hello world']
+
+    def test_chunks_respect_budget(self):
+        """每块都不超过预算，并且在段落边界切分"""
+        paragraphs = [f"Paragraph {i} " + 'word ' * 40 for i in range(20)]
+        chunks = split_text('\n\n'.join(paragraphs), 200)
+
+        assert len(chunks) > 1
+        assert all(estimate_tokens(c) <= 200 for c in chunks)
+        assert all(c.startswith('Paragraph') for c in chunks)
+
+    def test_overlap(self):
+        """相邻块之间带有重叠段落"""
+        paragraphs = [f"P{i} " + 'x ' * 30 for i in range(10)]
+        chunks = split_text('\n\n'.join(paragraphs), 60, overlap_tokens=25)
+
+        first_tail = chunks[0].split('\n\n')[-1]
+        assert chunks[1].startswith(first_tail)
+
+    def test_oversized_paragraph_is_hard_split(self):
+        """没有句子边界的超长段落按字符切分"""
+        chunks = split_text('a' * 5000, 100)
+        assert all(estimate_tokens(c) <= 100 for c in chunks)
+        assert ''.join(chunks) == 'a' * 5000
+
+
+class TestTokenBudget:
+    """测试 token 预算"""
+
+    def test_plan_batches(self):
+        """按预算贪心装箱"""
+        budget = TokenBudget(context_window=1000, max_output_tokens=200, prompt_overhead=100)
+        texts = ['x' * 1000] * 5  # 每项约 300 + 16 token
+
+        batches = budget.plan_batches(texts)
+
+        assert batches == [[0, 1], [2, 3], [4]]
+
+    def test_plan_batches_output_limit(self):
+        """输出预算同样限制每批项数"""
+        budget = TokenBudget(context_window=10000, max_output_tokens=100, prompt_overhead=0)
+        batches = budget.plan_batches(['hi'] * 5, output_tokens_per_item=40)
+        assert [len(b) for b in batches] == [2, 2, 1]
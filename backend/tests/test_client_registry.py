@@ -0,0 +1,138 @@
+"""
+AI 客户端注册表测试模块
+
+测试内容:
+1. 按 (服务提供商, 密钥, 模型) 复用实例
+2. 密钥验证结果缓存
+3. 最近最少使用与空闲淘汰后延迟关闭连接
+4. 并发请求只创建一次实例
+5. 定时清理任务在没有新请求时关闭空闲实例
+"""
+import threading
+import time
+import pytest
+from app.service.ai.base_ai_service import BaseAIService, AIServiceError
+from app.service.ai import client_registry
+from app.service.ai.client_registry import AIClientRegistry, schedule_client_sweep
+from app.service.scheduler_service import SchedulerService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeService(BaseAIService):
+    """记录验证与关闭的 AI 服务"""
+
+    created = []
+
+    def __init__(self, api_key, model, valid=True):
+        super().__init__(api_key, model)
+        self.valid = valid
+        self.validations = 0
+        self.closed = False
+        FakeService.created.append(self)
+
+    def validate_config(self, config):
+        self.validations += 1
+        time.sleep(0.01)
+        return self.valid
+
+    def chat(self, message, **kwargs):
+        return {"response": message}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def registry():
+    FakeService.created = []
+    clock = FakeClock()
+    return AIClientRegistry(max_entries=2, idle_seconds=100, validation_ttl=50, close_grace=10, clock=clock), clock
+
+
+def get(registry, key, model="deepseek-chat", valid=True):
+    return registry.get("deepseek", key, model, lambda: FakeService(key, model, valid))
+
+
+class TestAIClientRegistry:
+    """测试 AI 客户端注册表"""
+
+    def test_reuses_clients_across_users(self, registry):
+        registry, _ = registry
+        alice, bob = get(registry, "key-a"), get(registry, "key-b")
+        for _ in range(3):
+            assert get(registry, "key-a") is alice
+            assert get(registry, "key-b") is bob
+        assert len(FakeService.created) == 2
+        assert registry.stats()["hits"] == 6
+        assert registry.stats()["validations"] == 2
+
+    def test_validation_cached_per_key(self, registry):
+        registry, clock = registry
+        get(registry, "key-a", model="deepseek-chat")
+        get(registry, "key-a", model="deepseek-reasoner")
+        assert registry.stats()["validations"] == 1
+
+        with pytest.raises(AIServiceError):
+            get(registry, "bad-key", valid=False)
+        assert FakeService.created[-1].closed
+        assert registry.stats()["size"] == 2
+
+    def test_lru_and_idle_eviction_close_after_grace(self, registry):
+        registry, clock = registry
+        a = get(registry, "key-a")
+        clock.now = 1
+        b = get(registry, "key-b")
+        clock.now = 2
+        get(registry, "key-a")
+        clock.now = 3
+        get(registry, "key-c")
+        # b 最久未使用被淘汰，但在宽限期内不关闭
+        assert not b.closed
+        clock.now = 20
+        registry.sweep()
+        assert b.closed and not a.closed
+        assert registry.stats()["evictions"] == 1
+
+        clock.now = 200
+        assert registry.sweep() == 0
+        clock.now = 220
+        assert registry.sweep() == 2
+        assert a.closed and registry.stats()["size"] == 0
+
+    def test_concurrent_requests_create_once(self, registry):
+        registry, _ = registry
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get(registry, "key-a")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(FakeService.created) == 1
+        assert all(service is results[0] for service in results)
+
+    def test_scheduled_sweep_closes_idle_client(self, registry, monkeypatch):
+        registry, clock = registry
+        monkeypatch.setattr(client_registry, "_client_registry", registry)
+        service = get(registry, "key-a")
+        scheduler = SchedulerService(start=False)
+        schedule_client_sweep(scheduler, 30)
+        sweep = scheduler.scheduler.get_job("ai_client_sweep")
+        assert scheduler.get_interval("ai_client_sweep") == 30
+
+        # 之后没有任何 get() 调用：空闲超时后由定时任务淘汰，宽限期后关闭
+        clock.now = 101
+        sweep.func()
+        assert not service.closed and registry.stats()["retired"] == 1
+        clock.now = 112
+        sweep.func()
+        assert service.closed and registry.stats()["retired"] == 0
+        assert schedule_client_sweep(scheduler, 0) is None
+        scheduler.shutdown()
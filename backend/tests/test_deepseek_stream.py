@@ -0,0 +1,80 @@
+"""
+DeepSeek 流式响应测试模块
+
+测试内容:
+1. SSE 数据行解析
+2. 流式生成器逐段返回内容
+3. 调用方关闭生成器时上游连接被关闭
+"""
+import json
+import httpx
+import pytest
+from app.service.ai.deepseek_service import DeepSeekService, parse_stream_line
+
+
+def _sse_line(content: str) -> bytes:
+    chunk = {"choices": [{"delta": {"content": content}}]}
+    return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+class RecordingStream(httpx.SyncByteStream):
+    """记录是否被关闭的响应流"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def make_service():
+    """创建使用模拟传输层的服务"""
+    def factory(stream):
+        service = DeepSeekService(api_key="test-key")
+        service.client = httpx.Client(
+            base_url=service.BASE_URL,
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=stream))
+        )
+        return service
+    return factory
+
+
+class TestParseStreamLine:
+    """测试 SSE 行解析"""
+
+    def test_delta(self):
+        assert parse_stream_line(_sse_line("你好").decode().strip()) == "你好"
+
+    def test_done(self):
+        assert parse_stream_line("data: [DONE]") is None
+
+    def test_non_data_line(self):
+        assert parse_stream_line(": keep-alive") == ""
+
+
+class TestChatStream:
+    """测试流式对话"""
+
+    def test_yields_deltas(self, make_service):
+        """按顺序返回每个文本片段，遇到 [DONE] 结束"""
+        stream = RecordingStream([_sse_line("Hel"), _sse_line("lo"), b"data: [DONE]\n\n"])
+        service = make_service(stream)
+
+        assert list(service.chat_stream("hi")) == ["Hel", "lo"]
+        assert stream.closed is True
+
+    def test_close_releases_upstream(self, make_service):
+        """调用方提前关闭生成器时，上游响应流被关闭"""
+        stream = RecordingStream([_sse_line(str(i)) for i in range(100)])
+        service = make_service(stream)
+
+        generator = service.chat_stream("hi")
+        assert next(generator) == "0"
+        generator.close()
+
+        assert stream.closed is True
@@ -0,0 +1,96 @@
+"""
+邮件分析结果存储测试模块
+
+测试内容:
+1. 已分析的邮件直接读库，不再调用 AI
+2. 只分析没有当前版本结果的邮件
+3. token 用量与分析结果一起保存
+"""
+import json
+from datetime import datetime
+import pytest
+from flask import Flask
+from app.db.database import db
+from app.models import User, Email, EmailAnalysis
+from app.service.email_analyzer import EmailAnalysisService
+from app.service.email_analysis_store import AnalysisStore
+
+
+@pytest.fixture
+def store_app():
+    """使用内存数据库的应用"""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(email="me@example.com")
+        db.session.add(user)
+        db.session.commit()
+        yield user
+        db.session.remove()
+        db.drop_all()
+
+
+def add_email(user, n):
+    email = Email(user_id=user.id, subject=f"Contract draft v{n}", from_email="alice@partner.com",
+                  body=f"Please review section {n} of the contract before Friday.",
+                  received_at=datetime(2024, 5, n))
+    db.session.add(email)
+    db.session.commit()
+    return email
+
+
+class UsageService:
+    """返回 token 用量的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        return {
+            "response": json.dumps({"sentiment": "neutral", "keywords": ["合同"],
+                                    "categories": ["工作"], "priority": "high"}),
+            "usage": {"prompt_tokens": 120, "completion_tokens": 30}
+        }
+
+
+class TestAnalysisStore:
+    """测试邮件分析结果存储"""
+
+    def test_reopening_reads_stored_result(self, store_app):
+        email = add_email(store_app, 1)
+        service = UsageService()
+        analyzer = EmailAnalysisService(service)
+
+        first = AnalysisStore.analyze_email(email, analyzer)
+        second = AnalysisStore.analyze_email(email, analyzer)
+
+        assert len(service.prompts) == 1
+        assert second.id == first.id
+        assert second.to_dict()["priority"] == "high"
+        assert (first.source, first.prompt_tokens, first.completion_tokens) == ("llm", 120, 30)
+        assert AnalysisStore.latest(email.id).id == first.id
+
+        AnalysisStore.analyze_email(email, analyzer, force=True)
+        assert len(service.prompts) == 2
+        assert EmailAnalysis.query.count() == 1
+
+    def test_analyze_pending_only_new_emails(self, store_app):
+        emails = [add_email(store_app, n) for n in range(1, 4)]
+        service = UsageService()
+        analyzer = EmailAnalysisService(service)
+        AnalysisStore.analyze_email(emails[0], analyzer)
+
+        assert [e.id for e in AnalysisStore.pending_emails(store_app.id, "deepseek-chat")] == \
+            [emails[2].id, emails[1].id]
+        assert AnalysisStore.analyze_pending(store_app.id, analyzer) == 2
+        assert AnalysisStore.analyze_pending(store_app.id, analyzer) == 0
+        assert AnalysisStore.list_analyses(store_app.id)["total"] == 3
+
+        # 分析器版本或模型变化后旧结果不再视为当前结果
+        assert len(AnalysisStore.pending_emails(store_app.id, "deepseek-chat", version="analyzer-v0")) == 3
+        assert len(AnalysisStore.pending_emails(store_app.id, "other-model")) == 3
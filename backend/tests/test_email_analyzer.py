@@ -0,0 +1,85 @@
+"""
+邮件分析服务测试模块
+
+测试内容:
+1. 单封邮件分析与长邮件分块
+2. 多封邮件打包分析、按ID映射与失败重试
+"""
+import json
+import re
+from types import SimpleNamespace
+from app.service.ai.chunking import TokenBudget
+from app.service.email_analyzer import EmailAnalysisService
+
+
+def make_email(email_id, body="Please review the quarterly report."):
+    return SimpleNamespace(id=email_id, user_id=None, subject=f"Subject {email_id}",
+                           from_email="a@example.com", body=body, html_body="")
+
+
+class PackedService:
+    """按提示中的邮件ID返回打包结果的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self, broken_ids=()):
+        self.prompts = []
+        self.broken_ids = set(broken_ids)
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        ids = [int(i) for i in re.findall(r"\[id=(\d+)\]", message)]
+        if not ids:
+            return {"response": json.dumps({"sentiment": "negative", "keywords": ["solo"],
+                                            "categories": ["工作"], "priority": "high"})}
+        items = []
+        for email_id in ids:
+            if email_id in self.broken_ids:
+                self.broken_ids.discard(email_id)  # 只失败一次
+                items.append({"id": email_id, "sentiment": "angry"})
+                continue
+            items.append({"id": email_id, "sentiment": "positive", "keywords": [f"k{email_id}"],
+                          "categories": ["通知"], "priority": "low"})
+        return {"response": "```json\n" + json.dumps(items) + "\n```"}
+
+
+class TestEmailAnalysisService:
+    """测试邮件分析服务"""
+
+    def test_default_result_without_ai_service(self):
+        result = EmailAnalysisService().analyze_email(make_email(1))
+        assert result["sentiment"] == "neutral"
+
+    def test_long_email_is_chunked(self):
+        """超出预算的长邮件分块分析后合并"""
+        service = PackedService()
+        analyzer = EmailAnalysisService(
+            service, budget=TokenBudget(context_window=400, max_output_tokens=100, prompt_overhead=100)
+        )
+        body = "\n\n".join(["word " * 100] * 6)
+
+        result = analyzer.analyze_email(make_email(1, body=body))
+
+        assert len(service.prompts) > 1
+        assert result["priority"] == "high"
+
+    def test_packed_batch_uses_few_calls(self):
+        """多封邮件打包在一个请求中，结果按ID映射"""
+        service = PackedService()
+        analyzer = EmailAnalysisService(service)
+
+        results = analyzer.analyze_emails([make_email(i) for i in range(1, 21)])
+
+        assert len(service.prompts) == 1
+        assert [r["keywords"] for r in results] == [[f"k{i}"] for i in range(1, 21)]
+
+    def test_only_failed_items_are_retried(self):
+        """校验失败的邮件单独重新打包，其余邮件不重复请求"""
+        service = PackedService(broken_ids={3})
+        analyzer = EmailAnalysisService(service)
+
+        results = analyzer.analyze_emails([make_email(i) for i in range(1, 6)])
+
+        assert len(service.prompts) == 2
+        assert re.findall(r"\[id=(\d+)\]", service.prompts[1]) == ["3"]
+        assert results[2]["keywords"] == ["k3"]
@@ -0,0 +1,155 @@
+"""
+本地预分类测试模块
+
+测试内容:
+1. 邮件头规则
+2. 特征哈希线性模型的训练与评估
+3. 分析服务只把无法本地判定的邮件交给 AI
+4. 样本文件的条数上限与定时重新训练
+5. 已有数据库升级时补齐标签和邮件头列
+"""
+import json
+from types import SimpleNamespace
+from sqlalchemy import create_engine, inspect, text
+from app.db.database import upgrade_schema
+from app.service.email_analyzer import EmailAnalysisService
+from app.service.email_classifier import (
+    LocalClassifier, HashedLinearModel, OTHER, PROMOTION, NOTIFICATION,
+    evaluate, extract_features, hash_features, header_rules, label_from_result
+)
+
+
+def make_email(email_id, subject, sender="friend@example.com", body="", headers=None, labels=None):
+    return SimpleNamespace(id=email_id, user_id=None, subject=subject, from_email=sender,
+                           body=body, html_body="", headers=headers or {}, labels=labels or [])
+
+
+def promo(i):
+    return make_email(i, f"Flash sale {i}: 50% off everything", f"deals@shop{i % 3}.com",
+                      "Limited time offer, shop now and save big. Unsubscribe anytime.")
+
+
+def personal(i):
+    return make_email(i, f"Question about the contract draft v{i}", f"alice{i % 3}@partner.com",
+                      "Could you review section 4 before our call tomorrow? Thanks.")
+
+
+class CountingService:
+    """记录请求的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        return {"response": json.dumps({"sentiment": "neutral", "keywords": ["合同"],
+                                        "categories": ["工作"], "priority": "high"})}
+
+
+class TestHeaderRules:
+    """测试邮件头规则"""
+
+    def test_rules(self):
+        bulk = make_email(1, "News", headers={"list-unsubscribe": "<mailto:x>", "precedence": "bulk"})
+        auto = make_email(2, "Receipt", headers={"auto-submitted": "auto-generated"})
+        noreply = make_email(3, "Hi", sender="GitHub <noreply@mailer.example.com>")
+        known = make_email(4, "Hi", sender="x@github.com")
+        gmail = make_email(5, "Hi", labels=["CATEGORY_PROMOTIONS"])
+        important = make_email(6, "Hi", labels=["IMPORTANT", "CATEGORY_PROMOTIONS"])
+
+        assert header_rules(bulk) == PROMOTION
+        assert header_rules(auto) == NOTIFICATION
+        assert header_rules(noreply) == NOTIFICATION
+        assert header_rules(known) == NOTIFICATION
+        assert header_rules(gmail) == PROMOTION
+        assert header_rules(important) is None
+        assert header_rules(personal(7)) is None
+
+    def test_label_from_result(self):
+        assert label_from_result({"categories": ["推广"], "priority": "low"}) == PROMOTION
+        assert label_from_result({"categories": ["推广"], "priority": "high"}) == OTHER
+        assert label_from_result({"categories": ["工作"], "priority": "normal"}) == OTHER
+
+
+class TestHashedLinearModel:
+    """测试线性模型"""
+
+    def test_learns_and_evaluates(self):
+        samples = [(hash_features(extract_features(promo(i))), PROMOTION) for i in range(40)]
+        samples += [(hash_features(extract_features(personal(i))), OTHER) for i in range(40)]
+        model = HashedLinearModel().fit(samples)
+
+        label, confidence = model.predict(hash_features(extract_features(promo(99))))
+        assert label == PROMOTION and confidence > 0.9
+        assert model.predict(hash_features(extract_features(personal(99))))[0] == OTHER
+
+        report = evaluate(model, samples, thresholds=(0.9,))
+        assert report[0]["coverage"] >= 0.45
+        assert report[0]["precision"] == 1.0
+        assert report[0]["missed_rate"] == 0.0
+
+
+class TestLocalClassifier:
+    """测试预分类器与分析服务的配合"""
+
+    def test_only_uncertain_emails_reach_llm(self, tmp_path):
+        classifier = LocalClassifier(str(tmp_path / "model.npz"), str(tmp_path / "samples.jsonl"),
+                                     retrain_every=0)
+        classifier.train([(hash_features(extract_features(promo(i))), PROMOTION) for i in range(30)]
+                         + [(hash_features(extract_features(personal(i))), OTHER) for i in range(30)])
+        service = CountingService()
+        analyzer = EmailAnalysisService(service, classifier=classifier)
+
+        emails = [promo(100), promo(101), personal(102),
+                  make_email(103, "Build failed", headers={"auto-submitted": "auto-generated"})]
+        results = analyzer.analyze_emails(emails)
+
+        assert results[0]["categories"] == [PROMOTION]
+        assert results[3]["categories"] == [NOTIFICATION]
+        assert results[2]["priority"] == "high"
+        assert len(service.prompts) == 1
+        assert classifier.stats == {"rules": 1, "model": 2, "llm": 1}
+        # AI 的结果被记录为训练样本
+        assert classifier.load_samples()[0][1] == OTHER
+        assert LocalClassifier(str(tmp_path / "model.npz"), str(tmp_path / "samples.jsonl")).model
+
+    def test_retrains_off_the_hot_path_and_caps_samples(self, tmp_path):
+        samples_path = tmp_path / "samples.jsonl"
+        classifier = LocalClassifier(str(tmp_path / "model.npz"), str(samples_path),
+                                     retrain_every=20, max_samples=30)
+        for i in range(25):
+            classifier.record(promo(i), {"categories": ["推广"]})
+        # 记录样本时不训练，由定时任务重新训练
+        assert classifier.model is None
+        assert classifier.retrain_if_needed()
+        assert classifier.model is not None
+
+        for i in range(25, 70):
+            classifier.record(personal(i), {"categories": ["工作"]})
+        # 超过上限两倍时就地压缩，只保留最新的样本
+        lines = samples_path.read_text(encoding="utf-8").splitlines()
+        assert len(lines) < 60
+        assert json.loads(lines[-1])["email_id"] == 69
+
+        assert classifier.retrain_if_needed()
+        assert len(samples_path.read_text(encoding="utf-8").splitlines()) == 30
+        assert len(classifier.load_samples()) == 30
+        assert not classifier.retrain_if_needed()
+
+
+def test_upgrade_adds_label_and_header_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE emails (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                          "subject VARCHAR(255), simhash VARCHAR(16), topic_id INTEGER)"))
+        conn.execute(text("INSERT INTO emails (id, user_id, subject) VALUES (1, 1, 'old')"))
+
+    assert upgrade_schema(engine) == ["emails.labels", "emails.headers"]
+    engine.dispose()
+    assert {"labels", "headers"} <= {column["name"] for column in inspect(engine).get_columns("emails")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT labels, headers FROM emails")).one() == (None, None)
+    assert upgrade_schema(engine) == []
+    engine.dispose()
@@ -0,0 +1,102 @@
+"""
+邮件近似重复检测测试模块
+
+测试内容:
+1. SimHash 指纹
+2. 分段 LSH 索引与簇维护
+3. 已有数据库升级时补齐指纹列
+"""
+from sqlalchemy import create_engine, inspect, text
+from app.db.database import upgrade_schema
+from app.models import Email  # noqa: F401  注册 emails 表
+from app.service.email_dedup import (
+    MAX_HAMMING_DISTANCE,
+    NearDuplicateIndex,
+    fingerprint_from_hex,
+    fingerprint_to_hex,
+    hamming_distance,
+    simhash,
+)
+
+TEMPLATE = (
+    "Hi {name}, your order #{order} has shipped and will arrive within 3 business "
+    "days. Track your package in the app. Thanks for shopping with us, the store team. "
+    "You can manage notification preferences in your account settings at any time."
+)
+
+
+class TestSimHash:
+    """测试 SimHash 指纹"""
+
+    def test_template_emails_are_close(self):
+        """只有姓名和编号不同的模板邮件指纹接近"""
+        a = simhash(TEMPLATE.format(name="Alice", order=1001))
+        b = simhash(TEMPLATE.format(name="Bob", order=2002))
+        assert hamming_distance(a, b) <= MAX_HAMMING_DISTANCE
+
+    def test_different_emails_are_far(self):
+        """内容不同的邮件指纹相距较远"""
+        a = simhash(TEMPLATE.format(name="Alice", order=1001))
+        b = simhash("本周项目进展顺利，完成了用户认证模块开发，下周开始压力测试并准备上线文档。")
+        assert hamming_distance(a, b) > MAX_HAMMING_DISTANCE
+
+    def test_hex_roundtrip(self):
+        """十六进制存储格式可还原"""
+        value = simhash("hello world")
+        assert fingerprint_from_hex(fingerprint_to_hex(value)) == value
+        assert len(fingerprint_to_hex(value)) == 16
+
+
+class TestNearDuplicateIndex:
+    """测试近似重复索引"""
+
+    def test_cluster_assignment(self):
+        """近似重复邮件归入同一簇，代表为最早的邮件"""
+        index = NearDuplicateIndex()
+        index.add(1, simhash(TEMPLATE.format(name="Alice", order=1)))
+        index.add(2, simhash("Quarterly budget review meeting moved to Thursday afternoon"))
+        index.add(3, simhash(TEMPLATE.format(name="Carol", order=3)))
+
+        assert index.cluster_of(3) == 1
+        assert index.cluster_of(2) == 2
+        assert index.members(1) == [1, 3]
+        assert index.clusters() == {1: [1, 3]}
+
+    def test_remove_representative(self):
+        """删除簇代表后其余成员仍在同一簇"""
+        index = NearDuplicateIndex()
+        for email_id, name in enumerate(["Alice", "Bob", "Carol"], start=1):
+            index.add(email_id, simhash(TEMPLATE.format(name=name, order=email_id)))
+
+        index.remove(1)
+
+        assert 1 not in index
+        assert index.cluster_of(3) == 2
+        assert index.members(2) == [2, 3]
+
+    def test_unknown_email(self):
+        """未索引的邮件没有簇"""
+        index = NearDuplicateIndex()
+        assert index.cluster_of(42) is None
+        assert index.members(42) == []
+
+
+class TestSchemaUpgrade:
+    """测试已有数据库的升级"""
+
+    def test_adds_simhash_column_to_existing_table(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE emails (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                              "subject VARCHAR(255))"))
+            conn.execute(text("INSERT INTO emails (id, user_id, subject) VALUES (1, 1, 'old')"))
+
+        assert "emails.simhash" in upgrade_schema(engine)
+        inspector = inspect(engine)
+        assert "simhash" in {column["name"] for column in inspector.get_columns("emails")}
+        assert "ix_emails_simhash" in {index["name"] for index in inspector.get_indexes("emails")}
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT simhash FROM emails WHERE id = 1")).scalar() is None
+        # 再次启动时不重复添加
+        assert "emails.simhash" not in upgrade_schema(engine)
+        engine.dispose()
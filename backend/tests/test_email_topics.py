@@ -0,0 +1,134 @@
+"""
+邮件主题聚类测试模块
+
+测试内容:
+1. 小批量 k-means 聚类
+2. 新邮件增量分配主题
+3. 每个主题只标注一次
+4. 已有数据库升级时补齐主题列
+"""
+from datetime import datetime
+import numpy as np
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, inspect, text
+from app.db.database import db, upgrade_schema
+from app.models import User, Email, EmailTopic
+from app.service.embedding import EmbeddingService, HashingEmbeddingBackend
+from app.service.embedding import service as embedding_service
+from app.service.email_topics import MiniBatchKMeans, TopicService
+from app.service.embedding.backends import normalize_rows
+
+
+INVOICES = [f"Invoice {n} for your cloud subscription, payment due amount {n}0 USD" for n in range(6)]
+MEETINGS = [f"Meeting invitation: weekly sync room {n} agenda review project status" for n in range(6)]
+
+
+@pytest.fixture
+def topic_app(tmp_path, monkeypatch):
+    """使用内存数据库和临时向量目录的应用"""
+    monkeypatch.setattr(embedding_service, "EMBEDDING_DIR", str(tmp_path))
+    EmbeddingService.set_backend(HashingEmbeddingBackend(dim=256))
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(email="me@example.com")
+        db.session.add(user)
+        db.session.commit()
+        yield user
+        db.session.remove()
+        db.drop_all()
+    EmbeddingService.reset()
+
+
+def add_email(user, text):
+    email = Email(user_id=user.id, subject=text.split(":")[0], from_email="x@example.com",
+                  body=text, received_at=datetime(2024, 5, 1))
+    db.session.add(email)
+    db.session.commit()
+    EmbeddingService.index_email(email)
+    return email
+
+
+class LabelService:
+    """按代表邮件内容返回类别名称的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        return {"response": "账单" if "Invoice" in message else "“会议通知”"}
+
+
+class TestMiniBatchKMeans:
+    """测试小批量 k-means"""
+
+    def test_separates_clusters(self):
+        rng = np.random.default_rng(1)
+        centers = normalize_rows(rng.standard_normal((3, 16)).astype(np.float32))
+        truth = rng.integers(0, 3, 600)
+        data = normalize_rows(centers[truth] + 0.05 * rng.standard_normal((600, 16)).astype(np.float32))
+
+        labels = MiniBatchKMeans(3, batch_size=64).fit(data)
+
+        # 每个真实簇应整体落在同一个聚类中
+        for cluster in range(3):
+            assert len(set(labels[truth == cluster].tolist())) == 1
+        assert len(set(labels.tolist())) == 3
+
+
+class TestTopicService:
+    """测试邮件主题服务"""
+
+    def test_incremental_assignment_and_single_labeling(self, topic_app):
+        user = topic_app
+        emails = [add_email(user, text) for pair in zip(INVOICES, MEETINGS) for text in pair]
+        for email in emails:
+            TopicService.assign_email(email)
+
+        topics = EmailTopic.query.filter_by(user_id=user.id).all()
+        invoice_topics = {e.topic_id for e in emails if e.body.startswith("Invoice")}
+        meeting_topics = {e.topic_id for e in emails if e.body.startswith("Meeting")}
+        assert len(invoice_topics) == 1 and len(meeting_topics) == 1
+        assert invoice_topics != meeting_topics
+        assert sum(t.size for t in topics) == len(emails)
+
+        service = LabelService()
+        assert TopicService.label_topics(user.id, service) == len(topics)
+        assert TopicService.label_topics(user.id, service) == 0
+        assert len(service.prompts) == len(topics)
+        assert TopicService.topic_label(emails[0]) == "账单"
+        assert TopicService.topic_label(emails[1]) == "会议通知"
+
+    def test_rebuild_keeps_existing_labels(self, topic_app):
+        user = topic_app
+        emails = [add_email(user, text) for text in INVOICES + MEETINGS]
+        TopicService.rebuild_topics(user.id, n_topics=2)
+        TopicService.label_topics(user.id, LabelService())
+
+        topics = TopicService.rebuild_topics(user.id, n_topics=2)
+
+        assert sorted(t.label for t in topics) == ["会议通知", "账单"]
+        assert all(e.topic_id for e in Email.query.all())
+
+
+def test_upgrade_adds_topic_column(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE emails (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                          "subject VARCHAR(255), simhash VARCHAR(16))"))
+    # 启动时 db.create_all() 先创建新表 email_topics，再给 emails 补齐列
+    db.metadata.tables["email_topics"].create(engine)
+
+    assert "emails.topic_id" in upgrade_schema(engine)
+    # 新连接读取升级后的表结构
+    engine.dispose()
+    inspector = inspect(engine)
+    assert "ix_emails_topic_id" in {index["name"] for index in inspector.get_indexes("emails")}
+    assert [fk["referred_table"] for fk in inspector.get_foreign_keys("emails")] == ["email_topics"]
+    engine.dispose()
@@ -0,0 +1,107 @@
+"""
+邮件向量检索测试模块
+
+测试内容:
+1. 本地向量化后端
+2. 向量存储的增删改、持久化与扩容
+3. 带元数据过滤的 top-k 检索
+"""
+from datetime import datetime
+import numpy as np
+from app.service.embedding import HashingEmbeddingBackend, VectorStore
+
+
+TEXTS = {
+    1: "Finance: please submit the Q3 budget report by Friday",
+    2: "Team lunch on Thursday at the usual place",
+    3: "Your invoice for October is attached, payment due in 30 days",
+    4: "Finance reminder: expense claims must include receipts",
+}
+
+
+def build_store(path, backend):
+    store = VectorStore(str(path), backend.dim)
+    ids = list(TEXTS)
+    store.add(ids, backend.embed([TEXTS[i] for i in ids]), [
+        {"received_at": datetime(2024, 10, i), "sender": f"user{i}@{'finance' if i in (1, 4) else 'team'}.com",
+         "labels": ["INBOX", "IMPORTANT"] if i == 1 else ["INBOX"]}
+        for i in ids
+    ])
+    return store
+
+
+class TestHashingEmbeddingBackend:
+    """测试本地向量化后端"""
+
+    def test_vectors_are_normalized_and_deterministic(self):
+        backend = HashingEmbeddingBackend(dim=256)
+        vectors = backend.embed(["hello world", "hello world", ""])
+        assert vectors.shape == (3, 256)
+        assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+        assert np.array_equal(vectors[0], vectors[1])
+        assert not vectors[2].any()
+
+
+class TestVectorStore:
+    """测试向量存储"""
+
+    def test_search_ranks_relevant_first(self, tmp_path):
+        backend = HashingEmbeddingBackend(dim=256)
+        store = build_store(tmp_path, backend)
+
+        hits = store.search(backend.embed(["finance budget report"])[0], k=2)
+
+        assert hits[0][0] == 1
+        assert len(hits) == 2
+        assert hits[0][1] >= hits[1][1]
+
+    def test_metadata_filters(self, tmp_path):
+        backend = HashingEmbeddingBackend(dim=256)
+        store = build_store(tmp_path, backend)
+        query = backend.embed(["finance"])[0]
+
+        assert {i for i, _ in store.search(query, k=10, sender="FINANCE.com")} == {1, 4}
+        assert [i for i, _ in store.search(query, k=10, labels=["IMPORTANT"])] == [1]
+        dated = store.search(query, k=10, date_from=datetime(2024, 10, 2), date_to=datetime(2024, 10, 3))
+        assert {i for i, _ in dated} == {2, 3}
+
+    def test_persistence_update_and_remove(self, tmp_path):
+        backend = HashingEmbeddingBackend(dim=256)
+        store = build_store(tmp_path, backend)
+        store.remove([1])
+        store.add([2], backend.embed(["finance budget report"]), [{"sender": "new@finance.com"}])
+        store.close()
+
+        reopened = VectorStore(str(tmp_path), backend.dim)
+        assert len(reopened) == 3
+        assert 1 not in reopened
+        hits = reopened.search(backend.embed(["finance budget report"])[0], k=1)
+        assert hits[0][0] == 2
+        assert hits[0][1] > 0.99
+        assert reopened.vector_path.endswith(".f16")
+
+    def test_grows_beyond_initial_capacity(self, tmp_path):
+        backend = HashingEmbeddingBackend(dim=8)
+        store = VectorStore(str(tmp_path), backend.dim)
+        ids = list(range(1, store.capacity + 10))
+        vectors = np.eye(8, dtype=np.float32)[np.arange(len(ids)) % 8]
+        store.add(ids, vectors, [{}] * len(ids))
+
+        assert len(store) == len(ids)
+        assert store.capacity >= len(ids)
+        assert store.matrix().dtype == np.float16
+
+    def test_metadata_is_saved_in_batches(self, tmp_path):
+        backend = HashingEmbeddingBackend(dim=8)
+        store = VectorStore(str(tmp_path), backend.dim)
+        for email_id in range(1, 11):
+            store.add([email_id], backend.embed([f"mail {email_id}"]), [{}])
+
+        # 少量增删只累积在内存中，flush 后一次写入
+        assert len(VectorStore(str(tmp_path), backend.dim)) == 0
+        store.flush()
+        assert len(VectorStore(str(tmp_path), backend.dim)) == 10
+
+        ids = list(range(100, 100 + 300))
+        store.add(ids, np.eye(8, dtype=np.float32)[np.arange(len(ids)) % 8], [{}] * len(ids))
+        assert len(VectorStore(str(tmp_path), backend.dim)) == 310
@@ -0,0 +1,126 @@
+"""
+提示模板测试模块
+
+测试内容:
+1. 同一模板的请求共享完全相同的前缀，动态内容只在最后一条用户消息
+2. 请求数据与响应缓存键包含模板前缀
+3. 按模板统计上游返回的缓存命中 token
+4. 邮件分析对不同邮件发送相同的前缀
+"""
+import json
+from types import SimpleNamespace
+import pytest
+from app.service.ai.base_ai_service import BaseAIService
+from app.service.ai.cached_ai_service import CachedAIService
+from app.service.ai.deepseek_service import build_chat_payload
+from app.service.ai.prompts import PromptTemplate, get_prompt_cache_stats, get_template
+from app.service.ai.response_cache import LRUCache, ResponseCache
+from app.service.ai.usage import MeteredAIService, UsageLedger
+from app.service.email_analyzer import ANALYSIS_TEMPLATE, BATCH_ANALYSIS_TEMPLATE, EmailAnalysisService
+
+
+class RecordingService(BaseAIService):
+    """记录请求参数，返回 DeepSeek 格式用量的 AI 服务"""
+
+    def __init__(self, usage=True):
+        super().__init__("key", "deepseek-chat")
+        self.calls = []
+        self.usage = usage
+
+    def validate_config(self, config):
+        return True
+
+    def chat_stream(self, message, **kwargs):
+        yield ""
+
+    def chat(self, message, **kwargs):
+        self.calls.append((message, kwargs))
+        # 第一次请求只写入上游缓存，之后的请求命中固定前缀
+        cached = 64 if len(self.calls) > 1 else 0
+        result = {"response": json.dumps({"sentiment": "neutral", "keywords": [],
+                                          "categories": ["工作"], "priority": "normal"})}
+        if self.usage:
+            result["usage"] = {"prompt_tokens": 100, "completion_tokens": 10, "prompt_cache_hit_tokens": cached}
+        return result
+
+
+@pytest.fixture(autouse=True)
+def reset_cache_stats():
+    get_prompt_cache_stats().reset()
+    yield
+    get_prompt_cache_stats().reset()
+
+
+class TestPromptTemplate:
+    """测试提示模板"""
+
+    def test_prefix_is_stable_and_content_at_tail(self):
+        template = PromptTemplate(name="test", version=3, system="指令",
+                                  examples=[("示例问题", "示例回答")], user="内容：{content}")
+        first = template.messages(content="邮件 A")
+        second = template.messages(content="邮件 B")
+
+        assert first[:-1] == second[:-1] == template.prefix
+        assert [m["role"] for m in first] == ["system", "user", "assistant", "user"]
+        assert first[-1]["content"] == "内容：邮件 A"
+        assert template.options()["prompt_version"] == "test-v3"
+        # 返回的前缀是副本，修改不影响模板
+        template.prefix[0]["content"] = "changed"
+        assert template.prefix[0]["content"] == "指令"
+
+    def test_feature_templates_are_registered(self):
+        assert get_template("email-analysis") is ANALYSIS_TEMPLATE
+        assert get_template("email-batch-analysis") is BATCH_ANALYSIS_TEMPLATE
+        assert get_template("summary-map") and get_template("topic-label")
+
+    def test_payload_and_cache_key_include_prefix(self):
+        options = ANALYSIS_TEMPLATE.options()
+        payload = build_chat_payload("deepseek-chat", "tail", **options)
+        assert payload["messages"][:-1] == ANALYSIS_TEMPLATE.prefix
+        assert payload["messages"][-1] == {"role": "user", "content": "tail"}
+
+        service = CachedAIService(RecordingService(), ResponseCache(memory=LRUCache(10)))
+        with_prefix, _ = service._cache_key("tail", {"temperature": 0, **options})
+        without_prefix, _ = service._cache_key("tail", {"temperature": 0})
+        assert with_prefix != without_prefix
+
+
+class TestPromptCacheStats:
+    """测试按模板统计缓存命中"""
+
+    def test_metered_service_records_hit_rate_per_template(self):
+        ledger = UsageLedger()
+        service = MeteredAIService(RecordingService(), "deepseek", ledger)
+        for i in range(4):
+            service.chat(f"邮件 {i}", **ANALYSIS_TEMPLATE.options())
+        service.chat("无模板")
+
+        stats = get_prompt_cache_stats().stats()
+        assert list(stats) == [ANALYSIS_TEMPLATE.key]
+        assert stats[ANALYSIS_TEMPLATE.key]["requests"] == 4
+        assert stats[ANALYSIS_TEMPLATE.key]["hit_rate"] == pytest.approx(192 / 400)
+
+    def test_estimated_usage_counts_prefix(self):
+        ledger = UsageLedger()
+        service = MeteredAIService(RecordingService(usage=False), "deepseek", ledger)
+        service.chat("hi", **ANALYSIS_TEMPLATE.options())
+        assert ledger.get_stats()["buffered"] == 1
+        assert ledger._buffer[0]["prompt_tokens"] >= ANALYSIS_TEMPLATE.prefix_tokens // 2
+
+
+class TestAnalyzerPrefix:
+    """测试邮件分析使用固定前缀"""
+
+    def test_different_emails_share_prefix(self):
+        service = RecordingService()
+        analyzer = EmailAnalysisService(service)
+        for email_id, body in [(1, "请查收本月账单。"), (2, "下周一上午十点开会。")]:
+            analyzer.analyze_email(SimpleNamespace(id=email_id, user_id=None, subject="Hi",
+                                                   from_email="a@example.com", body=body, html_body=""))
+
+        (first, first_options), (second, second_options) = service.calls
+        assert first_options["prefix_messages"] == second_options["prefix_messages"] == ANALYSIS_TEMPLATE.prefix
+        assert first_options["prompt_version"] == ANALYSIS_TEMPLATE.key
+        assert "账单" in first and "开会" in second
+        # 动态内容不出现在前缀中
+        assert all("开会" not in m["content"] for m in second_options["prefix_messages"])
@@ -0,0 +1,198 @@
+"""
+AI 服务容错测试模块
+
+测试内容:
+1. 熔断器的关闭、打开、半开状态转换
+2. 自适应并发上限的加性增加与乘性减少
+3. 只对上游故障退避重试，客户端错误直接返回
+4. DeepSeekService 在上游故障时不再成倍放大请求
+"""
+import httpx
+import pytest
+from app.service.ai.base_ai_service import AIServiceError
+from app.service.ai.deepseek_service import DeepSeekService
+from app.service.ai.resilience import (
+    AdaptiveLimiter, BackendGuard, BackendUnavailableError, CircuitBreaker, classify_error
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def status_error(code):
+    request = httpx.Request("POST", "https://api.deepseek.com/v1/chat/completions")
+    response = httpx.Response(code, request=request, headers={"Retry-After": "3"})
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+@pytest.fixture
+def guard():
+    clock = FakeClock()
+    sleeps = []
+    guard = BackendGuard(
+        "test",
+        breaker=CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock),
+        limiter=AdaptiveLimiter(initial=4, min_limit=1, max_limit=8, clock=clock),
+        max_attempts=3, base_delay=0.5, max_delay=2.0, acquire_timeout=0.01,
+        sleep=sleeps.append
+    )
+    return guard, clock, sleeps
+
+
+class TestCircuitBreaker:
+    """测试熔断器"""
+
+    def test_opens_and_recovers_through_half_open(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+        assert breaker.retry_after() == 10
+
+        clock.now = 10
+        # 半开状态只放行一个探测请求
+        assert breaker.allow() and not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        clock.now = 25
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+        assert breaker.trips == 2
+
+
+class TestAdaptiveLimiter:
+    """测试自适应并发上限"""
+
+    def test_additive_increase_multiplicative_decrease(self):
+        clock = FakeClock()
+        limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=8, clock=clock)
+        for _ in range(4):
+            assert limiter.acquire(0)
+        assert not limiter.acquire(0.01)
+
+        for _ in range(4):
+            limiter.release('success')
+        assert 4.9 < limiter.limit < 5.1
+
+        limiter.acquire(0)
+        limiter.acquire(0)
+        limiter.release('timeout')
+        # 同一时刻的多个超时只减半一次
+        limiter.release('timeout')
+        assert 2.4 < limiter.limit < 2.6
+        clock.now = 5
+        limiter.acquire(0)
+        limiter.release('overload')
+        assert 1.2 < limiter.limit < 1.3
+        assert limiter.in_flight == 0
+
+
+class TestBackendGuard:
+    """测试后端容错组合"""
+
+    def test_classifies_errors(self):
+        assert classify_error(httpx.ReadTimeout("timeout")) == 'timeout'
+        assert classify_error(status_error(429)) == 'overload'
+        assert classify_error(status_error(503)) == 'error'
+        assert classify_error(status_error(401)) is None
+        assert classify_error(httpx.ConnectError("refused")) == 'error'
+        assert classify_error(KeyError("choices")) is None
+
+    def test_retries_transient_errors_with_backoff(self, guard):
+        guard, _, sleeps = guard
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise status_error(429)
+            return "ok"
+
+        assert guard.call(flaky) == "ok"
+        assert len(sleeps) == 2
+        # 限流时等待时间不少于 Retry-After（受 max_delay 限制）
+        assert all(delay == 2.0 for delay in sleeps)
+        assert guard.stats()["retries"] == 2
+
+    def test_client_errors_are_not_retried(self, guard):
+        guard, _, sleeps = guard
+
+        def unauthorized():
+            raise status_error(401)
+
+        for _ in range(5):
+            with pytest.raises(httpx.HTTPStatusError):
+                guard.call(unauthorized)
+        assert sleeps == []
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+
+    def test_open_breaker_fails_fast(self, guard):
+        guard, clock, sleeps = guard
+        calls = []
+
+        def down():
+            calls.append(1)
+            raise httpx.ConnectError("refused")
+
+        with pytest.raises(httpx.ConnectError):
+            guard.call(down)
+        # 第三次失败时熔断打开，之后的请求不再发出
+        assert len(calls) == 3
+        with pytest.raises(BackendUnavailableError) as excinfo:
+            guard.call(down)
+        assert len(calls) == 3 and excinfo.value.retry_after == 10
+        assert guard.stats()["state"] == "open" and guard.stats()["rejected"] == 1
+
+        clock.now = 10
+        assert guard.call(lambda: "ok") == "ok"
+        assert guard.stats()["state"] == "closed"
+
+
+class TestDeepSeekResilience:
+    """测试 DeepSeekService 接入容错"""
+
+    def test_outage_does_not_multiply_requests(self, guard):
+        guard, _, sleeps = guard
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(503, json={"error": "unavailable"})
+
+        service = DeepSeekService("key")
+        service.client.close()
+        service.client = httpx.Client(base_url=DeepSeekService.BASE_URL, transport=httpx.MockTransport(handler))
+        service.guard = guard
+
+        with pytest.raises(AIServiceError):
+            service.chat("hi")
+        assert len(requests) == 3 and len(sleeps) == 2
+        # 熔断后后续请求不再到达上游
+        for _ in range(3):
+            with pytest.raises(BackendUnavailableError):
+                service.chat("hi")
+        assert len(requests) == 3
+        service.close()
+
+    def test_success_parses_response(self, guard):
+        guard, _, _ = guard
+
+        def handler(request):
+            return httpx.Response(200, json={"choices": [{"message": {"content": "pong"}}]})
+
+        service = DeepSeekService("key")
+        service.client.close()
+        service.client = httpx.Client(base_url=DeepSeekService.BASE_URL, transport=httpx.MockTransport(handler))
+        service.guard = guard
+        assert service.chat("ping") == {"response": "pong"}
+        assert guard.stats()["requests"] == 1
+        service.close()
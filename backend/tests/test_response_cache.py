@@ -0,0 +1,185 @@
+"""
+AI 响应缓存测试模块
+
+测试内容:
+1. 缓存键规范化
+2. 内存 LRU 与 SQLite 两级缓存
+3. 带缓存的 AI 服务
+"""
+import threading
+import time
+import pytest
+from app.service.ai.base_ai_service import AIServiceError, BaseAIService
+from app.service.ai.cached_ai_service import CachedAIService
+from app.service.ai.response_cache import (
+    LRUCache,
+    ResponseCache,
+    SQLiteCacheStore,
+    make_cache_key,
+)
+
+
+class CountingService(BaseAIService):
+    """记录调用次数的 AI 服务"""
+
+    def __init__(self):
+        super().__init__(api_key="test-key", model="deepseek-chat")
+        self.calls = 0
+
+    def validate_config(self, config):
+        return True
+
+    def chat(self, message, **kwargs):
+        self.calls += 1
+        return {"response": f"reply:{message}"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """创建使用临时 SQLite 文件的缓存"""
+    store = SQLiteCacheStore(str(tmp_path / "cache.db"), ttl=3600, max_entries=100)
+    yield ResponseCache(LRUCache(max_entries=2), store)
+    store.close()
+
+
+class TestCacheKey:
+    """测试缓存键"""
+
+    def test_key_is_canonical(self):
+        """字典键顺序不影响缓存键"""
+        a = make_cache_key("m", [{"role": "user", "content": "hi"}], 0, 100)
+        b = make_cache_key("m", [{"content": "hi", "role": "user"}], 0.0, 100)
+        assert a == b
+
+    def test_key_depends_on_parameters(self):
+        """模型、温度、模板版本、输出格式和服务地址不同时缓存键不同"""
+        messages = [{"role": "user", "content": "hi"}]
+        base = make_cache_key("m", messages, 0, 100, "v1")
+        assert base != make_cache_key("other", messages, 0, 100, "v1")
+        assert base != make_cache_key("m", messages, 0.5, 100, "v1")
+        assert base != make_cache_key("m", messages, 0, 100, "v2")
+        assert base != make_cache_key("m", messages, 0, 100, "v1", {"type": "json_object"})
+        assert base != make_cache_key("m", messages, 0, 100, "v1", endpoint="openai|https://example.com/v1")
+
+    def test_service_key_includes_format_and_endpoint(self, cache):
+        """JSON 模式与普通请求、不同接口地址的同名模型互不复用缓存"""
+        inner = CountingService()
+        CachedAIService(inner, cache, "deepseek").chat("hello", temperature=0)
+        CachedAIService(inner, cache, "deepseek").chat("hello", temperature=0,
+                                                      response_format={"type": "json_object"})
+        inner.base_url = "https://proxy.example.com/v1"
+        CachedAIService(inner, cache, "deepseek").chat("hello", temperature=0)
+        CachedAIService(inner, cache, "openai").chat("hello", temperature=0)
+        assert inner.calls == 4
+
+
+class TestResponseCache:
+    """测试两级缓存"""
+
+    def test_lru_eviction(self):
+        """超过容量时淘汰最久未使用的条目"""
+        lru = LRUCache(max_entries=2)
+        lru.set("a", {"v": 1})
+        lru.set("b", {"v": 2})
+        lru.get("a")
+        lru.set("c", {"v": 3})
+        assert lru.get("b") is None
+        assert lru.get("a") == {"v": 1}
+
+    def test_memory_ttl_expiry(self):
+        """内存缓存同样按 TTL 过期，从二级缓存回填时沿用原创建时间"""
+        lru = LRUCache(max_entries=10, ttl=60)
+        lru.set("a", {"v": 1})
+        lru.set("b", {"v": 2}, created_at=time.time() - 120)
+        assert lru.get("a") == {"v": 1}
+        assert lru.get("b") is None
+        assert len(lru) == 1
+
+    def test_store_hit_after_memory_eviction(self, cache):
+        """内存中被淘汰的条目仍可从 SQLite 命中"""
+        for key in ("a", "b", "c"):
+            cache.set(key, {"response": key})
+
+        assert cache.get("a") == {"response": "a"}
+        stats = cache.stats()
+        assert stats["store_hits"] == 1
+        assert stats["hit_rate"] == 1.0
+
+    def test_ttl_expiry(self, tmp_path):
+        """过期条目视为未命中"""
+        store = SQLiteCacheStore(str(tmp_path / "ttl.db"), ttl=0)
+        store.set("a", {"response": "a"})
+        time.sleep(0.01)
+        assert store.get("a") is None
+        store.close()
+
+    def test_size_eviction(self, tmp_path):
+        """条目数超出上限时按最近访问时间淘汰"""
+        store = SQLiteCacheStore(str(tmp_path / "size.db"), ttl=3600, max_entries=3)
+        for i in range(10):
+            store.set(str(i), {"response": i})
+        assert len(store) <= 3
+        assert store.get("9") == {"response": 9}
+        store.close()
+
+
+class TestCachedAIService:
+    """测试带缓存的 AI 服务"""
+
+    def test_deterministic_requests_are_cached(self, cache):
+        """temperature 为 0 的请求默认缓存"""
+        inner = CountingService()
+        service = CachedAIService(inner, cache)
+
+        first = service.chat("hello", temperature=0)
+        second = service.chat("hello", temperature=0)
+
+        assert inner.calls == 1
+        assert second == dict(first, cached=True)
+
+    def test_sampling_requests_are_not_cached(self, cache):
+        """非确定性请求默认不缓存，可显式开启"""
+        inner = CountingService()
+        service = CachedAIService(inner, cache)
+
+        service.chat("hello", temperature=0.7)
+        service.chat("hello", temperature=0.7)
+        assert inner.calls == 2
+
+        service.chat("hello", temperature=0.7, cache=True)
+        service.chat("hello", temperature=0.7, cache=True)
+        assert inner.calls == 3
+
+    def test_batch_only_sends_misses(self, cache):
+        """批量请求只发送未命中的消息"""
+        inner = CountingService()
+        service = CachedAIService(inner, cache)
+        service.chat("a", temperature=0)
+
+        results = service.batch_chat(["a", "b"], temperature=0)
+
+        assert inner.calls == 2
+        assert results[0]["cached"] is True
+        assert results[1] == {"response": "reply:b"}
+
+    def test_batch_misses_run_concurrently_and_fail_per_item(self, cache):
+        """没有批量接口的服务逐条并发发送，失败的请求对应异常对象"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        class SlowService(CountingService):
+            def chat(self, message, **kwargs):
+                # 三个请求同时在途时才会越过屏障，串行执行会超时
+                barrier.wait()
+                if message == "bad":
+                    raise ValueError("boom")
+                return super().chat(message, **kwargs)
+
+        inner = SlowService()
+        service = CachedAIService(inner, cache)
+
+        results = service.batch_chat(["a", "bad", "c"], temperature=0)
+
+        assert results[0] == {"response": "reply:a"}
+        assert isinstance(results[1], AIServiceError)
+        assert results[2] == {"response": "reply:c"}
+        assert service.chat("c", temperature=0)["cached"] is True
@@ -0,0 +1,362 @@
+"""
+共享调度器测试模块
+
+测试内容:
+1. 应用只创建一个调度器，服务实例和路由共享它，不再为每个请求创建线程
+2. 重复启动同步时替换已有任务
+3. 更新任务，路由只能操作当前用户的任务
+4. 协程任务在同一个事件循环线程上被 await，可以交错执行、超时取消和按任务取消
+5. 任务保存在数据库中，重启后恢复；启动时为缺少任务的已授权用户补建；多个进程共享任务表时只有持有锁的进程执行任务
+6. 各用户的同步散列到间隔内均匀分布的时刻，同步任务的同时执行数有上限
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import pytest
+from apscheduler.events import EVENT_JOB_ERROR
+from flask import Flask
+from app import create_app
+from app.db.database import db
+from app.models import User
+from app.service import email_sync
+from app.service.email_sync import EmailSyncService, reconcile_sync_jobs, schedule_sync_jobs, sync_emails_task
+from app.service.scheduler_service import (SchedulerService, get_scheduler_service, init_scheduler,
+                                           spread_interval_trigger)
+from app.service.service_manager import ServiceManager
+
+
+def noop_task(*args):
+    return None
+
+
+@pytest.fixture
+def app():
+    app = create_app('test')
+    with app.app_context():
+        db.session.add_all([User(email="a@example.com"), User(email="b@example.com")])
+        db.session.commit()
+    yield app
+    app.extensions['scheduler'].shutdown(wait=False)
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = {'email': 'a@example.com'}
+    return client
+
+
+class TestSharedScheduler:
+    """测试应用共享的调度器"""
+
+    def test_services_share_one_scheduler(self, app):
+        shared = app.extensions['scheduler']
+        threads = threading.active_count()
+        with app.test_request_context():
+            services = [EmailSyncService(db, object()) for _ in range(20)]
+            assert all(service.scheduler is shared for service in services)
+            assert ServiceManager.get_scheduler() is shared
+            assert get_scheduler_service() is shared
+        assert threading.active_count() == threads
+        assert shared.stats() == {'state': 'paused', 'pool_size': 10, 'jobs': 0, 'persistent': True,
+                                  'async_running': 0}
+
+    def test_restarting_sync_replaces_jobs(self, app):
+        with app.test_request_context():
+            user = User.query.filter_by(email="a@example.com").first()
+            for _ in range(3):
+                assert EmailSyncService(db, object()).start_sync(user)
+            jobs = get_scheduler_service().get_all_jobs()
+            assert sorted(job['id'] for job in jobs) == [f"email_analysis_{user.id}", f"email_sync_{user.id}"]
+            assert EmailSyncService(db, object()).stop_sync(user)
+            assert get_scheduler_service().get_all_jobs() == []
+
+    def test_update_job(self):
+        service = SchedulerService(pool_size=1, start=False)
+        job = service.create_job("report_1", noop_task, "interval:60")
+        updated = service.update_job(job['id'], name="daily_1", trigger="cron:0 8 * * *")
+        assert updated['name'] == "daily_1" and "cron" in updated['trigger']
+        assert service.update_job("missing") is None
+        service.shutdown()
+
+
+class TestSchedulerRoutes:
+    """测试调度器路由"""
+
+    def test_routes_see_only_own_jobs(self, app, client):
+        with app.app_context():
+            users = {u.email: u.id for u in User.query.all()}
+            scheduler = get_scheduler_service()
+            mine = scheduler.create_job(f"email_sync_{users['a@example.com']}", noop_task, "interval:60")
+            other = scheduler.create_job(f"email_sync_{users['b@example.com']}", noop_task, "interval:60")
+
+        listed = client.get('/api/scheduler/jobs').get_json()
+        assert [job['id'] for job in listed] == [mine['id']]
+        assert client.get(f"/api/scheduler/jobs/{other['id']}").status_code == 404
+        assert client.delete(f"/api/scheduler/jobs/{other['id']}").status_code == 404
+        assert client.post(f"/api/scheduler/jobs/{mine['id']}/pause").status_code == 200
+        assert client.get('/api/scheduler/stats').get_json()['jobs'] == 2
+
+    def test_create_job_only_accepts_task_functions(self, client):
+        response = client.post('/api/scheduler/jobs', json={
+            'name': 'evil', 'func': 'os:system', 'trigger': 'interval:60', 'args': ['id']
+        })
+        assert response.status_code == 400
+        response = client.post('/api/scheduler/jobs', json={
+            'name': 'retrain', 'func': 'app.service.email_classifier:retrain_classifier_task',
+            'trigger': 'interval:3600'
+        })
+        assert response.status_code == 400
+        response = client.post('/api/scheduler/jobs', json={
+            'name': 'analysis', 'func': 'app.service.email_analysis_store:analyze_pending_task',
+            'trigger': 'interval:1800'
+        })
+        assert response.status_code == 200 and response.get_json()['name'].startswith('analysis_')
+        assert response.get_json()['id'].startswith('email_analysis_')
+        assert client.get('/api/scheduler/jobs').status_code == 200
+
+    def test_user_jobs_are_rate_limited_and_grouped(self, app, client):
+        job = {'name': 'sync', 'func': 'app.service.email_sync:sync_emails_task'}
+        for trigger in ('interval:1', 'interval:899', 'cron:* * * * *', 'cron:*/5 9 * * *', 'every:60', 60):
+            assert client.post('/api/scheduler/jobs', json=dict(job, trigger=trigger)).status_code == 400
+        created = client.post('/api/scheduler/jobs', json=dict(job, trigger='cron:0 8 * * *')).get_json()
+        # 用户创建的同步任务与系统同步任务同属 email_sync_ 分组，受同时执行数上限约束
+        assert created['id'].startswith('email_sync_') and created['id'] != 'email_sync_1'
+        assert client.put(f"/api/scheduler/jobs/{created['id']}", json={'trigger': 'interval:60'}).status_code == 400
+        assert client.put(f"/api/scheduler/jobs/{created['id']}", json={
+            'func': 'app.service.email_analysis_store:analyze_pending_task'}).status_code == 400
+        with app.app_context():
+            assert get_scheduler_service().get_interval(created['id']) is None
+
+    def test_task_args_are_bound_to_user(self, app, client):
+        with app.app_context():
+            users = {u.email: u.id for u in User.query.all()}
+        me, other = users['a@example.com'], users['b@example.com']
+        job = {'name': 'sync', 'func': 'app.service.email_sync:sync_emails_task', 'trigger': 'interval:900'}
+
+        # 不能为其他用户创建任务，也不能传入额外参数
+        assert client.post('/api/scheduler/jobs', json=dict(job, args=[other])).status_code == 400
+        assert client.post('/api/scheduler/jobs', json=dict(job, kwargs={'user_id': other})).status_code == 400
+        created = client.post('/api/scheduler/jobs', json=dict(job, args=[me])).get_json()
+        assert client.put(f"/api/scheduler/jobs/{created['id']}", json={'args': [other]}).status_code == 400
+        assert client.put(f"/api/scheduler/jobs/{created['id']}", json={'trigger': 'interval:1800'}).status_code == 200
+        with app.app_context():
+            job = get_scheduler_service().scheduler.get_job(created['id'])
+            assert list(job.args) == [me] and job.kwargs == {}
+
+    def test_stats_require_login(self, app):
+        assert app.test_client().get('/api/scheduler/stats').status_code == 401
+
+
+class FakeGmail:
+    """记录请求线程的 Gmail 客户端"""
+
+    def __init__(self):
+        self.threads = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, **kwargs):
+        return self
+
+    def execute(self, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        return {'messages': []}
+
+
+class TestCoroutineJobs:
+    """测试协程任务的执行"""
+
+    def test_coroutine_jobs_overlap_on_one_loop(self):
+        service = SchedulerService(pool_size=1)
+        runs = []
+
+        async def sync_task(user_id):
+            start = time.monotonic()
+            await asyncio.sleep(0.3)
+            runs.append((user_id, threading.current_thread().name, start, time.monotonic()))
+            return user_id
+
+        for user_id in (1, 2, 3):
+            service.create_job(f"email_sync_{user_id}", sync_task, "date:2000-01-01T00:00:00+00:00",
+                               args=[user_id], misfire_grace_time=None)
+        deadline = time.monotonic() + 5
+        while len(runs) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        service.shutdown()
+
+        assert sorted(run[0] for run in runs) == [1, 2, 3]
+        # 线程池只有一个线程，三个同步仍在同一个事件循环线程上同时进行
+        assert len({run[1] for run in runs}) == 1 and runs[0][1].startswith("scheduler-async")
+        assert max(run[2] for run in runs) < min(run[3] for run in runs)
+
+    def test_timeout_and_cancel(self):
+        service = SchedulerService(async_timeout=0.2)
+        errors, cancelled = [], []
+        service.scheduler.add_listener(lambda event: errors.append(event), EVENT_JOB_ERROR)
+
+        async def slow_task(name):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+
+        service.create_job("slow_1", slow_task, "date:2000-01-01T00:00:00+00:00", args=["timeout"],
+                           id="slow_1", misfire_grace_time=None)
+        deadline = time.monotonic() + 5
+        while not errors and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert cancelled == ["timeout"] and isinstance(errors[0].exception, asyncio.TimeoutError)
+
+        service.scheduler._lookup_executor('asyncio').timeout = None
+        service.create_job("slow_2", slow_task, "date:2000-01-01T00:00:00+00:00", args=["stop"],
+                           id="slow_2", misfire_grace_time=None)
+        while not service.stats()['async_running'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert service.cancel_running("slow_2") == 1
+        while len(cancelled) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert cancelled == ["timeout", "stop"] and service.stats()['async_running'] == 0
+        service.shutdown()
+
+    def test_sync_task_runs_in_app_context(self, app, monkeypatch):
+        gmail, built = FakeGmail(), []
+        monkeypatch.setattr(email_sync, 'build', lambda *args, **kwargs: built.append(kwargs) or gmail)
+        with app.app_context():
+            user = User.query.filter_by(email="a@example.com").first()
+            user.access_token, user.refresh_token = "access", "refresh"
+            db.session.commit()
+            user_id = user.id
+        # 任务参数只有用户ID，应用上下文由执行器提供
+        service = SchedulerService(app=app)
+        service.create_job(f"email_sync_{user_id}", sync_emails_task, "date:2000-01-01T00:00:00+00:00",
+                           args=[user_id], misfire_grace_time=None)
+        deadline = time.monotonic() + 5
+        while not gmail.threads and time.monotonic() < deadline:
+            time.sleep(0.05)
+        service.shutdown()
+        assert built[0]['credentials'].refresh_token == "refresh"
+        # 阻塞的 Gmail 请求不在事件循环线程上执行
+        assert gmail.threads and not gmail.threads[0].startswith("scheduler-async")
+
+
+@pytest.fixture
+def store_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'jobs.db'}",
+                      SCHEDULER_JOBSTORE='sqlalchemy', SCHEDULER_ENABLED=False,
+                      SCHEDULER_MISFIRE_GRACE_SECONDS=600)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(email="a@example.com", auth_provider='google', refresh_token="r1"),
+                            User(email="b@example.com", auth_provider='google', refresh_token="r2"),
+                            User(email="c@example.com")])
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+class TestPersistentJobs:
+    """测试持久化的任务存储"""
+
+    def test_jobs_survive_restart(self, store_app):
+        with store_app.app_context():
+            schedule_sync_jobs(init_scheduler(store_app), db.session.get(User, 1))
+            before = get_scheduler_service().get_all_jobs()
+            get_scheduler_service().shutdown()
+
+            restarted = init_scheduler(store_app)
+            assert restarted.get_all_jobs() == before
+            job = restarted.scheduler.get_job("email_sync_1")
+            assert job.args == (1,) and job.executor == 'asyncio'
+            assert job.coalesce and job.misfire_grace_time == 600
+            restarted.shutdown()
+
+    def test_reconcile_recreates_missing_jobs(self, store_app):
+        with store_app.app_context():
+            scheduler = init_scheduler(store_app)
+            schedule_sync_jobs(scheduler, db.session.get(User, 2))
+            # 只为有令牌且缺少任务的用户补建，重复核对不再创建
+            assert reconcile_sync_jobs() == 1
+            assert reconcile_sync_jobs() == 0
+            assert sorted(job['id'] for job in scheduler.get_all_jobs()) == [
+                "email_analysis_1", "email_analysis_2", "email_sync_1", "email_sync_2"]
+            scheduler.shutdown()
+
+
+    def test_only_lock_holder_runs_jobs(self, store_app, tmp_path):
+        store_app.config.update(SCHEDULER_ENABLED=True, SCHEDULER_LOCK_FILE=str(tmp_path / "scheduler.lock"))
+        with store_app.app_context():
+            # 同一主机上的两个进程共享任务表：第二个调度器取不到锁，暂停且只维护任务
+            leader = init_scheduler(store_app)
+            follower = init_scheduler(store_app)
+            assert (leader.state, follower.state) == ("running", "paused")
+            schedule_sync_jobs(follower, db.session.get(User, 1))
+            assert leader.scheduler.get_job("email_sync_1") is not None
+
+            # 持有锁的进程退出后，新启动的进程取得锁
+            leader.shutdown(wait=False)
+            successor = init_scheduler(store_app)
+            assert successor.state == "running"
+            successor.shutdown(wait=False)
+            follower.shutdown(wait=False)
+
+
+class TestLoadSpreading:
+    """测试同步任务的负载分散"""
+
+    def test_slots_spread_evenly_across_interval(self):
+        now = datetime(2024, 6, 1, 9, 0, tzinfo=timezone.utc)
+        # 6000 个用户同时登录，首次同步时刻仍均匀分布在一小时内的 12 个 5 分钟区间
+        fire_times = [spread_interval_trigger(f"email_sync:{user_id}", 3600).get_next_fire_time(None, now)
+                      for user_id in range(6000)]
+        buckets = Counter(int((t - now).total_seconds()) // 300 for t in fire_times)
+        assert sorted(buckets) == list(range(12))
+        assert max(buckets.values()) / min(buckets.values()) < 1.3
+
+        # 偏移由用户ID决定，与创建时间无关
+        later = now + timedelta(minutes=17, seconds=5)
+        trigger = spread_interval_trigger("email_sync:7", 3600)
+        first, second = trigger.get_next_fire_time(None, now), trigger.get_next_fire_time(None, later)
+        assert (second - first).total_seconds() % 3600 == 0
+
+    def test_jitter_is_bounded(self):
+        assert spread_interval_trigger("email_sync:1", 6 * 3600, 120).jitter == 120
+        assert spread_interval_trigger("email_analysis:1", 240, 120).jitter == 60
+        assert spread_interval_trigger("email_sync:1", 3600).jitter is None
+
+    def test_sync_jobs_share_concurrency_cap(self):
+        service = SchedulerService(group_limits={'email_sync_': 2})
+        running, peak, others = [0], [0], []
+
+        async def sync_task(user_id):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.1)
+            running[0] -= 1
+
+        async def other_task():
+            # 其他协程任务不受同步任务排队影响
+            others.append(running[0])
+
+        for user_id in range(6):
+            service.create_job(f"email_sync_{user_id}", sync_task, "date:2000-01-01T00:00:00+00:00",
+                               args=[user_id], id=f"email_sync_{user_id}", misfire_grace_time=None)
+        service.create_job("report_1", other_task, "date:2000-01-01T00:00:01+00:00", misfire_grace_time=None)
+        deadline = time.monotonic() + 5
+        while (service.stats()['async_running'] or not others) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        service.shutdown()
+        assert peak[0] == 2 and others == [2]
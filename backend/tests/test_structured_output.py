@@ -0,0 +1,136 @@
+"""
+结构化输出测试模块
+
+测试内容:
+1. 本地修复常见的 JSON 语法问题
+2. 按声明的字段校验并规整输出
+3. 只针对不合法字段发送简短的修复请求
+4. 打包分析只为部分字段不合法的邮件请求这些字段
+"""
+import json
+import re
+from types import SimpleNamespace
+from app.service.ai.deepseek_service import build_chat_payload
+from app.service.ai.structured import OutputSchema, SchemaField, repair_json
+from app.service.email_analyzer import ANALYSIS_SCHEMA, ANALYSIS_TEMPLATE, EmailAnalysisService
+
+
+def make_email(email_id, body="Please review the quarterly report."):
+    return SimpleNamespace(id=email_id, user_id=None, subject=f"Subject {email_id}",
+                           from_email="a@example.com", body=body, html_body="")
+
+
+class ScriptedService:
+    """按顺序返回预设回答并记录请求的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def chat(self, message, **kwargs):
+        self.calls.append((message, kwargs))
+        return {"response": self.answers.pop(0)}
+
+
+class TestRepairJson:
+    """测试本地修复 JSON"""
+
+    def test_repairs_common_syntax_errors(self):
+        assert repair_json('```json\n{"a": 1,}\n```') == {"a": 1}
+        assert repair_json("结果：{'a': 'x', 'b': True}") == {"a": "x", "b": True}
+        assert repair_json('{sentiment: "positive", keywords: ["x"]}') == {"sentiment": "positive", "keywords": ["x"]}
+        assert repair_json('{“a”: “b”}') == {"a": "b"}
+        # 输出被截断
+        assert repair_json('{"a": ["x", "y"], "b": "tru') == {"a": ["x", "y"], "b": "tru"}
+        assert repair_json('[{"id": 1}, {"id": 2', '[') == [{"id": 1}, {"id": 2}]
+        assert repair_json('no json here') is None
+
+    def test_schema_coerces_and_reports_invalid_fields(self):
+        schema = OutputSchema([SchemaField("level", enum=("low", "high")),
+                               SchemaField("tags", type="array", max_items=2),
+                               SchemaField("note")])
+        values, invalid = schema.validate({"level": " HIGH ", "tags": "a, b、c", "note": 3})
+        assert values == {"level": "high", "tags": ["a", "b"]}
+        assert invalid == ["note"]
+        assert schema.validate([1, 2]) == ({}, ["level", "tags", "note"])
+
+
+class TestFieldRepair:
+    """测试只修复不合法的字段"""
+
+    def test_reasks_only_invalid_fields(self):
+        service = ScriptedService([
+            '{"sentiment": "angry", "keywords": ["发票"], "categories": ["账单"], "priority": "urgent"}',
+            '{"sentiment": "negative", "priority": "high"}'
+        ])
+        result = EmailAnalysisService(service).analyze_email(make_email(1, "发票逾期未付。"))
+
+        assert result["sentiment"] == "negative" and result["priority"] == "high"
+        assert result["keywords"] == ["发票"]
+        first, repair = service.calls
+        assert first[1]["response_format"] == {"type": "json_object"}
+        # 修复请求沿用原对话作为前缀，最后一条消息只列出不合法的字段
+        repair_message, repair_options = repair
+        assert "sentiment" in repair_message and "priority" in repair_message
+        assert "keywords" not in repair_message and "逾期" not in repair_message
+        history = repair_options["prefix_messages"]
+        assert history[:len(ANALYSIS_TEMPLATE.prefix)] == ANALYSIS_TEMPLATE.prefix
+        assert "逾期" in history[-2]["content"] and history[-1]["role"] == "assistant"
+        assert repair_options["max_tokens"] < 200
+
+    def test_local_repair_needs_no_extra_request(self):
+        service = ScriptedService([
+            "```json\n{'sentiment': 'Positive', 'keywords': ['x'], 'categories': ['工作'], 'priority': 'low',}\n```"
+        ])
+        result = EmailAnalysisService(service).analyze_email(make_email(1))
+        assert len(service.calls) == 1
+        assert result["sentiment"] == "positive"
+
+    def test_unrepaired_fields_fall_back_to_defaults(self):
+        service = ScriptedService(['{"keywords": ["x"]}', "抱歉"])
+        result = EmailAnalysisService(service).analyze_email(make_email(1))
+        assert len(service.calls) == 2
+        assert result == {"sentiment": "neutral", "keywords": ["x"], "categories": [],
+                          "priority": "normal", "source": "llm"}
+
+    def test_response_format_in_payload(self):
+        payload = build_chat_payload("deepseek-chat", "hi", response_format={"type": "json_object"})
+        assert payload["response_format"] == {"type": "json_object"}
+        assert "response_format" not in build_chat_payload("deepseek-chat", "hi")
+
+
+class PartialBatchService:
+    """第一轮回答缺少部分字段的打包分析服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        items = []
+        for email_id in (int(i) for i in re.findall(r"\[id=(\d+)\]", message)):
+            item = {"id": email_id, "sentiment": "positive", "keywords": [f"k{email_id}"],
+                    "categories": ["通知"], "priority": "low"}
+            if email_id == 2 and len(self.prompts) == 1:
+                item["priority"] = "urgent"
+            items.append(item)
+        return {"response": json.dumps(items)}
+
+
+class TestPackedFieldRepair:
+    """测试打包分析的字段级重试"""
+
+    def test_partial_items_request_missing_fields(self):
+        service = PartialBatchService()
+        results = EmailAnalysisService(service).analyze_emails([make_email(i) for i in range(1, 4)])
+
+        assert len(service.prompts) == 2
+        retry = service.prompts[1]
+        assert re.findall(r"\[id=(\d+)\]", retry) == ["2"]
+        assert "只需字段: priority" in retry
+        assert results[1]["priority"] == "low" and results[1]["keywords"] == ["k2"]
+        assert ANALYSIS_SCHEMA.validate(results[0])[1] == []
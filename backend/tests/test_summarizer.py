@@ -0,0 +1,102 @@
+"""
+分层摘要测试模块
+
+测试内容:
+1. 按天生成叶子，按日历周、月逐层合并
+2. 近似重复邮件只摘要一次
+3. 时间窗口延长或平移一天时只重算边界所在的分组和新增节点
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from app.service.ai.response_cache import ResponseCache
+from app.service.ai.summarizer import MapReduceSummarizer
+
+
+def make_emails(days, per_day=2):
+    start = datetime(2024, 5, 1, 9)
+    emails = []
+    for day in range(days):
+        for n in range(per_day):
+            email_id = day * per_day + n + 1
+            emails.append(SimpleNamespace(
+                id=email_id, user_id=None, subject=f"Subject {email_id}",
+                from_email="a@example.com", body=f"Body of email {email_id}.", html_body="",
+                received_at=start + timedelta(days=day, minutes=n)
+            ))
+    return emails
+
+
+class CountingService:
+    """记录调用次数的 AI 服务"""
+
+    model = "deepseek-chat"
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat(self, message, **kwargs):
+        self.prompts.append(message)
+        return {"response": f"summary#{len(self.prompts)}"}
+
+
+class TestMapReduceSummarizer:
+    """测试分层摘要器"""
+
+    def test_tree_reduces_to_single_answer(self):
+        """8 天邮件在扇入为 2 时先在周内合并，再按月合并"""
+        service = CountingService()
+        summarizer = MapReduceSummarizer(service, cache=ResponseCache(), fan_in=2)
+
+        result = summarizer.summarize(make_emails(8), "归纳")
+
+        assert result["leaves"] == 8
+        # 5/1~5/5 和 5/6~5/8 分属两个 ISO 周：周内 3 + 2 + 1 个合并节点，月内 1 个
+        assert result["levels"] == 5
+        # 8 个叶子 + 7 个合并节点 + 1 次最终回答
+        assert result["llm_calls"] == 16 == len(service.prompts)
+        assert result["period"] == "2024-05-01 ~ 2024-05-08"
+        assert "归纳" in service.prompts[-1]
+
+    def test_near_duplicates_are_collapsed(self):
+        """同一簇的邮件只出现一次并标注数量"""
+        service = CountingService()
+        emails = make_emails(1, per_day=3)
+        cluster_ids = {1: 1, 2: 1, 3: 3}
+
+        MapReduceSummarizer(service, cache=ResponseCache()).summarize(emails, cluster_ids=cluster_ids)
+
+        leaf_prompt = service.prompts[0]
+        assert "[x2]" in leaf_prompt
+        assert "Body of email 2" not in leaf_prompt
+        assert "Body of email 3" in leaf_prompt
+
+    def test_extending_window_recomputes_only_new_path(self):
+        """增加一天只重算新叶子、它在周内的祖先、月节点和最终回答"""
+        cache = ResponseCache()
+        MapReduceSummarizer(CountingService(), cache=cache, fan_in=2).summarize(make_emails(8))
+
+        service = CountingService()
+        result = MapReduceSummarizer(service, cache=cache, fan_in=2).summarize(make_emails(9))
+
+        # 新叶子 1 个；第二周的 2 个合并节点；月节点 1 个；最终回答 1 次；第一周整棵子树命中缓存
+        assert result["llm_calls"] == 5
+        assert result["cached_nodes"] > 0
+
+    def test_shifting_window_keeps_full_weeks(self):
+        """窗口平移一天时，完整的周命中缓存，只重算首尾两周"""
+        emails = make_emails(22)
+        cache = ResponseCache()
+        MapReduceSummarizer(CountingService(), cache=cache, fan_in=2).summarize(emails[:42])
+
+        service = CountingService()
+        result = MapReduceSummarizer(service, cache=cache, fan_in=2).summarize(emails[2:])
+
+        # 5/6~5/12、5/13~5/19 两周命中缓存；新叶子 1 个，首周 3 个、末周 1 个合并节点
+        # （5/20~5/21 的合并节点命中缓存），月内 3 个合并节点，最终回答 1 次
+        assert result["llm_calls"] == 9
+
+    def test_empty_window(self):
+        service = CountingService()
+        result = MapReduceSummarizer(service, cache=ResponseCache()).summarize([])
+        assert result["summary"] == ""
+        assert service.prompts == []
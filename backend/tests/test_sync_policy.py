@@ -0,0 +1,108 @@
+"""
+自适应同步频率测试模块
+
+测试内容:
+1. 新邮件多的邮箱缩短同步间隔，没有新邮件的邮箱拉长间隔，间隔在上下限内
+2. 到达率按时间衰减平滑，单次突发不会立即把间隔压到最短
+3. 长时间未登录的用户退避，登录后恢复
+4. 同步后按新的间隔重新安排同步任务
+"""
+from datetime import datetime, timedelta
+import pytest
+from flask import Flask
+from app.db.database import db
+from app.models import SyncState, User
+from app.service.email_sync import reschedule_sync_job, schedule_sync_jobs
+from app.service.scheduler_service import SchedulerService
+from app.service.sync_policy import AdaptiveSyncPolicy
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+@pytest.fixture
+def policy_app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        users = [User(email=f"u{n}@example.com") for n in range(3)]
+        db.session.add_all(users)
+        db.session.commit()
+        for user in users:
+            user.last_login = NOW
+        db.session.commit()
+        yield users
+        db.session.remove()
+        db.drop_all()
+
+
+def make_policy():
+    return AdaptiveSyncPolicy(min_interval=900, max_interval=24 * 3600, target_messages=5,
+                              half_life_hours=24, inactive_days=7, inactive_max_interval=72 * 3600)
+
+
+def run_syncs(policy, user, counts, hours):
+    """每隔 hours 小时同步一次，依次取到 counts 封新邮件"""
+    state = None
+    for n, count in enumerate(counts):
+        state = policy.observe(user, count, now=NOW + timedelta(hours=hours * n))
+    return state
+
+
+class TestSyncPolicy:
+    """测试自适应同步频率"""
+
+    def test_interval_follows_arrival_rate(self, policy_app):
+        busy, quiet, dormant = policy_app
+        policy = make_policy()
+        busy_state = run_syncs(policy, busy, [60] * 12, hours=1)
+        quiet_state = run_syncs(policy, quiet, [2] * 8, hours=6)
+        dormant_state = run_syncs(policy, dormant, [0] * 5, hours=24)
+
+        # 每小时约 60 封：半天内缩短到一小时以内；每 6 小时 2 封：十几个小时；没有新邮件：最长 24 小时
+        assert busy_state.interval_seconds <= 3600
+        assert 12 * 3600 <= quiet_state.interval_seconds < 24 * 3600
+        assert quiet_state.interval_seconds % 900 == 0
+        assert dormant_state.interval_seconds == 24 * 3600
+        assert SyncState.query.count() == 3 and busy_state.syncs == 12
+
+    def test_rate_is_smoothed(self):
+        policy = make_policy()
+        rate = policy.estimate_rate(1.0, 30, elapsed_hours=1)
+        # 一小时的观测权重约 3%，突发只小幅抬高估计
+        assert 1.5 < rate < 3
+        assert policy.estimate_rate(None, 12, elapsed_hours=6) == 2
+        # 相隔很久的观测几乎完全取代旧估计
+        assert policy.estimate_rate(10.0, 0, elapsed_hours=240) < 0.01
+
+    def test_inactive_users_back_off(self, policy_app):
+        policy = make_policy()
+        assert policy.interval_for(1.0, last_login=NOW, now=NOW) == 5 * 3600
+        # 未登录 15 天：两个退避周期，间隔翻两倍
+        assert policy.interval_for(1.0, last_login=NOW - timedelta(days=15), now=NOW) == 20 * 3600
+        # 退避有上限
+        assert policy.interval_for(0.0, last_login=NOW - timedelta(days=60), now=NOW) == 72 * 3600
+
+        user = policy_app[0]
+        # 首次同步取到一天内的 24 封，到达率每小时 1 封
+        policy.observe(user, 24, now=NOW)
+        user.last_login = NOW - timedelta(days=30)
+        assert policy.current_interval(user, 6 * 3600, now=NOW) == 72 * 3600
+        user.last_login = NOW
+        assert policy.current_interval(user, 6 * 3600, now=NOW) == 5 * 3600
+        assert policy.current_interval(policy_app[1], 6 * 3600, now=NOW) == 6 * 3600
+
+    def test_sync_job_is_rescheduled(self, policy_app):
+        user = policy_app[0]
+        scheduler = SchedulerService(start=False)
+        schedule_sync_jobs(scheduler, user)
+        job_id = f"email_sync_{user.id}"
+        assert scheduler.get_interval(job_id) == 6 * 3600
+
+        state = run_syncs(AdaptiveSyncPolicy(), user, [40] * 3, hours=1)
+        assert reschedule_sync_job(scheduler, user.id, state.interval_seconds)
+        assert scheduler.get_interval(job_id) == state.interval_seconds < 6 * 3600
+        assert not reschedule_sync_job(scheduler, user.id, state.interval_seconds)
+        assert not reschedule_sync_job(scheduler, 999, 900)
+        scheduler.shutdown()